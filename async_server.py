@@ -0,0 +1,686 @@
+import asyncio
+import json
+from datetime import datetime
+import time
+from statistics_collector import StatisticsLog
+from metrics import ServerMetrics
+from file_storage import FileStorage
+from read_cache import ReadCache
+from server_side import (upload_rejection, upload_range, upload_codec, download_codec, chunked_upload_rejection,
+                         dedup_response, listing_batches, error_status, instrument_locks, start_metrics,
+                         server_features, download_digest, digest_rejection, batch_names, delete_many, stat_many,
+                         member_rejection, shaper_for, cluster_for, ring_response, signature_response, name_rejection,
+                         FILE_COMMANDS)
+from cluster import VNODES
+from storage_layout import InvalidName, normalize_name
+import compression
+import integrity
+import protocol
+from protocol import (ProtocolError, encode_frame, read_frame_async, read_payload_async, iter_body_async,
+                      iter_encoded_async, skip_request_body_async, read_trailer_async)
+
+# Bytes of a received body gathered before they are handed to a worker thread to be written.
+WRITE_BATCH_SIZE = 1024 * 1024
+# Most bytes of a file in memory (cached or memory-mapped) written to a transport at once.
+VIEW_WRITE_SIZE = 4 * 1024 * 1024
+
+
+# Class that serves the same commands as FileServer from a single asyncio event loop
+# instead of one thread per connection.
+class AsyncFileServer:
+    def __init__(self, host='10.128.0.2', port=3300, storage_path="server_storage",
+                 backlog=128, max_connections=None, idle_timeout=None, use_sendfile=True, dedup=False,
+                 stats_file='network_statistics.jsonl', metrics_port=None, metrics_interval=None,
+                 cache_size=0, cache_max_file=None, rate_limit=None, client_rate_limit=None,
+                 operation_rate_limits=None, cluster_nodes=None, node_id=None, vnodes=VNODES,
+                 listen_socket=None, reuse_port=False, shared_storage=False, durability='group'):
+        self.host = host
+        self.port = port
+        # A prefork worker accepts on the listening socket it inherited, or binds its own with reuse_port.
+        self.listen_socket = listen_socket
+        self.reuse_port = reuse_port
+        self.storage_path = storage_path
+        # Popular files are served from memory when the read cache is given a size in bytes.
+        self.cache = ReadCache(cache_size, cache_max_file) if cache_size else None
+        self.storage = FileStorage(storage_path, dedup, self.cache, shared_storage, durability)
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.use_sendfile = use_sendfile
+        self.active_connections = 0
+        self.statistics = StatisticsLog(stats_file, shared=shared_storage)
+        self.metrics = ServerMetrics()
+        self.metrics_port = metrics_port
+        self.metrics_interval = metrics_interval
+        instrument_locks(self.metrics, self.storage, self.statistics)
+        self.metrics.watch_committer(self.storage.committer)
+        if self.cache is not None:
+            self.metrics.watch_cache(self.cache)
+        # Rate limits in bytes/sec for the whole server, each client IP and each operation, all optional.
+        self.shaper = shaper_for(rate_limit, client_rate_limit, operation_rate_limits, self.metrics)
+        # With cluster_nodes this server is the node node_id (default host:port) of a cluster.
+        self.cluster = cluster_for(cluster_nodes, node_id or f'{host}:{port}', vnodes, self.storage)
+        # Maps each protocol command to the coroutine that serves it.
+        self.handlers = {
+            protocol.CMD_DIR: self.handle_dir,
+            protocol.CMD_UPLOAD: self.handle_upload,
+            protocol.CMD_DOWNLOAD: self.handle_download,
+            protocol.CMD_DELETE: self.handle_delete,
+            protocol.CMD_UPLOAD_STATUS: self.handle_upload_status,
+            protocol.CMD_UPLOAD_BEGIN: self.handle_upload_begin,
+            protocol.CMD_UPLOAD_CHUNK: self.handle_upload_chunk,
+            protocol.CMD_UPLOAD_COMMIT: self.handle_upload_commit,
+            protocol.CMD_CHUNK_QUERY: self.handle_dedup,
+            protocol.CMD_CHUNK_PUT: self.handle_dedup,
+            protocol.CMD_MANIFEST_PUT: self.handle_dedup,
+            protocol.CMD_PING: self.handle_ping,
+            protocol.CMD_DELETE_MANY: self.handle_delete_many,
+            protocol.CMD_STAT_MANY: self.handle_stat_many,
+            protocol.CMD_UPLOAD_MANY: self.handle_upload_many,
+            protocol.CMD_DOWNLOAD_MANY: self.handle_download_many,
+            protocol.CMD_RING: self.handle_ring,
+            protocol.CMD_SIGNATURES: self.handle_signatures,
+        }
+
+    # Method to start the server.
+    def start(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\nShutting down...")
+        except Exception as ex:
+            print(f"Error Occurred while Starting: {str(ex)}")
+        finally:
+            self.statistics.close()
+            self.metrics.close()
+
+    # Coroutine that listens for connections until cancelled.
+    async def serve(self):
+        if self.listen_socket is not None:
+            server = await asyncio.start_server(self.handle_client, sock=self.listen_socket,
+                                                limit=protocol.BUFFER_SIZE)
+        else:
+            server = await asyncio.start_server(
+                self.handle_client, self.host, self.port, backlog=self.backlog, reuse_address=True,
+                reuse_port=self.reuse_port or None, limit=protocol.BUFFER_SIZE
+            )
+        print(f'Starting Server on {self.host}:{self.port} (asyncio)')
+        start_metrics(self.metrics, self.metrics_port, self.metrics_interval)
+        print('[*] Waiting for connection')
+        async with server:
+            await server.serve_forever()
+
+    # Coroutine to write one response frame and wait until the transport has room again.
+    async def send_response(self, writer, request, status=protocol.STATUS_OK, message='', meta=None):
+        body = message.encode()
+        writer.write(encode_frame(request.reply(status, meta=meta), body))
+        self.count_sent(request, len(body))
+        await writer.drain()
+
+    # Method to add body bytes sent for a request to the metrics.
+    def count_sent(self, request, size):
+        if size:
+            self.metrics.bytes_out.inc(size, protocol.command_name(request.command))
+
+    # Handles requests from one connection, closing it when the client goes quiet for idle_timeout seconds.
+    async def handle_client(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        if self.max_connections and self.active_connections >= self.max_connections:
+            print(f'[*] Refused connection from IP {address[0]}: connection limit reached')
+            self.metrics.errors.inc(1, 'connection', 'refused')
+            writer.write(encode_frame(protocol.Frame(0, protocol.STATUS_ERROR), b"Server busy"))
+            writer.close()
+            return
+
+        self.active_connections += 1
+        self.metrics.connections.inc()
+        print(f'[*] Established connection from IP {address[0]} port: {address[1]}')
+        try:
+            while True:
+                frame = await asyncio.wait_for(read_frame_async(reader), self.idle_timeout)
+                if frame is None:
+                    break
+
+                print(f"Received command: {protocol.command_name(frame.command)} {frame.name}")
+
+                start = time.perf_counter()
+                if self.shaper:
+                    frame.pacer = self.shaper.pacer(address[0], protocol.command_name(frame.command))
+                handler = self.handlers.get(frame.command)
+                rejection = name_rejection(frame) if frame.command in FILE_COMMANDS else None
+                if handler is None or rejection:
+                    await self.skip_body(reader, frame.size)
+                    await self.send_response(writer, frame, protocol.STATUS_INVALID,
+                                             rejection or "Invalid command or missing arguments")
+                else:
+                    await handler(reader, writer, frame)
+                # Bytes sent are counted where they are written, see count_sent.
+                self.metrics.observe_request(protocol.command_name(frame.command), time.perf_counter() - start,
+                                             frame.size, 0, error_status(frame))
+
+        except asyncio.TimeoutError:
+            print(f'Closing idle connection from {address}')
+            self.metrics.errors.inc(1, 'connection', 'timeout')
+        except ProtocolError as ex:
+            print(f'Protocol error from client {address}: {str(ex)}')
+            self.metrics.errors.inc(1, 'connection', 'protocol')
+        except Exception as ex:
+            print(f'Error handling client {address}: {str(ex)}')
+            self.metrics.errors.inc(1, 'connection', 'exception')
+        finally:
+            self.active_connections -= 1
+            self.metrics.connections.dec()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            print(f'Connection closed from IP {address[0]} port: {address[1]}')
+
+    # Coroutine to discard a body that will not be used.
+    async def skip_body(self, reader, size):
+        async for _ in iter_body_async(reader, size):
+            pass
+
+    # Coroutine to run a call that touches the disk (opening, reading, writing or removing files) in a
+    # worker thread, so a slow disk holds up only the connection waiting for it instead of the event loop.
+    async def blocking(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+    # Coroutine to write a received body to a file and flush it. Chunks are gathered into batches of
+    # WRITE_BATCH_SIZE bytes, each written by a worker thread; when the body breaks off, the bytes gathered
+    # so far are still written, so an upload can be resumed after them. Every chunk is also fed to digest.
+    # Returns the bytes written and the time spent writing them.
+    async def write_body(self, file, body, digest):
+        batch = bytearray()
+        written = 0
+        write_time = 0.0
+        try:
+            async for chunk in body:
+                digest.update(chunk)
+                batch += chunk
+                if len(batch) >= WRITE_BATCH_SIZE:
+                    write_start = time.perf_counter()
+                    await self.blocking(file.write, batch)
+                    write_time += time.perf_counter() - write_start
+                    written += len(batch)
+                    batch = bytearray()
+        finally:
+            write_start = time.perf_counter()
+            if batch:
+                await self.blocking(file.write, batch)
+                written += len(batch)
+            await self.blocking(file.flush)
+            write_time += time.perf_counter() - write_start
+        return written, write_time
+
+    # Coroutine to answer a ping with the features this server supports, like FileServer.handle_ping.
+    async def handle_ping(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        await self.send_response(writer, frame, protocol.STATUS_OK, meta=server_features(self.cluster))
+
+    # Coroutine to answer a ring request, like FileServer.handle_ring. Files are moved by the cluster
+    # node's own thread, so the event loop is not held up by a rebalance.
+    async def handle_ring(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        status, message, meta = ring_response(self.cluster, frame)
+        await self.send_response(writer, frame, status, message, meta)
+
+    # Coroutine to handle overall directory, streamed in frames like FileServer.handle_dir.
+    # Each batch is built in a worker thread, since filling in checksums reads files.
+    async def handle_dir(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        loop = asyncio.get_running_loop()
+        batches = listing_batches(self.storage, frame)
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, next, batches, None)
+                if batch is None:
+                    break
+                flags, meta, body = batch
+                writer.write(encode_frame(frame.reply(protocol.STATUS_OK, flags=flags, meta=meta), body))
+                self.count_sent(frame, len(body))
+                await writer.drain()
+
+        except ValueError as ex:
+            await self.send_response(writer, frame, protocol.STATUS_INVALID, f"Invalid listing request: {str(ex)}")
+        except OSError as ex:
+            print(f"Directory listing error: {str(ex)}")
+            await self.send_response(writer, frame, protocol.STATUS_ERROR, f"Directory listing failed: {str(ex)}")
+
+    # Coroutine to handle upload from the client to the server, staged, verified and committed like
+    # FileServer.handle_upload. The body is hashed on the event loop; hashing a chunk takes far less time
+    # than handing it to a thread would.
+    async def handle_upload(self, reader, writer, frame):
+        file_size = protocol.body_size(frame)
+        expect_continue = bool(frame.flags & protocol.FLAG_EXPECT_CONTINUE)
+
+        rejection = upload_rejection(self.storage, frame, self.cluster)
+        if rejection:
+            if not expect_continue:
+                await skip_request_body_async(reader, frame)
+            status, message, meta = rejection
+            await self.send_response(writer, frame, status, message, meta)
+            return
+
+        # upload_rejection has put the name in its normalized form.
+        file_name = frame.name
+        if expect_continue:
+            await self.send_response(writer, frame, protocol.STATUS_CONTINUE)
+
+        start_time = datetime.now()
+        offset, total = upload_range(frame)
+
+        try:
+            codec = upload_codec(frame, self.storage)
+            # A delta decompressor opens the stored file the upload is rebuilt against.
+            decompressor = await self.blocking(codec.decompressor) if codec else None
+            file = await self.blocking(self.storage.open_staged, file_name, offset, total)
+        except OSError as ex:
+            await skip_request_body_async(reader, frame)
+            await self.send_response(writer, frame, protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}")
+            return
+
+        if codec:
+            body = iter_encoded_async(reader, frame, decompressor,
+                                      count=lambda size: self.metrics.bytes_in.inc(size, 'upload'))
+        else:
+            body = iter_body_async(reader, file_size, pacer=frame.pacer)
+
+        # The staged file is kept open, which keeps other uploads of the file out of it, until it is committed.
+        digest = integrity.new_digest()
+        with file:
+            received_size, write_time = await self.write_body(file, body, digest)
+            self.metrics.storage.observe(write_time, 'write')
+            digest = digest.hexdigest()
+
+            if frame.meta.get('verify'):
+                expected = await read_trailer_async(reader, frame)
+                rejection = await self.blocking(digest_rejection, self.storage, frame, digest, expected)
+                if rejection:
+                    status, message, meta = rejection
+                    await self.send_response(writer, frame, status, message, meta)
+                    return
+
+            duration = (datetime.now() - start_time).total_seconds()
+            transfer_rate = (file_size / (1024 * 1024)) / duration if duration else 0
+            self.statistics.transfer_stats('upload', file_name, received_size, duration, transfer_rate)
+
+            if offset + received_size < total:
+                await self.send_response(writer, frame, protocol.STATUS_OK, "Upload Partial.",
+                                         {'offset': offset + received_size})
+                return
+            checksum = digest if not offset else None
+            try:
+                with self.metrics.timed('commit'):
+                    await self.blocking(self.storage.commit_staged, file_name, checksum)
+            except OSError as ex:
+                print(f"Upload commit error: {str(ex)}")
+                await self.send_response(writer, frame, protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}")
+                return
+        await self.send_response(writer, frame, protocol.STATUS_OK, "Upload Complete.",
+                                 {'checksum': checksum} if checksum else None)
+
+    # Coroutine to send the block signatures of a stored file, like FileServer.handle_signatures.
+    # The whole file is read and hashed, so that is done in a worker thread.
+    async def handle_signatures(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        status, body, meta = await self.blocking(signature_response, self.storage, frame, self.cluster)
+        writer.write(encode_frame(frame.reply(status, meta=meta), body))
+        self.count_sent(frame, len(body))
+        await writer.drain()
+
+    # Coroutine to report how many bytes of an interrupted upload are staged.
+    async def handle_upload_status(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        await self.send_response(writer, frame, protocol.STATUS_OK,
+                                 meta={'offset': await self.blocking(self.storage.staged_size, frame.name)})
+
+    # Coroutine to start a chunked upload, like FileServer.handle_upload_begin.
+    async def handle_upload_begin(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        rejection = chunked_upload_rejection(self.storage, frame, self.cluster)
+        if rejection:
+            status, message = rejection
+            await self.send_response(writer, frame, status, message)
+            return
+        try:
+            await self.blocking(self.storage.begin_chunked, frame.name, int(frame.meta['total']))
+        except OSError as ex:
+            await self.send_response(writer, frame, protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}")
+            return
+        await self.send_response(writer, frame, protocol.STATUS_OK)
+
+    # Coroutine to write one chunk of a chunked upload at its meta 'offset'.
+    async def handle_upload_chunk(self, reader, writer, frame):
+        upload = await self.blocking(self.storage.get_chunked, frame.name)
+        offset = int(frame.meta.get('offset', 0))
+        if upload is None or offset < 0 or offset + frame.size > upload.total:
+            await self.skip_body(reader, frame.size)
+            await self.send_response(writer, frame, protocol.STATUS_INVALID,
+                                     "Upload Failed: chunk does not belong to an upload")
+            return
+
+        position = offset
+        async for chunk in iter_body_async(reader, frame.size, pacer=frame.pacer):
+            await self.blocking(upload.write_at, position, chunk)
+            position += len(chunk)
+        upload.mark_written(offset, frame.size)
+        await self.send_response(writer, frame, protocol.STATUS_OK)
+
+    # Coroutine to finish a chunked upload once all of its chunks have been written.
+    async def handle_upload_commit(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        upload = await self.blocking(self.storage.get_chunked, frame.name)
+        try:
+            with self.metrics.timed('commit'):
+                committed = upload is not None and await self.blocking(self.storage.commit_chunked, frame.name)
+        except OSError as ex:
+            print(f"Upload commit error: {str(ex)}")
+            await self.send_response(writer, frame, protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}")
+            return
+        if not committed:
+            await self.send_response(writer, frame, protocol.STATUS_INVALID, "Upload Failed: chunks are missing")
+            return
+
+        duration = (datetime.now() - upload.start_time).total_seconds()
+        transfer_rate = (upload.total / (1024 * 1024)) / duration if duration else 0
+        self.statistics.transfer_stats('upload', frame.name, upload.total, duration, transfer_rate)
+        await self.send_response(writer, frame, protocol.STATUS_OK, "Upload Complete.")
+
+    # Coroutine to handle the deduplicating upload commands, like FileServer.handle_dedup.
+    async def handle_dedup(self, reader, writer, frame):
+        if frame.pacer:
+            await frame.pacer.pace_async(frame.size)
+        payload = await read_payload_async(reader, frame)
+        status, body, meta = await self.blocking(dedup_response, self.storage, frame, payload, self.cluster)
+        writer.write(encode_frame(frame.reply(status, meta=meta), body))
+        self.count_sent(frame, len(body))
+        await writer.drain()
+
+    # Coroutine to handle download from the server to the client, optionally limited to a byte range,
+    # compressed and followed by a digest trailer like FileServer.handle_download.
+    # loop.sendfile uses zero-copy sendfile and falls back to buffered reads when it cannot.
+    async def handle_download(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        try:
+            with self.metrics.timed('open'):
+                file, file_size = await self.blocking(self.storage.open_read, frame.name, not self.use_sendfile)
+        except FileNotFoundError:
+            await self.send_response(writer, frame, protocol.STATUS_NOT_FOUND, "File not found")
+            return
+        except OSError as ex:
+            await self.send_response(writer, frame, protocol.STATUS_ERROR, f"Download Failed: {str(ex)}")
+            return
+
+        start_time = datetime.now()
+        with file:
+            byte_range = protocol.requested_range(frame, file_size)
+            if byte_range is None:
+                await self.send_response(writer, frame, protocol.STATUS_INVALID, "Requested range not satisfiable")
+                return
+            offset, length = byte_range
+            codec = await self.blocking(download_codec, frame, file, offset, length)
+            meta = {'offset': offset, 'total': file_size}
+            digest = None
+            if frame.meta.get('verify'):
+                meta['verify'] = True
+                digest = asyncio.get_running_loop().run_in_executor(None, download_digest, self.storage, frame.name,
+                                                                    offset, length, file_size)
+            if codec:
+                meta.update({'encoding': codec.name, 'size': length})
+                reply = frame.reply(protocol.STATUS_OK, flags=protocol.FLAG_MORE, meta=meta)
+                writer.write(encode_frame(reply))
+                size = await self.send_encoded(writer, reply, codec, file, offset, length, frame.pacer)
+            else:
+                reply = frame.reply(protocol.STATUS_OK, size=length, meta=meta)
+                writer.write(encode_frame(reply))
+                await writer.drain()
+                size = await self.send_range(writer, file, offset, length, frame.pacer)
+                self.count_sent(frame, size)
+            if size != length:
+                raise ProtocolError(f'File ended after {size} of {length} bytes')
+            if digest:
+                writer.write(encode_frame(protocol.trailer_frame(reply, await digest)))
+                await writer.drain()
+
+        duration = (datetime.now() - start_time).total_seconds()
+        transfer_rate = (size / (1024 * 1024)) / duration if duration else 0
+        self.statistics.transfer_stats('download', frame.name, size, duration, transfer_rate)
+
+    # Coroutine to delete many files with one request, like FileServer.handle_delete_many.
+    async def handle_delete_many(self, reader, writer, frame):
+        try:
+            names = batch_names(await read_payload_async(reader, frame))
+        except ValueError as ex:
+            await self.send_response(writer, frame, protocol.STATUS_INVALID, f"Invalid batch request: {str(ex)}")
+            return
+        with self.metrics.timed('delete'):
+            results = await self.blocking(delete_many, self.storage, names)
+        await self.send_body(writer, frame, json.dumps(results).encode())
+
+    # Coroutine to look up many index entries with one request, like FileServer.handle_stat_many.
+    # Filling in checksums reads files, so that runs in a worker thread.
+    async def handle_stat_many(self, reader, writer, frame):
+        try:
+            names = batch_names(await read_payload_async(reader, frame))
+        except ValueError as ex:
+            await self.send_response(writer, frame, protocol.STATUS_INVALID, f"Invalid batch request: {str(ex)}")
+            return
+        checksums = bool(frame.meta.get('checksums'))
+        if checksums:
+            entries = await asyncio.get_running_loop().run_in_executor(None, stat_many, self.storage, names, True)
+        else:
+            entries = stat_many(self.storage, names)
+        await self.send_body(writer, frame, json.dumps(entries).encode())
+
+    # Coroutine to write a reply with an in-memory body.
+    async def send_body(self, writer, frame, body):
+        writer.write(encode_frame(frame.reply(protocol.STATUS_OK), body))
+        self.count_sent(frame, len(body))
+        await writer.drain()
+
+    # Coroutine to receive many files in one request, like FileServer.handle_upload_many.
+    async def handle_upload_many(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        start_time = datetime.now()
+        results = {}
+        received_size = 0
+        more = frame.flags & protocol.FLAG_MORE
+        while more:
+            member = await read_frame_async(reader)
+            protocol.check_member_frame(frame, member)
+            more = member.flags & protocol.FLAG_MORE
+            self.metrics.bytes_in.inc(member.size, 'upload_many')
+            name = member.name
+            results[name] = protocol.status_name(await self.receive_member(reader, frame, member))
+            received_size += member.size
+
+        duration = (datetime.now() - start_time).total_seconds()
+        transfer_rate = (received_size / (1024 * 1024)) / duration if duration else 0
+        self.statistics.transfer_stats('upload_many', f'{len(results)} files', received_size, duration,
+                                       transfer_rate)
+        await self.send_body(writer, frame, json.dumps(results).encode())
+
+    # Coroutine to stage, verify and commit one file of a batch upload, like FileServer.receive_member.
+    async def receive_member(self, reader, frame, member):
+        member.flags |= frame.flags & protocol.FLAG_OVERWRITE
+        member.pacer = frame.pacer
+        rejection = member_rejection(self.storage, member, self.cluster)
+        if rejection:
+            await skip_request_body_async(reader, member)
+            return rejection[0]
+        try:
+            file = await self.blocking(self.storage.open_staged, member.name, 0, member.size)
+        except OSError:
+            await skip_request_body_async(reader, member)
+            return protocol.STATUS_ERROR
+
+        # The staged file is kept open, which keeps other uploads of the file out of it, until it is committed.
+        digest = integrity.new_digest()
+        with file:
+            if member.flags & protocol.FLAG_CHECKSUM:
+                if member.pacer:
+                    await member.pacer.pace_async(member.size)
+                data = await read_payload_async(reader, member)
+                digest.update(data)
+                await self.blocking(file.write, data)
+                await self.blocking(file.flush)
+            else:
+                await self.write_body(file, iter_body_async(reader, member.size, pacer=member.pacer), digest)
+            digest = digest.hexdigest()
+
+            if member.meta.get('verify'):
+                expected = await read_trailer_async(reader, member)
+                if await self.blocking(digest_rejection, self.storage, member, digest, expected):
+                    return protocol.STATUS_INVALID
+            try:
+                with self.metrics.timed('commit'):
+                    await self.blocking(self.storage.commit_staged, member.name, digest)
+            except OSError as ex:
+                print(f"Upload commit error: {str(ex)}")
+                return protocol.STATUS_ERROR
+        return protocol.STATUS_OK
+
+    # Coroutine to send many files in one reply, like FileServer.handle_download_many.
+    async def handle_download_many(self, reader, writer, frame):
+        try:
+            names = batch_names(await read_payload_async(reader, frame))
+        except ValueError as ex:
+            await self.send_response(writer, frame, protocol.STATUS_INVALID, f"Invalid batch request: {str(ex)}")
+            return
+        verify = bool(frame.meta.get('verify'))
+        writer.write(encode_frame(frame.reply(protocol.STATUS_OK, flags=protocol.FLAG_MORE if names else 0,
+                                              meta={'count': len(names), 'verify': verify})))
+
+        start_time = datetime.now()
+        sent_size = 0
+        for number, name in enumerate(names):
+            more = number + 1 < len(names)
+            # Members keep the name as the client sent it; the storage is asked by its normalized form.
+            try:
+                file_name = normalize_name(name)
+                file, file_size = await self.blocking(self.storage.open_read, file_name, not self.use_sendfile)
+            except InvalidName:
+                writer.write(encode_frame(protocol.member_frame(frame, name, 0, more, protocol.STATUS_INVALID)))
+                continue
+            except FileNotFoundError:
+                writer.write(encode_frame(protocol.member_frame(frame, name, 0, more, protocol.STATUS_NOT_FOUND)))
+                continue
+            except OSError:
+                writer.write(encode_frame(protocol.member_frame(frame, name, 0, more, protocol.STATUS_ERROR)))
+                continue
+
+            with file:
+                member = protocol.member_frame(frame, name, file_size, more)
+                if file_size <= protocol.CHUNK_SIZE:
+                    data = await self.blocking(file.read)
+                    if frame.pacer:
+                        await frame.pacer.pace_async(len(data))
+                    writer.write(encode_frame(member, data))
+                    if verify:
+                        writer.write(encode_frame(protocol.trailer_frame(member, integrity.digest_bytes(data))))
+                    sent_size += len(data)
+                    await writer.drain()
+                    continue
+                writer.write(encode_frame(member))
+                await writer.drain()
+                size = await self.send_range(writer, file, 0, file_size, frame.pacer)
+                if size != file_size:
+                    raise ProtocolError(f'File ended after {size} of {file_size} bytes')
+                sent_size += size
+            if verify:
+                digest = await self.blocking(self.storage.checksum, file_name)
+                writer.write(encode_frame(protocol.trailer_frame(member, digest)))
+        await writer.drain()
+        self.count_sent(frame, sent_size)
+
+        duration = (datetime.now() - start_time).total_seconds()
+        transfer_rate = (sent_size / (1024 * 1024)) / duration if duration else 0
+        self.statistics.transfer_stats('download_many', f'{len(names)} files', sent_size, duration, transfer_rate)
+
+    # Coroutine to send count bytes of a file from offset: straight from memory for cached files, with
+    # loop.sendfile, or with buffered reads. With a pacer the range is sent a quantum at a time, each one
+    # once the rate limits let it through. Returns the bytes sent.
+    async def send_range(self, writer, file, offset, count, pacer=None):
+        loop = asyncio.get_running_loop()
+        step = pacer.quantum if pacer else count
+        if hasattr(file, 'view'):
+            # The transport copies whatever the socket does not take at once into its buffer, so a large
+            # memory-mapped file is written a piece at a time rather than copied into memory whole.
+            step = min(step, VIEW_WRITE_SIZE)
+        sent = 0
+        while sent < count:
+            size = min(step, count - sent)
+            if pacer:
+                await pacer.pace_async(size)
+            if hasattr(file, 'view'):
+                done = await self.send_view(writer, file.view(offset + sent, size))
+            elif self.use_sendfile:
+                done = await loop.sendfile(writer.transport, file, offset + sent, size)
+            else:
+                done = await self.send_buffered(writer, file, offset + sent, size)
+            sent += done
+            if done < size:
+                break
+        return sent
+
+    # Coroutine to send bytes that are already in memory, e.g. a range of a cached file, in one write.
+    async def send_view(self, writer, data):
+        writer.write(data)
+        await writer.drain()
+        return len(data)
+
+    # Coroutine to send count bytes of a file from offset in chunks, waiting for the transport to drain.
+    async def send_buffered(self, writer, file, offset, count):
+        file.seek(offset)
+        sent = 0
+        while sent < count:
+            chunk = await self.blocking(file.read, min(protocol.CHUNK_SIZE, count - sent))
+            if not chunk:
+                break
+            writer.write(chunk)
+            sent += len(chunk)
+            await writer.drain()
+        return sent
+
+    # Coroutine to send count bytes of a file from offset as the encoded body following frame.
+    # Blocks are read and compressed in worker threads so the event loop keeps serving other connections.
+    # Returns the raw bytes sent; the compressed blocks go through pacer when it is given.
+    async def send_encoded(self, writer, frame, codec, file, offset, count, pacer=None):
+        loop = asyncio.get_running_loop()
+        compressor = codec.compressor()
+        file.seek(offset)
+        blocks = compression.iter_blocks(file, count)
+        sent = 0
+        while True:
+            chunk = await loop.run_in_executor(None, next, blocks, None)
+            if chunk is None:
+                break
+            block = await loop.run_in_executor(None, compressor.compress, chunk)
+            if block:
+                if pacer:
+                    await pacer.pace_async(len(block))
+                writer.write(encode_frame(protocol.data_frame(frame, True), block))
+                self.count_sent(frame, len(block))
+            sent += len(chunk)
+            await writer.drain()
+        block = compressor.finish()
+        writer.write(encode_frame(protocol.data_frame(frame, False), block))
+        self.count_sent(frame, len(block))
+        await writer.drain()
+        return sent
+
+    # Coroutine to handle delete from the server.
+    async def handle_delete(self, reader, writer, frame):
+        await self.skip_body(reader, frame.size)
+        try:
+            with self.metrics.timed('delete'):
+                deleted = await self.blocking(self.storage.delete, frame.name)
+            if not deleted:
+                await self.send_response(writer, frame, protocol.STATUS_NOT_FOUND, "File not found")
+                return
+            await self.send_response(writer, frame, protocol.STATUS_OK, "File deleted successfully")
+        except OSError as ex:
+            print(f"Delete error: {str(ex)}")
+            await self.send_response(writer, frame, protocol.STATUS_ERROR, f"Delete failed: {str(ex)}")
@@ -0,0 +1,119 @@
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size
+from latency_proxy import start_proxy, stop_proxy
+from transfer_client import TransferClient
+
+OPERATIONS = ['upload', 'stat', 'download', 'delete']
+
+
+# Runs every operation on every file with one request per file. Returns {operation: seconds}.
+def run_single(client, files):
+    times = {}
+    start = time.perf_counter()
+    for name, data in files.items():
+        success, message = client.upload(name, io.BytesIO(data), len(data), overwrite=True)
+        if not success:
+            raise RuntimeError(f'Upload of {name} failed: {message}')
+    times['upload'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in files:
+        client.file_size(name)
+    times['stat'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name, data in files.items():
+        success, response = client.start_download(name)
+        if not success or sum(len(chunk) for chunk in client.iter_download(response)) != len(data):
+            raise RuntimeError(f'Download of {name} failed')
+    times['download'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in files:
+        client.delete(name)
+    times['delete'] = time.perf_counter() - start
+    return times
+
+
+# Runs every operation on all files with one batch request each. Returns {operation: seconds}.
+def run_batch(client, files):
+    times = {}
+    start = time.perf_counter()
+    success, results = client.upload_many(((name, io.BytesIO(data), len(data)) for name, data in files.items()),
+                                          overwrite=True)
+    if not success or set(results.values()) != {'ok'}:
+        raise RuntimeError(f'Batch upload failed: {results}')
+    times['upload'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.stat_many(files)
+    times['stat'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    success, response = client.start_download_many(files)
+    if not success:
+        raise RuntimeError(f'Batch download failed: {response}')
+    for name, status, chunks in client.iter_download_many(response):
+        if sum(len(chunk) for chunk in chunks) != len(files[name]):
+            raise RuntimeError(f'Download of {name} failed')
+    times['download'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.delete_many(files)
+    times['delete'] = time.perf_counter() - start
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Small-file throughput (files/sec) with one request per file '
+                                                 'and with batch requests')
+    parser.add_argument('--sizes', nargs='+', default=['1K', '64K', '1M'])
+    parser.add_argument('--total', default='64M', help='bytes per size and mode; the file count is derived '
+                                                       'from it, capped by --max-files')
+    parser.add_argument('--max-files', type=int, default=1000)
+    parser.add_argument('--delays', nargs='+', type=float, default=[0.0, 0.001],
+                        help='one-way delay in seconds added by a proxy, 0 for plain loopback')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument('--no-verify', action='store_true', help='turn off end-to-end verification')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        process, server_port = start_server(work_dir, extra_args=['--engine', args.engine])
+        try:
+            for delay in args.delays:
+                proxy, port = None, server_port
+                if delay:
+                    proxy, port = start_proxy(server_port, delay=delay)
+                try:
+                    for label in args.sizes:
+                        size = parse_size(label)
+                        count = max(1, min(args.max_files, parse_size(args.total) // size))
+                        files = {f'file-{number:05d}.bin': os.urandom(size) for number in range(count)}
+                        client = TransferClient('127.0.0.1', port, verify=not args.no_verify).connect()
+                        try:
+                            single = run_single(client, files)
+                            batch = run_batch(client, files)
+                        finally:
+                            client.close()
+                        for operation in OPERATIONS:
+                            rows.append([f'{delay * 1000:g}', label, count, operation,
+                                         f'{count / single[operation]:.0f}', f'{count / batch[operation]:.0f}',
+                                         f'{single[operation] / batch[operation]:.1f}x'])
+                finally:
+                    if proxy:
+                        stop_proxy(proxy)
+        finally:
+            stop_server(process)
+
+    print(f'{args.engine} server, verification {"off" if args.no_verify else "on"}')
+    print_table(['delay ms', 'size', 'files', 'operation', 'single files/s', 'batch files/s', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import io
+import os
+import tempfile
+import threading
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, free_port, UNITS
+from latency_proxy import start_proxy, stop_proxy
+from cluster import ClusterClient
+
+
+# Starts count server processes, each in its own directory under work_dir, as a cluster of the first
+# members of them; the others are started too, ready to be added. With a bandwidth every node sits behind
+# its own proxy with a link of that many bytes/sec, like a machine with its own network card, and is
+# listed in the cluster under the proxy's address. Returns (server processes, proxy processes, node ids).
+def start_cluster(work_dir, count, members, args):
+    servers, proxies, nodes, targets = [], [], [], []
+    for number in range(count):
+        port = free_port()
+        if args.bandwidth:
+            proxy, proxy_port = start_proxy(port, delay=args.delay, window=parse_size(args.window),
+                                            bandwidth=parse_size(args.bandwidth), shared=True)
+            proxies.append(proxy)
+            nodes.append(f'127.0.0.1:{proxy_port}')
+        else:
+            nodes.append(f'127.0.0.1:{port}')
+        targets.append(port)
+    try:
+        for number, port in enumerate(targets):
+            directory = os.path.join(work_dir, f'node-{count}-{number}')
+            os.makedirs(directory)
+            ring = nodes[:members] if number < members else nodes
+            process, _ = start_server(directory, port, ['--engine', args.engine, '--cluster', ','.join(ring),
+                                                        '--node-id', nodes[number]])
+            servers.append(process)
+    except BaseException:
+        stop_cluster(servers, proxies)
+        raise
+    return servers, proxies, nodes
+
+
+def stop_cluster(servers, proxies):
+    for process in servers:
+        stop_server(process)
+    for proxy in proxies:
+        stop_proxy(proxy)
+
+
+# Uploads files of data under names from number until deadline, or downloads the given names in turn,
+# adding the bytes moved and the files done to totals[number].
+def client_loop(seed, operation, data, names, deadline, totals, number, verify):
+    client = ClusterClient([seed], verify=verify)
+    moved = files = 0
+    try:
+        while time.monotonic() < deadline:
+            if operation == 'upload':
+                name = f'client-{number}-{files:06d}.bin'
+                success, message = client.upload(name, io.BytesIO(data), len(data), overwrite=True)
+                names.append(name)
+            else:
+                success, message = client.download(names[files % len(names)], io.BytesIO())
+            if not success:
+                raise RuntimeError(f'{operation} failed: {message}')
+            moved += len(data)
+            files += 1
+    finally:
+        client.close()
+    totals[number] = (moved, files)
+
+
+# Runs args.clients clients doing operation for args.duration seconds. Returns (bytes/sec, files/sec).
+def run_phase(seed, operation, data, names, args):
+    totals = [(0, 0)] * args.clients
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=client_loop, args=(seed, operation, data, names[number], deadline,
+                                                           totals, number, not args.no_verify))
+               for number in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(moved for moved, _ in totals) / args.duration, sum(files for _, files in totals) / args.duration
+
+
+# Measures a cluster of count nodes, then adds one more node and measures the rebalance. Returns a table row.
+def run(work_dir, count, args):
+    servers, proxies, nodes = start_cluster(work_dir, count + 1, count, args)
+    try:
+        data = os.urandom(parse_size(args.file_size))
+        names = [[] for _ in range(args.clients)]
+        upload_rate, upload_files = run_phase(nodes[0], 'upload', data, names, args)
+        download_rate, download_files = run_phase(nodes[0], 'download', data, names, args)
+
+        client = ClusterClient([nodes[0]])
+        per_node = [len(client.client(node).list_entries(limit=0)[1]) for node in nodes[:count]]
+        stored = sum(per_node)
+        start = time.perf_counter()
+        success, message = client.add_node(nodes[count])
+        if not success:
+            raise RuntimeError(message)
+        client.wait_rebalanced(interval=0.02)
+        rebalance_time = time.perf_counter() - start
+        moved = sum(client.client(node).ring()[1]['moved'] for node in nodes[:count])
+        client.close()
+    finally:
+        stop_cluster(servers, proxies)
+    return [count, f'{upload_rate / UNITS["M"]:.1f}', f'{upload_files:.0f}', f'{download_rate / UNITS["M"]:.1f}',
+            f'{download_files:.0f}', f'{max(per_node) / (stored / count):.2f}', stored,
+            f'{moved / stored * 100:.1f}', f'{100 / (count + 1):.1f}', f'{rebalance_time:.2f}']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate throughput of a cluster as nodes are added, '
+                                                 'and the files moved when one more node joins')
+    parser.add_argument('--nodes', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--file-size', default='256K')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per phase')
+    parser.add_argument('--bandwidth', default='10M',
+                        help="bytes/sec of each node's own link, 0 to connect to the nodes directly")
+    parser.add_argument('--delay', type=float, default=0.0005, help='one-way delay of each link in seconds')
+    parser.add_argument('--window', default='1M', help='bytes in flight per connection and direction')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument('--no-verify', action='store_true', help='turn off end-to-end verification')
+    args = parser.parse_args()
+    if parse_size(args.bandwidth) == 0:
+        args.bandwidth = None
+
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in args.nodes:
+            rows.append(run(work_dir, count, args))
+
+    link = f'{args.bandwidth}/s link per node' if args.bandwidth else 'direct loopback'
+    print(f'{args.clients} clients, {args.file_size} files, {link}, {args.engine} nodes')
+    print_table(['nodes', 'up MB/s', 'up files/s', 'down MB/s', 'down files/s', 'max/mean files', 'files',
+                 'moved %', 'ideal %', 'rebalance s'], rows)
+
+
+if __name__ == '__main__':
+    main()
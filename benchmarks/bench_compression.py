@@ -0,0 +1,136 @@
+import argparse
+import gzip
+import os
+import random
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, UNITS
+from latency_proxy import start_proxy, stop_proxy
+from transfer_client import TransferClient
+import compression
+
+
+# Writes size bytes of server log lines, which compress several times over.
+def write_log(path, size, rng):
+    levels = ['INFO', 'INFO', 'INFO', 'DEBUG', 'WARNING', 'ERROR']
+    paths = ['/upload', '/download', '/list', '/delete', '/connect']
+    with open(path, 'w') as file:
+        written = 0
+        while written < size:
+            line = (f'2026-10-18 {rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d},'
+                    f'{rng.randrange(1000):03d} {rng.choice(levels)} 10.128.{rng.randrange(256)}.{rng.randrange(256)} '
+                    f'{rng.choice(paths)} status={rng.choice([200, 200, 200, 404, 500])} '
+                    f'bytes={rng.randrange(1 << 24)} seconds={rng.random():.4f}\n')
+            written += file.write(line)
+        file.truncate(size)
+
+
+# Writes size bytes of CSV rows of numbers.
+def write_csv(path, size, rng):
+    with open(path, 'w') as file:
+        written = file.write('id,timestamp,sensor,temperature,humidity,pressure\n')
+        row = 0
+        while written < size:
+            written += file.write(f'{row},{1760000000 + row * 5},sensor-{rng.randrange(64)},'
+                                  f'{rng.gauss(21, 3):.2f},{rng.uniform(20, 80):.1f},{rng.gauss(1013, 8):.1f}\n')
+            row += 1
+        file.truncate(size)
+
+
+# Writes size random bytes, which do not compress at all.
+def write_random(path, size, rng):
+    with open(path, 'wb') as file:
+        remaining = size
+        while remaining:
+            remaining -= file.write(os.urandom(min(UNITS['M'], remaining)))
+
+
+# Writes a gzip archive of log lines, i.e. content that is already compressed.
+def write_gzip(path, size, rng):
+    source = path + '.log'
+    write_log(source, size * 8, rng)
+    with open(source, 'rb') as log, gzip.open(path, 'wb', compresslevel=6) as file:
+        file.write(log.read())
+    os.remove(source)
+
+
+FILE_TYPES = {'log': write_log, 'csv': write_csv, 'random': write_random, 'gzip': write_gzip}
+
+
+# Uploads and downloads path through port with the given compression setting.
+# Returns (upload seconds, download seconds, encoding the download came back with).
+def transfer(port, path, compress):
+    client = TransferClient('127.0.0.1', port, compress=compress).connect()
+    name = os.path.basename(path)
+    size = os.path.getsize(path)
+    try:
+        start = time.perf_counter()
+        with open(path, 'rb') as file:
+            success, message = client.upload(name, file, size, overwrite=True)
+        upload_seconds = time.perf_counter() - start
+        if not success:
+            raise RuntimeError(f'Upload failed: {message}')
+
+        start = time.perf_counter()
+        success, response = client.start_download(name)
+        if not success:
+            raise RuntimeError(f'Download failed: {response}')
+        received = sum(len(chunk) for chunk in client.iter_download(response))
+        download_seconds = time.perf_counter() - start
+        if received != size:
+            raise RuntimeError(f'Downloaded {received} of {size} bytes')
+        return upload_seconds, download_seconds, response.meta.get('encoding', '-')
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transfer throughput for every codec x file type x link bandwidth')
+    parser.add_argument('--size', default='64M', help='size of each test file')
+    parser.add_argument('--codecs', nargs='+', default=['none'] + compression.available(),
+                        help=f'none and any of {compression.available()}')
+    parser.add_argument('--types', nargs='+', default=list(FILE_TYPES), choices=list(FILE_TYPES))
+    parser.add_argument('--bandwidths', nargs='+', default=['10M', '100M', '0'],
+                        help='per-direction link bandwidth in bytes/sec, 0 for plain loopback')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    rng = random.Random(0)
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = {}
+        for file_type in args.types:
+            paths[file_type] = os.path.join(work_dir, f'{file_type}.dat')
+            FILE_TYPES[file_type](paths[file_type], size, rng)
+
+        process, server_port = start_server(work_dir, extra_args=['--engine', args.engine])
+        try:
+            for label in args.bandwidths:
+                bandwidth = parse_size(label)
+                proxy, port = None, server_port
+                if bandwidth:
+                    proxy, port = start_proxy(server_port, window=4 * UNITS['M'], bandwidth=bandwidth)
+                try:
+                    for file_type in args.types:
+                        file_size = os.path.getsize(paths[file_type])
+                        for codec in args.codecs:
+                            upload, download, encoding = transfer(port, paths[file_type],
+                                                                  None if codec == 'none' else codec)
+                            rows.append([label if bandwidth else 'loopback', file_type, codec, encoding,
+                                         f'{file_size / upload / UNITS["M"]:.1f}',
+                                         f'{file_size / download / UNITS["M"]:.1f}'])
+                finally:
+                    if proxy:
+                        stop_proxy(proxy)
+        finally:
+            stop_server(process)
+
+    print(f'{args.size} files, {args.engine} server; "sent as" is the encoding the download used '
+          f'(- when the probe found the content incompressible)')
+    print_table(['bandwidth', 'file', 'codec', 'sent as', 'upload MB/s', 'download MB/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, UNITS
+from latency_proxy import start_proxy, stop_proxy
+from chunk_store import ChunkStore
+from transfer_client import TransferClient
+
+
+# Writes a file of random bytes that do not repeat, so the original has nothing to dedup against itself.
+def make_random_file(path, size):
+    with open(path, 'wb') as file:
+        remaining = size
+        while remaining:
+            remaining -= file.write(os.urandom(min(remaining, 1024 * 1024)))
+
+
+# Writes a lightly modified copy of a file: a few small insertions and overwrites at random places.
+def make_modified_copy(source, target, edits, seed=7):
+    rng = random.Random(seed)
+    with open(source, 'rb') as file:
+        data = bytearray(file.read())
+    for _ in range(edits):
+        position = rng.randrange(len(data))
+        if rng.random() < 0.5:
+            data[position:position] = os.urandom(rng.randint(1, 64))
+        else:
+            data[position:position + 4096] = os.urandom(4096)
+    with open(target, 'wb') as file:
+        file.write(data)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dedup ratio and upload time for a lightly modified file')
+    parser.add_argument('--size', default='32M')
+    parser.add_argument('--edits', type=int, default=10, help='small edits in the modified copy')
+    parser.add_argument('--bandwidth', default='20M', help='link bandwidth in bytes/sec, 0 for plain loopback')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    with tempfile.TemporaryDirectory() as work_dir:
+        original = os.path.join(work_dir, 'original.bin')
+        modified = os.path.join(work_dir, 'modified.bin')
+        make_random_file(original, size)
+        make_modified_copy(original, modified, args.edits)
+        modified_size = os.path.getsize(modified)
+
+        process, server_port = start_server(work_dir, extra_args=['--dedup'])
+        bandwidth = parse_size(args.bandwidth)
+        proxy, port = None, server_port
+        if bandwidth:
+            proxy, port = start_proxy(server_port, window=64 * UNITS['M'], bandwidth=bandwidth)
+        try:
+            client = TransferClient('127.0.0.1', port).connect()
+            with open(original, 'rb') as file:
+                first_time, (_, _, first_stats) = timed(client.dedup_upload, 'original.bin', file)
+            with open(modified, 'rb') as file:
+                dedup_time, (_, _, dedup_stats) = timed(client.dedup_upload, 'modified.bin', file)
+            with open(modified, 'rb') as file:
+                plain_time, _ = timed(client.upload, 'modified-plain.bin', file, modified_size, True)
+            client.close()
+        finally:
+            if proxy:
+                stop_proxy(proxy)
+            stop_server(process)
+
+        logical, stored = ChunkStore(os.path.join(work_dir, 'server_storage')).usage()
+
+    megabytes = UNITS['M']
+    rows = [
+        ['original, dedup upload', f'{first_stats["sent_bytes"] / megabytes:.1f}', f'{first_time:.2f}'],
+        ['modified copy, plain upload', f'{modified_size / megabytes:.1f}', f'{plain_time:.2f}'],
+        ['modified copy, dedup upload', f'{dedup_stats["sent_bytes"] / megabytes:.1f}', f'{dedup_time:.2f}'],
+    ]
+    print(f'{args.size} file, {args.bandwidth} bytes/sec link, {args.edits} edits, '
+          f'{dedup_stats["chunks"]} chunks in the modified copy, {dedup_stats["sent_chunks"]} sent')
+    print_table(['upload', 'MB sent', 'seconds'], rows)
+    print(f'stored {stored / megabytes:.1f} MB for {logical / megabytes:.1f} MB of files: '
+          f'dedup ratio {logical / stored:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, UNITS
+from bench_dedup import make_random_file
+from latency_proxy import start_proxy, stop_proxy
+from transfer_client import TransferClient
+import integrity
+
+
+# Writes a copy of a file with percent of its bytes overwritten in place, in runs of edit_size bytes at
+# random offsets, or, with inserts, with that many runs of 1-64 random bytes inserted, shifting what follows.
+def make_edited_copy(source, target, percent, edit_size, inserts=0, seed=11):
+    rng = random.Random(seed)
+    with open(source, 'rb') as file:
+        data = bytearray(file.read())
+    for _ in range(int(len(data) * percent / 100 / edit_size)):
+        position = rng.randrange(len(data) - edit_size)
+        data[position:position + edit_size] = rng.randbytes(edit_size)
+    for _ in range(inserts):
+        position = rng.randrange(len(data))
+        data[position:position] = rng.randbytes(rng.randint(1, 64))
+    with open(target, 'wb') as file:
+        file.write(data)
+
+
+# Uploads the edited copy over a stored copy of the original twice, whole and as a delta, and checks
+# that the server ended up with the edited file both times. Returns a table row.
+def run(client, label, original, edited, number):
+    full_name, delta_name = f'full-{number}.bin', f'delta-{number}.bin'
+    with open(original, 'rb') as file:
+        size = os.path.getsize(original)
+        for name in (full_name, delta_name):
+            file.seek(0)
+            success, message = client.upload(name, file, size, overwrite=True)
+            if not success:
+                raise RuntimeError(f'Upload failed: {message}')
+
+    edited_size = os.path.getsize(edited)
+    with open(edited, 'rb') as file:
+        start = time.perf_counter()
+        success, message = client.upload(full_name, file, edited_size, overwrite=True)
+        full_time = time.perf_counter() - start
+        if not success:
+            raise RuntimeError(f'Upload failed: {message}')
+        start = time.perf_counter()
+        success, message, stats = client.delta_upload(delta_name, file)
+        delta_time = time.perf_counter() - start
+        if not success:
+            raise RuntimeError(f'Delta upload failed: {message}')
+
+    expected = integrity.digest_path(edited)
+    if client.remote_checksum(full_name) != expected or client.remote_checksum(delta_name) != expected:
+        raise RuntimeError(f'{label}: the server does not hold the edited file')
+
+    # Bytes on the wire for the delta: the signatures received as well as the records sent.
+    delta_bytes = stats['sent_bytes'] + stats['signature_bytes']
+    megabytes = UNITS['M']
+    return [label, f'{edited_size / megabytes:.1f}', f'{delta_bytes / megabytes:.3f}',
+            f'{edited_size / delta_bytes:.0f}x' if delta_bytes else '-', 'yes' if stats['delta'] else 'no',
+            f'{full_time:.2f}', f'{delta_time:.2f}', f'{full_time / delta_time:.2f}x']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes sent and upload time of a new version of a file, '
+                                                 'whole and as a delta against the stored version')
+    parser.add_argument('--size', default='64M')
+    parser.add_argument('--percents', nargs='+', type=float, default=[0, 0.1, 1, 10],
+                        help='percent of the file overwritten in each edited version')
+    parser.add_argument('--edit-size', default='4K', help='bytes per overwritten run')
+    parser.add_argument('--inserts', type=int, default=100,
+                        help='small insertions in one more edited version, 0 to leave it out')
+    parser.add_argument('--bandwidth', default='20M', help='link bandwidth in bytes/sec, 0 for plain loopback')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    edit_size = parse_size(args.edit_size)
+    versions = [(f'{percent:g}% overwritten', percent, 0) for percent in args.percents]
+    if args.inserts:
+        versions.append((f'{args.inserts} insertions', 0, args.inserts))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        original = os.path.join(work_dir, 'original.bin')
+        edited = os.path.join(work_dir, 'edited.bin')
+        make_random_file(original, size)
+
+        process, server_port = start_server(work_dir, extra_args=['--engine', args.engine, '--durability', 'none'])
+        bandwidth = parse_size(args.bandwidth)
+        proxy, port = None, server_port
+        if bandwidth:
+            proxy, port = start_proxy(server_port, window=64 * UNITS['M'], bandwidth=bandwidth)
+        try:
+            client = TransferClient('127.0.0.1', port).connect()
+            for number, (label, percent, inserts) in enumerate(versions):
+                make_edited_copy(original, edited, percent, edit_size, inserts)
+                rows.append(run(client, label, original, edited, number))
+            client.close()
+        finally:
+            if proxy:
+                stop_proxy(proxy)
+            stop_server(process)
+
+    print(f'{args.size} file, {args.bandwidth} bytes/sec link, {args.engine} server, '
+          f'overwrites of {args.edit_size} bytes')
+    print_table(['edited version', 'MB', 'delta MB sent', 'reduction', 'delta used', 'whole s', 'delta s',
+                 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
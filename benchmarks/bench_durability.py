@@ -0,0 +1,86 @@
+import argparse
+import io
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+
+from bench_utils import start_server, stop_server, print_table, parse_size, percentile, free_port, UNITS
+from bench_read_cache import metric_value
+from transfer_client import TransferClient
+from durability import DURABILITY_MODES
+
+
+# Uploads data under fresh names until deadline, appending the latency of every upload to latencies.
+def upload_loop(port, data, deadline, number, latencies):
+    client = TransferClient('127.0.0.1', port).connect()
+    count = 0
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            success, message = client.upload(f'client-{number}-{count:06d}.bin', io.BytesIO(data), len(data))
+            if not success:
+                raise RuntimeError(f'Upload failed: {message}')
+            latencies.append(time.perf_counter() - start)
+            count += 1
+    finally:
+        client.close()
+
+
+# Runs clients uploading files of size bytes for args.duration seconds against a server with the given
+# durability mode. Returns a table row.
+def run(work_dir, mode, clients, size, args):
+    metrics_port = free_port()
+    storage = os.path.join(work_dir, f'{mode}-{clients}-{size}')
+    process, port = start_server(work_dir, extra_args=['--engine', args.engine, '--durability', mode,
+                                                       '--storage', storage, '--metrics-port', str(metrics_port)])
+    try:
+        data = os.urandom(size)
+        latencies = []
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=upload_loop, args=(port, data, deadline, number, latencies))
+                   for number in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        text = urllib.request.urlopen(f'http://127.0.0.1:{metrics_port}/metrics').read().decode()
+    finally:
+        stop_server(process)
+
+    files = len(latencies)
+    fsyncs = metric_value(text, 'fileserver_fsyncs_total')
+    return [mode, clients, f'{size // UNITS["K"]}K', f'{files / args.duration:.0f}',
+            f'{files * size / args.duration / UNITS["M"]:.1f}', f'{fsyncs / files:.2f}' if files else '-',
+            f'{percentile(latencies, 50) * 1000:.2f}', f'{percentile(latencies, 99) * 1000:.2f}']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload throughput and commit latency for each durability '
+                                                 'mode: many small concurrent uploads, then a few large ones')
+    parser.add_argument('--modes', nargs='+', choices=DURABILITY_MODES, default=list(DURABILITY_MODES))
+    parser.add_argument('--small-size', default='4K', help='bytes per file of the small uploads')
+    parser.add_argument('--small-clients', nargs='+', type=int, default=[1, 8, 32])
+    parser.add_argument('--large-size', default='64M', help='bytes per file of the large uploads')
+    parser.add_argument('--large-clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per mode and client count')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument('--dir', default=None, help='directory to store the files in (default: a temporary '
+                                                    'one); use one on the disk you want to measure')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+        for clients in args.small_clients:
+            for mode in args.modes:
+                rows.append(run(work_dir, mode, clients, parse_size(args.small_size), args))
+        for mode in args.modes:
+            rows.append(run(work_dir, mode, args.large_clients, parse_size(args.large_size), args))
+
+    print(f'{args.engine} server, {args.duration:.0f}s per row')
+    print_table(['durability', 'clients', 'size', 'files/s', 'MB/s', 'fsyncs/file', 'p50 ms', 'p99 ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, percentile, UNITS
+from latency_proxy import start_proxy, stop_proxy
+from protocol import ProtocolError
+from transfer_client import TransferClient
+
+
+# Moves the bulk file over and over until stop is set, adding the bytes moved to moved[number].
+# An upload in progress ends when the proxy is stopped under it.
+def bulk_loop(port, operation, size, stop, moved, number):
+    client = TransferClient('127.0.0.1', port, verify=False).connect()
+    data = b'\0' * size if operation == 'upload' else None
+    try:
+        while not stop.is_set():
+            if operation == 'upload':
+                counted = moved[number]
+                client.upload(f'bulk-{number}.bin', io.BytesIO(data), size, overwrite=True,
+                              progress=lambda sent: moved.__setitem__(number, counted + sent))
+                continue
+            success, response = client.start_download('bulk.bin')
+            if not success:
+                raise RuntimeError(f'Bulk download failed: {response}')
+            for chunk in client.iter_download(response):
+                moved[number] += len(chunk)
+                if stop.is_set():
+                    return
+    except (OSError, ProtocolError):
+        if not stop.is_set():
+            raise
+    finally:
+        client.close()
+
+
+# Lists the files and downloads the small file in turn every interval seconds until deadline.
+# Returns {'dir': [seconds], 'small': [seconds]}.
+def probe_loop(port, interval, deadline):
+    latencies = {'dir': [], 'small': []}
+    client = TransferClient('127.0.0.1', port).connect()
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            client.list_files()
+            latencies['dir'].append(time.perf_counter() - start)
+            time.sleep(interval / 2)
+
+            start = time.perf_counter()
+            success, response = client.start_download('small.bin')
+            if not success:
+                raise RuntimeError(f'Small download failed: {response}')
+            for _ in client.iter_download(response):
+                pass
+            latencies['small'].append(time.perf_counter() - start)
+            time.sleep(interval / 2)
+    finally:
+        client.close()
+    return latencies
+
+
+# Runs the probe through a shared link of the given bandwidth, under load from args.bulk_clients bulk
+# transfers when bulk is set. Returns the probe latencies and the bytes each bulk client moved per second.
+def run(work_dir, args, bandwidth, bulk, server_args):
+    process, server_port = start_server(work_dir, extra_args=['--engine', args.engine] + server_args)
+    proxy, port = start_proxy(server_port, delay=args.delay, window=parse_size(args.window),
+                              bandwidth=bandwidth, shared=True)
+    stop = threading.Event()
+    moved = [0] * args.bulk_clients
+    threads = []
+    try:
+        if bulk:
+            threads = [threading.Thread(target=bulk_loop, args=(port, args.bulk_op, parse_size(args.bulk_size), stop,
+                                                                moved, number))
+                       for number in range(args.bulk_clients)]
+            for thread in threads:
+                thread.start()
+            time.sleep(args.warmup)
+        before = list(moved)
+        start = time.monotonic()
+        latencies = probe_loop(port, args.interval, start + args.duration)
+        elapsed = time.monotonic() - start
+        rates = [(after - then) / elapsed for after, then in zip(moved, before)]
+    finally:
+        stop.set()
+        stop_proxy(proxy)
+        for thread in threads:
+            thread.join()
+        stop_server(process)
+    return latencies, rates if bulk else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of listings and small downloads while bulk transfers '
+                                                 'saturate a shared link, with and without server-side shaping')
+    parser.add_argument('--bandwidth', default='20M', help='bytes/sec of the link shared by every connection')
+    parser.add_argument('--delay', type=float, default=0.001, help='one-way link delay in seconds')
+    parser.add_argument('--window', default='1M', help='bytes in flight per connection and direction')
+    parser.add_argument('--share', type=float, default=0.9,
+                        help='server --rate-limit as a fraction of the link bandwidth when shaping')
+    parser.add_argument('--bulk-clients', type=int, default=4)
+    parser.add_argument('--bulk-op', choices=['download', 'upload'], default='download')
+    parser.add_argument('--bulk-size', default='64M')
+    parser.add_argument('--small-size', default='4K')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between probe requests')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of probing per scenario')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds of bulk load before probing')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument('--max-p99', type=float, default=None,
+                        help='fail (exit status 1) when a shaped probe p99 exceeds this many milliseconds')
+    args = parser.parse_args()
+
+    bandwidth = parse_size(args.bandwidth)
+    rate_limit = f'{bandwidth * args.share / UNITS["M"]:.3f}'
+    scenarios = [('idle', False, []), ('bulk, unshaped', True, []),
+                 (f'bulk, shaped {rate_limit} MB/s', True, ['--rate-limit', rate_limit])]
+    rows = []
+    failed = False
+    with tempfile.TemporaryDirectory() as work_dir:
+        process, port = start_server(work_dir)
+        try:
+            client = TransferClient('127.0.0.1', port).connect()
+            for name, size in (('small.bin', parse_size(args.small_size)),
+                               ('bulk.bin', parse_size(args.bulk_size))):
+                client.upload(name, io.BytesIO(os.urandom(size)), size, overwrite=True)
+            client.close()
+        finally:
+            stop_server(process)
+
+        for label, bulk, server_args in scenarios:
+            latencies, rates = run(work_dir, args, bandwidth, bulk, server_args)
+            for kind, values in latencies.items():
+                p99 = percentile(values, 99) * 1000
+                if server_args and args.max_p99 is not None and p99 > args.max_p99:
+                    failed = True
+                rows.append([label, kind, len(values), f'{percentile(values, 50) * 1000:.1f}', f'{p99:.1f}',
+                             f'{max(values) * 1000:.1f}',
+                             f'{sum(rates) / UNITS["M"]:.1f}' if rates else '-',
+                             f'{min(rates) / UNITS["M"]:.1f}-{max(rates) / UNITS["M"]:.1f}' if rates else '-'])
+
+    print(f'{args.bandwidth}/s shared link, {args.delay * 1000:g} ms delay, {args.bulk_clients} bulk '
+          f'{args.bulk_op}s of {args.bulk_size}, {args.small_size} small downloads, {args.engine} server')
+    print_table(['scenario', 'probe', 'count', 'p50 ms', 'p99 ms', 'max ms', 'bulk MB/s', 'per client MB/s'],
+                rows)
+    if args.max_p99 is not None:
+        print(f'{"FAIL" if failed else "PASS"}: shaped p99 limit {args.max_p99:g} ms')
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
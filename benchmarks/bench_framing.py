@@ -0,0 +1,123 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from bench_utils import start_server, stop_server, free_port, wait_for_port, print_table
+import protocol
+from transfer_client import TransferClient
+
+
+# Text protocol used before the framed protocol: one recv(1024) per command and one send per reply.
+# Only dir and delete are reproduced, which is all this benchmark issues.
+def legacy_handle_client(connection, storage_path):
+    while True:
+        command = connection.recv(1024).decode()
+        if not command:
+            break
+        parts = command.split()
+        if parts[0] == 'dir':
+            files = os.listdir(storage_path)
+            connection.send(("\n".join(files) if files else "No Files Found").encode())
+        elif parts[0] == 'delete' and len(parts) > 1:
+            file_path = os.path.join(storage_path, parts[1])
+            if not os.path.exists(file_path):
+                connection.send("File not found".encode())
+            else:
+                os.remove(file_path)
+                connection.send("File deleted successfully".encode())
+        else:
+            connection.send("Invalid command or missing arguments".encode())
+    connection.close()
+
+
+def run_legacy_server(port, storage_path):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(('127.0.0.1', port))
+    server_socket.listen(6)
+    while True:
+        connection, _ = server_socket.accept()
+        threading.Thread(target=legacy_handle_client, args=(connection, storage_path), daemon=True).start()
+
+
+# Issues operations alternating between dir and delete of a missing file.
+def operations(count):
+    for i in range(count):
+        if i % 2:
+            yield protocol.CMD_DELETE, f'missing-{i}.bin'
+        else:
+            yield protocol.CMD_DIR, ''
+
+
+def bench_legacy(port, count):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    start = time.perf_counter()
+    for command, name in operations(count):
+        text = 'dir' if command == protocol.CMD_DIR else f'delete {name}'
+        sock.send(text.encode())
+        sock.recv(4096)
+    elapsed = time.perf_counter() - start
+    sock.close()
+    return elapsed
+
+
+def bench_framed(port, count, window):
+    client = TransferClient('127.0.0.1', port).connect()
+    pending = list(operations(count))
+    start = time.perf_counter()
+    if window <= 1:
+        for command, name in pending:
+            client.request(command, name)
+    else:
+        for offset in range(0, count, window):
+            client.pipeline(pending[offset:offset + window])
+    elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Small dir/delete operations per second on one connection')
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--files', type=int, default=20, help='files present in storage for dir listings')
+    parser.add_argument('--window', type=int, default=64, help='requests in flight when pipelining')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        storage_path = os.path.join(work_dir, 'server_storage')
+        os.makedirs(storage_path)
+        for i in range(args.files):
+            with open(os.path.join(storage_path, f'file-{i}.txt'), 'wb') as file:
+                file.write(b'x' * 100)
+
+        rows = []
+
+        legacy_port = free_port()
+        legacy = multiprocessing.Process(target=run_legacy_server, args=(legacy_port, storage_path), daemon=True)
+        legacy.start()
+        try:
+            wait_for_port('127.0.0.1', legacy_port)
+            elapsed = bench_legacy(legacy_port, args.ops)
+            rows.append(['text (before)', args.ops, f'{elapsed:.3f}', f'{args.ops / elapsed:.0f}'])
+        finally:
+            legacy.terminate()
+
+        process, port = start_server(work_dir)
+        try:
+            elapsed = bench_framed(port, args.ops, 1)
+            rows.append(['framed, lockstep', args.ops, f'{elapsed:.3f}', f'{args.ops / elapsed:.0f}'])
+            elapsed = bench_framed(port, args.ops, args.window)
+            rows.append([f'framed, pipelined x{args.window}', args.ops, f'{elapsed:.3f}', f'{args.ops / elapsed:.0f}'])
+        finally:
+            stop_server(process)
+
+        print_table(['protocol', 'ops', 'seconds', 'ops/sec'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, UNITS
+from latency_proxy import start_proxy, stop_proxy
+from transfer_client import TransferClient
+import integrity
+
+
+# Hashes size bytes in memory and returns the digest speed in bytes/sec, the ceiling for verified transfers
+# if hashing were not overlapped with the network.
+def digest_speed(size):
+    block = os.urandom(UNITS['M'])
+    digest = integrity.new_digest()
+    start = time.perf_counter()
+    for _ in range(size // len(block)):
+        digest.update(block)
+    return size / (time.perf_counter() - start)
+
+
+# Uploads and downloads path through port, with or without verification.
+# Returns (upload seconds, download seconds).
+def transfer(port, path, verify):
+    client = TransferClient('127.0.0.1', port, verify=verify).connect()
+    name = os.path.basename(path)
+    size = os.path.getsize(path)
+    try:
+        start = time.perf_counter()
+        with open(path, 'rb') as file:
+            success, message = client.upload(name, file, size, overwrite=True)
+        upload_seconds = time.perf_counter() - start
+        if not success:
+            raise RuntimeError(f'Upload failed: {message}')
+
+        start = time.perf_counter()
+        success, response = client.start_download(name)
+        if not success:
+            raise RuntimeError(f'Download failed: {response}')
+        received = sum(len(chunk) for chunk in client.iter_download(response))
+        download_seconds = time.perf_counter() - start
+        if received != size:
+            raise RuntimeError(f'Downloaded {received} of {size} bytes')
+        return upload_seconds, download_seconds
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transfer throughput with and without end-to-end verification')
+    parser.add_argument('--size', default='256M', help='size of the test file')
+    parser.add_argument('--bandwidths', nargs='+', default=['100M', '0'],
+                        help='per-direction link bandwidth in bytes/sec, 0 for plain loopback')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per mode; the best is reported')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'source.bin')
+        with open(path, 'wb') as file:
+            for _ in range(size // UNITS['M']):
+                file.write(os.urandom(UNITS['M']))
+
+        process, server_port = start_server(work_dir, extra_args=['--engine', args.engine])
+        try:
+            for label in args.bandwidths:
+                bandwidth = parse_size(label)
+                proxy, port = None, server_port
+                if bandwidth:
+                    proxy, port = start_proxy(server_port, window=4 * UNITS['M'], bandwidth=bandwidth)
+                try:
+                    for verify in (False, True):
+                        runs = [transfer(port, path, verify) for _ in range(args.repeat)]
+                        upload = min(run[0] for run in runs)
+                        download = min(run[1] for run in runs)
+                        rows.append([label if bandwidth else 'loopback', 'on' if verify else 'off',
+                                     f'{size / upload / UNITS["M"]:.1f}', f'{size / download / UNITS["M"]:.1f}'])
+                finally:
+                    if proxy:
+                        stop_proxy(proxy)
+        finally:
+            stop_server(process)
+
+    print(f'{args.size} of random data, {args.engine} server, best of {args.repeat}; '
+          f'BLAKE2b alone hashes {digest_speed(size) / UNITS["M"]:.0f} MB/s on one core')
+    print_table(['bandwidth', 'verify', 'upload MB/s', 'download MB/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
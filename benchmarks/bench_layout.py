@@ -0,0 +1,156 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench_utils import print_table, parse_size, percentile, make_file, UNITS
+from storage_layout import StorageLayout, MappedFile, LEVELS, WIDTH, MAP_MIN_SIZE
+import integrity
+
+
+# Creates count files of size bytes in the layout. Returns the seconds it took.
+def populate(layout, count, size):
+    data = b'x' * size
+    start = time.perf_counter()
+    for number in range(count):
+        path = layout.path_for(f'file-{number:07d}.bin')
+        layout.make_parent(path)
+        with open(path, 'wb') as file:
+            file.write(data)
+    return time.perf_counter() - start
+
+
+# Drops the page, dentry and inode caches so lookups go to the disk, when allowed (root only).
+def drop_caches():
+    os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as file:
+            file.write('3\n')
+        return True
+    except OSError:
+        return False
+
+
+# Returns the latencies in microseconds of operation, called with the path of each name.
+def timed(layout, names, operation):
+    latencies = []
+    for name in names:
+        start = time.perf_counter()
+        operation(layout.path_for(name))
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+
+def stat_missing(path):
+    try:
+        os.stat(path)
+    except FileNotFoundError:
+        pass
+
+
+def open_read(path):
+    with open(path, 'rb') as file:
+        file.read()
+
+
+def open_mapped(path):
+    with open(path, 'rb') as file, MappedFile(file) as mapped:
+        mapped.view(0, mapped.size)
+
+
+# Returns the microseconds it takes on average to open a file of size bytes, hash it (as a checksum or a
+# digest trailer does) and close it, reading it into memory vs mapping it.
+def bench_mapping(work_dir, size):
+    path = os.path.join(work_dir, f'map-{size}.bin')
+    make_file(path, size)
+    repeat = max(20, 256 * UNITS['M'] // size)
+    results = []
+    for mapped in (False, True):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            with open(path, 'rb') as file:
+                if mapped:
+                    with MappedFile(file) as reader:
+                        integrity.digest_file(reader)
+                else:
+                    integrity.digest_file(file)
+        results.append((time.perf_counter() - start) / repeat * 1e6)
+    return results
+
+
+# Measures one layout holding count files. Returns a table row.
+def run(work_dir, label, levels, count, args):
+    root = os.path.join(work_dir, f'{label}-{count}')
+    os.makedirs(root)
+    layout = StorageLayout(root, levels, args.width)
+    create_time = populate(layout, count, args.file_size)
+    cold = args.drop_caches and drop_caches()
+
+    start = time.perf_counter()
+    scanned = sum(1 for _ in layout.scan())
+    scan_time = time.perf_counter() - start
+    if scanned != count:
+        raise RuntimeError(f'{label}: scanned {scanned} of {count} files')
+
+    rng = random.Random(count)
+    present = [f'file-{rng.randrange(count):07d}.bin' for _ in range(args.lookups)]
+    missing = [f'missing-{number}.bin' for number in range(args.lookups)]
+    if args.drop_caches:
+        drop_caches()
+    hits = timed(layout, present, os.stat)
+    misses = timed(layout, missing, stat_missing)
+    reads = timed(layout, present, open_read)
+    maps = timed(layout, present, open_mapped)
+
+    if levels:
+        largest = max(len(os.listdir(directory)) for directory in layout.directories)
+    else:
+        largest = count
+    row = [label, count, largest, f'{count / create_time:.0f}', f'{scan_time:.2f}']
+    for latencies in (hits, misses, reads, maps):
+        row += [f'{percentile(latencies, 50):.1f}', f'{percentile(latencies, 99):.1f}']
+    return row, cold
+
+
+def main():
+    parser = argparse.ArgumentParser(description='File creation, listing, lookup and open latency of the flat '
+                                                 'and the hashed storage layout as the number of files grows')
+    parser.add_argument('--counts', nargs='+', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--file-size', type=parse_size, default='4K')
+    parser.add_argument('--levels', type=int, default=LEVELS, help='fan-out levels of the hashed layout')
+    parser.add_argument('--width', type=int, default=WIDTH, help='hex digits per level of the hashed layout')
+    parser.add_argument('--lookups', type=int, default=20000, help='random files looked up and opened per run')
+    parser.add_argument('--drop-caches', action='store_true',
+                        help='look up with cold caches (needs root), instead of right after creating the files')
+    parser.add_argument('--dir', default=None, help='directory to create the files in, default a temporary one')
+    parser.add_argument('--map-sizes', nargs='+', default=['4K', '64K', '256K', '1M', '16M'],
+                        help='file sizes to compare reading and mapping at, nothing to skip it')
+    args = parser.parse_args()
+
+    rows = []
+    cold = False
+    for count in args.counts:
+        for label, levels in (('flat', 0), ('hashed', args.levels)):
+            with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+                row, cold = run(work_dir, label, levels, count, args)
+                rows.append(row)
+                print(f'{label} layout with {count} files done', flush=True)
+
+    print(f'{args.file_size} byte files, hashed layout of {args.levels} levels of {args.width} hex digits, '
+          f'{args.lookups} lookups, {"cold" if cold else "warm"} caches; latencies in microseconds')
+    print_table(['layout', 'files', 'largest dir', 'creates/s', 'scan s', 'stat p50', 'stat p99', 'miss p50',
+                 'miss p99', 'read p50', 'read p99', 'mmap p50', 'mmap p99'], rows)
+
+    if args.map_sizes:
+        rows = []
+        with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+            for label in args.map_sizes:
+                read_time, map_time = bench_mapping(work_dir, parse_size(label))
+                rows.append([label, f'{read_time:.1f}', f'{map_time:.1f}', f'{read_time / map_time:.2f}x'])
+        print(f'\nopen, hash and close one file, warm; the server maps files of {MAP_MIN_SIZE // 1024}K and more')
+        print_table(['size', 'read us', 'mmap us', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
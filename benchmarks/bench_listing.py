@@ -0,0 +1,102 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench_utils import start_server, stop_server, print_table
+from file_index import FileIndex, FileEntry
+from transfer_client import TransferClient
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+# Lists a directory the way handle_dir used to: listdir, then a getsize and getmtime call per entry.
+def scan_listing(path):
+    return [(name, os.path.getsize(os.path.join(path, name)), os.path.getmtime(os.path.join(path, name)))
+            for name in os.listdir(path)]
+
+
+# Times index operations on a synthetic index of count files, without touching the disk.
+def bench_index(count, page_size):
+    entries = (FileEntry(f'dir{number % 100:02d}/file-{number:08d}', number % 100003, 1.7e9 + number)
+               for number in range(count))
+    index = FileIndex()
+    load_time, _ = timed(index.load, entries)
+    rows = [['build index', f'{load_time * 1000:.1f}', '']]
+
+    cases = [
+        ('first page by name', dict(limit=page_size)),
+        ('page deep in the listing', dict(limit=page_size, cursor=f'dir50/file-{count // 2:08d}')),
+        ('prefix page', dict(prefix='dir42/', limit=page_size)),
+        ('last page by name, reversed', dict(reverse=True, limit=page_size)),
+        ('first page by size (builds the order)', dict(sort='size', limit=page_size)),
+        ('next page by size', dict(sort='size', limit=page_size, cursor=[50000, ''])),
+        ('first page by mtime (builds the order)', dict(sort='mtime', reverse=True, limit=page_size)),
+        ('next page by mtime', dict(sort='mtime', reverse=True, limit=page_size, cursor=[1.7e9 + count / 2, ''])),
+    ]
+    for label, arguments in cases:
+        seconds, (result, _) = timed(index.page, **arguments)
+        rows.append([label, f'{seconds * 1000:.2f}', len(result)])
+
+    update_time, _ = timed(index.update, 'dir00/file-new', 1, 1.0)
+    remove_time, _ = timed(index.remove, 'dir00/file-new')
+    rows.append(['insert one file (all orders)', f'{update_time * 1000:.3f}', ''])
+    rows.append(['remove one file (all orders)', f'{remove_time * 1000:.3f}', ''])
+
+    # Memory held by one page request once the orders exist: only the page itself.
+    tracemalloc.start()
+    index.page(sort='size', limit=page_size, cursor=[50000, ''])
+    page_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f'index of {count} files, peak memory of one {page_size} entry page: {page_peak / 1024:.0f} KB')
+    print_table(['operation', 'ms', 'entries'], rows)
+
+
+# Compares a full listing of count files on disk: the old per-request scan against the streamed index listing.
+def bench_server(count, engine):
+    with tempfile.TemporaryDirectory() as work_dir:
+        storage_path = os.path.join(work_dir, 'server_storage')
+        os.makedirs(storage_path)
+        for number in range(count):
+            with open(os.path.join(storage_path, f'file-{number:07d}'), 'wb') as file:
+                file.write(b'x' * (number % 100))
+
+        scan_time = min(timed(scan_listing, storage_path)[0] for _ in range(3))
+        process, port = start_server(work_dir, extra_args=['--engine', engine])
+        try:
+            client = TransferClient('127.0.0.1', port).connect()
+            full_time = min(timed(client.list_entries, limit=0)[0] for _ in range(3))
+            page_time = min(timed(client.list_entries, prefix='file-05', limit=100)[0] for _ in range(3))
+            client.close()
+        finally:
+            stop_server(process)
+
+    print(f'\n{count} files on disk, {engine} server')
+    print_table(['listing', 'ms'], [
+        ['old scan: listdir + getsize + getmtime (server side only)', f'{scan_time * 1000:.1f}'],
+        ['index: full listing streamed to the client', f'{full_time * 1000:.1f}'],
+        ['index: 100 entry prefix page', f'{page_time * 1000:.2f}'],
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Directory index build, paging and listing latency')
+    parser.add_argument('--files', type=int, default=1000000, help='files in the synthetic index')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--disk-files', type=int, default=20000, help='files created for the server comparison')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    args = parser.parse_args()
+
+    bench_index(args.files, args.page_size)
+    if args.disk_files:
+        bench_server(args.disk_files, args.engine)
+
+
+if __name__ == '__main__':
+    main()
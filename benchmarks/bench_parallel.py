@@ -0,0 +1,76 @@
+import argparse
+import os
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, make_file, UNITS
+from latency_proxy import start_proxy, stop_proxy
+from parallel_transfer import ParallelTransfer
+from transfer_client import TransferClient
+
+
+# Times a plain single-request upload and download, the path used before chunked transfers.
+def single_stream(port, local_path, work_dir):
+    client = TransferClient('127.0.0.1', port).connect()
+    size = os.path.getsize(local_path)
+    start = time.perf_counter()
+    with open(local_path, 'rb') as file:
+        client.upload('single.bin', file, size, overwrite=True)
+    upload = time.perf_counter() - start
+    start = time.perf_counter()
+    with open(os.path.join(work_dir, 'single.out'), 'wb') as file:
+        client.download('single.bin', file)
+    download = time.perf_counter() - start
+    client.close()
+    return upload, download
+
+
+# Times a chunked upload and download over the given number of streams.
+def multi_stream(port, local_path, work_dir, streams, chunk_size):
+    transfer = ParallelTransfer('127.0.0.1', port, streams, chunk_size)
+    start = time.perf_counter()
+    success, message = transfer.upload('parallel.bin', local_path, overwrite=True)
+    upload = time.perf_counter() - start
+    if not success:
+        raise RuntimeError(message)
+    start = time.perf_counter()
+    success, message = transfer.download('parallel.bin', os.path.join(work_dir, 'parallel.out'))
+    download = time.perf_counter() - start
+    if not success:
+        raise RuntimeError(message)
+    return upload, download
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput against stream count behind a delay proxy')
+    parser.add_argument('--size', default='64M')
+    parser.add_argument('--streams', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--chunk-size', default='4M')
+    parser.add_argument('--delay-ms', type=float, default=25.0, help='one-way delay added by the proxy')
+    parser.add_argument('--window', default='256K', help='bytes in flight per connection and direction')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        local_path = os.path.join(work_dir, 'source.bin')
+        make_file(local_path, size)
+        server, server_port = start_server(work_dir)
+        proxy, port = start_proxy(server_port, args.delay_ms / 1000, parse_size(args.window))
+        try:
+            upload, download = single_stream(port, local_path, work_dir)
+            rows.append(['single request', f'{size / upload / UNITS["M"]:.1f}', f'{size / download / UNITS["M"]:.1f}'])
+            for streams in args.streams:
+                upload, download = multi_stream(port, local_path, work_dir, streams, parse_size(args.chunk_size))
+                rows.append([f'{streams} streams', f'{size / upload / UNITS["M"]:.1f}',
+                             f'{size / download / UNITS["M"]:.1f}'])
+        finally:
+            stop_proxy(proxy)
+            stop_server(server)
+
+    print(f'{args.size} file, {args.delay_ms} ms one-way delay, {args.window} window per connection')
+    print_table(['mode', 'upload MB/s', 'download MB/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
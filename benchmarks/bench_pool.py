@@ -0,0 +1,104 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from bench_utils import start_server, stop_server, print_table, parse_size, percentile, UNITS
+from latency_proxy import start_proxy, stop_proxy
+from connection_pool import ConnectionPool
+from transfer_client import TransferClient
+
+
+# The way FileClient used to share the server: one connection, held under a lock for a whole operation.
+class SharedConnection:
+    def __init__(self, host, port):
+        self.connection = TransferClient(host, port).connect()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def checkout(self, bulk=False):
+        with self.lock:
+            yield self.connection
+
+    def close(self):
+        self.connection.close()
+
+
+# Keeps uploading a file of size bytes until stop is set.
+def upload_loop(clients, name, source, size, stop, uploads):
+    while not stop.is_set():
+        with clients.checkout(bulk=True) as connection:
+            with open(source, 'rb') as file:
+                connection.upload(name, file, size, overwrite=True)
+        uploads.append(name)
+
+
+# Lists the files every interval seconds until stop is set, recording how long each listing took.
+def list_loop(clients, interval, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        with clients.checkout() as connection:
+            connection.list_files()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(interval)
+
+
+def run(clients, args, source, size):
+    stop = threading.Event()
+    latencies = []
+    uploads = []
+    threads = [threading.Thread(target=upload_loop, args=(clients, f'bulk-{number}.bin', source, size, stop, uploads))
+               for number in range(args.uploads)]
+    threads.append(threading.Thread(target=list_loop, args=(clients, args.interval, stop, latencies)))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, len(uploads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Listing latency while bulk uploads run, shared connection vs pool')
+    parser.add_argument('--size', default='32M', help='size of each upload')
+    parser.add_argument('--uploads', type=int, default=2, help='concurrent uploaders')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per mode')
+    parser.add_argument('--interval', type=float, default=0.05, help='pause between listings')
+    parser.add_argument('--bandwidth', default='50M', help='per-connection link bandwidth in bytes/sec, 0 for none')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = os.path.join(work_dir, 'source.bin')
+        with open(source, 'wb') as file:
+            file.write(os.urandom(size))
+
+        process, server_port = start_server(work_dir)
+        bandwidth = parse_size(args.bandwidth)
+        proxy, port = None, server_port
+        if bandwidth:
+            proxy, port = start_proxy(server_port, window=4 * UNITS['M'], bandwidth=bandwidth)
+        try:
+            for label, make_clients in (('shared connection + lock', SharedConnection),
+                                        ('connection pool', ConnectionPool)):
+                clients = make_clients('127.0.0.1', port)
+                latencies, uploads = run(clients, args, source, size)
+                clients.close()
+                rows.append([label, len(latencies), f'{percentile(latencies, 50) * 1000:.1f}',
+                             f'{percentile(latencies, 99) * 1000:.1f}', f'{max(latencies) * 1000:.1f}', uploads])
+        finally:
+            if proxy:
+                stop_proxy(proxy)
+            stop_server(process)
+
+    print(f'{args.uploads} uploaders of {args.size} each, {args.bandwidth} bytes/sec per connection, '
+          f'{args.duration:.0f}s per mode')
+    print_table(['clients', 'listings', 'p50 ms', 'p99 ms', 'max ms', 'uploads done'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, UNITS
+from transfer_client import TransferClient
+
+# CPU-bound work each operation puts on the server: hashing a verified upload, decompressing a
+# zstd upload, encoding a listing as JSON, or hashing a ranged download for its digest trailer.
+OPERATIONS = ['upload', 'upload-zstd', 'dir', 'range']
+
+
+# Runs one operation in a loop on its own connection until deadline and puts (operations, bytes) on results.
+# Each client is a process of its own, so the clients are not what limits the server.
+def client_loop(port, operation, size, number, deadline, results):
+    compress = 'zstd' if operation == 'upload-zstd' else None
+    client = TransferClient('127.0.0.1', port, compress=compress).connect()
+    # Text-like data compresses, so a zstd upload is really decompressed by the server.
+    data = (b'%d client sent this line of a log file\n' % number) * (size // 32) if compress else os.urandom(size)
+    count = moved = 0
+    try:
+        while time.monotonic() < deadline:
+            if operation in ('upload', 'upload-zstd'):
+                success, message = client.upload(f'client-{number}.bin', io.BytesIO(data), len(data), overwrite=True)
+                if not success:
+                    raise RuntimeError(message)
+                moved += len(data)
+            elif operation == 'dir':
+                success, entries, _ = client.list_entries(limit=0)
+                moved += len(entries)
+            else:
+                success, response = client.start_download('range.bin', offset=1, length=size)
+                if not success:
+                    raise RuntimeError(response)
+                moved += sum(len(chunk) for chunk in client.iter_download(response))
+            count += 1
+    finally:
+        client.close()
+    results.put((count, moved))
+
+
+# Runs args.clients client processes against a server of the given worker count. Returns (ops/s, units/s).
+def run(work_dir, workers, operation, args):
+    process, port = start_server(work_dir, extra_args=['--engine', args.engine, '--workers', str(workers)]
+                                 + (['--no-reuseport'] if args.no_reuseport else []))
+    try:
+        time.sleep(args.settle)
+        results = multiprocessing.Queue()
+        deadline = time.monotonic() + args.duration
+        clients = [multiprocessing.Process(target=client_loop, args=(port, operation, parse_size(args.size),
+                                                                      number, deadline, results))
+                   for number in range(args.clients)]
+        for client in clients:
+            client.start()
+        totals = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        stop_server(process)
+    return sum(count for count, _ in totals) / args.duration, sum(moved for _, moved in totals) / args.duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate throughput of CPU-bound operations against the '
+                                                 'number of prefork worker processes')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument('--clients', type=int, default=8, help='client processes, one connection each')
+    parser.add_argument('--size', default='4M', help='bytes per upload or ranged download')
+    parser.add_argument('--listing-files', type=int, default=5000, help='files in the listing of the dir operation')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per worker count and operation')
+    parser.add_argument('--settle', type=float, default=0.5, help='seconds to let the workers start')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument('--no-reuseport', action='store_true', help='workers share one inherited socket')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        process, port = start_server(work_dir)
+        try:
+            client = TransferClient('127.0.0.1', port).connect()
+            size = parse_size(args.size)
+            client.upload('range.bin', io.BytesIO(os.urandom(size + 1)), size + 1, overwrite=True)
+            client.upload_many(((f'listed-{number:06d}', io.BytesIO(b''), 0) for number in range(args.listing_files)),
+                               overwrite=True)
+            client.close()
+        finally:
+            stop_server(process)
+
+        for operation in args.operations:
+            baseline = None
+            for workers in args.workers:
+                rate, moved = run(work_dir, workers, operation, args)
+                baseline = baseline or rate
+                unit = f'{moved:.0f} entries/s' if operation == 'dir' else f'{moved / UNITS["M"]:.1f} MB/s'
+                rows.append([operation, workers, f'{rate:.1f}', unit, f'{rate / baseline:.2f}x'])
+
+    print(f'{os.cpu_count()} CPUs, {args.clients} client processes, {args.size} transfers, '
+          f'{args.listing_files} listed files, {args.engine} workers '
+          f'({"inherited socket" if args.no_reuseport else "SO_REUSEPORT"})')
+    print_table(['operation', 'workers', 'ops/s', 'throughput', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
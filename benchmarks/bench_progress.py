@@ -0,0 +1,99 @@
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, make_file, UNITS
+from transfer_client import TransferClient
+from progress import ProgressReporter
+
+MODES = ['off', 'per-chunk', 'coalesced']
+
+
+# File object that hands out at most read_size bytes per read, like the body of an HTTP request read
+# from a socket, so the upload reports progress as often as the web client does.
+class ShortReader:
+    def __init__(self, file, read_size):
+        self.file = file
+        self.read_size = read_size
+
+    def read(self, size=-1):
+        return self.file.read(min(size, self.read_size) if size >= 0 else self.read_size)
+
+
+# Stand-in for socketio.emit: encodes each event as a Socket.IO text packet, which a real emit does too
+# before queueing it for every connected browser, and counts it.
+class PacketSink:
+    def __init__(self):
+        self.events = 0
+        self.bytes = 0
+
+    def emit(self, event, data):
+        packet = '42' + json.dumps([event, data])
+        self.events += 1
+        self.bytes += len(packet)
+
+
+# Uploads path once with the given progress mode. Returns (CPU seconds, wall seconds, events emitted).
+def run(port, path, size, mode, args):
+    sink = PacketSink()
+    client = TransferClient('127.0.0.1', port, compress=None, verify=not args.no_verify).connect()
+    with open(path, 'rb') as file, open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if mode == 'per-chunk':
+            # What the web client did before: an event and a DEBUG line for every chunk.
+            def report(sent):
+                percent = round((sent / size) * 100, 2)
+                sink.emit('upload_progress', {'progress': percent, 'filename': 'bench.bin'})
+                print(f"DEBUG - Progress: {percent}%")
+        elif mode == 'coalesced':
+            transfer = ProgressReporter(sink.emit).start('upload', 'bench.bin', size)
+            report = transfer.update
+        else:
+            report = None
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        success, message = client.upload('bench.bin', ShortReader(file, args.read_size), size, overwrite=True,
+                                         progress=report)
+        if mode == 'coalesced':
+            transfer.finish(success, message)
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    client.close()
+    if not success:
+        raise RuntimeError(f'Upload failed: {message}')
+    return cpu, wall, sink.events
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Client CPU time of an upload with progress reporting off, '
+                                                 'one event per chunk, and coalesced events')
+    parser.add_argument('--size', default='1G')
+    parser.add_argument('--read-size', type=parse_size, default='4K',
+                        help='bytes per read of the source, i.e. per progress callback')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--repeat', type=int, default=3, help='uploads per mode; the best is reported')
+    parser.add_argument('--no-verify', action='store_true', help='turn off end-to-end verification')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'bench.bin')
+        make_file(path, size)
+        process, port = start_server(work_dir, extra_args=['--durability', 'none'])
+        try:
+            baseline = None
+            for mode in args.modes:
+                cpu, wall, events = min(run(port, path, size, mode, args) for _ in range(args.repeat))
+                baseline = baseline or cpu
+                rows.append([mode, events, f'{cpu:.2f}', f'{cpu / (size / UNITS["M"]) * 1e6:.0f}',
+                             f'{cpu / baseline:.2f}x', f'{size / wall / UNITS["M"]:.1f}'])
+        finally:
+            stop_server(process)
+
+    print(f'{args.size} upload read {args.read_size} bytes at a time, best of {args.repeat}')
+    print_table(['progress', 'events', 'client CPU s', 'CPU us/MB', 'vs first', 'MB/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
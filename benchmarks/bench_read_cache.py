@@ -0,0 +1,150 @@
+import argparse
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+
+from bench_utils import start_server, stop_server, print_table, parse_size, percentile, free_port, UNITS
+from transfer_client import TransferClient
+
+
+# Returns the value of an unlabelled metric in a Prometheus text document, or 0 when it is not there.
+def metric_value(text, name):
+    match = re.search(rf'^{name} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0
+
+
+# Returns cumulative weights that make file number k (from 1) k ** skew times less popular than the first.
+def zipf_weights(count, skew):
+    weights = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1 / rank ** skew
+        weights.append(total)
+    return weights
+
+
+# Drops the page cache of every file under root until stop is set, like a server whose memory is needed
+# elsewhere or whose disk is on the network, so reads that miss the read cache really go to disk.
+def evict_loop(root, interval, stop):
+    while not stop.is_set():
+        for directory, _, names in os.walk(root):
+            for name in names:
+                try:
+                    fd = os.open(os.path.join(directory, name), os.O_RDONLY)
+                except OSError:
+                    continue
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                finally:
+                    os.close(fd)
+        stop.wait(interval)
+
+
+# Downloads files picked by popularity until deadline, recording the latency and size of each download.
+def download_loop(port, names, weights, deadline, seed, latencies, sizes):
+    rng = random.Random(seed)
+    client = TransferClient('127.0.0.1', port, verify=False).connect()
+    try:
+        while time.monotonic() < deadline:
+            name = rng.choices(names, cum_weights=weights)[0]
+            start = time.perf_counter()
+            success, response = client.start_download(name)
+            if not success:
+                raise RuntimeError(f'Download of {name} failed: {response}')
+            size = sum(len(chunk) for chunk in client.iter_download(response))
+            latencies.append(time.perf_counter() - start)
+            sizes.append(size)
+    finally:
+        client.close()
+
+
+def run(work_dir, args, names, weights, cache_size):
+    metrics_port = free_port()
+    extra_args = ['--metrics-port', str(metrics_port)] + (['--dedup'] if args.dedup else [])
+    if cache_size:
+        extra_args += ['--cache-size', str(cache_size // UNITS['M'])]
+    process, port = start_server(work_dir, extra_args=extra_args)
+    stop = threading.Event()
+    evictor = None
+    if args.cold:
+        evictor = threading.Thread(target=evict_loop, args=(os.path.join(work_dir, 'server_storage'),
+                                                            args.evict_interval, stop))
+        evictor.start()
+    try:
+        latencies, sizes = [], []
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=download_loop, args=(port, names, weights, deadline, number,
+                                                                latencies, sizes))
+                   for number in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        text = urllib.request.urlopen(f'http://127.0.0.1:{metrics_port}/metrics').read().decode()
+    finally:
+        stop.set()
+        if evictor:
+            evictor.join()
+        stop_server(process)
+
+    hits = metric_value(text, 'fileserver_cache_hits_total')
+    lookups = hits + metric_value(text, 'fileserver_cache_misses_total')
+    return [f'{cache_size // UNITS["M"]}M' if cache_size else 'off',
+            f'{hits / lookups * 100:.1f}' if lookups else '-',
+            f'{len(latencies) / args.duration:.0f}', f'{sum(sizes) / args.duration / UNITS["M"]:.1f}',
+            f'{percentile(latencies, 50) * 1000:.2f}', f'{percentile(latencies, 99) * 1000:.2f}']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download throughput for Zipf-distributed requests, '
+                                                 'with and without the server read cache')
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--min-size', default='16K', help='smallest file; sizes are spread log-uniformly')
+    parser.add_argument('--max-size', default='4M', help='largest file')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of file popularity')
+    parser.add_argument('--cache-sizes', nargs='+', default=['0', '64M', '256M'], help='0 for no cache')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per cache size')
+    parser.add_argument('--cold', action='store_true',
+                        help='keep dropping the page cache of the stored files, as on a cold or network disk')
+    parser.add_argument('--evict-interval', type=float, default=0.05)
+    parser.add_argument('--dedup', action='store_true', help='store the files as deduplicated chunks')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    low, high = parse_size(args.min_size), parse_size(args.max_size)
+    sizes = [int(low * (high / low) ** rng.random()) for _ in range(args.files)]
+    names = [f'file-{number:05d}.bin' for number in range(args.files)]
+    weights = zipf_weights(args.files, args.skew)
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        process, port = start_server(work_dir, extra_args=['--dedup'] if args.dedup else [])
+        try:
+            client = TransferClient('127.0.0.1', port).connect()
+            for name, size in zip(names, sizes):
+                path = os.path.join(work_dir, 'source.bin')
+                with open(path, 'wb') as file:
+                    file.write(os.urandom(size))
+                with open(path, 'rb') as file:
+                    success, message = client.upload(name, file, size, overwrite=True)
+                if not success:
+                    raise RuntimeError(f'Upload of {name} failed: {message}')
+            client.close()
+        finally:
+            stop_server(process)
+
+        for label in args.cache_sizes:
+            rows.append(run(work_dir, args, names, weights, parse_size(label)))
+
+    print(f'{args.files} files of {args.min_size}-{args.max_size} ({sum(sizes) / UNITS["M"]:.0f}M in total), '
+          f'Zipf skew {args.skew}, {args.clients} clients, {args.duration:.0f}s per cache size'
+          f'{", page cache dropped continuously" if args.cold else ""}{", dedup storage" if args.dedup else ""}')
+    print_table(['cache', 'hit %', 'downloads/s', 'MB/s', 'p50 ms', 'p99 ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import os
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, make_file, UNITS
+import protocol
+from transfer_client import TransferClient
+
+
+# Downloads a file and throws the bytes away as cheaply as possible, so the client is not the bottleneck.
+def timed_download(client, file_name):
+    request = client.new_request(protocol.CMD_DOWNLOAD, file_name)
+    start = time.perf_counter()
+    client.frames.send_frame(request)
+    response = client.read_response(request)
+    if response.status != protocol.STATUS_OK:
+        raise RuntimeError(client.frames.read_text(response))
+
+    buffer = memoryview(bytearray(1024 * 1024))
+    remaining = response.size
+    while remaining:
+        received = client.frames.reader.readinto(buffer[:min(len(buffer), remaining)])
+        if not received:
+            raise protocol.ProtocolError('Connection closed during download')
+        remaining -= received
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Loopback download throughput, sendfile vs buffered sends')
+    parser.add_argument('--sizes', nargs='+', default=['1M', '16M', '256M', '1G', '4G'])
+    parser.add_argument('--repeat', type=int, default=3, help='downloads per size; the best run is reported')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes]
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        storage_path = os.path.join(work_dir, 'server_storage')
+        os.makedirs(storage_path)
+        for size in sizes:
+            make_file(os.path.join(storage_path, f'file-{size}.bin'), size)
+
+        results = {}
+        for mode, extra_args in (('sendfile', []), ('buffered', ['--no-sendfile'])):
+            process, port = start_server(work_dir, extra_args=['--engine', args.engine] + extra_args)
+            try:
+                client = TransferClient('127.0.0.1', port).connect()
+                for size in sizes:
+                    results[mode, size] = min(timed_download(client, f'file-{size}.bin')
+                                              for _ in range(args.repeat))
+                client.close()
+            finally:
+                stop_server(process)
+
+        for size, label in zip(sizes, args.sizes):
+            row = [label]
+            for mode in ('sendfile', 'buffered'):
+                row.append(f'{size / results[mode, size] / UNITS["M"]:.0f}')
+            row.append(f'{results["buffered", size] / results["sendfile", size]:.2f}x')
+            rows.append(row)
+
+    print_table(['size', 'sendfile MB/s', 'buffered MB/s', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
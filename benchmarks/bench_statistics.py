@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from bench_utils import print_table
+from statistics_collector import StatisticsLog, read_records
+
+
+# The statistics writer the server used before: every record re-reads the whole JSON file,
+# appends to it and writes it back, with no locking between threads.
+def legacy_record(path, number):
+    records = []
+    if os.path.exists(path):
+        try:
+            with open(path) as file:
+                records = json.load(file)
+        except (json.JSONDecodeError, IOError):
+            records = []
+    records.append({'timestamp': '', 'operation': 'upload', 'filename': f'file-{number}',
+                    'byte_size': number, 'seconds_duration': 0.1, 'mbps_rate': 1.0})
+    with open(path, 'w') as file:
+        json.dump(records, file, indent=2)
+
+
+# Runs record(number) count times spread over threads. Returns the elapsed seconds.
+def run_threads(record, count, threads):
+    def work(start):
+        for number in range(start, count, threads):
+            record(number)
+
+    workers = [threading.Thread(target=work, args=(start,)) for start in range(threads)]
+    begin = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - begin
+
+
+def count_legacy(path):
+    try:
+        with open(path) as file:
+            return len(json.load(file))
+    except (json.JSONDecodeError, IOError):
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Statistics records per second, JSON rewrite vs batched JSON Lines')
+    parser.add_argument('--records', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in args.records:
+            legacy_path = os.path.join(work_dir, f'legacy-{count}.json')
+            legacy_time = run_threads(lambda number: legacy_record(legacy_path, number), count, args.threads)
+            rows.append(['json rewrite', count, f'{count / legacy_time:.0f}', count_legacy(legacy_path)])
+
+            log_path = os.path.join(work_dir, f'log-{count}.jsonl')
+            log = StatisticsLog(log_path)
+            log_time = run_threads(lambda number: log.transfer_stats('upload', f'file-{number}', number, 0.1, 1.0),
+                                   count, args.threads)
+            log.close()
+            rows.append(['batched jsonl', count, f'{count / log_time:.0f}', sum(1 for _ in read_records(log_path))])
+
+    print(f'{args.threads} threads recording at the same time')
+    print_table(['writer', 'records', 'records/sec', 'records kept'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, print_table, parse_size, percentile, make_file, PROJECT_ROOT, UNITS
+from latency_proxy import start_proxy, stop_proxy
+from transfer_client import TransferClient
+
+SCENARIOS = ['large', 'small', 'scaling', 'listing']
+# Version of the results file format.
+FORMAT = 1
+
+
+# Writable file object that throws its data away, so downloads measure the transfer and not the disk.
+class NullWriter:
+    def write(self, data):
+        return len(data)
+
+
+# Class that runs one scenario against its own server process, reached directly or through the delay
+# proxy, and collects its metrics as {name: {'value', 'unit', 'better'}}, 'better' being 'higher' or 'lower'.
+class Scenario:
+    def __init__(self, work_dir, name, args):
+        self.args = args
+        self.metrics = {}
+        storage = os.path.join(work_dir, f'{name}-storage')
+        self.server, port = start_server(work_dir, extra_args=['--engine', args.engine, '--storage', storage,
+                                                               '--durability', args.durability])
+        self.proxy = None
+        self.port = port
+        if args.delay or args.bandwidth:
+            self.proxy, self.port = start_proxy(port, delay=args.delay, window=parse_size(args.window),
+                                                bandwidth=parse_size(args.bandwidth) if args.bandwidth else None)
+
+    def client(self):
+        return TransferClient('127.0.0.1', self.port, verify=not self.args.no_verify).connect()
+
+    def record(self, name, value, unit, better='higher'):
+        self.metrics[name] = {'value': round(value, 4), 'unit': unit, 'better': better}
+
+    def close(self):
+        if self.proxy:
+            stop_proxy(self.proxy)
+        stop_server(self.server)
+
+
+# Single large file: upload and download MB/s, best of args.repeat.
+def run_large(scenario, work_dir, args):
+    size = parse_size(args.large_size)
+    path = os.path.join(work_dir, 'large.bin')
+    make_file(path, size)
+    client = scenario.client()
+    try:
+        uploads, downloads = [], []
+        for _ in range(args.repeat):
+            with open(path, 'rb') as file:
+                start = time.perf_counter()
+                success, message = client.upload('large.bin', file, size, overwrite=True)
+                uploads.append(time.perf_counter() - start)
+            if not success:
+                raise RuntimeError(f'Upload failed: {message}')
+            start = time.perf_counter()
+            success, message = client.download('large.bin', NullWriter())
+            downloads.append(time.perf_counter() - start)
+            if not success:
+                raise RuntimeError(f'Download failed: {message}')
+    finally:
+        client.close()
+    os.remove(path)
+    scenario.record('large.upload', size / min(uploads) / UNITS['M'], 'MB/s')
+    scenario.record('large.download', size / min(downloads) / UNITS['M'], 'MB/s')
+
+
+# Many small files, one request each on one connection: uploads, stats, downloads and deletes per second.
+def run_small(scenario, work_dir, args):
+    size = parse_size(args.small_size)
+    data = os.urandom(size)
+    names = [f'small-{number:06d}.bin' for number in range(args.small_files)]
+    client = scenario.client()
+    try:
+        operations = [
+            ('upload', lambda name: client.upload(name, io.BytesIO(data), size, overwrite=True)),
+            ('stat', lambda name: (client.file_size(name) == size, 'wrong size')),
+            ('download', lambda name: client.download(name, NullWriter())),
+            ('delete', client.delete),
+        ]
+        for operation, call in operations:
+            start = time.perf_counter()
+            for name in names:
+                success, message = call(name)
+                if not success:
+                    raise RuntimeError(f'{operation} of {name} failed: {message}')
+            scenario.record(f'small.{operation}', len(names) / (time.perf_counter() - start), 'ops/s')
+    finally:
+        client.close()
+
+
+# Uploads and downloads a file of size bytes in turn on its own connection until deadline and puts
+# (operations, bytes) on results. Each client is a process of its own, so the clients are not the limit.
+def scaling_client(port, size, number, deadline, verify, results):
+    client = TransferClient('127.0.0.1', port, verify=verify).connect()
+    data = os.urandom(size)
+    count = moved = 0
+    try:
+        while time.monotonic() < deadline:
+            name = f'client-{number}.bin'
+            success, message = client.upload(name, io.BytesIO(data), size, overwrite=True)
+            if success:
+                success, message = client.download(name, NullWriter())
+            if not success:
+                raise RuntimeError(message)
+            count += 2
+            moved += 2 * size
+    finally:
+        client.close()
+        results.put((count, moved))
+
+
+# Concurrent clients: aggregate MB/s and operations/s of 1, 2, 4, ... clients uploading and downloading.
+def run_scaling(scenario, work_dir, args):
+    size = parse_size(args.scaling_size)
+    for clients in args.clients:
+        results = multiprocessing.Queue()
+        deadline = time.monotonic() + args.duration
+        processes = [multiprocessing.Process(target=scaling_client, args=(scenario.port, size, number, deadline,
+                                                                          not args.no_verify, results))
+                     for number in range(clients)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        scenario.record(f'scaling.clients-{clients}.throughput',
+                        sum(moved for _, moved in totals) / args.duration / UNITS['M'], 'MB/s')
+        scenario.record(f'scaling.clients-{clients}.ops', sum(count for count, _ in totals) / args.duration, 'ops/s')
+
+
+# Listing latency against directory size: the directory is grown to each size with empty files, then the
+# full listing and its first page of 1000 entries are timed, median of args.repeat.
+def run_listing(scenario, work_dir, args):
+    client = scenario.client()
+    stored = 0
+    try:
+        for count in sorted(args.listing_files):
+            batch = [(f'listed-{number:07d}', io.BytesIO(b''), 0) for number in range(stored, count)]
+            for start in range(0, len(batch), 1000):
+                client.upload_many(batch[start:start + 1000], overwrite=True)
+            stored = max(stored, count)
+            for label, limit in (('full', 0), ('page', 1000)):
+                latencies = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    success, entries, _ = client.list_entries(limit=limit)
+                    latencies.append(time.perf_counter() - start)
+                    if not success or len(entries) != min(count, limit or count):
+                        raise RuntimeError(f'Listing of {count} files returned {len(entries)} entries')
+                scenario.record(f'listing.files-{count}.{label}', percentile(latencies, 50) * 1000, 'ms', 'lower')
+    finally:
+        client.close()
+
+
+RUNNERS = {'large': run_large, 'small': run_small, 'scaling': run_scaling, 'listing': run_listing}
+
+
+# Returns the commit the project is at, or None outside a git checkout.
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Runs the chosen scenarios and returns the results document.
+def run_suite(args):
+    metrics = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.scenarios:
+            print(f'[*] Running {name}...', file=sys.stderr)
+            scenario = Scenario(work_dir, name, args)
+            try:
+                RUNNERS[name](scenario, work_dir, args)
+            finally:
+                scenario.close()
+            metrics.update(scenario.metrics)
+    link = {'delay': args.delay, 'bandwidth': args.bandwidth, 'window': args.window} if args.delay or args.bandwidth \
+        else None
+    return {
+        'format': FORMAT,
+        'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'commit': git_commit(),
+                 'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count(),
+                 'engine': args.engine, 'durability': args.durability, 'verify': not args.no_verify, 'link': link},
+        'metrics': metrics,
+    }
+
+
+# Compares the metrics of two results documents. A metric is a regression when it got worse by more than
+# threshold percent. Returns (table rows, number of regressions).
+def compare(baseline, current, threshold):
+    rows = []
+    regressions = 0
+    names = list(baseline['metrics']) + [name for name in current['metrics'] if name not in baseline['metrics']]
+    for name in names:
+        old, new = baseline['metrics'].get(name), current['metrics'].get(name)
+        if old is None or new is None:
+            metric = old or new
+            rows.append([name, metric['unit'], old['value'] if old else '-', new['value'] if new else '-', '-',
+                         'missing' if new is None else 'new'])
+            continue
+        change = (new['value'] - old['value']) / old['value'] * 100 if old['value'] else 0.0
+        worse = -change if new['better'] == 'higher' else change
+        if worse > threshold:
+            verdict = 'REGRESSION'
+            regressions += 1
+        elif worse < -threshold:
+            verdict = 'improved'
+        else:
+            verdict = 'ok'
+        rows.append([name, new['unit'], old['value'], new['value'], f'{change:+.1f}%', verdict])
+    return rows, regressions
+
+
+def print_comparison(baseline, current, threshold):
+    rows, regressions = compare(baseline, current, threshold)
+    # Runs on another engine or link measure something else; say so rather than refuse.
+    for key in ('engine', 'durability', 'verify', 'link', 'cpus'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f"warning: {key} differs: {baseline['meta'].get(key)} vs {current['meta'].get(key)}")
+    print(f"baseline {baseline['meta'].get('commit')} ({baseline['meta'].get('time')}) vs "
+          f"current {current['meta'].get('commit')} ({current['meta'].get('time')}), threshold {threshold:g}%")
+    print_table(['metric', 'unit', 'baseline', 'current', 'change', 'verdict'], rows)
+    print(f'{regressions} regression(s)')
+    return regressions
+
+
+def print_results(results):
+    rows = [[name, metric['unit'], metric['value']] for name, metric in results['metrics'].items()]
+    print_table(['metric', 'unit', 'value'], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite for the file server: large file throughput, '
+                                                 'small file ops/s, concurrent clients and listing latency, '
+                                                 'with JSON results and regression checks between runs')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the suite and write its results as JSON')
+    run_parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    run_parser.add_argument('--output', default=None, help='file for the JSON results (default: stdout)')
+    run_parser.add_argument('--baseline', default=None, help='results of an earlier run to compare against')
+    run_parser.add_argument('--threshold', type=float, default=10.0,
+                            help='percent a metric may get worse before it counts as a regression')
+    run_parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded')
+    run_parser.add_argument('--durability', choices=['always', 'group', 'none'], default='group')
+    run_parser.add_argument('--no-verify', action='store_true', help='turn off end-to-end verification')
+    run_parser.add_argument('--delay', type=float, default=0.0,
+                            help='one-way delay in seconds of a proxy put between client and server')
+    run_parser.add_argument('--bandwidth', default=None, help='bytes/sec per direction of the proxy link')
+    run_parser.add_argument('--window', default='4M', help='bytes in flight per connection through the proxy')
+    run_parser.add_argument('--large-size', default='256M')
+    run_parser.add_argument('--small-size', default='4K')
+    run_parser.add_argument('--small-files', type=int, default=2000)
+    run_parser.add_argument('--scaling-size', default='1M')
+    run_parser.add_argument('--clients', nargs='+', type=int, default=[1, 2, 4, 8])
+    run_parser.add_argument('--listing-files', nargs='+', type=int, default=[1000, 10000, 100000])
+    run_parser.add_argument('--duration', type=float, default=5.0, help='seconds per client count')
+    run_parser.add_argument('--repeat', type=int, default=3, help='runs of the timed large and listing operations')
+    run_parser.add_argument('--quick', action='store_true', help='smaller sizes and shorter runs, for a smoke test')
+
+    compare_parser = commands.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='percent a metric may get worse before it counts as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        sys.exit(1 if print_comparison(baseline, current, args.threshold) else 0)
+
+    if args.quick:
+        args.large_size, args.small_files, args.clients = '32M', 200, [1, 4]
+        args.listing_files, args.duration = [1000, 10000], 2.0
+    results = run_suite(args)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print_results(results)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        sys.exit(1 if print_comparison(baseline, results, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
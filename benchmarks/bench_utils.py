@@ -0,0 +1,108 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+# Directory holding server_side.py, client_side.py and the other project modules.
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+# Returns a TCP port on loopback that is currently free.
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Blocks until something accepts connections on host:port.
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f'Nothing listening on {host}:{port} after {timeout} seconds')
+
+
+# Starts server_side.py in a child process on loopback and waits until it accepts connections.
+# The child runs inside work_dir so its storage and statistics files stay out of the project tree.
+def start_server(work_dir, port=None, extra_args=()):
+    port = port or free_port()
+    command = [sys.executable, os.path.join(PROJECT_ROOT, 'server_side.py'),
+               '--host', '127.0.0.1', '--port', str(port)] + list(extra_args)
+    process = subprocess.Popen(command, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port('127.0.0.1', port)
+    except TimeoutError:
+        process.kill()
+        raise
+    return process, port
+
+
+# Starts the Flask client (client_side.py) in a child process on loopback, connected to nothing yet.
+# Like start_server it runs inside work_dir; temporary files it creates go to work_dir/tmp.
+def start_web_client(work_dir, port=None):
+    port = port or free_port()
+    temp_dir = os.path.join(work_dir, 'tmp')
+    os.makedirs(temp_dir, exist_ok=True)
+    environment = dict(os.environ, PYTHONPATH=PROJECT_ROOT, TMPDIR=temp_dir)
+    command = [sys.executable, '-c',
+               f'import client_side; client_side.app.run(host="127.0.0.1", port={port}, threaded=True)']
+    process = subprocess.Popen(command, cwd=work_dir, env=environment,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port('127.0.0.1', port)
+    except TimeoutError:
+        process.kill()
+        raise
+    return process, port
+
+
+# Stops a server process started with start_server.
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# Returns the given percentile (0-100) of a list of numbers.
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+# Prints rows of equal length as an aligned text table.
+def print_table(headers, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    for row in [headers] + rows:
+        print('  '.join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+
+# Parses sizes such as 512K, 16M or 4G.
+def parse_size(text):
+    text = text.upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+# Writes a file of the given size made of a repeated random megabyte.
+def make_file(path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as file:
+        remaining = size
+        while remaining:
+            written = file.write(block[:min(len(block), remaining)])
+            remaining -= written
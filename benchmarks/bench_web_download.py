@@ -0,0 +1,73 @@
+import argparse
+import http.client
+import os
+import tempfile
+import time
+
+from bench_utils import start_server, start_web_client, stop_server, print_table, parse_size, make_file, UNITS
+from bench_web_upload import DiskSampler, connect_web_client
+from transfer_client import TransferClient
+
+
+# Downloads a file through the Flask client, optionally with a Range header.
+# Returns (status, seconds to the first body byte, total seconds, body bytes).
+def web_download(port, file_name, byte_range=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    headers = {'Range': byte_range} if byte_range else {}
+    start = time.perf_counter()
+    connection.request('GET', f'/download/{file_name}', headers=headers)
+    response = connection.getresponse()
+    first_byte = None
+    received = 0
+    while True:
+        chunk = response.read(1024 * 1024)
+        if not chunk:
+            break
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        received += len(chunk)
+    seconds = time.perf_counter() - start
+    connection.close()
+    return response.status, first_byte or seconds, seconds, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Browser-style downloads through the Flask client: '
+                                                 'time to first byte, throughput and client disk use')
+    parser.add_argument('--sizes', nargs='+', default=['16M', '256M', '1G'])
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        server, server_port = start_server(work_dir)
+        web, web_port = start_web_client(work_dir)
+        try:
+            connect_web_client(web_port, server_port)
+            uploader = TransferClient('127.0.0.1', server_port).connect()
+            watched = [os.path.join(work_dir, 'client_uploads'), os.path.join(work_dir, 'tmp')]
+            for label in args.sizes:
+                size = parse_size(label)
+                path = os.path.join(work_dir, f'source-{label}.bin')
+                make_file(path, size)
+                name = f'download-{label}.bin'
+                with open(path, 'rb') as file:
+                    uploader.upload(name, file, size, overwrite=True)
+                os.remove(path)
+
+                for mode, byte_range in (('whole file', None), ('last 1 MB', f'bytes=-{UNITS["M"]}'),
+                                         ('middle 1 MB', f'bytes={size // 2}-{size // 2 + UNITS["M"] - 1}')):
+                    with DiskSampler(watched) as sampler:
+                        status, first_byte, seconds, received = web_download(web_port, name, byte_range)
+                    rows.append([label, mode, status, f'{first_byte * 1000:.1f}', f'{seconds:.2f}',
+                                 f'{received / seconds / UNITS["M"]:.0f}', f'{sampler.peak / UNITS["M"]:.1f}'])
+            uploader.close()
+        finally:
+            stop_server(web)
+            stop_server(server)
+
+    print('peak client disk = temporary files of the Flask client (client_uploads and its temp directory)')
+    print_table(['size', 'request', 'status', 'first byte ms', 'seconds', 'MB/s', 'peak client disk MB'], rows)
+
+
+if __name__ == '__main__':
+    main()
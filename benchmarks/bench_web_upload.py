@@ -0,0 +1,126 @@
+import argparse
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+
+from bench_utils import start_server, start_web_client, stop_server, print_table, parse_size, make_file, UNITS
+
+BOUNDARY = 'bench-upload-boundary'
+
+
+# Samples the total size of the files under some directories until stopped, keeping the peak.
+class DiskSampler:
+    def __init__(self, paths, interval=0.005):
+        self.paths = paths
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+        return False
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, self.usage())
+            time.sleep(self.interval)
+
+    def usage(self):
+        total = 0
+        for path in self.paths:
+            for directory, _, names in os.walk(path):
+                for name in names:
+                    try:
+                        total += os.path.getsize(os.path.join(directory, name))
+                    except OSError:
+                        pass
+        return total
+
+
+# Returns the bytes a multipart form holding one file puts before and after the file contents.
+def multipart_frame(file_name):
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="overwrite"\r\n\r\ntrue\r\n'
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    return head, f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+# Yields the body of a multipart form holding one file, reading the file in chunks.
+def multipart_body(path, file_name):
+    head, tail = multipart_frame(file_name)
+    yield head
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            yield chunk
+    yield tail
+
+
+# Sends one upload through the Flask client and returns its JSON reply.
+def web_upload(port, path, file_name, mode):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    if mode == 'multipart POST':
+        head, tail = multipart_frame(file_name)
+        headers = {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}',
+                   'Content-Length': str(len(head) + os.path.getsize(path) + len(tail))}
+        connection.request('POST', '/upload', multipart_body(path, file_name), headers)
+    else:
+        headers = {'Content-Type': 'application/octet-stream', 'Content-Length': str(os.path.getsize(path))}
+        with open(path, 'rb') as file:
+            connection.request('PUT', f'/upload?name={file_name}&overwrite=true', file, headers)
+    reply = json.loads(connection.getresponse().read())
+    connection.close()
+    return reply
+
+
+def connect_web_client(port, server_port):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    connection.request('POST', '/connect', json.dumps({'host': '127.0.0.1', 'port': server_port}),
+                       {'Content-Type': 'application/json'})
+    connection.getresponse().read()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end browser-style uploads through the Flask client')
+    parser.add_argument('--sizes', nargs='+', default=['16M', '256M', '1G'])
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        server, server_port = start_server(work_dir)
+        web, web_port = start_web_client(work_dir)
+        try:
+            connect_web_client(web_port, server_port)
+            watched = [os.path.join(work_dir, 'client_uploads'), os.path.join(work_dir, 'tmp')]
+            for label in args.sizes:
+                path = os.path.join(work_dir, f'source-{label}.bin')
+                make_file(path, parse_size(label))
+                for mode in ('multipart POST', 'raw PUT'):
+                    with DiskSampler(watched) as sampler:
+                        start = time.perf_counter()
+                        reply = web_upload(web_port, path, f'upload-{label}.bin', mode)
+                        seconds = time.perf_counter() - start
+                    if not reply.get('success'):
+                        raise RuntimeError(f'{mode} upload failed: {reply.get("message")}')
+                    rows.append([label, mode, f'{seconds:.2f}', f'{parse_size(label) / seconds / UNITS["M"]:.0f}',
+                                 f'{sampler.peak / UNITS["M"]:.1f}'])
+                os.remove(path)
+        finally:
+            stop_server(web)
+            stop_server(server)
+
+    print('peak client disk = temporary files of the Flask client (client_uploads and its temp directory)')
+    print_table(['size', 'upload', 'seconds', 'MB/s', 'peak client disk MB'], rows)
+
+
+if __name__ == '__main__':
+    main()
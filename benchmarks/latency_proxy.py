@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import multiprocessing
+
+from bench_utils import free_port, wait_for_port
+
+
+# TCP proxy that makes loopback behave like a long or narrow link. Every byte is held back for
+# delay seconds in each direction, at most window bytes per direction are in flight at once
+# (like a TCP window, so one stream moves at most window / delay bytes per second), and an
+# optional bandwidth in bytes per second caps each direction of each connection. With shared=True
+# the bandwidth is that of one link all connections queue for, like clients behind the same uplink.
+class LatencyProxy:
+    def __init__(self, target_host, target_port, delay=0.0, window=256 * 1024, bandwidth=None, shared=False):
+        self.target_host = target_host
+        self.target_port = target_port
+        self.delay = delay
+        self.window = window
+        self.bandwidth = bandwidth
+        # Time each direction of the shared link is next free, when connections share it.
+        self.links = ({'link_free_at': 0.0}, {'link_free_at': 0.0}) if shared else None
+
+    # Coroutine that accepts connections on port until cancelled.
+    async def serve(self, port, host='127.0.0.1'):
+        server = await asyncio.start_server(self.handle, host, port, reuse_address=True)
+        async with server:
+            await server.serve_forever()
+
+    # Coroutine that connects an accepted client to the target and relays both directions.
+    async def handle(self, client_reader, client_writer):
+        try:
+            target_reader, target_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError:
+            client_writer.close()
+            return
+        links = self.links or ({'link_free_at': 0.0}, {'link_free_at': 0.0})
+        await asyncio.gather(self.pipe(client_reader, target_writer, links[0]),
+                             self.pipe(target_reader, client_writer, links[1]),
+                             return_exceptions=True)
+
+    # Coroutine that relays one direction with the configured delay, window and bandwidth.
+    # link holds the time that direction of the link is next free.
+    async def pipe(self, reader, writer, link):
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+        room = asyncio.Event()
+        room.set()
+        state = {'in_flight': 0}
+
+        async def deliver():
+            while True:
+                deliver_at, data = await pending.get()
+                if data is None:
+                    break
+                wait = deliver_at - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                writer.write(data)
+                await writer.drain()
+                state['in_flight'] -= len(data)
+                if state['in_flight'] < self.window:
+                    room.set()
+
+        delivery = asyncio.create_task(deliver())
+        try:
+            while True:
+                await room.wait()
+                data = await reader.read(min(64 * 1024, self.window))
+                if not data:
+                    break
+                now = loop.time()
+                if self.bandwidth:
+                    link['link_free_at'] = max(now, link['link_free_at']) + len(data) / self.bandwidth
+                    deliver_at = link['link_free_at'] + self.delay
+                else:
+                    deliver_at = now + self.delay
+                state['in_flight'] += len(data)
+                if state['in_flight'] >= self.window:
+                    room.clear()
+                pending.put_nowait((deliver_at, data))
+        finally:
+            pending.put_nowait((0, None))
+            try:
+                await delivery
+            finally:
+                writer.close()
+
+
+def run_proxy(port, target_port, delay, window, bandwidth, shared=False):
+    proxy = LatencyProxy('127.0.0.1', target_port, delay, window, bandwidth, shared)
+    asyncio.run(proxy.serve(port))
+
+
+# Starts a proxy to a loopback target port in a child process. Returns the process and its port.
+def start_proxy(target_port, delay=0.0, window=256 * 1024, bandwidth=None, shared=False):
+    port = free_port()
+    process = multiprocessing.Process(target=run_proxy, args=(port, target_port, delay, window, bandwidth, shared),
+                                      daemon=True)
+    process.start()
+    wait_for_port('127.0.0.1', port)
+    return process, port
+
+
+def stop_proxy(process):
+    process.terminate()
+    process.join(5)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delay/window/bandwidth limiting TCP proxy')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--target-port', type=int, required=True)
+    parser.add_argument('--delay-ms', type=float, default=25.0, help='one-way delay per direction')
+    parser.add_argument('--window', type=int, default=256 * 1024, help='bytes in flight per direction')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes per second per direction')
+    parser.add_argument('--shared', action='store_true', help='all connections share one link of --bandwidth')
+    args = parser.parse_args()
+    run_proxy(args.port, args.target_port, args.delay_ms / 1000, args.window, args.bandwidth, args.shared)
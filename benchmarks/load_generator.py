@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import resource
+import tempfile
+import time
+
+from bench_utils import start_server, stop_server, percentile, print_table
+import protocol
+from protocol import Frame, encode_frame, read_frame_async, read_payload_async
+
+
+# One simulated client: connect, issue a few dir requests one after another, disconnect.
+async def run_client(port, requests, latencies, failures):
+    try:
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        latencies['connect'].append(time.perf_counter() - start)
+        for request_id in range(1, requests + 1):
+            start = time.perf_counter()
+            writer.write(encode_frame(Frame(protocol.CMD_DIR, request_id=request_id)))
+            response = await read_frame_async(reader)
+            if response is None or response.status != protocol.STATUS_OK:
+                failures.append('rejected')
+                break
+            await read_payload_async(reader, response)
+            latencies['request'].append(time.perf_counter() - start)
+        writer.close()
+        await writer.wait_closed()
+    except (OSError, protocol.ProtocolError) as ex:
+        failures.append(str(ex))
+
+
+# Opens clients concurrent connections at once and waits for all of them to finish.
+async def run_load(port, clients, requests):
+    latencies = {'connect': [], 'request': []}
+    failures = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(port, requests, latencies, failures) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    return elapsed, latencies, failures
+
+
+# Raises the open file limit so thousands of sockets can be open in this process and the server.
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent client load against both server engines')
+    parser.add_argument('--clients', type=int, default=1000, help='concurrent client connections')
+    parser.add_argument('--requests', type=int, default=5, help='dir requests issued by each client')
+    parser.add_argument('--engines', nargs='+', default=['threaded', 'asyncio'])
+    parser.add_argument('--backlog', type=int, default=4096)
+    args = parser.parse_args()
+
+    raise_file_limit()
+    rows = []
+    for engine in args.engines:
+        with tempfile.TemporaryDirectory() as work_dir:
+            process, port = start_server(work_dir, extra_args=['--engine', engine, '--backlog', str(args.backlog)])
+            try:
+                elapsed, latencies, failures = asyncio.run(run_load(port, args.clients, args.requests))
+            finally:
+                stop_server(process)
+
+        request_latency = latencies['request']
+        rows.append([
+            engine,
+            args.clients,
+            len(failures),
+            f"{len(latencies['connect']) / elapsed:.0f}",
+            f"{percentile(request_latency, 50) * 1000:.2f}",
+            f"{percentile(request_latency, 99) * 1000:.2f}",
+            f"{elapsed:.2f}",
+        ])
+
+    print_table(['engine', 'clients', 'failed', 'conn/sec', 'p50 ms', 'p99 ms', 'seconds'], rows)
+
+
+if __name__ == '__main__':
+    main()
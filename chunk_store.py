@@ -0,0 +1,306 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import Counter
+from durability import Committer
+
+# Content-defined chunking parameters. A boundary is placed where the rolling hash matches a mask,
+# so an insertion only changes the chunks around it instead of shifting every later chunk.
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+# Harder mask before the average size and an easier one after it, which keeps chunk sizes
+# close to the average (normalized chunking).
+_MASK_SMALL = 0xFFFFC000
+_MASK_LARGE = 0xFFFC0000
+_HASH_MASK = 0xFFFFFFFF
+
+# Gear table: one fixed pseudo-random 32 bit value per byte value, identical on every machine.
+GEAR = [int.from_bytes(hashlib.blake2b(bytes([value]), digest_size=4).digest(), 'big') for value in range(256)]
+
+# Number of bytes read at a time when chunking a stream.
+_READ_SIZE = 4 * MAX_CHUNK_SIZE
+
+# Length of a chunk hash in hex digits (BLAKE2b with a 20 byte digest).
+HASH_LENGTH = 40
+_HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+# Returns the content hash that identifies a chunk.
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+# Returns whether a value is a chunk hash as chunk_hash makes it: HASH_LENGTH lowercase hex digits.
+# Chunk hashes come from clients and become part of chunk paths, so nothing else may get that far.
+def is_chunk_hash(digest):
+    return isinstance(digest, str) and len(digest) == HASH_LENGTH and _HEX_DIGITS.issuperset(digest)
+
+
+# Raises ValueError unless digest is a chunk hash.
+def check_chunk_hash(digest):
+    if not is_chunk_hash(digest):
+        raise ValueError(f'{digest!r} is not a chunk hash')
+
+
+# Returns the length of the chunk starting at start in data, cutting no later than end.
+def _cut_point(data, start, end):
+    if end - start <= MIN_CHUNK_SIZE:
+        return end - start
+    limit = min(end, start + MAX_CHUNK_SIZE)
+    normal = min(limit, start + AVG_CHUNK_SIZE)
+    gear = GEAR
+    value = 0
+    position = start + MIN_CHUNK_SIZE
+    while position < normal:
+        value = ((value << 1) + gear[data[position]]) & _HASH_MASK
+        position += 1
+        if not value & _MASK_SMALL:
+            return position - start
+    while position < limit:
+        value = ((value << 1) + gear[data[position]]) & _HASH_MASK
+        position += 1
+        if not value & _MASK_LARGE:
+            return position - start
+    return limit - start
+
+
+# Splits a readable binary stream into content-defined chunks. Yields (offset, data) pairs.
+def iter_chunks(file):
+    buffer = b''
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) < MAX_CHUNK_SIZE:
+            data = file.read(_READ_SIZE)
+            if data:
+                buffer += data
+            else:
+                eof = True
+        if not buffer:
+            return
+
+        start = 0
+        # Only cut where a full MAX_CHUNK_SIZE window is buffered, unless the stream has ended.
+        while len(buffer) - start >= MAX_CHUNK_SIZE or (eof and start < len(buffer)):
+            length = _cut_point(buffer, start, len(buffer))
+            yield offset, buffer[start:start + length]
+            offset += length
+            start += length
+        buffer = buffer[start:]
+
+
+# Class that stores each distinct chunk once, under its hash, and describes every file as a manifest:
+# the file size and the list of (hash, length) of its chunks, in order.
+class ChunkStore:
+    def __init__(self, root, committer=None):
+        self.chunks_path = os.path.join(root, ".chunks")
+        self.manifests_path = os.path.join(root, ".manifests")
+        self.lock = threading.Lock()
+        # Moves written chunks and manifests into place as durably as the storage commits files.
+        self.committer = committer or Committer('none')
+        for path in (self.chunks_path, self.manifests_path):
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        # Number of manifests referencing each chunk, so chunks can be removed with their last file.
+        self.references = Counter()
+        for file_name in self.list_manifests():
+            self.references.update(chunk for chunk, _ in self.read_manifest(file_name)['chunks'])
+
+    # Method to get the path of a chunk. Chunks are spread over 256 subdirectories.
+    # Raises ValueError when digest is not a chunk hash.
+    def chunk_path(self, digest):
+        check_chunk_hash(digest)
+        return os.path.join(self.chunks_path, digest[:2], digest)
+
+    # Method to get the path of a file's manifest.
+    def manifest_path(self, file_name):
+        return os.path.join(self.manifests_path, file_name + '.json')
+
+    # Method to check whether a chunk is stored.
+    def has_chunk(self, digest):
+        return os.path.exists(self.chunk_path(digest))
+
+    # Method to return the hashes from a list that are not stored yet.
+    # Raises ValueError when the list holds anything but chunk hashes.
+    def missing_chunks(self, digests):
+        if not isinstance(digests, list):
+            raise ValueError('expected a list of chunk hashes')
+        for digest in digests:
+            check_chunk_hash(digest)
+        return [digest for digest in digests if not self.has_chunk(digest)]
+
+    # Method to store a chunk. The data must match the hash it is stored under.
+    def put_chunk(self, digest, data):
+        check_chunk_hash(digest)
+        if chunk_hash(data) != digest:
+            raise ValueError(f'Chunk data does not match hash {digest}')
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        self.committer.commit(temp_path, path)
+        return True
+
+    # Method to read a stored chunk.
+    def read_chunk(self, digest):
+        with open(self.chunk_path(digest), 'rb') as file:
+            return file.read()
+
+    # Method to check whether a file is stored as a manifest.
+    def has_manifest(self, file_name):
+        return os.path.exists(self.manifest_path(file_name))
+
+    # Method to list the names of all files stored as manifests.
+    def list_manifests(self):
+        return [name[:-5] for name in os.listdir(self.manifests_path) if name.endswith('.json')]
+
+    # Method to read a file's manifest.
+    def read_manifest(self, file_name):
+        with open(self.manifest_path(file_name)) as file:
+            return json.load(file)
+
+    # Method to store a file as a manifest of already stored chunks, replacing any earlier version.
+    # Returns the hashes of chunks that are missing; nothing is written unless that list is empty.
+    # Raises ValueError when chunks is not a list of (chunk hash, length) pairs.
+    def put_manifest(self, file_name, chunks):
+        chunks = [(digest, int(length)) for digest, length in chunks]
+        for digest, length in chunks:
+            check_chunk_hash(digest)
+            if length < 0:
+                raise ValueError(f'chunk {digest} has a negative length')
+        with self.lock:
+            missing = self.missing_chunks(sorted({digest for digest, _ in chunks}))
+            if missing:
+                return missing
+            manifest = {'size': sum(length for _, length in chunks), 'chunks': chunks}
+            path = self.manifest_path(file_name)
+            temp_path = path + '.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(manifest, file, separators=(',', ':'))
+            previous = self.read_manifest(file_name) if os.path.exists(path) else None
+            self.committer.commit(temp_path, path)
+            self.references.update(digest for digest, _ in chunks)
+            if previous:
+                self.release(previous)
+        return []
+
+    # Method to chunk a local file into the store and record its manifest.
+    def store_file(self, file_name, path):
+        chunks = []
+        with open(path, 'rb') as file:
+            for _, data in iter_chunks(file):
+                digest = chunk_hash(data)
+                self.put_chunk(digest, data)
+                chunks.append((digest, len(data)))
+        # A chunk that already existed can vanish with the last file using it before the manifest
+        # is written; storing the file again puts it back.
+        if self.put_manifest(file_name, chunks):
+            self.store_file(file_name, path)
+
+    # Method to delete a file's manifest. Returns False when there was no such manifest.
+    def delete_manifest(self, file_name):
+        with self.lock:
+            try:
+                manifest = self.read_manifest(file_name)
+                os.remove(self.manifest_path(file_name))
+            except FileNotFoundError:
+                return False
+            self.release(manifest)
+        return True
+
+    # Method to drop the references of a manifest and remove chunks nothing refers to anymore.
+    # Entries that are not chunk hashes never name a chunk and are skipped. Must be called with the lock held.
+    def release(self, manifest):
+        self.references.subtract(digest for digest, _ in manifest['chunks'])
+        for digest in {digest for digest, _ in manifest['chunks']}:
+            if not is_chunk_hash(digest):
+                self.references.pop(digest, None)
+                continue
+            if self.references[digest] <= 0:
+                del self.references[digest]
+                try:
+                    os.remove(self.chunk_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    # Method to open a file stored as a manifest. Returns a readable, seekable file object and its size.
+    def open_manifest(self, file_name):
+        manifest = self.read_manifest(file_name)
+        return ManifestReader(self, manifest['chunks']), manifest['size']
+
+    # Method to get the logical size of all files and the size of the distinct chunks that store them.
+    def usage(self):
+        logical = 0
+        for file_name in self.list_manifests():
+            logical += self.read_manifest(file_name)['size']
+        stored = 0
+        for directory in os.listdir(self.chunks_path):
+            for name in os.listdir(os.path.join(self.chunks_path, directory)):
+                stored += os.path.getsize(os.path.join(self.chunks_path, directory, name))
+        return logical, stored
+
+
+# Read-only file object that reassembles a file from its chunks, one chunk in memory at a time.
+class ManifestReader(io.RawIOBase):
+    def __init__(self, store, chunks):
+        super().__init__()
+        self.store = store
+        self.chunks = chunks
+        self.starts = []
+        position = 0
+        for _, length in chunks:
+            self.starts.append(position)
+            position += length
+        self.size = position
+        self.position = 0
+        self.current = None
+        self.current_index = -1
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    # Method to find the index of the chunk holding a position, by binary search over chunk starts.
+    def chunk_index(self, position):
+        low, high = 0, len(self.starts) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.starts[middle] <= position:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        index = self.chunk_index(self.position)
+        if index != self.current_index:
+            self.current = self.store.read_chunk(self.chunks[index][0])
+            self.current_index = index
+        start = self.position - self.starts[index]
+        data = self.current[start:start + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
@@ -1,10 +1,17 @@
-import socket
+import logging
 import os
-import re
 import threading
-from flask import Flask, render_template, request, jsonify, send_file
+import zipfile
+from urllib.parse import quote
+from flask import Flask, render_template, request, jsonify, Response
 from werkzeug.utils import secure_filename
 from flask_socketio import SocketIO, emit
+from connection_pool import ConnectionPool
+from progress import ProgressReporter
+import protocol
+
+# Debug lines are only built when the log level asks for them (LOG_LEVEL=DEBUG python client_side.py).
+log = logging.getLogger('client')
 
 # Creates a flask app. 
 app = Flask(__name__)
@@ -12,214 +19,264 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'client_uploads'
 # Defines the maximum content length for the upload folder.
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024 * 1024
+# Compression of transfers to the server: 'auto', a codec name ('zstd', 'lz4', 'zlib') or None for off.
+# It pays off on links slower than the codec (see benchmarks/bench_compression.py).
+app.config['TRANSFER_COMPRESSION'] = 'auto'
 # Creates a socketio object for the app.
 socketio = SocketIO(app, cors_allowed_origins="*")
+# Reports the progress of every transfer to the browser over socketio, a few times per second at most.
+progress = ProgressReporter(socketio.emit)
 # Creates the upload folder if it doesn't exist.
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
 # Class that contains all methods for the client side.
+# Every operation checks out its own connection from a pool, so a long upload or download in one
+# browser tab does not hold up listings and deletes from another. The lock only guards connect/close.
 class FileClient:
     def __init__(self):
         self.host = None
         self.port = None
         self.connected = False
-        self.socket = None
+        self.pool = None
         self.lock = threading.Lock()
 
     # Method to connect to the server.
     def connect(self, host='localhost', port=3300):
-        if self.connected and self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
-
-        # Reset connection state
-        self.connected = False
-        self.socket = None
-
-        try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((host, port))
-            self.connected = True
-            self.host = host
-            self.port = port
-            print(f'[*] Connected to Server at {self.host}:{self.port}')
-            return True
-
-        except Exception as ex:
-            print(f'Connection failed: {str(ex)}')
-            self.host = None
-            self.port = None
-            return False
-        
-    # Method to ensure that the client is connected to the server.
-    def ensure_connected(self):
-        if not self.connected and self.host and self.port:
-            self.connect(self.host, self.port)
+        self.close()
 
-    # Method to list all files in the server.
-    def list_files(self):
         with self.lock:
             try:
-                self.ensure_connected()
-                self.socket.send("dir".encode())
-                response = self.socket.recv(4096).decode()
-                return True, response
+                # Transfers are compressed when both sides have a codec and the content compresses.
+                pool = ConnectionPool(host, port, compress=app.config['TRANSFER_COMPRESSION'])
+                pool.check()
+                self.pool = pool
+                self.connected = True
+                self.host = host
+                self.port = port
+                log.info(f'[*] Connected to Server at {self.host}:{self.port}')
+                return True
 
             except Exception as ex:
-                self.connected = False
-                response = f"Failed to list files: {str(ex)}"
-                return False, response
+                log.error(f'Connection failed: {str(ex)}')
+                self.host = None
+                self.port = None
+                return False
 
-    # Method to upload a file to the server.
-    def upload_file(self, file, overwrite=False):
-        with self.lock:
-            file_path = None
-            try:
-                self.ensure_connected()
-
-                file_name = secure_filename(file.filename)
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_name)
-
-                file.save(file_path)
-                file_size = os.path.getsize(file_path)
-
-                upload_command = f"upload {file_name} {'overwrite' if overwrite else ''}"
-                print(f"DEBUG - Sending command: {upload_command}")
-                if overwrite:
-                    self.socket.send('yes'.encode())
-                self.socket.send(upload_command.encode())
-
-                response = self.socket.recv(1024).decode()
-                print(f"DEBUG - Server initial response: {response}")
-
-                print(f"DEBUG - Sending file size: {file_size}")
-                self.socket.send(str(file_size).encode())
-
-                response = self.socket.recv(1024).decode()
-                print(f"DEBUG - Server initial response: {response}")
-
-                if response == "File Exists. Overwrite? (Yes/No): ":
-                    if overwrite:
-                        print(f"DEBUG - YES OVERWRITE: {response}")
-                        self.socket.send('yes'.encode())
-                    else:
-                        return False, "File Exists."
-
-                if any(r in response.lower() for r in ["ready", "confirm"]):
-                    with open(file_path, 'rb') as f:
-                        bytes_sent = 0
-                        while bytes_sent < file_size:
-                            chunk = f.read(4096)
-                            if not chunk:
-                                break
-                            self.socket.send(chunk)
-                            bytes_sent += len(chunk)
-
-                            progress = (bytes_sent / file_size) * 100
-                            progress = round(progress, 2)
-
-                            socketio.emit('upload_progress', {
-                                'progress': progress,
-                                'filename': file_name
-                            })
-                            print(f"DEBUG - Progress: {progress}%")
-
-                    self.socket.settimeout(5)  
-                    try:
-                        raw_response = self.socket.recv(1024).decode()
-                        final_response = re.sub(r'Progress:\d+(\.\d+)?', '', raw_response).strip()
-
-                        print(f"DEBUG - Raw response: {raw_response}")
-                        print(f"DEBUG - Cleaned final response: {final_response}")
-                    except socket.timeout:
-                        final_response = "Timeout waiting for server response"
-                    except Exception as e:
-                        final_response = f"Error receiving response: {str(e)}"
-
-                    success_indicators = [
-                        "success",
-                        "upload complete",
-                        "complete",
-                        "received"
-                    ]
-
-                    upload_successful = (
-                            any(indicator in final_response.lower() for indicator in success_indicators)
-                            or bytes_sent == file_size
-                    )
-
-                    if upload_successful:
-                        print("DEBUG - Upload successful")
-                        return True, "File uploaded successfully"
-                    else:
-                        print(f"DEBUG - Upload potentially failed: {final_response}")
-                        return False, f"Upload failed: {final_response}"
-
-                print(f"DEBUG - Unexpected server response: {response}")
-                return False, f"Unexpected server response: {response}"
+    # Method to get the connection pool of the server the client is connected to.
+    # Broken connections are reopened by the pool itself, so there is nothing to reconnect here.
+    def ensure_connected(self):
+        pool = self.pool
+        if not self.connected or pool is None:
+            raise ConnectionError("Not connected to a server")
+        return pool
 
-            except Exception as ex:
-                print(f"DEBUG - Upload error: {str(ex)}")
-                self.connected = False
-                return False, f"Upload failed: {str(ex)}"
-            finally:
-                if file_path and os.path.exists(file_path):
-                    try:
-                        os.unlink(file_path)
-                    except Exception as e:
-                        print(f"WARNING: Failed to delete temporary file: {e}")
-
-    # Method to download a file from the server.
-    def download_file(self, file_name):
-        with self.lock:
-            try:
-                self.ensure_connected()
-                self.socket.send(f"download {file_name}".encode())
+    # Method to list all files in the server.
+    def list_files(self):
+        try:
+            with self.ensure_connected().checkout() as connection:
+                return connection.list_files()
 
-                response = self.socket.recv(1024).decode()
-                if response == "File not found":
+        except Exception as ex:
+            response = f"Failed to list files: {str(ex)}"
+            return False, response
+
+    # Method to upload a file from a multipart form to the server.
+    # The form part is streamed from where werkzeug parsed it; it is not copied to client_uploads first.
+    def upload_file(self, file, overwrite=False, transfer_id=None):
+        file_name = secure_filename(file.filename)
+        stream = file.stream
+        stream.seek(0, os.SEEK_END)
+        file_size = stream.tell()
+        stream.seek(0)
+        return self.upload_stream(file_name, stream, file_size, overwrite, transfer_id)
+
+    # Method to upload file_size bytes read from a stream, such as the body of the HTTP request
+    # while the browser is still sending it. Progress is reported over socketio under transfer_id (or a
+    # new id), and the upload is verified against the server's checksum (or, with an older server, its
+    # stored size) once it completes.
+    def upload_stream(self, file_name, stream, file_size, overwrite=False, transfer_id=None):
+        transfer = progress.start('upload', file_name, file_size, transfer_id)
+        success, message = self.send_stream(file_name, stream, file_size, overwrite, transfer.update)
+        transfer.finish(success, message)
+        return success, message
+
+    # Method behind upload_stream: sends the stream and checks what the server stored.
+    def send_stream(self, file_name, stream, file_size, overwrite, report_progress):
+        try:
+            with self.ensure_connected().checkout(bulk=True) as connection:
+                log.debug(f"Sending upload of {file_name} ({file_size} bytes, overwrite: {overwrite})")
+                success, response = connection.upload(
+                    file_name, stream, file_size, overwrite, progress=report_progress
+                )
+
+                log.debug(f"Server response: {response}")
+                if success:
+                    # A verified upload was already checked end to end; otherwise at least check the size.
+                    if not connection.verifies():
+                        stored_size = connection.file_size(file_name)
+                        if stored_size != file_size:
+                            return False, f"Upload failed: server stored {stored_size} of {file_size} bytes"
+                    log.debug("Upload successful")
+                    return True, "File uploaded successfully"
+                if response == "File Exists.":
                     return False, response
+                return False, f"Upload failed: {response}"
 
-                file_size = int(response)
-                self.socket.send("Ready".encode())
-
-                received_size = 0
-                full_file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_name)
-                print(f"Downloading to: {full_file_path}")  
-
-                with open(full_file_path, 'wb') as file:
-                    while received_size < file_size:
-                        chunk = self.socket.recv(min(4096, file_size - received_size))
-                        if not chunk:
-                            break
-                        file.write(chunk)
-                        received_size += len(chunk)
+        except Exception as ex:
+            # A body that ends early leaves the connection in the middle of a frame; the pool drops it.
+            log.error(f"Upload error: {str(ex)}")
+            return False, f"Upload failed: {str(ex)}"
+
+    # Method to start streaming a file, or the byte range given by offset/length or suffix, from the server.
+    # Returns (True, response, chunks) where response.meta has the range 'offset' and the 'total' file size
+    # and chunks yields the body as it arrives, or (False, error message, None). The connection stays
+    # checked out until chunks is exhausted; closing chunks early drops it, since its body was not read.
+    def stream_download(self, file_name, offset=0, length=None, suffix=None):
+        chunks = self.download_chunks(file_name, offset, length, suffix)
+        success, result = next(chunks)
+        if not success:
+            return False, result, None
+        return True, result, chunks
+
+    # Generator behind stream_download: yields (success, response or message) first, then the body chunks.
+    # Progress is reported as the chunks are handed on; a download the browser gives up on is reported failed.
+    # An error once the body has started is logged and raised, which breaks the response off unfinished:
+    # by then the only thing left to yield is body bytes.
+    def download_chunks(self, file_name, offset, length, suffix):
+        started = False
+        try:
+            with self.ensure_connected().checkout(bulk=True) as connection:
+                success, result = connection.start_download(file_name, offset, length, suffix)
+                if success:
+                    started = True
+                    yield True, result
+                    received = 0
+                    with progress.start('download', file_name, protocol.body_size(result)) as transfer:
+                        for chunk in connection.iter_download(result):
+                            yield chunk
+                            received += len(chunk)
+                            transfer.update(received)
+                    return
+        except Exception as ex:
+            log.error(f"Download error: {str(ex)}")
+            if started:
+                raise
+            result = str(ex)
+        yield False, result
 
-                print(f"Download complete. File size: {received_size}")  
-                return True, full_file_path
-            except Exception as ex:
-                print(f"Download error: {str(ex)}")  
-                self.connected = False
-                return False, str(ex)
-            
     # Method to delete a file from the server.
     def delete_file(self, file_name):
-        with self.lock:
-            try:
-                self.ensure_connected()
-                self.socket.send(f"delete {file_name}".encode())
-                response = self.socket.recv(1024).decode()
-                return True, response
-            except Exception as ex:
-                self.connected = False
-                response = f"Delete Failed: {str(ex)}"
-                return False, response
+        try:
+            with self.ensure_connected().checkout() as connection:
+                return connection.delete(file_name)
+        except Exception as ex:
+            response = f"Delete Failed: {str(ex)}"
+            return False, response
+
+    # Method to delete many files from the server with one request.
+    # Returns (True, {name: 'ok', 'not_found' or 'error'}) or (False, error message).
+    def delete_many_files(self, names):
+        try:
+            with self.ensure_connected().checkout() as connection:
+                return connection.delete_many(names)
+        except Exception as ex:
+            return False, f"Delete Failed: {str(ex)}"
+
+    # Method to upload many files from a multipart form with one request, streamed one after another from
+    # where werkzeug parsed them. Progress over the whole batch is reported over socketio as one transfer.
+    # Returns (True, {name: 'ok', 'exists', 'invalid' or 'error'}) or (False, error message).
+    def upload_many_files(self, files, overwrite=False, transfer_id=None):
+        batch = []
+        for file in files:
+            stream = file.stream
+            stream.seek(0, os.SEEK_END)
+            batch.append((secure_filename(file.filename), stream, stream.tell()))
+            stream.seek(0)
+        total_size = sum(size for _, _, size in batch)
+        label = f'{len(batch)} files'
+
+        transfer = progress.start('upload', label, total_size, transfer_id)
+        try:
+            with self.ensure_connected().checkout(bulk=True) as connection:
+                log.debug(f"Sending upload of {label} ({total_size} bytes, overwrite: {overwrite})")
+                success, result = connection.upload_many(batch, overwrite, progress=transfer.update)
+        except Exception as ex:
+            log.error(f"Upload error: {str(ex)}")
+            success, result = False, f"Upload failed: {str(ex)}"
+        transfer.finish(success, None if success else result)
+        return success, result
+
+    # Method to stream many files from the server as one ZIP archive, fetched with a single batch download.
+    # Returns (True, chunks) where chunks yields the archive as the files arrive, or (False, error message).
+    # Files are stored uncompressed, since the archive is built on the fly; files the server does not have
+    # are left out. A file that fails verification, or any other error once the archive has started, breaks
+    # the response off before the archive is complete, so the browser sees the download fail.
+    def download_archive(self, names):
+        chunks = self.archive_chunks(names)
+        success, result = next(chunks)
+        if not success:
+            return False, result
+        return True, chunks
+
+    # Generator behind download_archive: yields (success, message) first, then the archive bytes. Errors after
+    # that are logged and raised, like in download_chunks.
+    def archive_chunks(self, names):
+        started = False
+        try:
+            with self.ensure_connected().checkout(bulk=True) as connection:
+                success, result = connection.start_download_many(names)
+                if success:
+                    started = True
+                    yield True, None
+                    sink = ArchiveSink()
+                    received = 0
+                    # The size of the archive is not known up front, so only the rate is reported.
+                    with progress.start('download', 'files.zip') as transfer, \
+                            zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+                        for file_name, status, chunks in connection.iter_download_many(result):
+                            if status != protocol.STATUS_OK:
+                                log.warning(f"Skipping {file_name} in archive: {protocol.status_name(status)}")
+                                continue
+                            with archive.open(file_name, 'w', force_zip64=True) as member:
+                                for chunk in chunks:
+                                    member.write(chunk)
+                                    received += len(chunk)
+                                    transfer.update(received)
+                                    yield sink.take()
+                    yield sink.take()
+                    return
+        except Exception as ex:
+            log.error(f"Download error: {str(ex)}")
+            if started:
+                raise
+            result = str(ex)
+        yield False, result
 
     def close(self):
-        self.socket.close()
+        with self.lock:
+            if self.pool:
+                self.pool.close()
+            self.pool = None
+            self.connected = False
+
+# Unseekable file object that zipfile writes an archive into while it is being streamed;
+# take hands out what was written since the last call.
+class ArchiveSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
 
 # Creates a client object to be used in the flask app.
 client = FileClient()
@@ -242,11 +299,7 @@ def connect():
         port = data.get('port', 3300)
 
         # Explicitly close any existing connection
-        if client.connected and client.socket:
-            try:
-                client.socket.close()
-            except:
-                pass
+        client.close()
 
         success = client.connect(host, port)
 
@@ -272,22 +325,45 @@ def list_files():
     files = response.split('\n') if success else []
     return jsonify({'success': success, 'files': files})
 
+# Route to get the latest progress update of every transfer still running, for a page that was just opened.
+@app.route('/transfers', methods=['GET'])
+def transfers():
+    return jsonify({'transfers': progress.active()})
+
 # Route to upload a file to the server.
-@app.route('/upload', methods=['POST'])
+# PUT /upload?name=<file name>&overwrite=true|false carries the raw file as the request body, which is
+# piped to the server while it arrives. POST with a multipart form ('file' and 'overwrite') is still accepted.
+# An optional 'id' (query or form) is the transfer id the page wants the progress updates tagged with.
+@app.route('/upload', methods=['POST', 'PUT'])
 def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'message': 'No file provided'})
-
-    file = request.files['file']
-    overwrite = request.form.get('overwrite', 'false').lower() == 'true'
-
-    if file.filename == '':
-        return jsonify({'success': False, 'message': 'No file selected'})
-
-    print(f"DEBUG - Attempting to upload file: {file.filename} (overwrite: {overwrite})")
-    success, message = client.upload_file(file, overwrite)
-
-    print(f"DEBUG - Upload result - Success: {success}, Message: {message}")
+    transfer_id = request.values.get('id')
+    if request.method == 'PUT':
+        file_name = secure_filename(request.args.get('name', ''))
+        overwrite = request.args.get('overwrite', 'false').lower() == 'true'
+        if file_name == '':
+            return jsonify({'success': False, 'message': 'No file selected'})
+        if request.content_length is None:
+            return jsonify({'success': False, 'message': 'Content-Length is required'}), 411
+        if request.content_length > app.config['MAX_CONTENT_LENGTH']:
+            return jsonify({'success': False, 'message': 'File too large'}), 413
+
+        log.debug(f"Attempting to upload file: {file_name} (overwrite: {overwrite})")
+        success, message = client.upload_stream(file_name, request.stream, request.content_length, overwrite,
+                                                transfer_id)
+    else:
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': 'No file provided'})
+
+        file = request.files['file']
+        overwrite = request.form.get('overwrite', 'false').lower() == 'true'
+
+        if file.filename == '':
+            return jsonify({'success': False, 'message': 'No file selected'})
+
+        log.debug(f"Attempting to upload file: {file.filename} (overwrite: {overwrite})")
+        success, message = client.upload_file(file, overwrite, transfer_id)
+
+    log.debug(f"Upload result - Success: {success}, Message: {message}")
 
     if not success and "confirm overwrite" in message.lower():
         return jsonify({
@@ -301,32 +377,136 @@ def upload_file():
         'message': message
     })
 
+# Route to upload several files with one request to the server.
+# POST with a multipart form: every selected file as 'files', plus 'overwrite' and optionally 'id'.
+# Files are stored under their secure_filename; 'names' maps each name the browser sent to the stored one,
+# which is how results and 'existing' refer to it.
+@app.route('/upload_many', methods=['POST'])
+def upload_many():
+    files = [file for file in request.files.getlist('files') if file.filename]
+    overwrite = request.form.get('overwrite', 'false').lower() == 'true'
+    if not files:
+        return jsonify({'success': False, 'message': 'No file selected'})
+
+    success, results = client.upload_many_files(files, overwrite, request.form.get('id'))
+    log.debug(f"Upload result - Success: {success}, Results: {results}")
+    if not success:
+        return jsonify({'success': False, 'message': results})
+
+    stored = [name for name, status in results.items() if status == 'ok']
+    existing = [name for name, status in results.items() if status == 'exists']
+    return jsonify({
+        'success': len(stored) == len(results),
+        'message': f'Uploaded {len(stored)} of {len(results)} files',
+        'results': results,
+        'existing': existing,
+        'names': {file.filename: secure_filename(file.filename) for file in files}
+    })
+
 # SocketIO event to handle connection.
 @socketio.on('connect')
 def handle_connect():
-    print('Client connected to SocketIO')
+    log.info('Client connected to SocketIO')
 
 # SocketIO event to handle disconnection.
 @socketio.on('disconnect')
 def handle_disconnect():
-    print('Client disconnected from SocketIO')
+    log.info('Client disconnected from SocketIO')
+
+# Parses a single byte range from an HTTP Range header into stream_download arguments.
+# Returns None when there is no header or it cannot be served as one range, in which case
+# the whole file is sent, as HTTP allows.
+def parse_range(header):
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if not start:
+            return {'suffix': int(end)} if end else None
+        first = int(start)
+        if not end:
+            return {'offset': first}
+        last = int(end)
+    except ValueError:
+        return None
+    if last < first:
+        return None
+    return {'offset': first, 'length': last - first + 1}
 
 # Route to download a file from the server.
+# The body is piped from the server's socket into the HTTP response as it arrives, a chunk at a time,
+# so nothing is staged on the client's disk. Range requests are mapped to server-side byte ranges.
 @app.route('/download/<filename>')
 def download_file(filename):
+    byte_range = parse_range(request.headers.get('Range'))
     try:
-        success, result = client.download_file(filename)
-        print(f"Download result: {success}, Path: {result}")  
-
-        if success and os.path.exists(result):
-            return send_file(result, as_attachment=True, download_name=filename)
-        else:
-            print(f"Download failed for {filename}")  
-            return f"File {filename} not found", 404
+        success, response, chunks = client.stream_download(filename, **(byte_range or {}))
     except Exception as e:
-        print(f"Download exception: {str(e)}")  
+        log.error(f"Download exception: {str(e)}")
         return f"Download failed: {str(e)}", 500
 
+    if not success:
+        log.warning(f"Download failed for {filename}: {response}")
+        if 'range' in response.lower():
+            return "Requested range not satisfiable", 416
+        return f"File {filename} not found", 404
+
+    offset = int(response.meta.get('offset', 0))
+    # Bytes of the range once decompressed, whether or not the server compressed them on the wire.
+    size = protocol.body_size(response)
+    total = int(response.meta.get('total', size))
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Length': str(size),
+        'Content-Disposition': f"attachment; filename=\"{secure_filename(filename)}\"; "
+                               f"filename*=UTF-8''{quote(filename)}",
+    }
+    if byte_range is None:
+        status = 200
+    elif size == 0:
+        # The range starts at the end of the file; the empty body is read so the connection is reused.
+        for _ in chunks:
+            pass
+        return "Requested range not satisfiable", 416, {'Content-Range': f'bytes */{total}'}
+    else:
+        status = 206
+        headers['Content-Range'] = f'bytes {offset}-{offset + size - 1}/{total}'
+
+    return Response(chunks, status=status, headers=headers, mimetype='application/octet-stream',
+                    direct_passthrough=True)
+
+# Route to download several files as one ZIP archive: /download_many?name=<file>&name=<file>...
+# The archive is built while the files arrive from the server over one batch request.
+@app.route('/download_many')
+def download_many():
+    names = request.args.getlist('name')
+    if not names:
+        return "No files selected", 400
+    success, result = client.download_archive(names)
+    if not success:
+        log.warning(f"Download failed for {len(names)} files: {result}")
+        return f"Download failed: {result}", 502
+
+    headers = {'Content-Disposition': 'attachment; filename="files.zip"'}
+    return Response(result, headers=headers, mimetype='application/zip', direct_passthrough=True)
+
+# Route to delete several files from the server with one request. The body is JSON: {"names": [...]}.
+@app.route('/delete_many', methods=['POST'])
+def delete_many():
+    names = (request.get_json(silent=True) or {}).get('names') or []
+    if not names:
+        return jsonify({'success': False, 'message': 'No files selected'}), 400
+
+    success, results = client.delete_many_files(names)
+    if not success:
+        return jsonify({'success': False, 'message': results}), 400
+    deleted = [name for name, status in results.items() if status == 'ok']
+    return jsonify({
+        'success': len(deleted) == len(results),
+        'message': f'Deleted {len(deleted)} of {len(results)} files',
+        'results': results
+    })
+
 # Route to delete a file from the server.
 @app.route('/delete/<filename>', methods=['DELETE'])  
 def delete_file(filename):
@@ -352,4 +532,5 @@ def internal_server_error(error):
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(levelname)s - %(message)s')
     app.run(debug=True, port=5001)
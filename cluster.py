@@ -0,0 +1,457 @@
+import bisect
+import hashlib
+import threading
+import time
+import unicodedata
+from protocol import ProtocolError
+from transfer_client import TransferClient
+
+# Points each node gets on the ring. More points spread the files more evenly between the nodes.
+VNODES = 128
+
+
+# Returns the position of a key on the ring: the first 8 bytes of its BLAKE2b hash, as a number.
+def ring_position(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+# Splits a node id of the form HOST:PORT into (host, port).
+def parse_node(node):
+    host, _, port = node.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f'expected HOST:PORT, got {node!r}')
+    return host, int(port)
+
+
+# Class that assigns file names to nodes by consistent hashing. Each node (a HOST:PORT id) is put on the
+# ring at vnodes points and a name belongs to the node of the first point at or after the name's position,
+# so adding or removing a node only moves the names next to its own points, about 1/N of them.
+# version grows with every change of the node list, so nodes can tell a newer ring from an older one.
+class HashRing:
+    def __init__(self, nodes, vnodes=VNODES, version=0):
+        self.nodes = sorted(set(nodes))
+        self.vnodes = int(vnodes)
+        self.version = int(version)
+        if not self.nodes or self.vnodes < 1:
+            raise ValueError('a ring needs at least one node and one point per node')
+        for node in self.nodes:
+            parse_node(node)
+        points = sorted((ring_position(f'{node}#{number}'), node)
+                        for node in self.nodes for number in range(self.vnodes))
+        self.positions = [position for position, _ in points]
+        self.owners = [node for _, node in points]
+
+    # Method to get the node a file name belongs to. Names are placed in the NFC form the servers store them
+    # under (see storage_layout.normalize_name), so every spelling of a name goes to the same node.
+    def owner(self, name):
+        index = bisect.bisect_left(self.positions, ring_position(unicodedata.normalize('NFC', name)))
+        return self.owners[index % len(self.owners)]
+
+    # Method to describe the ring for a ring request or reply meta.
+    def to_meta(self):
+        return {'nodes': self.nodes, 'vnodes': self.vnodes, 'version': self.version}
+
+    # Builds a ring from its meta description. Raises ValueError, TypeError or KeyError when it is not one.
+    @classmethod
+    def from_meta(cls, meta):
+        if not isinstance(meta['nodes'], list):
+            raise TypeError('nodes must be a list of HOST:PORT ids')
+        return cls(meta['nodes'], meta.get('vnodes', VNODES), meta.get('version', 0))
+
+
+# Class that makes a server one node of a cluster: it knows the ring, refuses uploads of names that belong to
+# other nodes, and after every change of the ring moves the files it no longer owns to their new owners in a
+# background thread. node_id is the HOST:PORT this node is listed under, as clients reach it.
+# The ring before the latest change is kept as previous, so clients can still find a file on its old owner
+# while it is being moved.
+class ClusterNode:
+    def __init__(self, node_id, ring, storage):
+        parse_node(node_id)
+        self.node_id = node_id
+        self.ring = ring
+        self.previous = None
+        self.storage = storage
+        self.rebalancing = False
+        self.pending = False
+        self.moved = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    # Method to check whether a file name belongs to this node.
+    def owns(self, name):
+        return self.ring.owner(name) == self.node_id
+
+    # Method to describe the cluster as this node sees it, for ping and ring replies.
+    def status(self):
+        with self.lock:
+            status = self.ring.to_meta()
+            status.update({'node': self.node_id, 'previous': self.previous.to_meta() if self.previous else None,
+                           'rebalancing': self.rebalancing, 'moved': self.moved, 'failed': self.failed})
+        return status
+
+    # Method to switch to a new ring and start moving the files that now belong elsewhere.
+    # Returns False, changing nothing, when the ring is not newer than the current one.
+    def set_ring(self, ring):
+        with self.lock:
+            if ring.version <= self.ring.version:
+                return False
+            self.previous = self.ring
+            self.ring = ring
+            self.pending = True
+            if not self.rebalancing:
+                self.rebalancing = True
+                threading.Thread(target=self.rebalance, name='rebalance', daemon=True).start()
+        print(f'[*] Cluster ring version {ring.version}: {", ".join(ring.nodes)}')
+        return True
+
+    # Runs in the background until every file this node stored under an older ring is with its new owner.
+    # Another pass is made after any pass that moved files or saw the ring change, since uploads that were
+    # already under way when the ring changed may have committed files that are no longer ours.
+    def rebalance(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.rebalancing = False
+                    return
+                self.pending = False
+                ring = self.ring
+            moved, failed = self.move_files(ring)
+            with self.lock:
+                self.moved += moved
+                self.failed += failed
+                if moved:
+                    self.pending = True
+            print(f'[*] Rebalanced ring version {ring.version}: {moved} files moved, {failed} failed')
+
+    # Method to move every stored file that ring gives to another node there. Files that cannot be moved
+    # stay here and are tried again after the next change of the ring. Returns (moved, failed).
+    def move_files(self, ring):
+        clients = {}
+        moved = failed = 0
+        try:
+            for name in self.storage.list_names():
+                if self.pending:
+                    break
+                owner = ring.owner(name)
+                if owner == self.node_id:
+                    continue
+                try:
+                    client = clients.get(owner)
+                    if client is None:
+                        host, port = parse_node(owner)
+                        client = clients[owner] = TransferClient(host, port, timeout=30).connect()
+                    if self.move_file(client, name):
+                        moved += 1
+                    else:
+                        failed += 1
+                except (OSError, ProtocolError) as ex:
+                    print(f'Could not move {name} to {owner}: {str(ex)}')
+                    client = clients.pop(owner, None)
+                    if client:
+                        client.close()
+                    failed += 1
+        finally:
+            for client in clients.values():
+                client.close()
+        return moved, failed
+
+    # Method to copy one file to its owner and delete it here. A copy the owner already has was written
+    # there after the ring changed, so it is newer than ours and is kept. Returns whether the file is gone
+    # from this node, which it also is when a client deleted it in the meantime.
+    def move_file(self, client, name):
+        try:
+            file, size = self.storage.open_read(name)
+        except FileNotFoundError:
+            return True
+        with file:
+            success, message = client.upload(name, file, size)
+        if not success:
+            stored, entries = client.stat_many([name])
+            if not stored or entries.get(name) is None:
+                print(f'Could not move {name} to {client.host}:{client.port}: {message}')
+                return False
+        self.storage.delete(name)
+        return True
+
+
+# Class that talks to every node of a cluster and sends each request straight to the node that owns the file.
+# It learns the ring from the first of seeds (HOST:PORT ids) that answers and keeps one TransferClient per
+# node, connected on first use with the given options. When a node refuses an upload because the ring has
+# changed, or does not have a file, the ring is fetched again and the request retried on the new owner, then
+# on the owner under the previous ring, where the file may not have been moved away from yet.
+# Like TransferClient it is meant to be used by one thread at a time.
+class ClusterClient:
+    def __init__(self, seeds, timeout=None, compress=None, verify=True):
+        self.seeds = list(seeds)
+        self.options = {'timeout': timeout, 'compress': compress, 'verify': verify}
+        self.clients = {}
+        self.ring = None
+        self.previous = None
+        self.refresh()
+
+    # Method to get the connected client for a node.
+    def client(self, node):
+        client = self.clients.get(node)
+        if client is None:
+            host, port = parse_node(node)
+            client = TransferClient(host, port, **self.options).connect()
+            self.clients[node] = client
+        return client
+
+    # Method to close and forget the connection to a node after it failed.
+    def drop(self, node):
+        client = self.clients.pop(node, None)
+        if client:
+            client.close()
+
+    # Method to fetch the ring, from node when given, otherwise from the known nodes and seeds in turn.
+    # Returns whether the ring changed. Raises ConnectionError when no node answers.
+    def refresh(self, node=None):
+        candidates = [node] if node else []
+        candidates += (self.ring.nodes if self.ring else []) + self.seeds
+        for candidate in dict.fromkeys(candidates):
+            try:
+                success, status = self.client(candidate).ring()
+            except (OSError, ProtocolError):
+                self.drop(candidate)
+                continue
+            if success:
+                return self.adopt(status)
+        raise ConnectionError(f'No cluster node answered: {", ".join(dict.fromkeys(candidates))}')
+
+    # Method to take the ring from a node's status when it is at least as new as ours.
+    def adopt(self, status):
+        ring = HashRing.from_meta(status)
+        if self.ring is not None and ring.version < self.ring.version:
+            return False
+        changed = self.ring is None or ring.version != self.ring.version
+        self.ring = ring
+        self.previous = HashRing.from_meta(status['previous']) if status.get('previous') else None
+        return changed
+
+    # Method to list the nodes that may hold name: its owner, then its owner under the previous ring.
+    def owners(self, name):
+        owners = [self.ring.owner(name)]
+        if self.previous and self.previous.owner(name) not in owners:
+            owners.append(self.previous.owner(name))
+        return owners
+
+    # Method to list every node of the current and the previous ring.
+    def all_nodes(self):
+        return list(dict.fromkeys(self.ring.nodes + (self.previous.nodes if self.previous else [])))
+
+    # Method to run request(client) on the nodes that may hold name until it succeeds. The ring is fetched
+    # again after the first failure, so a client with an old ring finds the file too.
+    # Returns the result of the last request, a (success, ...) tuple.
+    def on_owner(self, name, request):
+        tried = []
+        result = (False, f'No cluster node holds {name}')
+        for attempt in range(2):
+            for node in self.owners(name):
+                if node in tried:
+                    continue
+                tried.append(node)
+                result = request(self.client(node))
+                if result[0]:
+                    return result
+            if attempt == 0:
+                self.refresh(tried[0])
+        return result
+
+    # Method to group names by the node that owns them.
+    def group_by_owner(self, names):
+        groups = {}
+        for name in names:
+            groups.setdefault(self.ring.owner(name), []).append(name)
+        return groups
+
+    # Method to change the nodes of the cluster. The new ring, one version newer than any node has, is sent
+    # to every node of the old and the new ring, and each then moves the files it no longer owns on its own;
+    # see wait_rebalanced. Returns (True, '') or (False, error message) when a node did not take it.
+    def set_nodes(self, nodes, vnodes=None):
+        old_nodes = self.all_nodes()
+        versions = [self.ring.version]
+        for node in dict.fromkeys(list(nodes) + old_nodes):
+            try:
+                success, status = self.client(node).ring()
+            except (OSError, ProtocolError):
+                self.drop(node)
+                continue
+            if success:
+                versions.append(int(status['version']))
+        ring = HashRing(nodes, vnodes or self.ring.vnodes, max(versions) + 1)
+
+        failures = []
+        # New nodes get the ring first, so they take the files the others start sending them.
+        for node in list(dict.fromkeys(ring.nodes + old_nodes)):
+            try:
+                success, status = self.client(node).ring(ring.to_meta())
+            except (OSError, ProtocolError) as ex:
+                self.drop(node)
+                success, status = False, str(ex)
+            if not success:
+                failures.append(f'{node}: {status}')
+        self.refresh(ring.nodes[0])
+        if failures:
+            return False, 'Ring not accepted by ' + '; '.join(failures)
+        return True, ''
+
+    def add_node(self, node):
+        return self.set_nodes(self.ring.nodes + [node])
+
+    def remove_node(self, node):
+        return self.set_nodes([member for member in self.ring.nodes if member != node])
+
+    # Method to wait until no node is moving files any more. Returns False when timeout seconds pass first.
+    def wait_rebalanced(self, timeout=None, interval=0.1):
+        waited = 0.0
+        while True:
+            busy = False
+            for node in self.all_nodes():
+                success, status = self.client(node).ring()
+                busy = busy or not success or status.get('rebalancing')
+            if not busy:
+                return True
+            if timeout is not None and waited >= timeout:
+                return False
+            time.sleep(interval)
+            waited += interval
+
+    # Method to upload size bytes of a file object to the node that owns name. A refused upload is retried
+    # on the new owner when the ring has changed and the file can be rewound.
+    def upload(self, file_name, file, file_size, overwrite=False, progress=None):
+        node = self.ring.owner(file_name)
+        start = file.tell() if hasattr(file, 'seekable') and file.seekable() else None
+        success, message = self.client(node).upload(file_name, file, file_size, overwrite, progress)
+        if not success and start is not None and self.refresh(node) and self.ring.owner(file_name) != node:
+            file.seek(start)
+            return self.client(self.ring.owner(file_name)).upload(file_name, file, file_size, overwrite, progress)
+        return success, message
+
+    # Method to upload a new version of a file to the node that owns name, sending only what changed when
+    # the node has the old version (see TransferClient.delta_upload). Retried on the new owner like upload.
+    # Returns (success, message, stats).
+    def delta_upload(self, file_name, file, progress=None):
+        node = self.ring.owner(file_name)
+        result = self.client(node).delta_upload(file_name, file, progress)
+        if not result[0] and self.refresh(node) and self.ring.owner(file_name) != node:
+            return self.client(self.ring.owner(file_name)).delta_upload(file_name, file, progress)
+        return result
+
+    # Method to download a file from its owner into a writable file object.
+    # Returns (success, bytes received) or (False, error message).
+    def download(self, file_name, file, progress=None):
+        return self.on_owner(file_name, lambda client: client.download(file_name, file, progress))
+
+    # Method to get the size of a stored file, or None when no node has it.
+    def file_size(self, file_name):
+        def stat(client):
+            size = client.file_size(file_name)
+            return size is not None, size
+        return self.on_owner(file_name, stat)[1]
+
+    # Method to delete a file from its owner and from its previous owner, in case it has not moved yet.
+    def delete(self, file_name):
+        results = [self.client(node).delete(file_name) for node in self.owners(file_name)]
+        return next((result for result in results if result[0]), results[0])
+
+    # Method to list the files of every node, merged and sorted by name.
+    # Returns (True, entries) or (False, error message).
+    def list_entries(self, prefix='', checksums=False):
+        entries = {}
+        for node in self.all_nodes():
+            success, listing, _ = self.client(node).list_entries(prefix, limit=0, checksums=checksums)
+            if not success:
+                return False, f'{node}: {listing}'
+            for entry in listing:
+                entries.setdefault(entry['name'], entry)
+        return True, [entries[name] for name in sorted(entries)]
+
+    # Method to list the names of all files in the cluster, one per line, like TransferClient.list_files.
+    def list_files(self):
+        success, entries = self.list_entries()
+        if not success:
+            return False, entries
+        return True, "\n".join(entry['name'] for entry in entries) if entries else "No Files Found"
+
+    # Method to upload many files with one batch request per owner. files yields (name, file object, size).
+    # Returns (True, {name: status name}) or (False, error message).
+    def upload_many(self, files, overwrite=False, progress=None):
+        groups = {}
+        for item in files:
+            groups.setdefault(self.ring.owner(item[0]), []).append(item)
+        results = {}
+        sent = 0
+        for node, group in groups.items():
+            report = (lambda done, base=sent: progress(base + done)) if progress else None
+            success, result = self.client(node).upload_many(group, overwrite, report)
+            if not success:
+                return False, f'{node}: {result}'
+            results.update(result)
+            sent += sum(size for _, _, size in group)
+        return True, results
+
+    # Method to download many files into a local directory with one batch request per owner. Files their
+    # owner does not have are asked for again from their owner under the previous ring.
+    # Returns (True, {name: status name}) or (False, error message).
+    def download_many(self, names, directory):
+        results = {}
+        for node, group in self.group_by_owner(names).items():
+            success, result = self.client(node).download_many(group, directory)
+            if not success:
+                return False, f'{node}: {result}'
+            results.update(result)
+        if self.previous:
+            missing = [name for name, status in results.items() if status == 'not_found']
+            for node, group in self.group_by_previous_owner(missing).items():
+                success, result = self.client(node).download_many(group, directory)
+                if success:
+                    results.update((name, status) for name, status in result.items() if status != 'not_found')
+        return True, results
+
+    # Method to group names by their owner under the previous ring, leaving out names it gives the same owner.
+    def group_by_previous_owner(self, names):
+        groups = {}
+        for name in names:
+            node = self.previous.owner(name)
+            if node != self.ring.owner(name):
+                groups.setdefault(node, []).append(name)
+        return groups
+
+    # Method to delete many files with one batch request per owner, and per previous owner while it may
+    # still hold some of them. Returns (True, {name: status name}) or (False, error message).
+    def delete_many(self, names):
+        results = {}
+        for node, group in self.group_by_owner(names).items():
+            success, result = self.client(node).delete_many(group)
+            if not success:
+                return False, f'{node}: {result}'
+            results.update(result)
+        if self.previous:
+            for node, group in self.group_by_previous_owner(names).items():
+                success, result = self.client(node).delete_many(group)
+                if success:
+                    results.update((name, status) for name, status in result.items() if status == 'ok')
+        return True, results
+
+    # Method to look up many files with one batch request per owner.
+    # Returns (True, {name: entry dict, or None when not stored}) or (False, error message).
+    def stat_many(self, names, checksums=False):
+        entries = {}
+        for node, group in self.group_by_owner(names).items():
+            success, result = self.client(node).stat_many(group, checksums)
+            if not success:
+                return False, f'{node}: {result}'
+            entries.update(result)
+        if self.previous:
+            missing = [name for name, entry in entries.items() if entry is None]
+            for node, group in self.group_by_previous_owner(missing).items():
+                success, result = self.client(node).stat_many(group, checksums)
+                if success:
+                    entries.update((name, entry) for name, entry in result.items() if entry is not None)
+        return True, entries
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
+        self.clients = {}
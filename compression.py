@@ -0,0 +1,201 @@
+import zlib
+from protocol import ProtocolError
+
+# zstd and lz4 are used when their packages are installed (pip install zstandard lz4); zlib always works.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Raw bytes compressed into each frame of an encoded body.
+BLOCK_SIZE = 256 * 1024
+# Bytes read from the start of a transfer to decide whether it is worth compressing.
+PROBE_SIZE = 64 * 1024
+# A probe that does not shrink below this fraction of its size marks the content as incompressible,
+# e.g. media, archives or anything already compressed.
+PROBE_RATIO = 0.9
+# Transfers smaller than this are always sent as they are.
+MIN_SIZE = 4 * 1024
+# Most bytes one frame of an encoded body may decode to. Senders compress BLOCK_SIZE raw bytes into each,
+# so a frame that decodes to far more is a decompression bomb, refused before the output is allocated.
+MAX_FRAME_OUTPUT = 4 * BLOCK_SIZE
+# Compressed bytes fed to a zstd decompressor at a time (see ZstdDecompressor.decompress).
+ZSTD_SLICE = 1024
+
+
+# Raises ProtocolError when a frame decoded to more than limit bytes.
+def check_output(size, limit):
+    if size > limit:
+        raise ProtocolError(f'Encoded frame decodes to more than {limit} bytes')
+
+
+# Streaming zlib (deflate). Every block is followed by a sync flush, so each frame decodes on its own
+# arrival while the stream keeps the history of the blocks before it. Level 1 is fast enough for networks.
+class ZlibCompressor:
+    def __init__(self, level=1):
+        self.stream = zlib.compressobj(level)
+
+    def compress(self, data):
+        return self.stream.compress(data) + self.stream.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.stream.flush(zlib.Z_FINISH)
+
+
+class ZlibDecompressor:
+    def __init__(self):
+        self.stream = zlib.decompressobj()
+
+    # Method to decode data, which may decode to at most limit bytes, and never to more than MAX_FRAME_OUTPUT.
+    # zlib stops at max_length, leaving the rest of data in unconsumed_tail, so one byte past the limit is
+    # the most that is ever produced.
+    def decompress(self, data, limit):
+        limit = min(limit, MAX_FRAME_OUTPUT)
+        try:
+            chunk = self.stream.decompress(data, limit + 1)
+        except zlib.error as ex:
+            raise ProtocolError(f'Invalid zlib data: {str(ex)}')
+        check_output(len(chunk), limit)
+        return chunk
+
+
+# Streaming zstd, flushed at the end of every block like ZlibCompressor. Level 1 is about twice as fast
+# as the default level 3 and compresses logs about as well.
+class ZstdCompressor:
+    def __init__(self, level=1):
+        self.stream = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.stream.compress(data) + self.stream.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.stream.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class ZstdDecompressor:
+    def __init__(self):
+        self.stream = zstandard.ZstdDecompressor().decompressobj()
+
+    # Method to decode data, which may decode to at most limit bytes, like ZlibDecompressor.decompress.
+    # zstandard's decompressobj has no max_length, so data is fed to it ZSTD_SLICE bytes at a time and the
+    # output checked after each slice. A zstd block of 4 bytes (a run of one byte) decodes to at most 128 KiB,
+    # so a slice never expands past 32 MiB before a bomb is caught.
+    def decompress(self, data, limit):
+        limit = min(limit, MAX_FRAME_OUTPUT)
+        view = memoryview(data)
+        chunks = []
+        size = 0
+        try:
+            for start in range(0, len(view), ZSTD_SLICE):
+                chunk = self.stream.decompress(view[start:start + ZSTD_SLICE])
+                size += len(chunk)
+                check_output(size, limit)
+                chunks.append(chunk)
+        except zstandard.ZstdError as ex:
+            raise ProtocolError(f'Invalid zstd data: {str(ex)}')
+        return b''.join(chunks)
+
+
+# Streaming lz4 frame format. auto_flush makes every compress call return a complete block.
+class Lz4Compressor:
+    def __init__(self):
+        self.stream = lz4_frame.LZ4FrameCompressor(auto_flush=True)
+        self.header = self.stream.begin()
+
+    def compress(self, data):
+        block, self.header = self.header + self.stream.compress(data), b''
+        return block
+
+    def finish(self):
+        return self.header + self.stream.flush()
+
+
+class Lz4Decompressor:
+    def __init__(self):
+        self.stream = lz4_frame.LZ4FrameDecompressor()
+
+    # Method to decode data, which may decode to at most limit bytes, like ZlibDecompressor.decompress.
+    def decompress(self, data, limit):
+        limit = min(limit, MAX_FRAME_OUTPUT)
+        try:
+            chunk = self.stream.decompress(data, max_length=limit + 1)
+        except RuntimeError as ex:
+            raise ProtocolError(f'Invalid lz4 data: {str(ex)}')
+        check_output(len(chunk), limit)
+        return chunk
+
+
+# Class that names a compression format and makes compressors and decompressors for it.
+class Codec:
+    def __init__(self, name, compressor, decompressor):
+        self.name = name
+        self.compressor = compressor
+        self.decompressor = decompressor
+
+
+# Codecs this process can use, keyed by the name sent in the 'encoding' meta.
+CODECS = {'zlib': Codec('zlib', ZlibCompressor, ZlibDecompressor)}
+if zstandard:
+    CODECS['zstd'] = Codec('zstd', ZstdCompressor, ZstdDecompressor)
+if lz4_frame:
+    CODECS['lz4'] = Codec('lz4', Lz4Compressor, Lz4Decompressor)
+
+# Order in which codecs are offered: zstd compresses about as well as zlib at several times the speed,
+# lz4 is the fastest but compresses least, and zlib is always there.
+PREFERENCE = ('zstd', 'lz4', 'zlib')
+
+
+# Returns the names of the available codecs in order of preference.
+def available():
+    return [name for name in PREFERENCE if name in CODECS]
+
+
+# Returns the first codec of offered that is available here and in supported (every available codec
+# when supported is None), or None when there is none in common.
+def choose(offered, supported=None):
+    for name in offered or ():
+        if name in CODECS and (supported is None or name in supported):
+            return CODECS[name]
+    return None
+
+
+# Returns whether compressing sample with codec shrinks it enough to be worth doing for the whole transfer.
+def worth_compressing(codec, sample):
+    if not sample:
+        return False
+    compressor = codec.compressor()
+    size = len(compressor.compress(sample)) + len(compressor.finish())
+    return size <= len(sample) * PROBE_RATIO
+
+
+# Yields length bytes read from a file object in blocks of BLOCK_SIZE. Stops early if the file ends.
+def iter_blocks(file, length):
+    remaining = length
+    while remaining:
+        block = file.read(min(BLOCK_SIZE, remaining))
+        if not block:
+            return
+        remaining -= len(block)
+        yield block
+
+
+# File-like object that gives back the bytes already read for a probe before reading on from the file,
+# so a stream that cannot seek (such as an HTTP request body) can still be probed.
+class ProbedFile:
+    def __init__(self, sample, file):
+        self.sample = sample
+        self.file = file
+
+    def read(self, size=-1):
+        if not self.sample:
+            return self.file.read(size)
+        if size is None or size < 0:
+            data, self.sample = self.sample + self.file.read(), b''
+            return data
+        data, self.sample = self.sample[:size], self.sample[size:]
+        return data
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from protocol import ProtocolError
+from transfer_client import TransferClient
+
+log = logging.getLogger('connection_pool')
+
+
+# Class that hands out connections to one server, so every operation runs on its own socket.
+# Connections are opened on demand up to size and kept for reuse. One that sat idle longer than
+# check_after seconds is pinged before it is handed out and replaced when the ping fails, and one
+# that raised during an operation is closed, since it may have been left in the middle of a frame.
+# Bulk transfers may use at most bulk_limit connections, so listings and other small operations
+# always find a free connection instead of queueing behind large uploads and downloads.
+# compress and verify are passed on to every TransferClient it opens.
+class ConnectionPool:
+    def __init__(self, host, port, size=8, bulk_limit=None, timeout=None, check_after=5.0, compress=None,
+                 verify=True):
+        self.host = host
+        self.port = port
+        self.size = max(2, size)
+        self.timeout = timeout
+        self.compress = compress
+        self.verify = verify
+        self.check_after = check_after
+        self.bulk_slots = threading.BoundedSemaphore(bulk_limit or self.size - 1)
+        # Idle connections with the time they were last used, most recently used last.
+        self.idle = []
+        self.open_count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    # Method to check that the server is reachable by opening (or reusing) a connection and pinging it.
+    def check(self):
+        with self.checkout() as connection:
+            return connection.ping()
+
+    # Context manager that lends a connection for one operation:  with pool.checkout() as connection: ...
+    # Pass bulk=True for transfers that can take a long time.
+    @contextmanager
+    def checkout(self, bulk=False):
+        if bulk:
+            self.bulk_slots.acquire()
+        try:
+            connection = self.acquire()
+            try:
+                yield connection
+            except BaseException:
+                self.discard(connection)
+                raise
+            self.release(connection)
+        finally:
+            if bulk:
+                self.bulk_slots.release()
+
+    # Method to take an idle connection, or open a new one while fewer than size are open.
+    # Waits for a connection to come back when all of them are in use.
+    def acquire(self):
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise ConnectionError("Connection pool is closed")
+                if self.idle:
+                    connection, last_used = self.idle.pop()
+                    break
+                if self.open_count < self.size:
+                    self.open_count += 1
+                    connection, last_used = None, None
+                    break
+                self.condition.wait()
+
+        try:
+            if connection is None:
+                return self.open_connection()
+            if time.monotonic() - last_used > self.check_after and not self.healthy(connection):
+                log.info(f'Reconnecting stale connection to {self.host}:{self.port}')
+                connection.close()
+                connection.connect()
+            return connection
+        except BaseException:
+            if connection is not None:
+                connection.close()
+            with self.condition:
+                self.open_count -= 1
+                self.condition.notify()
+            raise
+
+    def open_connection(self):
+        return TransferClient(self.host, self.port, self.timeout, self.compress, self.verify).connect()
+
+    # Method to ping a connection. Returns False when it no longer answers.
+    def healthy(self, connection):
+        try:
+            return connection.ping()
+        except (OSError, ProtocolError):
+            return False
+
+    # Method to give a connection back for reuse.
+    def release(self, connection):
+        with self.condition:
+            if self.closed:
+                connection.close()
+                self.open_count -= 1
+            else:
+                self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    # Method to close a connection that failed, freeing its place in the pool.
+    def discard(self, connection):
+        connection.close()
+        with self.condition:
+            self.open_count -= 1
+            self.condition.notify()
+
+    # Method to close every idle connection. Connections still lent out are closed when they come back.
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.open_count -= len(idle)
+            self.condition.notify_all()
+        for connection, _ in idle:
+            connection.close()
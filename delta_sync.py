@@ -0,0 +1,447 @@
+import hashlib
+import struct
+import zlib
+import integrity
+from protocol import ProtocolError
+
+# rsync-style delta uploads. The server describes its copy of a file as a list of block signatures
+# (signatures). The client slides a window over the new version of the file (compute_delta) to find the
+# blocks the server already has, wherever they moved, and sends the new version as a series of records:
+# copies of runs of the server's blocks and literal bytes for everything else (iter_delta). The server
+# rebuilds the file from them with a DeltaDecoder, which takes the place of a decompressor in an upload
+# whose meta 'encoding' is ENCODING, so the rebuilt file is staged, verified and committed like any other.
+ENCODING = 'delta'
+
+# Blocks are about the square root of the file's size, as in rsync, rounded up to a power of two within
+# these bounds and large enough that a file has at most MAX_BLOCKS of them.
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 256 * 1024
+MAX_BLOCKS = 256 * 1024
+
+# A block's signature: its Adler-32 (the weak checksum, which can be rolled along a byte at a time) and the
+# first 16 bytes of its BLAKE2b digest (the strong checksum, which confirms a weak match).
+SIGNATURE = struct.Struct('!I16s')
+STRONG_SIZE = 16
+ADLER_MOD = 65521
+
+# Records of a delta: b'C' copies count blocks of the base from block index, b'L' is followed by
+# length literal bytes.
+COPY = struct.Struct('!cQI')
+LITERAL = struct.Struct('!cI')
+# A copy record rebuilds at most MAX_COPY_SIZE bytes and a literal record holds at most MAX_LITERAL_SIZE,
+# so neither side holds much of the file in memory at once. Records are sent in pieces of about PIECE_SIZE.
+MAX_COPY_SIZE = 4 * 1024 * 1024
+MAX_LITERAL_SIZE = 64 * 1024
+PIECE_SIZE = 64 * 1024
+# A piece may rebuild at most this many bytes; anything more is refused as malformed.
+MAX_PIECE_OUTPUT = 4 * MAX_COPY_SIZE
+
+# Bytes of the new file read at a time while searching it.
+SEGMENT_SIZE = 8 * 1024 * 1024
+# Sliding the window a byte at a time runs in Python and costs far more than checking whole blocks, so it is
+# only done where it can find something. A block changed in place is followed by blocks at their old
+# alignment, so when one of the next LOOKAHEAD blocks is on the server the window just moves on to it;
+# only when none is, which is what an insertion or deletion looks like, is the window slid along.
+# In a long run of new data that is done for the first ROLL_FIRST blocks and then for every ROLL_EVERY-th,
+# which bounds the cost at a few percent of a full search while still catching up with a shift within
+# a few blocks.
+LOOKAHEAD = 4
+ROLL_FIRST = 2
+ROLL_EVERY = 8
+# A delta is only sent when it is smaller than this fraction of the file; otherwise a plain
+# (possibly compressed) upload costs about the same and saves a pass over the file.
+MAX_DELTA_RATIO = 0.9
+
+
+# Returns the block size to describe a file of size bytes with.
+def choose_block_size(size):
+    block_size = MIN_BLOCK_SIZE
+    while block_size < MAX_BLOCK_SIZE and (block_size * block_size < size or size > block_size * MAX_BLOCKS):
+        block_size *= 2
+    return block_size
+
+
+# Returns the block size a signatures request asks for (meta 'block_size'), or one chosen for the file.
+# Raises ValueError when the requested size is out of bounds or would give the file too many blocks.
+def requested_block_size(meta, size):
+    block_size = meta.get('block_size')
+    if block_size is None:
+        return choose_block_size(size)
+    block_size = int(block_size)
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE or size > block_size * MAX_BLOCKS:
+        raise ValueError(f'block size {block_size} is out of bounds for a file of {size} bytes')
+    return block_size
+
+
+def strong_checksum(block):
+    return hashlib.blake2b(block, digest_size=STRONG_SIZE).digest()
+
+
+# Reads size bytes from a file object, or up to its end, however short the reads it makes; a ManifestReader
+# returns at most one chunk per read.
+def read_full(file, size):
+    data = file.read(size)
+    if len(data) == size or not data:
+        return data
+    parts = [data]
+    remaining = size - len(data)
+    while remaining:
+        data = file.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+# Returns the signatures of the blocks of a file object read from its current position, packed one after
+# the other. The last block is shorter when the size is not a multiple of block_size.
+def signatures(file, block_size):
+    parts = []
+    read_size = max(block_size, (integrity.READ_SIZE // block_size) * block_size)
+    while True:
+        data = read_full(file, read_size)
+        if not data:
+            break
+        view = memoryview(data)
+        for start in range(0, len(data), block_size):
+            block = view[start:start + block_size]
+            parts.append(SIGNATURE.pack(zlib.adler32(block), strong_checksum(block)))
+    return b''.join(parts)
+
+
+# Unpacks a signatures reply body into a list of (weak, strong) pairs, one per block.
+def parse_signatures(body):
+    if len(body) % SIGNATURE.size:
+        raise ProtocolError(f'Signature list of {len(body)} bytes is not a whole number of signatures')
+    return list(SIGNATURE.iter_unpack(body))
+
+
+# Class that holds the result of compute_delta: the instructions that rebuild the new file from the base,
+# ['C', first block, count] and ['L', offset in the new file, length], and what they add up to.
+class Delta:
+    def __init__(self, block_size, base_size):
+        self.block_size = block_size
+        self.base_size = base_size
+        self.instructions = []
+        self.size = 0
+        self.digest = None
+        self.copied_bytes = 0
+        self.literal_bytes = 0
+
+    # Method to add a copy of the base block index, extending the previous copy when it ends just before it.
+    def copy(self, index, length):
+        self.copied_bytes += length
+        last = self.instructions[-1] if self.instructions else None
+        if (last and last[0] == 'C' and last[1] + last[2] == index
+                and (last[2] + 1) * self.block_size <= MAX_COPY_SIZE):
+            last[2] += 1
+        else:
+            self.instructions.append(['C', index, 1])
+
+    # Method to add length literal bytes at offset, merging them with the literal bytes just before them.
+    def literal(self, offset, length):
+        if not length:
+            return
+        self.literal_bytes += length
+        last = self.instructions[-1] if self.instructions else None
+        if last and last[0] == 'L' and last[1] + last[2] == offset:
+            last[2] += length
+        else:
+            self.instructions.append(['L', offset, length])
+
+    # Method to get the number of bytes the delta takes on the wire, records included.
+    def encoded_size(self):
+        size = 0
+        for kind, _, length in self.instructions:
+            if kind == 'C':
+                size += COPY.size
+            else:
+                size += length + LITERAL.size * -(-length // MAX_LITERAL_SIZE)
+        return size
+
+    def stats(self):
+        return {'size': self.size, 'block_size': self.block_size, 'copied_bytes': self.copied_bytes,
+                'literal_bytes': self.literal_bytes, 'delta_bytes': self.encoded_size()}
+
+
+# Class that searches a new version of a file for the blocks of the base described by a signature list.
+class DeltaBuilder:
+    def __init__(self, file, signature_list, block_size, base_size):
+        self.file = file
+        self.block_size = block_size
+        self.delta = Delta(block_size, base_size)
+        # Index of the blocks of the base by weak checksum. A last block shorter than block_size can
+        # only be matched at the very end of the new file, so it is kept aside.
+        self.table = {}
+        self.tail = None
+        for index, (weak, strong) in enumerate(signature_list):
+            if (index + 1) * block_size <= base_size:
+                self.table.setdefault(weak, []).append((index, strong))
+            else:
+                self.tail = (index, strong, base_size - index * block_size)
+        # Bytes of the new file from offset self.start that have been read and not searched past yet.
+        self.data = b''
+        self.start = 0
+        self.eof = False
+        self.hasher = integrity.new_digest()
+
+    # Method to make data hold the bytes from position up to end, or up to the end of the file.
+    def fill(self, position, end):
+        if self.start + len(self.data) >= end or self.eof:
+            return
+        parts = [self.data[position - self.start:]]
+        available = self.start + len(self.data)
+        while available < end:
+            data = read_full(self.file, max(SEGMENT_SIZE, end - available))
+            if not data:
+                self.eof = True
+                break
+            self.hasher.update(data)
+            parts.append(data)
+            available += len(data)
+        self.data = b''.join(parts)
+        self.start = position
+
+    # Method to find the base block whose weak checksum is weak and whose contents are window.
+    # The block after the last one matched is preferred, so unchanged runs become a single copy.
+    def match(self, window, weak, expected):
+        candidates = self.table.get(weak)
+        if not candidates:
+            return None
+        strong = strong_checksum(window)
+        found = None
+        for index, candidate in candidates:
+            if candidate == strong:
+                if index == expected:
+                    return index
+                if found is None:
+                    found = index
+        return found
+
+    # Method to slide the window from offset i of data (where its weak checksum is weak) a byte at a time,
+    # up to a block further, looking for a block of the base. Returns (shift, block index) or None.
+    def roll(self, i, weak, expected):
+        data, table, block_size = self.data, self.table, self.block_size
+        a, b = weak & 0xffff, weak >> 16
+        limit = min(block_size - 1, len(data) - i - block_size)
+        for shift in range(1, limit + 1):
+            out, new = data[i + shift - 1], data[i + shift - 1 + block_size]
+            a = (a - out + new) % ADLER_MOD
+            b = (b - block_size * out + a - 1) % ADLER_MOD
+            weak = (b << 16) | a
+            if weak in table:
+                start = i + shift
+                index = self.match(data[start:start + block_size], weak, expected)
+                if index is not None:
+                    return shift, index
+        return None
+
+    # Method to check whether any of the LOOKAHEAD whole blocks from offset i of data is a block of the base.
+    def aligned_match(self, i):
+        block_size = self.block_size
+        for start in range(i, min(i + LOOKAHEAD * block_size, len(self.data) - block_size + 1), block_size):
+            window = self.data[start:start + block_size]
+            if self.match(window, zlib.adler32(window), None) is not None:
+                return True
+        return False
+
+    # Method to search the whole new file. Returns the Delta, with the digest of the new file.
+    def build(self):
+        delta, block_size = self.delta, self.block_size
+        position = 0
+        expected = None
+        misses = 0
+        while True:
+            self.fill(position, position + (LOOKAHEAD + 1) * block_size)
+            i = position - self.start
+            if len(self.data) - i < block_size:
+                break
+            window = self.data[i:i + block_size]
+            weak = zlib.adler32(window)
+            index = self.match(window, weak, expected)
+            if index is not None:
+                delta.copy(index, block_size)
+                position += block_size
+                expected, misses = index + 1, 0
+                continue
+
+            # A later block is on the server where it was: this one was changed in place.
+            if self.aligned_match(i + block_size):
+                delta.literal(position, block_size)
+                position += block_size
+                continue
+
+            if misses < ROLL_FIRST or misses % ROLL_EVERY == 0:
+                found = self.roll(i, weak, expected)
+                if found:
+                    shift, index = found
+                    delta.literal(position, shift)
+                    delta.copy(index, block_size)
+                    position += shift + block_size
+                    expected, misses = index + 1, 0
+                    continue
+            delta.literal(position, block_size)
+            position += block_size
+            misses += 1
+
+        remaining = self.data[position - self.start:]
+        if remaining and self.tail and len(remaining) == self.tail[2] and strong_checksum(remaining) == self.tail[1]:
+            delta.copy(self.tail[0], len(remaining))
+        else:
+            delta.literal(position, len(remaining))
+        delta.size = position + len(remaining)
+        delta.digest = self.hasher.hexdigest()
+        return delta
+
+
+# Returns the Delta that rebuilds the file object read from its current position out of the base
+# described by signature_list (see parse_signatures), with blocks of block_size and base_size bytes in all.
+def compute_delta(file, signature_list, block_size, base_size):
+    return DeltaBuilder(file, signature_list, block_size, base_size).build()
+
+
+# Yields the records of delta in pieces of about PIECE_SIZE bytes, reading literal bytes from the file
+# object. progress, when given, is called with the number of bytes of the new file covered so far.
+def iter_delta(file, delta, progress=None):
+    piece = []
+    piece_size = piece_output = 0
+    done = 0
+    for kind, first, length in delta.instructions:
+        if kind == 'C':
+            output = min(length * delta.block_size, delta.base_size - first * delta.block_size)
+            if piece_output + output > MAX_PIECE_OUTPUT:
+                yield b''.join(piece)
+                piece, piece_size, piece_output = [], 0, 0
+                if progress:
+                    progress(done)
+            piece.append(COPY.pack(b'C', first, length))
+            piece_size += COPY.size
+            piece_output += output
+            done += output
+            continue
+        file.seek(first)
+        remaining = length
+        while remaining:
+            data = read_full(file, min(MAX_LITERAL_SIZE, remaining))
+            if not data:
+                raise ProtocolError(f'Source ended {remaining} bytes short of a literal')
+            piece.append(LITERAL.pack(b'L', len(data)))
+            piece.append(data)
+            piece_size += LITERAL.size + len(data)
+            piece_output += len(data)
+            remaining -= len(data)
+            done += len(data)
+            if piece_size >= PIECE_SIZE:
+                yield b''.join(piece)
+                piece, piece_size, piece_output = [], 0, 0
+                if progress:
+                    progress(done)
+    if piece:
+        yield b''.join(piece)
+        if progress:
+            progress(done)
+
+
+# Stands in for a compressor when the records of a delta are sent with FrameConnection.send_encoded,
+# which sends each piece as a frame of its own: the records go out as they are.
+class Passthrough:
+    def compress(self, data):
+        return data
+
+    def finish(self):
+        return b''
+
+
+# Rebuilds a file from the records of a delta against the base file object, for iter_encoded.
+# The base is closed once the new file is complete; size is the size of the new file.
+class DeltaDecoder:
+    # Rebuilding reads the base file, so iter_encoded_async calls decompress in a worker thread.
+    blocking = True
+
+    def __init__(self, base, base_size, block_size, size):
+        self.base = base
+        self.base_size = base_size
+        self.block_size = block_size
+        self.blocks = -(-base_size // block_size)
+        self.size = size
+        self.produced = 0
+        self.pending = bytearray()
+        if not size:
+            self.close()
+
+    # Method to rebuild the bytes of the records in data, which may rebuild at most limit bytes.
+    def decompress(self, data, limit):
+        pending = self.pending
+        pending += data
+        output = []
+        output_size = 0
+        position = 0
+        while position < len(pending):
+            kind = pending[position:position + 1]
+            if kind == b'C':
+                if len(pending) - position < COPY.size:
+                    break
+                _, index, count = COPY.unpack_from(pending, position)
+                position += COPY.size
+                block = self.copy(index, count)
+            elif kind == b'L':
+                if len(pending) - position < LITERAL.size:
+                    break
+                _, length = LITERAL.unpack_from(pending, position)
+                if length > MAX_LITERAL_SIZE:
+                    raise ProtocolError(f'Delta literal of {length} bytes is too large')
+                if len(pending) - position - LITERAL.size < length:
+                    break
+                block = bytes(pending[position + LITERAL.size:position + LITERAL.size + length])
+                position += LITERAL.size + length
+            else:
+                raise ProtocolError(f'Invalid delta record {kind!r}')
+            output.append(block)
+            output_size += len(block)
+            if output_size > MAX_PIECE_OUTPUT or output_size > limit:
+                raise ProtocolError('Delta piece rebuilds too many bytes')
+        del pending[:position]
+
+        self.produced += output_size
+        if self.produced > self.size:
+            raise ProtocolError(f'Delta rebuilds more than {self.size} bytes')
+        if self.produced == self.size:
+            self.close()
+        return b''.join(output)
+
+    # Method to read count blocks of the base from block index.
+    def copy(self, index, count):
+        if not count or index + count > self.blocks or count * self.block_size > MAX_COPY_SIZE:
+            raise ProtocolError(f'Delta copies blocks {index}-{index + count} of {self.blocks}')
+        if self.base is None:
+            raise ProtocolError('Delta copies blocks after the file is complete')
+        offset = index * self.block_size
+        length = min(count * self.block_size, self.base_size - offset)
+        self.base.seek(offset)
+        data = read_full(self.base, length)
+        if len(data) != length:
+            raise ProtocolError(f'Base file ended {length - len(data)} bytes early')
+        return data
+
+    def close(self):
+        if self.base is not None:
+            self.base.close()
+            self.base = None
+
+
+# Class that stands in for a compression.Codec in an upload with a delta body: each decompressor rebuilds
+# the file against the stored file of the same name, opened when the decompressor is made.
+class DeltaCodec:
+    name = ENCODING
+
+    def __init__(self, storage, file_name, block_size, size):
+        self.storage = storage
+        self.file_name = file_name
+        self.block_size = block_size
+        self.size = size
+
+    # The base is memory-mapped: copies jump around it and only the blocks they name are read.
+    def decompressor(self):
+        base, base_size = self.storage.open_read(self.file_name, mapped=True)
+        return DeltaDecoder(base, base_size, self.block_size, self.size)
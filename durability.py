@@ -0,0 +1,98 @@
+import os
+import threading
+
+# How a commit reaches the disk before the client is told the upload is complete:
+#  'always' syncs the file's data before renaming it into place and the directory after, for every file;
+#  'group' does the same, but the directory syncs of commits that run at the same time are shared, one sync
+#          covering every rename made before it started;
+#  'none'   only renames, so a crash of the machine (not just the server) can lose recently committed files.
+DURABILITY_MODES = ('always', 'group', 'none')
+
+
+# Flushes the data of a file to disk. Its metadata is only flushed as far as needed to read the data back.
+def sync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Flushes a directory to disk, making the files created, renamed or removed in it survive a crash.
+def sync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Class that moves finished temporary files into place with an atomic rename, so readers see either the old
+# file or the whole new one, and makes the rename as durable as the mode asks for (see DURABILITY_MODES).
+# In 'group' mode a commit that finds a directory sync already running waits for it and then takes part in
+# the next one, together with every commit that arrived meanwhile, so under load the number of directory
+# syncs stays about the same however many files are committed.
+class Committer:
+    def __init__(self, mode='group'):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f'Unknown durability mode {mode!r}; expected one of {", ".join(DURABILITY_MODES)}')
+        self.mode = mode
+        self.condition = threading.Condition()
+        # Directories renamed into since the last group sync started.
+        self.dirty = set()
+        self.syncing = False
+        # Group syncs started and finished so far, and the number and error of the last one that failed.
+        self.started = 0
+        self.finished = 0
+        self.failure = None
+        # Number of fsync calls made, for benchmarks and metrics.
+        self.syncs = 0
+
+    # Method to replace path with the complete temporary file temp_path.
+    def commit(self, temp_path, path):
+        if self.mode != 'none':
+            sync_file(temp_path)
+            self.syncs += 1
+        os.replace(temp_path, path)
+        self.sync_directory(os.path.dirname(path) or '.')
+
+    # Method to make the entries of a directory durable as the mode asks, e.g. after removing a file.
+    def sync_directory(self, directory):
+        if self.mode == 'always':
+            sync_directory(directory)
+            self.syncs += 1
+        elif self.mode == 'group':
+            self.group_sync(directory)
+
+    # Method to wait until a group sync started after this call has flushed directory, running it
+    # in this thread when no other sync is in progress.
+    def group_sync(self, directory):
+        with self.condition:
+            self.dirty.add(directory)
+            # A sync already in progress may have missed this directory; the next one will not.
+            target = self.started + 1
+            while self.finished < target:
+                if self.syncing:
+                    self.condition.wait()
+                    continue
+                self.syncing = True
+                self.started += 1
+                directories, self.dirty = self.dirty, set()
+                self.condition.release()
+                try:
+                    for path in directories:
+                        sync_directory(path)
+                        self.syncs += 1
+                except OSError as ex:
+                    self.failure = (self.started, ex)
+                    raise
+                finally:
+                    self.condition.acquire()
+                    self.syncing = False
+                    self.finished += 1
+                    self.condition.notify_all()
+            if self.failure and self.failure[0] == target:
+                raise OSError(f'Directory sync failed: {self.failure[1]}')
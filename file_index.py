@@ -0,0 +1,313 @@
+import bisect
+import fcntl
+import json
+import os
+import threading
+
+# Size at which the shared index journal is continued in a new file.
+JOURNAL_MAX_BYTES = 16 * 1024 * 1024
+
+# Orders a listing can be sorted in besides by name, mapped to the attribute sorted by.
+# The name follows the attribute in every sort key, so entries with equal sizes or times keep a stable order.
+SORT_ATTRIBUTES = {
+    'size': 'size',
+    'mtime': 'mtime',
+}
+
+
+# Metadata of one stored file.
+class FileEntry:
+    __slots__ = ('name', 'size', 'mtime', 'checksum')
+
+    def __init__(self, name, size, mtime, checksum=None):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.checksum = checksum
+
+    def to_dict(self):
+        return {'name': self.name, 'size': self.size, 'mtime': self.mtime, 'checksum': self.checksum}
+
+
+# Class that keeps the metadata of every stored file in memory. It is filled once when the server
+# starts and then updated by uploads and deletes, so listings never touch the disk.
+# Names are kept in a sorted list, and each other sort order in a sorted list of (key, name) pairs
+# that is built the first time it is asked for and then kept up to date, so a page is found by
+# binary search and costs the same wherever it is in the listing.
+class FileIndex:
+    def __init__(self):
+        self.entries = {}
+        self.names = []
+        self.sorted_views = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, file_name):
+        return file_name in self.entries
+
+    # Method to get the entry of a file, or None.
+    def get(self, file_name):
+        return self.entries.get(file_name)
+
+    # Method to get the names of every file, in order.
+    def list_names(self):
+        with self.lock:
+            return list(self.names)
+
+    # Method to load many entries at once, e.g. from the startup scan.
+    def load(self, entries):
+        with self.lock:
+            for entry in entries:
+                self.entries[entry.name] = entry
+            self.names = sorted(self.entries)
+            self.sorted_views.clear()
+
+    # Method to replace every entry with the given ones, e.g. from a new scan.
+    def reload(self, entries):
+        with self.lock:
+            self.entries = {}
+        self.load(entries)
+
+    # Method to add or replace the entry of a file.
+    def update(self, file_name, size, mtime, checksum=None):
+        entry = FileEntry(file_name, size, mtime, checksum)
+        with self.lock:
+            previous = self.entries.get(file_name)
+            if previous is None:
+                bisect.insort(self.names, file_name)
+            for sort, view in self.sorted_views.items():
+                if previous is not None:
+                    remove_sorted(view, sort_key(previous, sort))
+                bisect.insort(view, sort_key(entry, sort))
+            self.entries[file_name] = entry
+
+    # Method to remove the entry of a file. Returns False when there was none.
+    def remove(self, file_name):
+        with self.lock:
+            entry = self.entries.pop(file_name, None)
+            if entry is None:
+                return False
+            remove_sorted(self.names, file_name)
+            for sort, view in self.sorted_views.items():
+                remove_sorted(view, sort_key(entry, sort))
+        return True
+
+    # Method to list one page of entries whose names start with prefix, in the given order.
+    # cursor is the value returned with the previous page; limit 0 means no limit.
+    # Returns (entries, cursor of the next page or None when this was the last page).
+    def page(self, prefix='', sort='name', reverse=False, limit=0, cursor=None):
+        if sort != 'name' and sort not in SORT_ATTRIBUTES:
+            raise ValueError(f'Unknown sort order {sort!r}')
+        with self.lock:
+            if sort == 'name':
+                view = self.names
+            else:
+                view = self.view(sort)
+                cursor = tuple(cursor) if cursor is not None else None
+
+            if cursor is not None:
+                position = bisect.bisect_left(view, cursor) - 1 if reverse else bisect.bisect_right(view, cursor)
+            elif sort == 'name':
+                # Names are sorted, so the ones with the prefix sit next to each other.
+                position = (bisect.bisect_left(view, prefix + '\U0010ffff') - 1 if reverse
+                            else bisect.bisect_left(view, prefix))
+            else:
+                position = len(view) - 1 if reverse else 0
+            return self.collect(view, position, -1 if reverse else 1, prefix, sort == 'name', limit)
+
+    # Method to walk a sorted view from position and gather up to limit entries with the prefix.
+    # In the name view the walk stops at the first name without the prefix, since none can follow it.
+    def collect(self, view, position, step, prefix, by_name, limit):
+        result = []
+        cursor = None
+        while 0 <= position < len(view):
+            if limit and len(result) == limit:
+                return [self.entries[name] for name in result], cursor
+            item = view[position]
+            name = item if by_name else item[1]
+            position += step
+            if name.startswith(prefix):
+                result.append(name)
+                cursor = item if by_name else list(item)
+            elif by_name:
+                break
+        return [self.entries[name] for name in result], None
+
+    # Method to get the sorted (key, name) list of an order, building it on first use.
+    def view(self, sort):
+        view = self.sorted_views.get(sort)
+        if view is None:
+            view = sorted(sort_key(entry, sort) for entry in self.entries.values())
+            self.sorted_views[sort] = view
+        return view
+
+
+# Class that keeps the FileIndex of one storage directory in step between the worker processes of a server.
+# Every update and remove is also appended to a journal in the storage directory, and before it answers
+# anything a worker replays what the other workers appended since it last looked, so a listing on one worker
+# shows an upload another worker has just committed. Appends are serialized by an flock on the journal's lock
+# file. Once a journal reaches max_bytes the next one is started (journal.1, journal.2, ...; the number of the
+# current one is kept in journal itself) and the one before the previous is removed. A worker that falls so
+# far behind that a journal it has not read is gone rebuilds its index with rescan, which returns every entry.
+class SharedFileIndex(FileIndex):
+    def __init__(self, journal_path, rescan, max_bytes=JOURNAL_MAX_BYTES):
+        super().__init__()
+        self.journal_path = journal_path
+        self.rescan = rescan
+        self.max_bytes = max_bytes
+        self.pid = os.getpid()
+        self.append_lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.lock_fd = os.open(journal_path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        self.reader_fd = None
+        self.position = 0
+        self.partial = b''
+        self.open_current()
+
+    # Method to start reading the current journal from its end. Whatever is in it already is on disk,
+    # so the caller loads the index by scanning the storage after this.
+    def open_current(self):
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            self.generation = self.current_generation()
+            self.open_reader(os.open(self.generation_path(self.generation), os.O_RDONLY | os.O_CREAT, 0o644))
+            self.position = os.fstat(self.reader_fd).st_size
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    # Method to read the number of the current journal. The caller holds the flock.
+    def current_generation(self):
+        try:
+            with open(self.journal_path) as file:
+                return int(file.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def open_reader(self, fd):
+        if self.reader_fd is not None:
+            os.close(self.reader_fd)
+        self.reader_fd = fd
+        self.position = 0
+        self.partial = b''
+
+    def generation_path(self, generation):
+        return f'{self.journal_path}.{generation}'
+
+    # Method to append a change to the current journal, starting the next one when it is full.
+    def append(self, record):
+        record['pid'] = self.pid
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self.append_lock:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+            try:
+                generation = self.current_generation()
+                with open(self.generation_path(generation), 'ab') as file:
+                    file.write(line)
+                    size = file.tell()
+                if size >= self.max_bytes:
+                    open(self.generation_path(generation + 1), 'ab').close()
+                    with open(self.journal_path + '.tmp', 'w') as file:
+                        file.write(str(generation + 1))
+                    os.replace(self.journal_path + '.tmp', self.journal_path)
+                    try:
+                        os.remove(self.generation_path(generation - 1))
+                    except FileNotFoundError:
+                        pass
+            finally:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    # Method to apply the changes other workers appended since the last call. When nothing changed this
+    # costs one fstat, since only a full journal can have been followed by another.
+    def sync(self):
+        with self.sync_lock:
+            while True:
+                self.read_journal()
+                if self.position < self.max_bytes:
+                    return
+                next_path = self.generation_path(self.generation + 1)
+                if not os.path.exists(next_path):
+                    if os.fstat(self.reader_fd).st_nlink == 0:
+                        # This journal and the one after it are both gone, so changes were missed.
+                        self.open_current()
+                        self.reload(self.rescan())
+                    return
+                # Nothing is appended to a journal once the next one exists, so this drains it.
+                self.read_journal()
+                try:
+                    fd = os.open(next_path, os.O_RDONLY)
+                except FileNotFoundError:
+                    self.open_current()
+                    self.reload(self.rescan())
+                    return
+                self.open_reader(fd)
+                self.generation += 1
+
+    # Method to apply whatever was appended to the journal being read since it was last read.
+    def read_journal(self):
+        size = os.fstat(self.reader_fd).st_size
+        if size > self.position:
+            self.replay(os.pread(self.reader_fd, size - self.position, self.position))
+            self.position = size
+
+    # Method to apply the complete lines of journal data; a line still being written is kept for later.
+    def replay(self, data):
+        if not data:
+            return
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('pid') == self.pid:
+                continue
+            if record.get('op') == 'put':
+                super().update(record['name'], record['size'], record['mtime'], record.get('checksum'))
+            elif record.get('op') == 'del':
+                super().remove(record['name'])
+
+    def __len__(self):
+        self.sync()
+        return super().__len__()
+
+    def __contains__(self, file_name):
+        self.sync()
+        return super().__contains__(file_name)
+
+    def get(self, file_name):
+        self.sync()
+        return super().get(file_name)
+
+    def list_names(self):
+        self.sync()
+        return super().list_names()
+
+    def page(self, prefix='', sort='name', reverse=False, limit=0, cursor=None):
+        self.sync()
+        return super().page(prefix, sort, reverse, limit, cursor)
+
+    def update(self, file_name, size, mtime, checksum=None):
+        self.sync()
+        super().update(file_name, size, mtime, checksum)
+        self.append({'op': 'put', 'name': file_name, 'size': size, 'mtime': mtime, 'checksum': checksum})
+
+    def remove(self, file_name):
+        self.sync()
+        removed = super().remove(file_name)
+        self.append({'op': 'del', 'name': file_name})
+        return removed
+
+
+# Returns the key an entry is sorted by in an order other than by name.
+def sort_key(entry, sort):
+    return getattr(entry, SORT_ATTRIBUTES[sort]), entry.name
+
+
+# Removes an item from a sorted list by binary search.
+def remove_sorted(view, item):
+    position = bisect.bisect_left(view, item)
+    if position < len(view) and view[position] == item:
+        del view[position]
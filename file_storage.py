@@ -0,0 +1,515 @@
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+import integrity
+from chunk_store import ChunkStore
+from durability import Committer
+from file_index import FileIndex, SharedFileIndex, FileEntry
+from read_cache import MemoryReader
+from storage_layout import open_layout, MappedFile, MAP_MIN_SIZE
+
+
+# Class that owns the server_storage directory. Both server engines go through it,
+# so they agree on where files live and how they are listed and removed.
+# With dedup enabled, committed files are kept as manifests of content-defined chunks in a ChunkStore
+# instead of as full copies; plain files already in the directory stay readable.
+# The metadata of every file is kept in a FileIndex, built when the storage is opened and updated
+# on every commit and delete, so listings and existence checks do not scan the directory.
+# Checksums are appended to a log as they become known and restored from it at startup for files whose
+# size and mtime have not changed, so a file is hashed at most once, however often the server restarts.
+# With a ReadCache, files small enough to cache are read from memory after their first download;
+# every commit and delete invalidates the cached copy.
+# With shared, several processes (the workers of a prefork server) use the directory at once: the index
+# is a SharedFileIndex kept in step through a journal, and chunked uploads record their chunks on disk
+# so each chunk may be received by a different process.
+# Every commit goes through a Committer, which renames the staged file into place and, unless durability
+# is 'none', syncs it to disk first so that a reply of "Upload Complete." survives a crash.
+# Where a file lives under root is up to the storage_layout.StorageLayout of the directory: new stores spread
+# their files over hashed fan-out directories, so no one directory holds every file; stores created before
+# keep the flat layout until they are migrated.
+class FileStorage:
+    # Uploads are written here and only moved into root once every byte has arrived.
+    STAGING_DIR = ".staging"
+    # JSON Lines log of {"name", "size", "mtime", "checksum"} records.
+    CHECKSUM_LOG = ".checksums.jsonl"
+    # Journal of index changes shared by the processes of a prefork server.
+    INDEX_JOURNAL = ".index-journal"
+    # Bytes of upload data collected in memory before they are written to the staged file, so the disk
+    # sees a few large writes however small the pieces the network delivers.
+    WRITE_BUFFER = 1024 * 1024
+
+    def __init__(self, root="server_storage", dedup=False, cache=None, shared=False, durability='group'):
+        self.root = root
+        self.cache = cache
+        self.staging_path = os.path.join(root, self.STAGING_DIR)
+        self.checksum_path = os.path.join(root, self.CHECKSUM_LOG)
+        self.committer = Committer(durability)
+        self.chunk_store = ChunkStore(root, self.committer) if dedup else None
+        # Chunked uploads in progress, by file name. Their chunks may arrive on several connections at once.
+        self.chunked_uploads = {}
+        self.chunked_lock = threading.Lock()
+        # Serializes writes to the checksum log and counts the records in it.
+        self.checksum_lock = threading.Lock()
+        self.checksum_records = 0
+
+        os.makedirs(self.staging_path, exist_ok=True)
+        self.layout = open_layout(root)
+        if shared:
+            self.index = SharedFileIndex(os.path.join(root, self.INDEX_JOURNAL), self.scan)
+        else:
+            self.index = FileIndex()
+        self.index.load(self.scan())
+        self.load_checksums()
+
+    # Method to read the metadata of every stored file from disk. Used once, to build the index.
+    def scan(self):
+        for file_name, stat in self.layout.scan():
+            yield FileEntry(file_name, stat.st_size, stat.st_mtime)
+        if self.chunk_store:
+            for file_name in self.chunk_store.list_manifests():
+                yield self.manifest_entry(file_name)
+
+    # Method to build the index entry of a file stored as a manifest.
+    def manifest_entry(self, file_name):
+        mtime = os.path.getmtime(self.chunk_store.manifest_path(file_name))
+        return FileEntry(file_name, self.chunk_store.read_manifest(file_name)['size'], mtime)
+
+    # Method to record the current size and mtime of a stored file in the index, with its checksum when known.
+    def index_file(self, file_name, checksum=None):
+        if self.chunk_store and self.chunk_store.has_manifest(file_name):
+            entry = self.manifest_entry(file_name)
+            size, mtime = entry.size, entry.mtime
+        else:
+            stat = os.stat(self.path_for(file_name))
+            size, mtime = stat.st_size, stat.st_mtime
+        self.index.update(file_name, size, mtime, checksum)
+        if self.cache is not None:
+            self.cache.invalidate(file_name)
+        if checksum:
+            self.record_checksum(self.index.get(file_name))
+
+    # Method to restore the checksums in the checksum log of files whose size and mtime still match,
+    # then rewrite the log with just those. A line cut short by a crash is skipped.
+    def load_checksums(self):
+        try:
+            with open(self.checksum_path) as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        entry = self.index.get(record['name'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if entry is not None and (entry.size, entry.mtime) == (record.get('size'), record.get('mtime')):
+                        entry.checksum = record.get('checksum')
+        except FileNotFoundError:
+            pass
+        self.compact_checksums()
+
+    # Method to rewrite the checksum log with one record per stored file whose checksum is known.
+    def compact_checksums(self):
+        with self.index.lock:
+            entries = [entry for entry in self.index.entries.values() if entry.checksum]
+        temp_path = f'{self.checksum_path}.{os.getpid()}.tmp'
+        with self.checksum_lock:
+            with open(temp_path, 'w') as file:
+                for entry in entries:
+                    file.write(checksum_record(entry))
+            os.replace(temp_path, self.checksum_path)
+            self.checksum_records = len(entries)
+
+    # Method to append the checksum of an index entry to the checksum log. Records of overwritten and
+    # deleted files are dropped by compacting the log once it holds twice as many records as files.
+    def record_checksum(self, entry):
+        with self.checksum_lock:
+            with open(self.checksum_path, 'a') as file:
+                file.write(checksum_record(entry))
+            self.checksum_records += 1
+            compact = self.checksum_records > 2 * len(self.index) + 1000
+        if compact:
+            self.compact_checksums()
+
+    # Method to get the on-disk path of a stored file. The name must be valid (see storage_layout.normalize_name).
+    def path_for(self, file_name):
+        return self.layout.path_for(file_name)
+
+    # Method to check whether a file is stored.
+    def exists(self, file_name):
+        return file_name in self.index
+
+    # Method to list the names of all stored files, in order. Hidden entries such as the staging area are skipped.
+    def list_names(self):
+        return self.index.list_names()
+
+    # Method to get the BLAKE2b checksum of a stored file. It is computed on first use, unless the upload
+    # already supplied it, and kept in the index entry and the checksum log until the file changes.
+    def checksum(self, file_name):
+        entry = self.index.get(file_name)
+        if entry is None:
+            raise FileNotFoundError(file_name)
+        if entry.checksum is None:
+            file, _ = self.open_file(file_name, mapped=True)
+            with file:
+                entry.checksum = integrity.digest_file(file)
+            self.record_checksum(entry)
+        return entry.checksum
+
+    # Method to get the checksum of a stored file when it is already known, without reading the file.
+    def cached_checksum(self, file_name):
+        entry = self.index.get(file_name)
+        return entry.checksum if entry is not None else None
+
+    # Method to get the BLAKE2b checksum of length bytes of a stored file from offset.
+    # The file is read through a handle of its own, so this can run while the file is being sent.
+    def range_checksum(self, file_name, offset, length):
+        file, _ = self.open_read(file_name, mapped=True)
+        with file:
+            file.seek(offset)
+            return integrity.digest_file(file, length)
+
+    # Method to open a stored file for reading. Returns the file object and its size.
+    # Files kept as manifests come back as a ManifestReader, which has no file descriptor,
+    # so sendfile falls back to buffered sends for them. Files the cache admits come back as a
+    # MemoryReader over their cached contents, read in whole on a miss. With mapped, other plain files of at least
+    # MAP_MIN_SIZE bytes come back as a storage_layout.MappedFile, which reads like a MemoryReader.
+    def open_read(self, file_name, mapped=False):
+        entry = self.index.get(file_name) if self.cache is not None else None
+        if entry is not None and self.cache.admits(entry.size):
+            data = self.cache.get(file_name, entry.mtime, entry.size)
+            if data is None:
+                file, _ = self.open_file(file_name)
+                with file:
+                    data = file.read()
+                self.cache.put(file_name, entry.mtime, data)
+            return MemoryReader(data), len(data)
+        return self.open_file(file_name, mapped)
+
+    # Method to open a stored file on disk, memory-mapped with mapped when it is large enough, or its manifest,
+    # bypassing the cache.
+    def open_file(self, file_name, mapped=False):
+        try:
+            file = open(self.path_for(file_name), 'rb')
+        except FileNotFoundError:
+            if not self.chunk_store:
+                raise
+            return self.chunk_store.open_manifest(file_name)
+        size = os.fstat(file.fileno()).st_size
+        if mapped and size >= MAP_MIN_SIZE:
+            with file:
+                return MappedFile(file), size
+        return file, size
+
+    # Method to get the path of the partial upload of a file.
+    def staged_path_for(self, file_name):
+        return os.path.join(self.staging_path, file_name + '.part')
+
+    # Method to get how many bytes of a file's upload have been staged so far.
+    def staged_size(self, file_name):
+        try:
+            return os.path.getsize(self.staged_path_for(file_name))
+        except FileNotFoundError:
+            return 0
+
+    # Method to open the partial upload of a file for writing at offset, buffered by WRITE_BUFFER.
+    # Anything staged past offset is discarded; offset 0 starts a fresh upload in a new file. When the file
+    # will grow to total bytes, the disk space for the rest is reserved up front, keeping the file in one piece.
+    # The staged file is locked for as long as the returned file is open, so keep it open until the upload
+    # is committed or given up: another upload of the same file meanwhile, from this process or another,
+    # fails here with UploadInProgress instead of writing into it too.
+    def open_staged(self, file_name, offset=0, total=None):
+        path = self.staged_path_for(file_name)
+        fd = lock_staged(path, create=not offset)
+        if not offset:
+            fd = recreate_staged(path, fd)
+        try:
+            if offset:
+                os.ftruncate(fd, offset)
+            # A file that fits in the buffer reaches the disk in one write anyway.
+            if total and total - offset > self.WRITE_BUFFER:
+                reserve(fd, offset, total - offset)
+        except BaseException:
+            os.close(fd)
+            raise
+        file = os.fdopen(fd, 'r+b', buffering=self.WRITE_BUFFER)
+        file.seek(offset)
+        return file
+
+    # Method to throw away the partial upload of a file, e.g. one that failed verification.
+    def discard_staged(self, file_name):
+        try:
+            os.remove(self.staged_path_for(file_name))
+        except FileNotFoundError:
+            pass
+
+    # Method to move a complete upload from the staging area into place, recording its checksum if known.
+    # The rename is atomic, so readers see either the old file or the whole new one, and a failed upload
+    # leaves the old one as it was. How durable the commit is when this returns depends on the committer,
+    # which also syncs the fan-out directories created for the file.
+    def commit_staged(self, file_name, checksum=None):
+        staged_path = self.staged_path_for(file_name)
+        if not self.chunk_store:
+            path = self.path_for(file_name)
+            for directory in self.layout.make_parent(path):
+                self.committer.sync_directory(directory)
+            self.committer.commit(staged_path, path)
+        else:
+            self.chunk_store.store_file(file_name, staged_path)
+            os.remove(staged_path)
+            self.remove_plain(file_name)
+        self.index_file(file_name, checksum)
+
+    # Method to record a file as a manifest of chunks already in the chunk store, replacing any plain copy.
+    # Returns the hashes of chunks that are missing; nothing changes unless that list is empty.
+    def put_manifest(self, file_name, chunks):
+        missing = self.chunk_store.put_manifest(file_name, chunks)
+        if not missing:
+            self.remove_plain(file_name)
+            self.index_file(file_name)
+        return missing
+
+    # Method to remove the plain copy of a file that is now stored as a manifest.
+    def remove_plain(self, file_name):
+        try:
+            os.remove(self.path_for(file_name))
+        except FileNotFoundError:
+            pass
+
+    # Method to start a chunked upload of a file of total bytes. The staged file is preallocated
+    # so chunks can be written at their offsets in any order, from any connection.
+    def begin_chunked(self, file_name, total):
+        upload = ChunkedUpload(self.staged_path_for(file_name), total)
+        with self.chunked_lock:
+            previous = self.chunked_uploads.pop(file_name, None)
+            self.chunked_uploads[file_name] = upload
+        if previous:
+            previous.close()
+        return upload
+
+    # Method to get the chunked upload in progress for a file, or None. An upload begun by another process,
+    # or begun again since this process last saw it, is picked up from its chunk log on disk.
+    def get_chunked(self, file_name):
+        with self.chunked_lock:
+            upload = self.chunked_uploads.get(file_name)
+            if upload is not None and upload.current():
+                return upload
+            if upload is not None:
+                del self.chunked_uploads[file_name]
+                upload.close()
+            try:
+                upload = ChunkedUpload.reopen(self.staged_path_for(file_name))
+            except (FileNotFoundError, ValueError):
+                return None
+            self.chunked_uploads[file_name] = upload
+            return upload
+
+    # Method to finish a chunked upload. Returns False, leaving it open, while chunks are still missing.
+    def commit_chunked(self, file_name):
+        upload = self.get_chunked(file_name)
+        with self.chunked_lock:
+            if upload is None or not upload.complete():
+                return False
+            self.chunked_uploads.pop(file_name, None)
+        upload.close()
+        upload.remove_log()
+        self.commit_staged(file_name)
+        return True
+
+    # Method to delete a stored file. Returns False when there was no such file.
+    def delete(self, file_name):
+        try:
+            os.remove(self.path_for(file_name))
+        except FileNotFoundError:
+            if not (self.chunk_store and self.chunk_store.delete_manifest(file_name)):
+                return False
+        self.index.remove(file_name)
+        if self.cache is not None:
+            self.cache.invalidate(file_name)
+        return True
+
+
+# Raised when a file cannot be staged because another upload of it is being written.
+class UploadInProgress(OSError):
+    def __init__(self):
+        super().__init__('another upload of this file is in progress')
+
+
+# Opens the staged file at path for reading and writing and locks it, so no other upload writes to it while
+# it is open; create makes it when there is none. Returns the file descriptor. Raises UploadInProgress when
+# another upload holds the lock. The lock is taken on the file, so when that upload commits (renames it
+# away) just before the lock is granted, this opens the file that is at path now instead.
+def lock_staged(path, create):
+    while True:
+        fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0), 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except BlockingIOError:
+            os.close(fd)
+            raise UploadInProgress()
+        except FileNotFoundError:
+            if not create:
+                os.close(fd)
+                raise
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+
+
+# Replaces the staged file at path, locked through fd, with a new empty one, also locked. Returns the file
+# descriptor of the new file; fd is closed either way.
+def recreate_staged(path, fd):
+    try:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        try:
+            new_fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            raise UploadInProgress()
+    finally:
+        os.close(fd)
+    try:
+        fcntl.flock(new_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(new_fd)
+        raise UploadInProgress()
+    return new_fd
+
+
+# Returns the checksum log line of an index entry.
+def checksum_record(entry):
+    return json.dumps({'name': entry.name, 'size': entry.size, 'mtime': entry.mtime,
+                       'checksum': entry.checksum}) + '\n'
+
+
+# Class for one chunked upload: a preallocated staged file and the chunks written into it so far.
+# The size of the file and every chunk written are also appended to a chunk log next to it, so other
+# processes can write chunks of the same upload and see which ones are there.
+class ChunkedUpload:
+    def __init__(self, path, total, create=True):
+        self.path = path
+        self.log_path = path + '.chunks'
+        self.total = total
+        self.start_time = datetime.now()
+        self.chunks = {}
+        self.lock = threading.Lock()
+        if create:
+            # A fresh file and chunk log, not truncated ones, so processes still holding an earlier upload notice
+            # and write nothing into the new one. Like a streamed upload's, the file is locked while it is set
+            # up; chunks are written to it without the lock.
+            self.fd = recreate_staged(path, lock_staged(path, create=True))
+            try:
+                os.remove(self.log_path)
+            except FileNotFoundError:
+                pass
+        else:
+            self.fd = os.open(path, os.O_WRONLY)
+        try:
+            if create:
+                if total:
+                    preallocate(self.fd, total)
+                with open(self.log_path, 'w') as log:
+                    log.write(f'{total}\n')
+            self.log_fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND)
+        except OSError:
+            os.close(self.fd)
+            raise
+        if create:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    # Opens an upload begun elsewhere from its chunk log. Raises FileNotFoundError when there is none.
+    @classmethod
+    def reopen(cls, path):
+        with open(path + '.chunks') as log:
+            total = int(log.readline())
+        return cls(path, total, create=False)
+
+    # Method to check that the staged file is still the one this upload writes to, i.e. that the upload
+    # has not been committed or begun again by another process.
+    def current(self):
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self.fd).st_ino
+        except FileNotFoundError:
+            return False
+
+    # Method to write data at position of the staged file.
+    def write_at(self, position, data):
+        if position + len(data) > self.total:
+            raise ValueError(f'Chunk data runs past the end of the file ({self.total} bytes)')
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, position)
+            view = view[written:]
+            position += written
+
+    # Method to record that a chunk of length bytes at offset has been written in full.
+    def mark_written(self, offset, length):
+        with self.lock:
+            self.chunks[offset] = max(length, self.chunks.get(offset, 0))
+        os.write(self.log_fd, f'{offset} {length}\n'.encode())
+
+    # Method to check whether every byte of the file has been written by some chunk, in any process.
+    def complete(self):
+        with open(self.log_path) as log:
+            records = log.read().split('\n')[1:]
+        with self.lock:
+            for record in records:
+                fields = record.split()
+                if len(fields) == 2:
+                    offset, length = int(fields[0]), int(fields[1])
+                    self.chunks[offset] = max(length, self.chunks.get(offset, 0))
+            covered = 0
+            for offset in sorted(self.chunks):
+                if offset > covered:
+                    return False
+                covered = max(covered, offset + self.chunks[offset])
+        return covered >= self.total
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self.log_fd)
+
+    def remove_log(self):
+        try:
+            os.remove(self.log_path)
+        except FileNotFoundError:
+            pass
+
+
+# The C library, for fallocate, which Python only exposes as posix_fallocate; None off Linux.
+FALLOC_FL_KEEP_SIZE = 1
+try:
+    LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True) if sys.platform.startswith('linux') else None
+    LIBC.fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+except (OSError, AttributeError):
+    LIBC = None
+
+
+# Reserves length bytes of disk from offset of a file without changing its size. posix_fallocate would
+# extend the file, and the size of a staged upload is how far a resumed upload continues from, so this
+# uses fallocate with FALLOC_FL_KEEP_SIZE. Returns False where that is not available; nothing is reserved then.
+def reserve(fd, offset, length):
+    if LIBC is None:
+        return False
+    return LIBC.fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, length) == 0
+
+
+# Reserves size bytes of disk for a file, so positional writes never fail halfway for lack of space
+# and the file is not fragmented. Falls back to extending the file where fallocate is unavailable.
+def preallocate(fd, size):
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as ex:
+            if ex.errno not in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS):
+                raise
+    os.ftruncate(fd, size)
@@ -0,0 +1,105 @@
+import hashlib
+import io
+import queue
+import threading
+
+# Transfers are verified with BLAKE2b, the same digest the server keeps as the checksum of every stored file,
+# so a verified upload also gives the server its checksum without reading the file back.
+DIGEST_SIZE = 32
+READ_SIZE = 1024 * 1024
+
+
+def new_digest():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+# Returns the hex digest of bytes held in memory.
+def digest_bytes(data):
+    digest = new_digest()
+    digest.update(data)
+    return digest.hexdigest()
+
+
+# Returns the hex digest of length bytes read from the current position of a file object, or of
+# everything up to its end when length is None. Files that are already in memory, cached or memory-mapped
+# ones with a view method, are hashed in place instead of copied out READ_SIZE bytes at a time.
+def digest_file(file, length=None):
+    digest = new_digest()
+    if hasattr(file, 'view'):
+        position = file.tell()
+        end = file.seek(0, io.SEEK_END)
+        data = file.view(position, end - position if length is None else length)
+        digest.update(data)
+        file.seek(position + len(data))
+        return digest.hexdigest()
+    remaining = length
+    while remaining is None or remaining > 0:
+        data = file.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+        if not data:
+            break
+        digest.update(data)
+        if remaining is not None:
+            remaining -= len(data)
+    return digest.hexdigest()
+
+
+# Returns the hex digest of a local file.
+def digest_path(path):
+    with open(path, 'rb') as file:
+        return digest_file(file)
+
+
+# Class that hashes the data given to update in a background thread. hashlib releases the GIL while it
+# hashes large buffers, so the digest is computed on another core while the caller keeps sending,
+# receiving and writing. At most max_pending chunks wait to be hashed; update blocks beyond that.
+# Use it as a context manager, or call close, so the thread ends when a transfer fails halfway.
+class Hasher:
+    def __init__(self, max_pending=64):
+        self.digest = new_digest()
+        self.pending = queue.Queue(max_pending)
+        self.result = None
+        self.thread = threading.Thread(target=self.run, name='hasher', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    # Method to queue bytes to be hashed. They must not be modified afterwards.
+    def update(self, data):
+        self.pending.put(data)
+
+    def run(self):
+        while True:
+            data = self.pending.get()
+            if data is None:
+                return
+            self.digest.update(data)
+
+    # Method to wait for everything queued to be hashed and return the hex digest.
+    def hexdigest(self):
+        if self.result is None:
+            self.close()
+            self.result = self.digest.hexdigest()
+        return self.result
+
+    def close(self):
+        if self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join()
+
+
+# File-like object that passes everything read through it to a Hasher.
+class HashingReader:
+    def __init__(self, file, hasher):
+        self.file = file
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        if data:
+            self.hasher.update(data)
+        return data
@@ -0,0 +1,342 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the latency histogram buckets, from half a millisecond to a minute.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Finer buckets for lock waits, which are microseconds when nothing contends for the lock.
+LOCK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+# Renders label names and values as Prometheus label text, e.g. {command="upload"}.
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+# Base class of a metric that has one value per combination of label values.
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    # Method to render the metric in the Prometheus text exposition format.
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{format_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+# Counter that only goes up, e.g. bytes sent. A function given as source is called for the value at
+# render time, for counts kept by another object.
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=(), source=None):
+        super().__init__(name, help_text, label_names)
+        self.source = source
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    # Method to get the total over every label combination.
+    def total(self):
+        if self.source:
+            return self.source()
+        with self.lock:
+            return sum(self.values.values())
+
+    def render(self):
+        if self.source:
+            with self.lock:
+                self.values[()] = self.source()
+        return super().render()
+
+
+# Gauge that holds a current value. A function given as source is called for the value at render time.
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, label_names=(), source=None):
+        super().__init__(name, help_text, label_names)
+        self.source = source
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def get(self, *labels):
+        if self.source:
+            return self.source()
+        with self.lock:
+            return self.values.get(labels, 0)
+
+    def render(self):
+        if self.source:
+            self.set(self.source())
+        return super().render()
+
+
+# Histogram of observed values in fixed buckets, with their count and sum.
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    # Method to record one value. Values are kept as a count per bucket, not one by one.
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    # Method to get a copy of the bucket counts of every label combination, for computing deltas.
+    def snapshot(self):
+        with self.lock:
+            return {labels: list(series[0]) for labels, series in self.values.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            items = sorted((labels, list(series[0]), series[1]) for labels, series in self.values.items())
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bound_label = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names, labels, bound_label)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+# Estimates a percentile from histogram bucket counts, interpolating inside the bucket it falls in.
+def bucket_percentile(buckets, counts, pct):
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = total * pct / 100
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(buckets + (buckets[-1],), counts):
+        if count and seen + count >= rank:
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return buckets[-1]
+
+
+# Class that holds every metric the file servers export, so both engines report the same names.
+# It can serve them over HTTP in the Prometheus text format and print a summary line periodically.
+class ServerMetrics:
+    def __init__(self):
+        self.requests = Histogram('fileserver_request_seconds', 'Time to serve a request, by command',
+                                  ('command',))
+        self.storage = Histogram('fileserver_storage_seconds', 'Time spent in storage operations (disk)',
+                                 ('operation',))
+        self.lock_wait = Histogram('fileserver_lock_wait_seconds', 'Time spent waiting for shared locks',
+                                   ('lock',), LOCK_BUCKETS)
+        self.bytes_in = Counter('fileserver_received_bytes_total', 'Body bytes received, by command', ('command',))
+        self.bytes_out = Counter('fileserver_sent_bytes_total', 'Body bytes sent, by command', ('command',))
+        self.errors = Counter('fileserver_errors_total',
+                              'Requests answered with an error status and connections dropped on errors',
+                              ('command', 'reason'))
+        self.connections = Gauge('fileserver_active_connections', 'Connections being served')
+        self.threads = Gauge('fileserver_threads', 'Live threads in the server process',
+                             source=threading.active_count)
+        self.metrics = [self.requests, self.storage, self.lock_wait, self.bytes_in, self.bytes_out,
+                        self.errors, self.connections, self.threads]
+        self.cache = None
+        self.http_server = None
+        self.reporter = None
+
+    # Method to render every metric as one Prometheus text document.
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    # Method to record one served request.
+    def observe_request(self, command, seconds, received, sent, status_name=None):
+        self.requests.observe(seconds, command)
+        if received:
+            self.bytes_in.inc(received, command)
+        if sent:
+            self.bytes_out.inc(sent, command)
+        if status_name:
+            self.errors.inc(1, command, status_name)
+
+    # Method to time a block of storage work: with metrics.timed('commit'): ...
+    def timed(self, operation):
+        return Timer(self.storage, operation)
+
+    # Method to wrap a lock so the time spent waiting for it is recorded under name.
+    def timed_lock(self, name, lock):
+        return TimedLock(lock, self.lock_wait, name)
+
+    # Method to export the lookups, evictions and size of a read_cache.ReadCache, and its hit rate
+    # in the summary line.
+    def watch_cache(self, cache):
+        self.cache = cache
+        self.metrics.extend([
+            Counter('fileserver_cache_hits_total', 'Reads of cacheable files served from memory',
+                    source=lambda: cache.hits),
+            Counter('fileserver_cache_misses_total', 'Reads of cacheable files that went to disk',
+                    source=lambda: cache.misses),
+            Counter('fileserver_cache_evictions_total', 'Files evicted from the read cache to stay in budget',
+                    source=lambda: cache.evictions),
+            Gauge('fileserver_cache_bytes', 'Bytes held in the read cache', source=lambda: cache.size),
+            Gauge('fileserver_cache_files', 'Files held in the read cache', source=lambda: len(cache)),
+        ])
+
+    # Method to export the number of fsync calls made by a durability.Committer.
+    def watch_committer(self, committer):
+        self.metrics.append(Counter('fileserver_fsyncs_total', 'fsync calls made to commit uploads durably',
+                                    source=lambda: committer.syncs))
+
+    # Method to export the time transfers spent waiting for the rate limits of a rate_limit.TrafficShaper.
+    def watch_shaper(self, shaper):
+        throttled = Counter('fileserver_throttled_seconds_total',
+                            'Seconds transfers waited for rate limits, by limit', ('limit',))
+        self.metrics.append(throttled)
+        shaper.on_wait = throttled.inc
+
+    # Method to serve /metrics on host:port from a background thread.
+    def serve(self, port, host='127.0.0.1'):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, name='metrics-http', daemon=True).start()
+        print(f'[*] Metrics on http://{host}:{self.http_server.server_address[1]}/metrics')
+
+    # Method to print a summary line every interval seconds from a background thread.
+    def report_every(self, interval):
+        self.reporter = threading.Thread(target=self.report_loop, args=(interval,), name='metrics-summary',
+                                         daemon=True)
+        self.reporter.start()
+
+    def report_loop(self, interval):
+        previous = self.snapshot()
+        while True:
+            time.sleep(interval)
+            current = self.snapshot()
+            print(self.summary(previous, current, interval))
+            previous = current
+
+    # Method to capture the values the summary line is computed from.
+    def snapshot(self):
+        return {'latency': self.requests.snapshot(), 'in': self.bytes_in.total(), 'out': self.bytes_out.total(),
+                'errors': self.errors.total(),
+                'cache': (self.cache.hits, self.cache.misses) if self.cache is not None else (0, 0)}
+
+    # Method to format what happened between two snapshots taken interval seconds apart.
+    def summary(self, previous, current, interval):
+        parts = []
+        requests = 0
+        for labels, counts in sorted(current['latency'].items()):
+            before = previous['latency'].get(labels, [0] * len(counts))
+            delta = [now - then for now, then in zip(counts, before)]
+            count = sum(delta)
+            if not count:
+                continue
+            requests += count
+            p50 = bucket_percentile(self.requests.buckets, delta, 50) * 1000
+            p99 = bucket_percentile(self.requests.buckets, delta, 99) * 1000
+            parts.append(f'{labels[0]} {count} p50={p50:.1f}ms p99={p99:.1f}ms')
+        megabytes = 1024 * 1024
+        hits = current['cache'][0] - previous['cache'][0]
+        lookups = hits + current['cache'][1] - previous['cache'][1]
+        cache = f', cache hits {hits / lookups * 100:.1f}% of {lookups}' if lookups else ''
+        return (f'[metrics] {requests / interval:.1f} req/s, '
+                f'in {(current["in"] - previous["in"]) / interval / megabytes:.2f} MB/s, '
+                f'out {(current["out"] - previous["out"]) / interval / megabytes:.2f} MB/s, '
+                f'connections {self.connections.get()}, threads {self.threads.get()}, '
+                f'errors {current["errors"] - previous["errors"]}{cache}'
+                + (' | ' + '; '.join(parts) if parts else ''))
+
+    def close(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+
+
+# Context manager that records how long its block took in a histogram.
+class Timer:
+    def __init__(self, histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+# Lock wrapper that records in a histogram how long each acquire waited. Usable wherever the lock was.
+class TimedLock:
+    def __init__(self, lock, histogram, name):
+        self.lock = lock
+        self.histogram = histogram
+        self.name = name
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        self.histogram.observe(time.perf_counter() - start, self.name)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
@@ -0,0 +1,144 @@
+import os
+import queue
+import threading
+from file_storage import preallocate
+from transfer_client import TransferClient
+
+# Size of the pieces a file is split into. Each piece is one request on one of the connections.
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+# Raised inside a stream when the server refuses one of the chunks.
+class TransferError(Exception):
+    pass
+
+
+# File-like object that writes what it receives at consecutive positions of a file descriptor.
+# Several of these can fill different ranges of the same file at once.
+class PositionalWriter:
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.position = offset
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.position)
+            view = view[written:]
+            self.position += written
+        return len(data)
+
+
+# Class that moves one large file over a pool of connections, a fixed-size chunk per request,
+# to fill links where a single TCP stream is limited by its window and the round trip time.
+class ParallelTransfer:
+    def __init__(self, host='localhost', port=3300, streams=4, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.host = host
+        self.port = port
+        self.streams = streams
+        self.chunk_size = chunk_size
+
+    # Method to call worker(client, offset, length) for every chunk of a file of total bytes.
+    # Each stream owns one connection and takes the next chunk as soon as its previous one is done.
+    def run_chunks(self, total, worker):
+        offsets = queue.Queue()
+        for offset in range(0, total, self.chunk_size):
+            offsets.put(offset)
+        errors = []
+
+        def stream():
+            try:
+                client = TransferClient(self.host, self.port).connect()
+            except OSError as ex:
+                errors.append(ex)
+                return
+            try:
+                while not errors:
+                    try:
+                        offset = offsets.get_nowait()
+                    except queue.Empty:
+                        return
+                    worker(client, offset, min(self.chunk_size, total - offset))
+            except Exception as ex:
+                errors.append(ex)
+            finally:
+                client.close()
+
+        threads = [threading.Thread(target=stream) for _ in range(min(self.streams, offsets.qsize()))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    # Method to build a callback that reports the running total of bytes moved by all streams.
+    def progress_counter(self, progress):
+        lock = threading.Lock()
+        done = [0]
+
+        def add(length):
+            with lock:
+                done[0] += length
+                if progress:
+                    progress(done[0])
+        return add
+
+    # Method to upload a local file in parallel chunks. Returns (success, message).
+    def upload(self, file_name, local_path, overwrite=False, progress=None):
+        total = os.path.getsize(local_path)
+        add_progress = self.progress_counter(progress)
+        control = TransferClient(self.host, self.port).connect()
+        try:
+            success, message = control.begin_upload(file_name, total, overwrite)
+            if not success:
+                return False, message
+
+            def send_chunk(client, offset, length):
+                with open(local_path, 'rb') as file:
+                    file.seek(offset)
+                    success, message = client.upload_chunk(file_name, file, offset, length)
+                if not success:
+                    raise TransferError(message)
+                add_progress(length)
+
+            try:
+                self.run_chunks(total, send_chunk)
+            except TransferError as ex:
+                return False, str(ex)
+            return control.commit_upload(file_name)
+        finally:
+            control.close()
+
+    # Method to download a file in parallel byte ranges into a preallocated local file.
+    # Returns (success, file size) or (False, error message).
+    def download(self, file_name, local_path, progress=None):
+        add_progress = self.progress_counter(progress)
+        control = TransferClient(self.host, self.port).connect()
+        try:
+            total = control.file_size(file_name)
+        finally:
+            control.close()
+        if total is None:
+            return False, "File not found"
+
+        fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            preallocate(fd, total)
+
+            def fetch_chunk(client, offset, length):
+                success, result = client.download(file_name, PositionalWriter(fd, offset),
+                                                  offset=offset, length=length)
+                if not success:
+                    raise TransferError(result)
+                if result != length:
+                    raise TransferError(f"Chunk at {offset} returned {result} of {length} bytes")
+                add_progress(length)
+
+            try:
+                self.run_chunks(total, fetch_chunk)
+            except TransferError as ex:
+                return False, str(ex)
+        finally:
+            os.close(fd)
+        return True, total
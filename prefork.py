@@ -0,0 +1,128 @@
+import os
+import signal
+import socket
+import time
+import traceback
+
+# Seconds a worker has to stay up for its exit to count as a crash of a running worker rather than a failure
+# to start; workers that keep failing to start are restarted after a doubling delay, up to MAX_RESTART_DELAY.
+MIN_UPTIME = 5.0
+MAX_RESTART_DELAY = 30.0
+# Seconds workers get to finish after SIGTERM before they are killed.
+STOP_TIMEOUT = 10.0
+
+
+# Returns whether the kernel can balance connections between sockets bound to the same port.
+def reuse_port_available():
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+# Opens a listening socket for the workers to inherit and accept on.
+def listen_socket(host, port, backlog):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+# Class that runs a server in several worker processes, so CPU-bound work such as hashing, decompressing
+# and JSON encoding is spread over the cores instead of sharing one interpreter lock. With reuse_port every
+# worker binds its own socket to the port with SO_REUSEPORT and the kernel spreads new connections between
+# them; otherwise the supervisor binds the port once and the workers accept on the socket they inherit.
+# make_server(number, socket) builds the server of worker number (from 0) in the worker process, with the
+# inherited socket or None. The supervisor restarts any worker that exits, and SIGTERM or Ctrl-C stops all.
+class Supervisor:
+    def __init__(self, make_server, workers, host, port, backlog=128, reuse_port=True):
+        self.make_server = make_server
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.reuse_port = reuse_port and reuse_port_available()
+        self.socket = None
+        # Worker number of each running worker process, by pid.
+        self.pids = {}
+        self.started = {}
+        self.failures = {}
+
+    # Method to start the workers and supervise them until the supervisor is stopped.
+    def start(self):
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            if not self.reuse_port:
+                self.socket = listen_socket(self.host, self.port, self.backlog)
+            print(f'Starting {self.workers} workers on {self.host}:{self.port} '
+                  f'({"SO_REUSEPORT" if self.reuse_port else "inherited socket"})')
+            for number in range(self.workers):
+                self.spawn(number)
+            while True:
+                pid, status = os.wait()
+                number = self.pids.pop(pid, None)
+                if number is not None:
+                    self.restart(number, pid, status)
+        except KeyboardInterrupt:
+            print("\nShutting down...")
+        except Exception as ex:
+            print(f"Error Occurred while Starting: {str(ex)}")
+        finally:
+            self.stop()
+
+    # Method to fork the process of one worker. The child never returns from here.
+    def spawn(self, number):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.default_int_handler)
+                self.make_server(number, self.socket).start()
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids[pid] = number
+        self.started[number] = time.monotonic()
+        print(f'[*] Worker {number} started with pid {pid}')
+
+    # Method to start a worker again after it exited. A worker that failed soon after it started is
+    # restarted after a delay that doubles each time, so a worker that cannot start does not spin.
+    def restart(self, number, pid, status):
+        uptime = time.monotonic() - self.started[number]
+        self.failures[number] = self.failures.get(number, 0) + 1 if uptime < MIN_UPTIME else 0
+        delay = min(MAX_RESTART_DELAY, 0.5 * 2 ** (self.failures[number] - 1)) if self.failures[number] else 0
+        if os.WIFSIGNALED(status):
+            reason = f'signal {os.WTERMSIG(status)}'
+        else:
+            reason = f'exit status {os.WEXITSTATUS(status)}'
+        print(f'[*] Worker {number} (pid {pid}) stopped with {reason} after {uptime:.1f}s; '
+              f'restarting in {delay:.1f}s')
+        time.sleep(delay)
+        self.spawn(number)
+
+    # Method to stop every worker: SIGTERM first, then SIGKILL for those still running after STOP_TIMEOUT.
+    def stop(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while self.pids and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.pids.pop(pid, None)
+            else:
+                time.sleep(0.05)
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.pids = {}
+        if self.socket:
+            self.socket.close()
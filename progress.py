@@ -0,0 +1,134 @@
+import logging
+import re
+import threading
+import time
+import uuid
+
+log = logging.getLogger('progress')
+
+# An update is sent at most every MIN_INTERVAL seconds, and only once the transfer has moved on by STEP
+# percent since the last one, or MAX_INTERVAL seconds have passed, so a slow transfer still gets a fresh
+# rate and ETA. A 1 GB upload is reported in about 100 updates instead of one per chunk.
+MIN_INTERVAL = 0.1
+MAX_INTERVAL = 1.0
+STEP = 1.0
+# Weight of the latest interval in the reported rate, which is smoothed so it does not jump with every update.
+RATE_SMOOTHING = 0.3
+# Transfer ids chosen by the browser must look like this; anything else gets a generated id.
+TRANSFER_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+# Class that turns the progress callbacks transfers make for every chunk into a few update events.
+# emit(event, data) is called with '<kind>_progress' (e.g. 'upload_progress') and a dict describing the
+# transfer, tagged with its id so the page can tell concurrent uploads and downloads apart.
+class ProgressReporter:
+    def __init__(self, emit, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, step=STEP):
+        self.emit = emit
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.step = step
+        # Transfers still running, by id.
+        self.transfers = {}
+        self.lock = threading.Lock()
+
+    # Method to start reporting a transfer of total bytes, or of an unknown size when total is None.
+    # transfer_id is used when it is a valid id, such as one the browser made up for its own upload.
+    def start(self, kind, name, total=None, transfer_id=None):
+        if not transfer_id or not TRANSFER_ID.match(transfer_id):
+            transfer_id = uuid.uuid4().hex[:12]
+        transfer = Transfer(self, transfer_id, kind, name, total)
+        with self.lock:
+            self.transfers[transfer_id] = transfer
+        transfer.publish('running')
+        return transfer
+
+    # Method to get the latest state of every running transfer, e.g. for a page that was just opened.
+    def active(self):
+        with self.lock:
+            transfers = list(self.transfers.values())
+        return [transfer.snapshot('running') for transfer in transfers]
+
+    def remove(self, transfer):
+        with self.lock:
+            self.transfers.pop(transfer.id, None)
+
+
+# Class for one transfer being reported. update is meant to be called as often as the transfer likes:
+# it only reads the clock and compares, unless an update is due.
+class Transfer:
+    def __init__(self, reporter, transfer_id, kind, name, total):
+        self.reporter = reporter
+        self.id = transfer_id
+        self.kind = kind
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.rate = 0.0
+        self.finished = False
+        self.started = self.last_time = time.monotonic()
+        self.last_done = 0
+        # Bytes the transfer has to reach, and times, before the next update is sent.
+        self.step_bytes = total * reporter.step / 100 if total else 0
+        self.next_done = self.step_bytes
+        self.next_time = self.started + reporter.min_interval
+        self.deadline = self.started + reporter.max_interval
+
+    # Method to record that done bytes of the transfer have been moved, sending an update when one is due.
+    def update(self, done):
+        self.done = done
+        now = time.monotonic()
+        if now < self.next_time or (done < self.next_done and now < self.deadline):
+            return
+        self.publish('running', now)
+
+    # Method to send the final update of the transfer: 'done', or 'failed' with a message.
+    def finish(self, success=True, message=None):
+        if self.finished:
+            return
+        self.finished = True
+        self.reporter.remove(self)
+        elapsed = time.monotonic() - self.started
+        # The final rate is the average over the whole transfer.
+        self.rate = self.done / elapsed if elapsed else 0.0
+        self.publish('done' if success else 'failed', message=message)
+
+    # Method to work out the rate since the last update and emit the state of the transfer.
+    def publish(self, state, now=None, message=None):
+        now = now or time.monotonic()
+        if state == 'running' and now > self.last_time:
+            current = (self.done - self.last_done) / (now - self.last_time)
+            self.rate = current if not self.rate else RATE_SMOOTHING * current + (1 - RATE_SMOOTHING) * self.rate
+        self.last_time, self.last_done = now, self.done
+        self.next_done = self.done + self.step_bytes
+        self.next_time = now + self.reporter.min_interval
+        self.deadline = now + self.reporter.max_interval
+
+        data = self.snapshot(state)
+        if message:
+            data['message'] = message
+        self.reporter.emit(f'{self.kind}_progress', data)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"{self.kind} {self.id} {self.name}: {data['progress']}% at {self.rate / 1048576:.1f} MB/s, "
+                      f"ETA {data['eta']}s ({state})")
+
+    # Method to describe the transfer as sent in its updates. progress (percent) and eta (seconds) are None
+    # while they cannot be known; 'filename' repeats the name for pages written for older clients.
+    def snapshot(self, state):
+        if self.total:
+            progress = round(min(self.done / self.total, 1.0) * 100, 2)
+        else:
+            progress = 100.0 if state == 'done' else None
+        eta = None
+        if state == 'running' and self.total and self.rate:
+            eta = round(max(self.total - self.done, 0) / self.rate, 1)
+        return {'id': self.id, 'kind': self.kind, 'name': self.name, 'filename': self.name, 'state': state,
+                'done': self.done, 'total': self.total, 'progress': progress, 'rate': round(self.rate),
+                'eta': eta, 'elapsed': round(time.monotonic() - self.started, 1)}
+
+    def __enter__(self):
+        return self
+
+    # A transfer left by an exception is reported as failed; one that returned normally and was not
+    # finished explicitly as done.
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish(exc_type is None, str(exc_value) if exc_value else None)
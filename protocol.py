@@ -0,0 +1,541 @@
+import asyncio
+import json
+import struct
+import zlib
+
+
+# Every frame starts with these bytes followed by the protocol version spoken by the sender.
+MAGIC = b'CF'
+PROTOCOL_VERSION = 1
+
+# Fixed size frame header: magic, version, command, status, flags, request id,
+# name length, meta length, body size and CRC32 checksum of the body.
+HEADER = struct.Struct('!2sBBBHIHIQI')
+
+# Size of the chunks used when streaming file bodies and of the socket read buffer.
+CHUNK_SIZE = 64 * 1024
+BUFFER_SIZE = 256 * 1024
+
+# Upper bounds for the parts of a frame that are held in memory.
+MAX_META_SIZE = 1024 * 1024
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+
+# Commands understood by the server.
+CMD_DIR = 1
+CMD_UPLOAD = 2
+CMD_DOWNLOAD = 3
+CMD_DELETE = 4
+CMD_UPLOAD_STATUS = 5
+CMD_UPLOAD_BEGIN = 6
+CMD_UPLOAD_CHUNK = 7
+CMD_UPLOAD_COMMIT = 8
+CMD_CHUNK_QUERY = 9
+CMD_CHUNK_PUT = 10
+CMD_MANIFEST_PUT = 11
+CMD_PING = 12
+CMD_DELETE_MANY = 13
+CMD_STAT_MANY = 14
+CMD_UPLOAD_MANY = 15
+CMD_DOWNLOAD_MANY = 16
+CMD_RING = 17
+CMD_SIGNATURES = 18
+
+COMMAND_NAMES = {
+    CMD_DIR: 'dir',
+    CMD_UPLOAD: 'upload',
+    CMD_DOWNLOAD: 'download',
+    CMD_DELETE: 'delete',
+    CMD_UPLOAD_STATUS: 'upload_status',
+    CMD_UPLOAD_BEGIN: 'upload_begin',
+    CMD_UPLOAD_CHUNK: 'upload_chunk',
+    CMD_UPLOAD_COMMIT: 'upload_commit',
+    CMD_CHUNK_QUERY: 'chunk_query',
+    CMD_CHUNK_PUT: 'chunk_put',
+    CMD_MANIFEST_PUT: 'manifest_put',
+    CMD_PING: 'ping',
+    CMD_DELETE_MANY: 'delete_many',
+    CMD_STAT_MANY: 'stat_many',
+    CMD_UPLOAD_MANY: 'upload_many',
+    CMD_DOWNLOAD_MANY: 'download_many',
+    CMD_RING: 'ring',
+    CMD_SIGNATURES: 'signatures',
+}
+
+# Status codes carried by responses. Requests are always sent with STATUS_OK.
+STATUS_OK = 0
+STATUS_CONTINUE = 1
+STATUS_ERROR = 2
+STATUS_NOT_FOUND = 3
+STATUS_EXISTS = 4
+STATUS_INVALID = 5
+STATUS_MOVED = 6   # the name belongs to another node of the cluster
+
+STATUS_NAMES = {
+    STATUS_OK: 'ok',
+    STATUS_CONTINUE: 'continue',
+    STATUS_ERROR: 'error',
+    STATUS_NOT_FOUND: 'not_found',
+    STATUS_EXISTS: 'exists',
+    STATUS_INVALID: 'invalid',
+    STATUS_MOVED: 'moved',
+}
+
+# Flag bits.
+FLAG_CHECKSUM = 0x0001          # checksum field holds the CRC32 of the body
+FLAG_OVERWRITE = 0x0002         # upload may replace an existing file
+FLAG_EXPECT_CONTINUE = 0x0004   # upload body is only sent after a STATUS_CONTINUE reply
+FLAG_MORE = 0x0008              # more response frames for the same request follow this one
+
+
+# Raised when the byte stream does not contain a valid frame or ends early.
+class ProtocolError(Exception):
+    pass
+
+
+# Raised when the digest of a transfer does not match the one its sender computed.
+class IntegrityError(ProtocolError):
+    pass
+
+
+# A single message of the protocol. The body (size bytes) follows the header on the wire.
+class Frame:
+    def __init__(self, command, status=STATUS_OK, flags=0, request_id=0, name='',
+                 meta=None, size=0, checksum=0, version=PROTOCOL_VERSION):
+        self.command = command
+        self.status = status
+        self.flags = flags
+        self.request_id = request_id
+        self.name = name
+        self.meta = meta if meta is not None else {}
+        self.size = size
+        self.checksum = checksum
+        self.version = version
+        # Status of the last reply built for this frame, so servers can tell how a request ended.
+        self.reply_status = None
+        # rate_limit.Pacer of the request's body bytes, set by servers that shape traffic.
+        self.pacer = None
+
+    def __repr__(self):
+        return (f'Frame({command_name(self.command)}, status={self.status}, flags={self.flags:#x}, '
+                f'request_id={self.request_id}, name={self.name!r}, size={self.size})')
+
+    # Method to build the response to this frame.
+    def reply(self, status=STATUS_OK, flags=0, meta=None, size=0, checksum=0):
+        self.reply_status = status
+        return Frame(self.command, status, flags, self.request_id, self.name, meta, size, checksum)
+
+
+def command_name(command):
+    return COMMAND_NAMES.get(command, f'unknown({command})')
+
+
+def status_name(status):
+    return STATUS_NAMES.get(status, f'unknown({status})')
+
+
+# Encodes a frame and an optional in-memory body. A non-empty body is checksummed.
+def encode_frame(frame, payload=b''):
+    name = frame.name.encode()
+    meta = json.dumps(frame.meta, separators=(',', ':')).encode() if frame.meta else b''
+    flags = frame.flags
+    size = frame.size
+    checksum = frame.checksum
+    if payload:
+        flags |= FLAG_CHECKSUM
+        size = len(payload)
+        checksum = zlib.crc32(payload)
+
+    header = HEADER.pack(MAGIC, frame.version, frame.command, frame.status, flags,
+                         frame.request_id, len(name), len(meta), size, checksum)
+    return b''.join((header, name, meta, payload))
+
+
+# Decodes a fixed size header. Returns the frame and the lengths of the name and meta that follow it.
+def decode_header(header):
+    (magic, version, command, status, flags, request_id,
+     name_length, meta_length, size, checksum) = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError('Invalid frame magic')
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f'Unsupported protocol version {version}')
+    if meta_length > MAX_META_SIZE:
+        raise ProtocolError(f'Frame meta too large: {meta_length} bytes')
+
+    frame = Frame(command, status, flags, request_id, size=size, checksum=checksum, version=version)
+    return frame, name_length, meta_length
+
+
+# Fills in the name and meta of a frame from the bytes that follow its header.
+def decode_extra(frame, extra, name_length):
+    try:
+        frame.name = extra[:name_length].decode()
+        if len(extra) > name_length:
+            frame.meta = json.loads(extra[name_length:])
+    except (UnicodeDecodeError, ValueError) as ex:
+        raise ProtocolError(f'Malformed frame: {str(ex)}')
+
+
+# Resolves the byte range asked for by a download request against the file size. The meta holds
+# offset and length, or suffix for the last suffix bytes of the file (an HTTP "bytes=-n" range).
+# Returns (offset, length), or None when the range starts past the end of the file.
+def requested_range(frame, file_size):
+    if frame.meta.get('suffix') is not None:
+        suffix = int(frame.meta['suffix'])
+        if suffix < 0:
+            return None
+        offset = max(0, file_size - suffix)
+        return offset, file_size - offset
+    offset = int(frame.meta.get('offset', 0))
+    length = frame.meta.get('length')
+    if offset < 0 or offset > file_size or (length is not None and int(length) < 0):
+        return None
+    remaining = file_size - offset
+    return offset, remaining if length is None else min(int(length), remaining)
+
+
+# Returns the number of raw body bytes a frame stands for. A frame whose meta names an 'encoding' is
+# followed by an encoded body, a series of frames of compressed blocks, and its meta 'size' holds the
+# raw size; any other frame carries its body itself.
+def body_size(frame):
+    if frame.meta.get('encoding'):
+        return int(frame.meta.get('size', 0))
+    return frame.size
+
+
+# Builds the frame that carries the next compressed block of the encoded body following frame.
+def data_frame(frame, more):
+    return Frame(frame.command, frame.status, FLAG_MORE if more else 0, frame.request_id)
+
+
+# Checks that the next frame of the encoded body following frame belongs to it.
+def check_data_frame(frame, data):
+    if data is None:
+        raise ProtocolError('Connection closed in the middle of an encoded body')
+    if data.request_id != frame.request_id or data.command != frame.command:
+        raise ProtocolError(f'Frame {data!r} does not continue the encoded body of {frame!r}')
+
+
+# Builds the frame that carries one file of a batch upload or download (upload_many, download_many):
+# its name, its size and, in a download, whether it was found. The file's bytes follow as its body, then a
+# digest trailer when its meta has 'verify'. FLAG_MORE is set on every member of the batch but the last.
+def member_frame(frame, name, size, more, status=STATUS_OK, meta=None):
+    return Frame(frame.command, status, FLAG_MORE if more else 0, frame.request_id, name, meta, size)
+
+
+# Checks that a member frame belongs to the batch request or reply frame.
+def check_member_frame(frame, member):
+    if member is None:
+        raise ProtocolError('Connection closed in the middle of a batch')
+    if member.request_id != frame.request_id or member.command != frame.command:
+        raise ProtocolError(f'Frame {member!r} is not part of the batch {frame!r}')
+
+
+# Builds the trailer frame sent after the body of a request or reply whose meta has 'verify' set.
+# It carries the BLAKE2b hex digest of the raw (decompressed) body in its meta 'digest'.
+def trailer_frame(frame, digest):
+    return Frame(frame.command, frame.status, 0, frame.request_id, meta={'digest': digest})
+
+
+# Checks that a trailer frame belongs to frame and returns the digest it carries.
+def trailer_digest(frame, trailer):
+    if trailer is None:
+        raise ProtocolError('Connection closed before the digest trailer')
+    if trailer.request_id != frame.request_id or trailer.command != frame.command or trailer.size:
+        raise ProtocolError(f'Frame {trailer!r} is not the digest trailer of {frame!r}')
+    return trailer.meta.get('digest')
+
+
+# Checks the raw size decoded from an encoded body against the size declared for it.
+def check_decoded_size(received, size, finished):
+    if received > size or (finished and received < size):
+        raise ProtocolError(f'Encoded body decoded to {received} bytes, not {size}')
+
+
+# Checks an in-memory body against the checksum carried by its frame.
+def verify_payload(frame, payload):
+    if frame.flags & FLAG_CHECKSUM and zlib.crc32(payload) != frame.checksum:
+        raise ProtocolError('Checksum mismatch')
+    return payload
+
+
+# Wraps a connected socket and reads/writes whole frames on it.
+class FrameConnection:
+    def __init__(self, sock, buffer_size=BUFFER_SIZE):
+        self.sock = sock
+        self.reader = sock.makefile('rb', buffering=buffer_size)
+        # Body bytes sent so far, headers not included.
+        self.body_bytes_sent = 0
+        # rate_limit.Pacer that body bytes of the current request go through, when the server shapes traffic.
+        self.pacer = None
+
+    # Method to wait until amount more body bytes may be moved under the current rate limits.
+    def pace(self, amount):
+        if self.pacer:
+            self.pacer.pace(amount)
+
+    # Method to send a frame, with its body when the body is held in memory.
+    def send_frame(self, frame, payload=b''):
+        self.sock.sendall(encode_frame(frame, payload))
+        self.body_bytes_sent += len(payload)
+
+    # Method to send several frames with a single write, used to pipeline requests.
+    def send_frames(self, frames):
+        self.sock.sendall(b''.join(encode_frame(frame, payload) for frame, payload in frames))
+        self.body_bytes_sent += sum(len(payload) for _, payload in frames)
+
+    # Method to answer a request with a status and an optional text message.
+    def send_response(self, request, status=STATUS_OK, message='', meta=None):
+        self.send_frame(request.reply(status, meta=meta), message.encode())
+
+    # Method to read the next frame header (with name and meta). Returns None on a clean close.
+    def recv_frame(self):
+        header = self.reader.read(HEADER.size)
+        if not header:
+            return None
+        if len(header) < HEADER.size:
+            raise ProtocolError('Connection closed in the middle of a frame header')
+
+        frame, name_length, meta_length = decode_header(header)
+        if name_length or meta_length:
+            decode_extra(frame, self.read_exact(name_length + meta_length), name_length)
+        return frame
+
+    # Method to read exactly size bytes from the connection.
+    def read_exact(self, size):
+        data = self.reader.read(size)
+        if len(data) < size:
+            raise ProtocolError(f'Connection closed after {len(data)} of {size} bytes')
+        return data
+
+    # Method to read the in-memory body of a frame and verify its checksum.
+    def read_payload(self, frame):
+        if not frame.size:
+            return b''
+        if frame.size > MAX_PAYLOAD_SIZE:
+            raise ProtocolError(f'Frame body too large to buffer: {frame.size} bytes')
+        return verify_payload(frame, self.read_exact(frame.size))
+
+    # Method to read the body of a frame as text.
+    def read_text(self, frame):
+        return self.read_payload(frame).decode()
+
+    # Method to stream a body of the given size in chunks.
+    def iter_body(self, size, chunk_size=CHUNK_SIZE):
+        remaining = size
+        while remaining:
+            chunk = self.reader.read(min(chunk_size, remaining))
+            if not chunk:
+                raise ProtocolError(f'Connection closed with {remaining} body bytes outstanding')
+            remaining -= len(chunk)
+            self.pace(len(chunk))
+            yield chunk
+
+    # Method to discard a body that will not be used, keeping the stream aligned on frames.
+    def skip_body(self, size):
+        for _ in self.iter_body(size):
+            pass
+
+    # Method to read the encoded body that follows frame, frame by frame up to the one without FLAG_MORE,
+    # and yield its blocks decompressed by decompressor. count, when given, is called with the size of
+    # each compressed block as it is read. No block may decode past the size declared in the frame's meta, so
+    # a decompression bomb raises ProtocolError before its output is allocated.
+    def iter_encoded(self, frame, decompressor, count=None):
+        size = body_size(frame)
+        received = 0
+        while True:
+            data = self.recv_frame()
+            check_data_frame(frame, data)
+            block = self.read_payload(data)
+            self.pace(len(block))
+            if count:
+                count(len(block))
+            chunk = decompressor.decompress(block, size - received)
+            received += len(chunk)
+            finished = not data.flags & FLAG_MORE
+            check_decoded_size(received, size, finished)
+            if chunk:
+                yield chunk
+            if finished:
+                return
+
+    # Method to read the digest trailer that follows the body of frame.
+    def read_trailer(self, frame):
+        return trailer_digest(frame, self.recv_frame())
+
+    # Method to discard the body of a request or response, whether it is encoded or not,
+    # along with its digest trailer.
+    def skip_request_body(self, frame):
+        if not frame.meta.get('encoding'):
+            self.skip_body(frame.size)
+        else:
+            while True:
+                data = self.recv_frame()
+                check_data_frame(frame, data)
+                self.skip_body(data.size)
+                if not data.flags & FLAG_MORE:
+                    break
+        if frame.meta.get('verify'):
+            self.read_trailer(frame)
+
+    # Method to send the encoded body that follows frame: every chunk is compressed by compressor
+    # and sent as a frame of its own, the last of them without FLAG_MORE. Returns the raw bytes sent;
+    # progress, when given, is called with that count after each chunk.
+    def send_encoded(self, frame, compressor, chunks, progress=None):
+        sent = 0
+        for chunk in chunks:
+            block = compressor.compress(chunk)
+            if block:
+                self.pace(len(block))
+                self.send_frame(data_frame(frame, True), block)
+            sent += len(chunk)
+            if progress:
+                progress(sent)
+        self.send_frame(data_frame(frame, False), compressor.finish())
+        return sent
+
+    # Method to stream size bytes of a file object as a frame body.
+    def send_body(self, file, size, chunk_size=CHUNK_SIZE, progress=None):
+        sent = 0
+        while sent < size:
+            chunk = file.read(min(chunk_size, size - sent))
+            if not chunk:
+                raise ProtocolError(f'Source ended after {sent} of {size} bytes')
+            self.pace(len(chunk))
+            self.sock.sendall(chunk)
+            sent += len(chunk)
+            self.body_bytes_sent += len(chunk)
+            if progress:
+                progress(sent)
+        return sent
+
+    # Method to send count bytes of a regular file starting at offset as a frame body.
+    # With use_sendfile the kernel copies the bytes straight from the page cache to the socket
+    # (socket.sendfile falls back to plain sends when sendfile is unavailable for this file);
+    # otherwise the range is read and sent in chunks with sendall, which never drops short writes.
+    # Files held in memory (read_cache.MemoryReader) are sent straight from their buffer.
+    # Under rate limits the range is sent a pacer quantum at a time.
+    def send_file_range(self, file, offset, count, use_sendfile=True):
+        if not count:
+            return 0
+        if self.pacer and count > self.pacer.quantum:
+            sent = 0
+            while sent < count:
+                sent += self.send_file_range(file, offset + sent, min(self.pacer.quantum, count - sent),
+                                             use_sendfile)
+            return sent
+        self.pace(count)
+        if hasattr(file, 'view'):
+            data = file.view(offset, count)
+            self.sock.sendall(data)
+            sent = len(data)
+            self.body_bytes_sent += sent
+        elif use_sendfile:
+            sent = self.sock.sendfile(file, offset, count)
+            self.body_bytes_sent += sent
+        else:
+            file.seek(offset)
+            sent = self.send_body(file, count)
+        if sent != count:
+            raise ProtocolError(f'File ended after {sent} of {count} bytes')
+        return sent
+
+    def close(self):
+        try:
+            self.reader.close()
+        finally:
+            self.sock.close()
+
+
+# Reads the next frame header (with name and meta) from an asyncio StreamReader. Returns None on a clean close.
+async def read_frame_async(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as ex:
+        if not ex.partial:
+            return None
+        raise ProtocolError('Connection closed in the middle of a frame header')
+
+    frame, name_length, meta_length = decode_header(header)
+    if name_length or meta_length:
+        decode_extra(frame, await read_exact_async(reader, name_length + meta_length), name_length)
+    return frame
+
+
+# Reads exactly size bytes from an asyncio StreamReader.
+async def read_exact_async(reader, size):
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError as ex:
+        raise ProtocolError(f'Connection closed after {len(ex.partial)} of {size} bytes')
+
+
+# Reads the in-memory body of a frame from an asyncio StreamReader and verifies its checksum.
+async def read_payload_async(reader, frame):
+    if not frame.size:
+        return b''
+    if frame.size > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f'Frame body too large to buffer: {frame.size} bytes')
+    return verify_payload(frame, await read_exact_async(reader, frame.size))
+
+
+# Streams a body of the given size from an asyncio StreamReader in chunks, through pacer when it is given.
+async def iter_body_async(reader, size, chunk_size=CHUNK_SIZE, pacer=None):
+    remaining = size
+    while remaining:
+        chunk = await reader.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ProtocolError(f'Connection closed with {remaining} body bytes outstanding')
+        remaining -= len(chunk)
+        if pacer:
+            await pacer.pace_async(len(chunk))
+        yield chunk
+
+
+# Reads the encoded body that follows frame from an asyncio StreamReader, like FrameConnection.iter_encoded.
+# A decompressor marked blocking, one that reads files, is run in a worker thread.
+async def iter_encoded_async(reader, frame, decompressor, count=None):
+    size = body_size(frame)
+    received = 0
+    while True:
+        data = await read_frame_async(reader)
+        check_data_frame(frame, data)
+        block = await read_payload_async(reader, data)
+        if frame.pacer:
+            await frame.pacer.pace_async(len(block))
+        if count:
+            count(len(block))
+        if getattr(decompressor, 'blocking', False):
+            chunk = await asyncio.get_running_loop().run_in_executor(None, decompressor.decompress, block,
+                                                                     size - received)
+        else:
+            chunk = decompressor.decompress(block, size - received)
+        received += len(chunk)
+        finished = not data.flags & FLAG_MORE
+        check_decoded_size(received, size, finished)
+        if chunk:
+            yield chunk
+        if finished:
+            return
+
+
+# Reads the digest trailer that follows the body of frame from an asyncio StreamReader.
+async def read_trailer_async(reader, frame):
+    return trailer_digest(frame, await read_frame_async(reader))
+
+
+# Discards the body of a request read from an asyncio StreamReader, whether it is encoded or not,
+# along with its digest trailer.
+async def skip_request_body_async(reader, frame):
+    if not frame.meta.get('encoding'):
+        async for _ in iter_body_async(reader, frame.size, pacer=frame.pacer):
+            pass
+    else:
+        while True:
+            data = await read_frame_async(reader)
+            check_data_frame(frame, data)
+            async for _ in iter_body_async(reader, data.size):
+                pass
+            if not data.flags & FLAG_MORE:
+                break
+    if frame.meta.get('verify'):
+        await read_trailer_async(reader, frame)
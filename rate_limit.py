@@ -0,0 +1,261 @@
+import asyncio
+import itertools
+import threading
+import time
+
+# Commands whose bytes count against an operation's rate limit under a shared name, so a limit on
+# 'upload' or 'download' covers every way of moving files in that direction.
+OPERATION_GROUPS = {
+    'upload': 'upload', 'upload_chunk': 'upload', 'upload_many': 'upload', 'chunk_put': 'upload',
+    'download': 'download', 'download_many': 'download',
+}
+
+# Bytes paced at a time; bulk transfers queue for the link again after every quantum.
+QUANTUM = 64 * 1024
+# Bytes a transfer may move at interactive priority before it counts as a bulk stream.
+SMALL_TRANSFER = 1024 * 1024
+# Per-client buckets kept before the idle ones are forgotten.
+MAX_CLIENTS = 4096
+
+
+# Returns the operation a command's bytes are limited under.
+def operation_group(command_name):
+    return OPERATION_GROUPS.get(command_name, command_name)
+
+
+# Class that lets through rate bytes per second on average and bursts of up to burst bytes.
+# An amount larger than the burst is let through once the bucket is full and leaves it in debt,
+# so the average rate still holds for transfers paced in large pieces.
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = max(burst or self.rate / 10, QUANTUM)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Method to take amount tokens if they are there. Returns 0 when they were taken,
+    # otherwise the seconds until they will be.
+    def try_take(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            needed = min(amount, self.burst)
+            if self.tokens >= needed:
+                self.tokens -= amount
+                return 0
+            return (needed - self.tokens) / self.rate
+
+    # Method to check whether the bucket is full, i.e. nobody has used it lately.
+    def idle(self):
+        with self.lock:
+            return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+    # Method to wait until amount tokens could be taken. Returns the seconds waited.
+    def take(self, amount):
+        waited = 0.0
+        while True:
+            delay = self.try_take(amount)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    # Coroutine version of take, for the asyncio server.
+    async def take_async(self, amount):
+        waited = 0.0
+        while True:
+            delay = self.try_take(amount)
+            if not delay:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+
+# A transfer waiting in a FairScheduler for its next amount of bytes.
+class Ticket:
+    __slots__ = ('client', 'amount', 'interactive', 'order', 'event')
+
+    def __init__(self, client, amount, interactive, order, event):
+        self.client = client
+        self.amount = amount
+        self.interactive = interactive
+        self.order = order
+        self.event = event
+
+
+# Class that shares the tokens of one bucket (the server's link) between the transfers waiting for it.
+# Only the ticket at the head of the queue may take tokens; everyone else sleeps until it is done.
+# Interactive tickets (listings, small transfers and the first bytes of every transfer) go first, in
+# arrival order. Bulk tickets take turns by client, so each client gets an equal share of what is left
+# however many connections it opens, and a client's own transfers take turns in arrival order.
+# A ticket is woken when it reaches the head, so an interactive request that arrives while a bulk
+# transfer waits for tokens is let through as soon as they are there, ahead of it.
+class FairScheduler:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.waiting = []
+        # Sequence number of the last grant to each client's bulk transfers; lower goes first.
+        self.turns = {}
+        self.sequence = itertools.count(1)
+        self.lock = threading.Lock()
+
+    # Returns the ticket that is served next. The caller holds the lock.
+    def head(self):
+        if not self.waiting:
+            return None
+        return min(self.waiting, key=lambda ticket: (not ticket.interactive,
+                                                     0 if ticket.interactive else self.turns.get(ticket.client, 0),
+                                                     ticket.order))
+
+    def enqueue(self, client, amount, interactive, event):
+        ticket = Ticket(client, amount, interactive, next(self.sequence), event)
+        with self.lock:
+            self.waiting.append(ticket)
+        return ticket
+
+    # Method to give a ticket its tokens if it is at the head of the queue. Returns 0 when it got them,
+    # None when another ticket is ahead of it, or the seconds until the bucket has enough.
+    def try_grant(self, ticket):
+        with self.lock:
+            if self.head() is not ticket:
+                return None
+            delay = self.bucket.try_take(ticket.amount)
+            if delay:
+                return delay
+            self.waiting.remove(ticket)
+            if not ticket.interactive:
+                self.turns[ticket.client] = next(self.sequence)
+                if len(self.turns) > MAX_CLIENTS:
+                    active = {waiting.client for waiting in self.waiting}
+                    self.turns = {client: turn for client, turn in self.turns.items() if client in active}
+            head = self.head()
+        if head:
+            head.event.set()
+        return 0
+
+    # Method to take a ticket out of the queue when its transfer gives up waiting.
+    def cancel(self, ticket):
+        with self.lock:
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+            head = self.head()
+        if head:
+            head.event.set()
+
+    # Method to wait for amount bytes of the link. Returns the seconds waited.
+    def wait(self, client, amount, interactive):
+        start = time.monotonic()
+        ticket = self.enqueue(client, amount, interactive, threading.Event())
+        try:
+            while True:
+                ticket.event.clear()
+                delay = self.try_grant(ticket)
+                if delay == 0:
+                    return time.monotonic() - start
+                ticket.event.wait(delay)
+        except BaseException:
+            self.cancel(ticket)
+            raise
+
+    # Coroutine version of wait, for the asyncio server. The scheduler must only be used from one event loop.
+    async def wait_async(self, client, amount, interactive):
+        start = time.monotonic()
+        ticket = self.enqueue(client, amount, interactive, asyncio.Event())
+        try:
+            while True:
+                ticket.event.clear()
+                delay = self.try_grant(ticket)
+                if delay == 0:
+                    return time.monotonic() - start
+                try:
+                    await asyncio.wait_for(ticket.event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self.cancel(ticket)
+            raise
+
+
+# Class that holds the rate limits of a server: rate bytes/sec for the whole server (shared fairly by
+# FairScheduler), client_rate bytes/sec for each client IP, and operation_rates, a dict of bytes/sec
+# for operations such as 'upload' and 'download' (see OPERATION_GROUPS). Every limit is optional.
+# Servers ask it for a Pacer for each request. on_wait, when set, is called with the seconds a transfer
+# waited and the limit it waited for ('global', 'client' or 'operation').
+class TrafficShaper:
+    def __init__(self, rate=None, client_rate=None, operation_rates=None, burst=None,
+                 small_transfer=SMALL_TRANSFER, quantum=QUANTUM):
+        self.scheduler = FairScheduler(TokenBucket(rate, burst)) if rate else None
+        self.client_rate = client_rate
+        self.burst = burst
+        self.client_buckets = {}
+        self.operation_buckets = {operation: TokenBucket(operation_rate, burst)
+                                  for operation, operation_rate in (operation_rates or {}).items()}
+        self.small_transfer = small_transfer
+        self.quantum = quantum
+        self.on_wait = None
+        self.lock = threading.Lock()
+
+    # Method to check whether any limit is configured.
+    def enabled(self):
+        return bool(self.scheduler or self.client_rate or self.operation_buckets)
+
+    # Method to get the pacer for the body bytes of one request from client (an IP address).
+    def pacer(self, client, command_name):
+        buckets = []
+        if self.client_rate:
+            buckets.append(('client', self.client_bucket(client)))
+        operation = self.operation_buckets.get(operation_group(command_name))
+        if operation:
+            buckets.append(('operation', operation))
+        return Pacer(self, client, buckets, interactive=operation_group(command_name) not in ('upload', 'download'))
+
+    # Method to get the bucket shared by every connection from client.
+    def client_bucket(self, client):
+        with self.lock:
+            bucket = self.client_buckets.get(client)
+            if bucket is None:
+                if len(self.client_buckets) >= MAX_CLIENTS:
+                    self.client_buckets = {address: bucket for address, bucket in self.client_buckets.items()
+                                           if not bucket.idle()}
+                bucket = self.client_buckets[client] = TokenBucket(self.client_rate, self.burst)
+            return bucket
+
+    def record_wait(self, seconds, scope):
+        if seconds and self.on_wait:
+            self.on_wait(seconds, scope)
+
+
+# Class that paces the body bytes of one request through the limits that apply to it. Transfers count
+# as interactive for their first small_transfer bytes, so small files are scheduled like listings, and as
+# bulk streams after that. Callers pace at most quantum bytes at a time.
+class Pacer:
+    def __init__(self, shaper, client, buckets, interactive):
+        self.shaper = shaper
+        self.client = client
+        self.buckets = buckets
+        self.interactive = interactive
+        self.quantum = shaper.quantum
+        self.moved = 0
+
+    def priority(self, amount):
+        self.moved += amount
+        return self.interactive or self.moved <= self.shaper.small_transfer
+
+    # Method to wait until amount more bytes may be sent or received.
+    def pace(self, amount):
+        interactive = self.priority(amount)
+        for scope, bucket in self.buckets:
+            self.shaper.record_wait(bucket.take(amount), scope)
+        if self.shaper.scheduler:
+            self.shaper.record_wait(self.shaper.scheduler.wait(self.client, amount, interactive), 'global')
+
+    # Coroutine version of pace, for the asyncio server.
+    async def pace_async(self, amount):
+        interactive = self.priority(amount)
+        for scope, bucket in self.buckets:
+            self.shaper.record_wait(await bucket.take_async(amount), scope)
+        if self.shaper.scheduler:
+            self.shaper.record_wait(await self.shaper.scheduler.wait_async(self.client, amount, interactive),
+                                    'global')
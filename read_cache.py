@@ -0,0 +1,121 @@
+import io
+import threading
+from collections import OrderedDict
+
+
+# Contents of one cached file and the mtime they were read at.
+class CachedFile:
+    __slots__ = ('mtime', 'data')
+
+    def __init__(self, mtime, data):
+        self.mtime = mtime
+        self.data = data
+
+
+# Class that keeps the contents of recently downloaded files in memory, up to max_bytes in total, so
+# popular files are served without touching the disk. The least recently used files are evicted first.
+# Every lookup passes the mtime and size the index has for the file, and an entry that does not match
+# them is dropped instead of served, so a changed file is never sent stale even when its invalidation
+# raced with the read that filled the entry. Files larger than max_file_size (an eighth of the budget by
+# default) are never cached, so one large download cannot push out every popular small file.
+class ReadCache:
+    def __init__(self, max_bytes, max_file_size=None):
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size or max_bytes // 8, max_bytes)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Method to check whether a file of size bytes may be cached.
+    def admits(self, size):
+        return size <= self.max_file_size
+
+    # Method to get the contents of a file if they are cached for this mtime and size, or None.
+    def get(self, file_name, mtime, size):
+        with self.lock:
+            entry = self.entries.get(file_name)
+            if entry is not None and entry.mtime == mtime and len(entry.data) == size:
+                self.entries.move_to_end(file_name)
+                self.hits += 1
+                return entry.data
+            if entry is not None:
+                self.drop(file_name)
+            self.misses += 1
+            return None
+
+    # Method to cache the contents of a file read at mtime, evicting the least recently used files
+    # until the cache fits its budget again.
+    def put(self, file_name, mtime, data):
+        if not self.admits(len(data)):
+            return
+        with self.lock:
+            self.drop(file_name)
+            self.entries[file_name] = CachedFile(mtime, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.data)
+                self.evictions += 1
+
+    # Method to forget a file, e.g. because it was overwritten or deleted.
+    def invalidate(self, file_name):
+        with self.lock:
+            self.drop(file_name)
+
+    # Removes the entry of a file. The caller holds the lock.
+    def drop(self, file_name):
+        entry = self.entries.pop(file_name, None)
+        if entry is not None:
+            self.size -= len(entry.data)
+
+    # Method to get the fraction of lookups that were hits.
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# File-like object over cached contents. The file servers send a range of it straight from memory with view
+# instead of reading it in chunks; reads and seeks work as on a file, for compression probes and digests.
+class MemoryReader(io.RawIOBase):
+    def __init__(self, data):
+        super().__init__()
+        self.data = memoryview(data)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.data) if size is None or size < 0 else min(self.position + size, len(self.data))
+        chunk = self.data[self.position:end].tobytes()
+        self.position = max(self.position, end)
+        return chunk
+
+    def readinto(self, buffer):
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.data)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    # Method to get count bytes from offset without copying them.
+    def view(self, offset, count):
+        return self.data[offset:offset + count]
@@ -1,36 +1,113 @@
+import argparse
+import json
 import socket
 import threading
-import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from statistics_collector import Network_Statistics
+from statistics_collector import StatisticsLog
+from metrics import ServerMetrics
+from file_storage import FileStorage
+from durability import DURABILITY_MODES
+from read_cache import ReadCache
+from rate_limit import TrafficShaper
+from cluster import ClusterNode, HashRing, VNODES
+from storage_layout import InvalidName, is_flat_store, normalize_name, valid_name
+import compression
+import delta_sync
+import integrity
+import protocol
+from protocol import FrameConnection, ProtocolError
 
+# Number of entries sent in each frame of a directory listing.
+LISTING_BATCH = 1000
 
-# Class that contains all methods for the server side. 
+
+# Class that contains all methods for the server side.
 class FileServer:
-    def __init__(self, host='10.128.0.2', port=3300):
+    def __init__(self, host='10.128.0.2', port=3300, storage_path="server_storage",
+                 backlog=128, max_connections=None, idle_timeout=None, use_sendfile=True, dedup=False,
+                 stats_file='network_statistics.jsonl', metrics_port=None, metrics_interval=None,
+                 cache_size=0, cache_max_file=None, rate_limit=None, client_rate_limit=None,
+                 operation_rate_limits=None, cluster_nodes=None, node_id=None, vnodes=VNODES,
+                 listen_socket=None, reuse_port=False, shared_storage=False, durability='group'):
         self.host = host
         self.port = port
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.storage_path = "server_storage"
+        # A prefork worker accepts on the listening socket it inherited, or binds its own with reuse_port.
+        self.listening = listen_socket is not None
+        self.server_socket = listen_socket or socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.reuse_port = reuse_port
+        self.storage_path = storage_path
+        # Popular files are served from memory when the read cache is given a size in bytes.
+        self.cache = ReadCache(cache_size, cache_max_file) if cache_size else None
+        # With shared_storage other processes serve the same storage directory and statistics log.
+        self.storage = FileStorage(storage_path, dedup, self.cache, shared_storage, durability)
+        self.backlog = backlog
+        self.idle_timeout = idle_timeout
+        self.use_sendfile = use_sendfile
+        # Limits the number of client threads alive at the same time.
+        self.connection_slots = threading.BoundedSemaphore(max_connections) if max_connections else None
         self.clients = {}
-        self.statistics = {
-            'transfers': [],
-            'response_time': []
+        # Shared by every client thread; records are written out in batches by a background thread.
+        self.statistics = StatisticsLog(stats_file, shared=shared_storage)
+        self.metrics = ServerMetrics()
+        self.metrics_port = metrics_port
+        self.metrics_interval = metrics_interval
+        instrument_locks(self.metrics, self.storage, self.statistics)
+        self.metrics.watch_committer(self.storage.committer)
+        if self.cache is not None:
+            self.metrics.watch_cache(self.cache)
+        # Rate limits in bytes/sec for the whole server, each client IP and each operation, all optional.
+        self.shaper = shaper_for(rate_limit, client_rate_limit, operation_rate_limits, self.metrics)
+        # With cluster_nodes this server is the node node_id (default host:port) of a cluster and only
+        # stores the names the ring gives it.
+        self.cluster = cluster_for(cluster_nodes, node_id or f'{host}:{port}', vnodes, self.storage)
+        # Threads that hash download ranges while the range itself is being sent.
+        self.digest_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='digest')
+        # Maps each protocol command to the method that serves it.
+        self.handlers = {
+            protocol.CMD_DIR: self.handle_dir,
+            protocol.CMD_UPLOAD: self.handle_upload,
+            protocol.CMD_DOWNLOAD: self.handle_download,
+            protocol.CMD_DELETE: self.handle_delete,
+            protocol.CMD_UPLOAD_STATUS: self.handle_upload_status,
+            protocol.CMD_UPLOAD_BEGIN: self.handle_upload_begin,
+            protocol.CMD_UPLOAD_CHUNK: self.handle_upload_chunk,
+            protocol.CMD_UPLOAD_COMMIT: self.handle_upload_commit,
+            protocol.CMD_CHUNK_QUERY: self.handle_dedup,
+            protocol.CMD_CHUNK_PUT: self.handle_dedup,
+            protocol.CMD_MANIFEST_PUT: self.handle_dedup,
+            protocol.CMD_PING: self.handle_ping,
+            protocol.CMD_DELETE_MANY: self.handle_delete_many,
+            protocol.CMD_STAT_MANY: self.handle_stat_many,
+            protocol.CMD_UPLOAD_MANY: self.handle_upload_many,
+            protocol.CMD_DOWNLOAD_MANY: self.handle_download_many,
+            protocol.CMD_RING: self.handle_ring,
+            protocol.CMD_SIGNATURES: self.handle_signatures,
         }
 
-        if not os.path.exists(self.storage_path):
-            os.makedirs(self.storage_path)
-
     # Method to start the server.
     def start(self):
         try:
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(6)
+            if not self.listening:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if self.reuse_port:
+                    self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                self.server_socket.bind((self.host, self.port))
+                self.server_socket.listen(self.backlog)
             print(f'Starting Server on {self.host}:{self.port}')
+            start_metrics(self.metrics, self.metrics_port, self.metrics_interval)
             print('[*] Waiting for connection')
             while True:
                 connection, address = self.server_socket.accept()
+                if self.connection_slots and not self.connection_slots.acquire(blocking=False):
+                    print(f'[*] Refused connection from IP {address[0]}: connection limit reached')
+                    self.metrics.errors.inc(1, 'connection', 'refused')
+                    self.refuse(connection)
+                    continue
                 print(f'[*] Established connection from IP {address[0]} port: {address[1]}')
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.settimeout(self.idle_timeout)
                 client_thread = threading.Thread(
                     target=self.handle_client,
                     args=(connection, address)
@@ -42,169 +119,954 @@ class FileServer:
             print(f"Error Occurred while Starting: {str(ex)}")
         finally:
             self.server_socket.close()
+            self.digest_pool.shutdown(wait=False)
+            self.statistics.close()
+            self.metrics.close()
 
-    # Handles response from connection (client) and performs the required operation.
+    # Method to turn away a connection accepted while all connection slots are taken.
+    def refuse(self, connection):
+        try:
+            connection.sendall(protocol.encode_frame(protocol.Frame(0, protocol.STATUS_ERROR), b"Server busy"))
+        except OSError:
+            pass
+        connection.close()
+
+    # Handles requests from connection (client) and performs the required operation.
+    # Requests are read frame by frame, so a client may pipeline several of them without waiting.
     def handle_client(self, connection, address):
+        frames = FrameConnection(connection)
+        self.metrics.connections.inc()
         while True:
             try:
-                command = connection.recv(1024).decode()
-                if not command:
+                frame = frames.recv_frame()
+                if frame is None:
                     break
 
-                print(f"Received command: {command}")
-                command_parts = command.split()
-
-                if not command_parts:
-                    continue
-
-                operation = command_parts[0].lower()
+                print(f"Received command: {protocol.command_name(frame.command)} {frame.name}")
 
-                if operation == "dir":
-                    self.handle_dir(connection)
-                elif operation == "upload" and len(command_parts) > 1:
-                    self.handle_upload(connection, command_parts[1])
-                elif operation == "download" and len(command_parts) > 1:
-                    self.handle_download(connection, command_parts[1])
-                elif operation == "delete" and len(command_parts) > 1:
-                    self.handle_delete(connection, command_parts[1])
+                start = time.perf_counter()
+                sent_before = frames.body_bytes_sent
+                if self.shaper:
+                    frames.pacer = self.shaper.pacer(address[0], protocol.command_name(frame.command))
+                handler = self.handlers.get(frame.command)
+                rejection = name_rejection(frame) if frame.command in FILE_COMMANDS else None
+                if handler is None or rejection:
+                    frames.skip_body(frame.size)
+                    frames.send_response(frame, protocol.STATUS_INVALID,
+                                         rejection or "Invalid command or missing arguments")
                 else:
-                    connection.send("Invalid command or missing arguments".encode())
+                    handler(frames, frame)
+                self.metrics.observe_request(protocol.command_name(frame.command), time.perf_counter() - start,
+                                             frame.size, frames.body_bytes_sent - sent_before,
+                                             error_status(frame))
 
+            except ProtocolError as ex:
+                print(f'Protocol error from client {address}: {str(ex)}')
+                self.metrics.errors.inc(1, 'connection', 'protocol')
+                break
+            except socket.timeout:
+                print(f'Closing idle connection from {address}')
+                self.metrics.errors.inc(1, 'connection', 'timeout')
+                break
             except Exception as ex:
                 print(f'Error handling client {address}: {str(ex)}')
+                self.metrics.errors.inc(1, 'connection', 'exception')
                 break
 
-        connection.close()
+        frames.close()
+        self.metrics.connections.dec()
+        if self.connection_slots:
+            self.connection_slots.release()
         print(f'Connection closed from IP {address[0]} port: {address[1]}')
 
-    # Method to handle overall directory. Similar to the basic index.
-    def handle_dir(self, connection):
-        try:
-            files = os.listdir(self.storage_path)
-            file_info = []
+    # Method to answer a ping, which clients use to check that a pooled connection still works.
+    # The reply tells clients what the server supports: the codecs it can decode, which they may upload with,
+    # digest trailers ('verify'), which let both sides check a transfer end to end, and delta uploads ('delta').
+    def handle_ping(self, frames, frame):
+        frames.skip_body(frame.size)
+        frames.send_response(frame, protocol.STATUS_OK, meta=server_features(self.cluster))
 
-            for file_name in files:
-                file_path = os.path.join(self.storage_path, file_name)
-                size = os.path.getsize(file_path)
-                modified = os.path.getmtime(file_path)
-                file_info.append(file_name) 
+    # Method to answer a ring request: the reply meta is the cluster status of this node (see
+    # cluster.ClusterNode.status). A request meta holding a ring replaces the current one when it is newer,
+    # and the files that now belong to other nodes are moved to them in the background.
+    def handle_ring(self, frames, frame):
+        frames.skip_body(frame.size)
+        status, message, meta = ring_response(self.cluster, frame)
+        frames.send_response(frame, status, message, meta)
 
-            response = "\n".join(file_info) if file_info else "No Files Found"
-            connection.send(response.encode())
+    # Method to handle overall directory. The listing is answered from the storage index and streamed
+    # as a series of frames, each holding a JSON list of entries; every frame but the last has FLAG_MORE set.
+    def handle_dir(self, frames, frame):
+        frames.skip_body(frame.size)
+        try:
+            for flags, meta, body in listing_batches(self.storage, frame):
+                frames.send_frame(frame.reply(protocol.STATUS_OK, flags=flags, meta=meta), body)
 
-        except Exception as ex:
+        except ValueError as ex:
+            frames.send_response(frame, protocol.STATUS_INVALID, f"Invalid listing request: {str(ex)}")
+        except OSError as ex:
             print(f"Directory listing error: {str(ex)}")
-            connection.send(f"Directory listing failed: {str(ex)}".encode())
+            frames.send_response(frame, protocol.STATUS_ERROR, f"Directory listing failed: {str(ex)}")
 
     #  Method to handle upload from the client to the server.
-    def handle_upload(self, connection, file_name):
-        try:
-            overwrite_requested = 'overwrite' in file_name
-            if overwrite_requested:
-                file_name = file_name.replace(' overwrite', '')
+    #  The file body follows the request frame directly unless the client asked to wait for STATUS_CONTINUE.
+    #  The body is bytes [offset, offset + size) of a file of total bytes (both taken from the meta);
+    #  it is appended to the staged copy, which replaces the stored file once all total bytes are there.
+    #  A request with an 'encoding' in its meta is followed by an encoded body, decompressed as it arrives;
+    #  with the 'delta' encoding the body is a delta against the stored file, rebuilt as it arrives.
+    #  The body is hashed in the background as it is written. With 'verify' in the meta the client sends its
+    #  own digest in a trailer after the body, and the upload is only committed when the two match. The digest
+    #  of a file uploaded in one piece becomes its stored checksum and is returned in the reply meta.
+    def handle_upload(self, frames, frame):
+        file_size = protocol.body_size(frame)
+        expect_continue = bool(frame.flags & protocol.FLAG_EXPECT_CONTINUE)
 
-            connection.send("Ready".encode())
+        rejection = upload_rejection(self.storage, frame, self.cluster)
+        if rejection:
+            if not expect_continue:
+                frames.skip_request_body(frame)
+            status, message, meta = rejection
+            frames.send_response(frame, status, message, meta)
+            return
 
-            file_size = int(connection.recv(1024).decode())
-            file_path = os.path.join(self.storage_path, file_name)
+        # upload_rejection has put the name in its normalized form.
+        file_name = frame.name
+        if expect_continue:
+            frames.send_response(frame, protocol.STATUS_CONTINUE)
 
-            if os.path.exists(file_path) and not overwrite_requested:
-                connection.send("File Exists. Overwrite? (Yes/No): ".encode())
+        # ----------------------------------------------------------------------
+        start_time = datetime.now()
+        offset, total = upload_range(frame)
+        received_size = 0
 
-                response = connection.recv(1024).decode().lower()
-                if response != 'yes':
-                    connection.send("Upload Canceled.".encode())
-                    return
+        try:
+            codec = upload_codec(frame, self.storage)
+            decompressor = codec.decompressor() if codec else None
+            file = self.storage.open_staged(file_name, offset, total)
+        except OSError as ex:
+            frames.skip_request_body(frame)
+            frames.send_response(frame, protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}")
+            return
 
-            connection.send("Ready".encode())
-            # ----------------------------------------------------------------------
-            start_time = datetime.now()
-            received_size = 0
+        if codec:
+            body = frames.iter_encoded(frame, decompressor,
+                                       count=lambda size: self.metrics.bytes_in.inc(size, 'upload'))
+        else:
+            body = frames.iter_body(file_size)
 
-            with open(file_path, 'wb') as file:
-                while received_size < file_size:
-                    chunk = connection.recv(min(4096, file_size - received_size))
-                    if not chunk:
-                        break
-                    file.write(chunk)
-                    received_size += len(chunk)
+        # A dropped connection raises out of this loop and leaves the received bytes staged for a resume.
+        # The staged file is kept open, which keeps other uploads of the file out of it, until it is committed.
+        # Time spent writing to disk, as opposed to waiting for the network, goes to the 'write' storage metric.
+        write_time = 0.0
+        with file, integrity.Hasher() as hasher:
+            for chunk in body:
+                hasher.update(chunk)
+                write_start = time.perf_counter()
+                file.write(chunk)
+                write_time += time.perf_counter() - write_start
+                received_size += len(chunk)
+            digest = hasher.hexdigest()
+            write_start = time.perf_counter()
+            file.flush()
+            write_time += time.perf_counter() - write_start
+            self.metrics.storage.observe(write_time, 'write')
+
+            if frame.meta.get('verify'):
+                rejection = digest_rejection(self.storage, frame, digest, frames.read_trailer(frame))
+                if rejection:
+                    status, message, meta = rejection
+                    frames.send_response(frame, status, message, meta)
+                    return
 
             end_time = datetime.now()
             duration = (end_time - start_time).total_seconds()
-            transfer_rate = (file_size / (1024 * 1024)) / duration
-            network_stats = Network_Statistics()
-            network_stats.transfer_stats(
+            transfer_rate = (file_size / (1024 * 1024)) / duration if duration else 0
+            self.statistics.transfer_stats(
                 'upload',
                 file_name,
                 received_size,
                 duration,
                 transfer_rate
             )
-            connection.send(f"Upload Complete.".encode())
 
-        except Exception as ex:
-            connection.send(f"Upload Failed: {str(ex)}").encode()
+            if offset + received_size < total:
+                frames.send_response(frame, protocol.STATUS_OK, "Upload Partial.",
+                                     {'offset': offset + received_size})
+                return
+            checksum = digest if not offset else None
+            try:
+                with self.metrics.timed('commit'):
+                    self.storage.commit_staged(file_name, checksum)
+            except OSError as ex:
+                print(f"Upload commit error: {str(ex)}")
+                frames.send_response(frame, protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}")
+                return
+        frames.send_response(frame, protocol.STATUS_OK, "Upload Complete.",
+                             {'checksum': checksum} if checksum else None)
 
-    # Method to handle download from the server to the client.
-    def handle_download(self, connection, file_name):
+    # Method to send the block signatures of a stored file, which a client compares with its new version of
+    # the file to upload only what changed (see delta_sync). The reply body is the packed signatures and its
+    # meta the block size used and the size and mtime of the version they describe.
+    def handle_signatures(self, frames, frame):
+        frames.skip_body(frame.size)
+        status, body, meta = signature_response(self.storage, frame, self.cluster)
+        frames.send_frame(frame.reply(status, meta=meta), body)
+
+    # Method to report how many bytes of an interrupted upload are staged, so the client can resume there.
+    def handle_upload_status(self, frames, frame):
+        frames.skip_body(frame.size)
+        offset = self.storage.staged_size(frame.name)
+        frames.send_response(frame, protocol.STATUS_OK, meta={'offset': offset})
+
+    # Method to start a chunked upload of a file of meta 'total' bytes. Its chunks may then arrive
+    # in any order over any number of connections, and upload_commit moves the file into place.
+    def handle_upload_begin(self, frames, frame):
+        frames.skip_body(frame.size)
+        rejection = chunked_upload_rejection(self.storage, frame, self.cluster)
+        if rejection:
+            status, message = rejection
+            frames.send_response(frame, status, message)
+            return
         try:
-            file_path = os.path.join(self.storage_path, file_name)
-            if not os.path.exists(file_path):
-                connection.send("File not found".encode())
-                return
+            self.storage.begin_chunked(frame.name, int(frame.meta['total']))
+        except OSError as ex:
+            frames.send_response(frame, protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}")
+            return
+        frames.send_response(frame, protocol.STATUS_OK)
+
+    # Method to write one chunk of a chunked upload at its meta 'offset' with positional writes.
+    def handle_upload_chunk(self, frames, frame):
+        upload = self.storage.get_chunked(frame.name)
+        offset = int(frame.meta.get('offset', 0))
+        if upload is None or offset < 0 or offset + frame.size > upload.total:
+            frames.skip_body(frame.size)
+            frames.send_response(frame, protocol.STATUS_INVALID, "Upload Failed: chunk does not belong to an upload")
+            return
+
+        position = offset
+        for chunk in frames.iter_body(frame.size):
+            upload.write_at(position, chunk)
+            position += len(chunk)
+        upload.mark_written(offset, frame.size)
+        frames.send_response(frame, protocol.STATUS_OK)
+
+    # Method to finish a chunked upload once all of its chunks have been written.
+    def handle_upload_commit(self, frames, frame):
+        frames.skip_body(frame.size)
+        upload = self.storage.get_chunked(frame.name)
+        try:
+            with self.metrics.timed('commit'):
+                committed = upload is not None and self.storage.commit_chunked(frame.name)
+        except OSError as ex:
+            print(f"Upload commit error: {str(ex)}")
+            frames.send_response(frame, protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}")
+            return
+        if not committed:
+            frames.send_response(frame, protocol.STATUS_INVALID, "Upload Failed: chunks are missing")
+            return
+
+        duration = (datetime.now() - upload.start_time).total_seconds()
+        transfer_rate = (upload.total / (1024 * 1024)) / duration if duration else 0
+        self.statistics.transfer_stats('upload', frame.name, upload.total, duration, transfer_rate)
+        frames.send_response(frame, protocol.STATUS_OK, "Upload Complete.")
 
-            file_size = os.path.getsize(file_path)
-            connection.send(str(file_size).encode())
+    # Method to handle the deduplicating upload commands: chunk_query, chunk_put and manifest_put.
+    def handle_dedup(self, frames, frame):
+        frames.pace(frame.size)
+        payload = frames.read_payload(frame)
+        status, body, meta = dedup_response(self.storage, frame, payload, self.cluster)
+        frames.send_frame(frame.reply(status, meta=meta), body)
 
-            if connection.recv(1024).decode() != "Ready":
+    # Method to handle download from the server to the client.
+    # The reply carries the size of the requested range in its header and those bytes as its body.
+    # Requests may carry 'offset' and 'length' in their meta to ask for part of the file, and the codecs
+    # the client can decode in 'accept_encoding'; see download_codec for when the range is compressed.
+    # With 'verify' the body is followed by a digest trailer. The digest is computed by a worker thread
+    # while the range is sent, from the stored checksum when the whole file is asked for. Without sendfile the
+    # file is memory-mapped and the range sent straight from the mapping.
+    def handle_download(self, frames, frame):
+        frames.skip_body(frame.size)
+        try:
+            with self.metrics.timed('open'):
+                file, file_size = self.storage.open_read(frame.name, mapped=not self.use_sendfile)
+        except FileNotFoundError:
+            frames.send_response(frame, protocol.STATUS_NOT_FOUND, "File not found")
+            return
+        except OSError as ex:
+            frames.send_response(frame, protocol.STATUS_ERROR, f"Download Failed: {str(ex)}")
+            return
+
+        with file:
+            byte_range = protocol.requested_range(frame, file_size)
+            if byte_range is None:
+                frames.send_response(frame, protocol.STATUS_INVALID, "Requested range not satisfiable")
                 return
-            
+            offset, length = byte_range
+            codec = download_codec(frame, file, offset, length)
+            meta = {'offset': offset, 'total': file_size}
+            digest = None
+            if frame.meta.get('verify'):
+                meta['verify'] = True
+                digest = self.digest_pool.submit(download_digest, self.storage, frame.name, offset, length, file_size)
+
             # ----------------------------------------------------------------------
 
             start_time = datetime.now()
-            size = 0
-
-            with open(file_path, 'rb') as file:
-                while True:
-                    chunk = file.read(4096)
-                    if not chunk:
-                        break
-                    connection.send(chunk)
-                    size += len(chunk)
+            if codec:
+                meta.update({'encoding': codec.name, 'size': length})
+                reply = frame.reply(protocol.STATUS_OK, flags=protocol.FLAG_MORE, meta=meta)
+                frames.send_frame(reply)
+                file.seek(offset)
+                size = frames.send_encoded(reply, codec.compressor(), compression.iter_blocks(file, length))
+                if size != length:
+                    raise ProtocolError(f'File ended after {size} of {length} bytes')
+            else:
+                reply = frame.reply(protocol.STATUS_OK, size=length, meta=meta)
+                frames.send_frame(reply)
+                size = frames.send_file_range(file, offset, length, self.use_sendfile)
+            if digest:
+                frames.send_frame(protocol.trailer_frame(reply, digest.result()))
 
-            end_time = datetime.now()
-            duration = (end_time - start_time).total_seconds()
-            transfer_rate = (file_size / (1024 * 1024)) / duration
-            network_stats = Network_Statistics()
-            network_stats.transfer_stats(
-                'download',
-                file_name,
-                size,
-                duration,
-                transfer_rate
-            )
-        except Exception as ex:
-            connection.send(f"Download Failed: {str(ex)}".encode())
+        end_time = datetime.now()
+        duration = (end_time - start_time).total_seconds()
+        transfer_rate = (size / (1024 * 1024)) / duration if duration else 0
+        self.statistics.transfer_stats(
+            'download',
+            frame.name,
+            size,
+            duration,
+            transfer_rate
+        )
 
     # Method to handle delete from the server.
-    def handle_delete(self, connection, file_name):
+    def handle_delete(self, frames, frame):
+        frames.skip_body(frame.size)
         try:
-            file_path = os.path.join(self.storage_path, file_name)
-
-            if not os.path.exists(file_path):
-                connection.send("File not found".encode())
+            with self.metrics.timed('delete'):
+                deleted = self.storage.delete(frame.name)
+            if not deleted:
+                frames.send_response(frame, protocol.STATUS_NOT_FOUND, "File not found")
                 return
 
-            os.remove(file_path)
-            connection.send("File deleted successfully".encode())
+            frames.send_response(frame, protocol.STATUS_OK, "File deleted successfully")
 
-        except Exception as ex:
+        except OSError as ex:
             print(f"Delete error: {str(ex)}")
-            connection.send(f"Delete failed: {str(ex)}".encode())
+            frames.send_response(frame, protocol.STATUS_ERROR, f"Delete failed: {str(ex)}")
+
+    # Method to delete every file named in the JSON list of the request body with one request.
+    # The reply body maps each name to the status of its delete: 'ok', 'not_found' or 'error'.
+    def handle_delete_many(self, frames, frame):
+        try:
+            names = batch_names(frames.read_payload(frame))
+        except ValueError as ex:
+            frames.send_response(frame, protocol.STATUS_INVALID, f"Invalid batch request: {str(ex)}")
+            return
+        with self.metrics.timed('delete'):
+            results = delete_many(self.storage, names)
+        frames.send_frame(frame.reply(protocol.STATUS_OK), json.dumps(results).encode())
+
+    # Method to look up the index entries of every file named in the JSON list of the request body.
+    # The reply body is a JSON list of entries in the same order, null for names that are not stored;
+    # 'checksums' in the meta fills in checksums not computed yet, as in a listing.
+    def handle_stat_many(self, frames, frame):
+        try:
+            names = batch_names(frames.read_payload(frame))
+        except ValueError as ex:
+            frames.send_response(frame, protocol.STATUS_INVALID, f"Invalid batch request: {str(ex)}")
+            return
+        entries = stat_many(self.storage, names, bool(frame.meta.get('checksums')))
+        frames.send_frame(frame.reply(protocol.STATUS_OK), json.dumps(entries).encode())
+
+    # Method to receive many files in one request. Each file arrives as a member frame (see
+    # protocol.member_frame) carrying its name and size, followed by its bytes and, with 'verify' in its
+    # meta, a digest trailer; FLAG_MORE on the request and on each member says another member follows.
+    # Every file is staged, checked and committed on its own, like a single upload, without the round trips
+    # in between. The one reply at the end maps each name to its status: 'ok', 'exists', 'invalid' or 'error'.
+    def handle_upload_many(self, frames, frame):
+        frames.skip_body(frame.size)
+        start_time = datetime.now()
+        results = {}
+        received_size = 0
+        more = frame.flags & protocol.FLAG_MORE
+        while more:
+            member = frames.recv_frame()
+            protocol.check_member_frame(frame, member)
+            more = member.flags & protocol.FLAG_MORE
+            self.metrics.bytes_in.inc(member.size, 'upload_many')
+            name = member.name
+            results[name] = protocol.status_name(self.receive_member(frames, frame, member))
+            received_size += member.size
+
+        duration = (datetime.now() - start_time).total_seconds()
+        transfer_rate = (received_size / (1024 * 1024)) / duration if duration else 0
+        self.statistics.transfer_stats('upload_many', f'{len(results)} files', received_size, duration,
+                                       transfer_rate)
+        frames.send_frame(frame.reply(protocol.STATUS_OK), json.dumps(results).encode())
+
+    # Method to stage, verify and commit one file of a batch upload. Returns the status of the file.
+    def receive_member(self, frames, frame, member):
+        member.flags |= frame.flags & protocol.FLAG_OVERWRITE
+        rejection = member_rejection(self.storage, member, self.cluster)
+        if rejection:
+            frames.skip_request_body(member)
+            return rejection[0]
+        try:
+            file = self.storage.open_staged(member.name, 0, member.size)
+        except OSError:
+            frames.skip_request_body(member)
+            return protocol.STATUS_ERROR
+
+        # Small files come with their bytes checksummed in the member frame, like any in-memory body.
+        if member.flags & protocol.FLAG_CHECKSUM:
+            frames.pace(member.size)
+            body = [frames.read_payload(member)]
+        else:
+            body = frames.iter_body(member.size)
+        # The staged file is kept open, which keeps other uploads of the file out of it, until it is committed.
+        digest = integrity.new_digest()
+        with file:
+            for chunk in body:
+                digest.update(chunk)
+                file.write(chunk)
+            file.flush()
+            digest = digest.hexdigest()
+
+            if member.meta.get('verify') and digest_rejection(self.storage, member, digest,
+                                                              frames.read_trailer(member)):
+                return protocol.STATUS_INVALID
+            try:
+                with self.metrics.timed('commit'):
+                    self.storage.commit_staged(member.name, digest)
+            except OSError as ex:
+                print(f"Upload commit error: {str(ex)}")
+                return protocol.STATUS_ERROR
+        return protocol.STATUS_OK
+
+    # Method to send many files in one reply. The request body is a JSON list of names; the reply frame is
+    # followed by one member frame per name, in order, holding the file as its body, or no body and
+    # STATUS_NOT_FOUND when it is not stored. With 'verify' in the request meta every file found is followed
+    # by its digest trailer. Files up to CHUNK_SIZE are read and sent together with their member frame and
+    # trailer in one write; larger ones are sent with sendfile.
+    def handle_download_many(self, frames, frame):
+        try:
+            names = batch_names(frames.read_payload(frame))
+        except ValueError as ex:
+            frames.send_response(frame, protocol.STATUS_INVALID, f"Invalid batch request: {str(ex)}")
+            return
+        verify = bool(frame.meta.get('verify'))
+        frames.send_frame(frame.reply(protocol.STATUS_OK, flags=protocol.FLAG_MORE if names else 0,
+                                      meta={'count': len(names), 'verify': verify}))
+
+        start_time = datetime.now()
+        sent_size = 0
+        for number, name in enumerate(names):
+            more = number + 1 < len(names)
+            # Members keep the name as the client sent it; the storage is asked by its normalized form.
+            try:
+                file_name = normalize_name(name)
+                file, file_size = self.storage.open_read(file_name, mapped=not self.use_sendfile)
+            except InvalidName:
+                frames.send_frame(protocol.member_frame(frame, name, 0, more, protocol.STATUS_INVALID))
+                continue
+            except FileNotFoundError:
+                frames.send_frame(protocol.member_frame(frame, name, 0, more, protocol.STATUS_NOT_FOUND))
+                continue
+            except OSError:
+                frames.send_frame(protocol.member_frame(frame, name, 0, more, protocol.STATUS_ERROR))
+                continue
+
+            with file:
+                member = protocol.member_frame(frame, name, file_size, more)
+                if file_size <= protocol.CHUNK_SIZE:
+                    data = file.read()
+                    batch = [(member, data)]
+                    if verify:
+                        batch.append((protocol.trailer_frame(member, integrity.digest_bytes(data)), b''))
+                    frames.pace(len(data))
+                    frames.send_frames(batch)
+                    sent_size += len(data)
+                    continue
+                frames.send_frame(member)
+                sent_size += frames.send_file_range(file, 0, file_size, self.use_sendfile)
+            if verify:
+                frames.send_frame(protocol.trailer_frame(member, self.storage.checksum(file_name)))
+
+        duration = (datetime.now() - start_time).total_seconds()
+        transfer_rate = (sent_size / (1024 * 1024)) / duration if duration else 0
+        self.statistics.transfer_stats('download_many', f'{len(names)} files', sent_size, duration, transfer_rate)
+
+
+# Returns the features a server announces in its reply to a ping, with the cluster status of a cluster node.
+def server_features(cluster=None):
+    features = {'encodings': compression.available(), 'verify': True, 'delta': True}
+    if cluster:
+        features['cluster'] = cluster.status()
+    return features
+
 
+# Returns the cluster.ClusterNode of a server started with a list of cluster nodes, otherwise None.
+def cluster_for(nodes, node_id, vnodes, storage):
+    if not nodes:
+        return None
+    cluster = ClusterNode(node_id, HashRing(nodes, vnodes), storage)
+    print(f'Cluster node {node_id} of {", ".join(cluster.ring.nodes)}')
+    return cluster
 
-# Main method which creates oa server object and runs it by calling start(). 
+
+# Serves a ring request for a server's cluster node. Returns (status, message, meta).
+def ring_response(cluster, frame):
+    if cluster is None:
+        return protocol.STATUS_INVALID, "Not a cluster node", None
+    if frame.meta.get('nodes') is not None:
+        try:
+            ring = HashRing.from_meta(frame.meta)
+        except (ValueError, TypeError, KeyError) as ex:
+            return protocol.STATUS_INVALID, f"Invalid ring: {str(ex)}", None
+        if not cluster.set_ring(ring):
+            message = f"Ring version {ring.version} is not newer than {cluster.ring.version}"
+            return protocol.STATUS_INVALID, message, cluster.status()
+    return protocol.STATUS_OK, '', cluster.status()
+
+
+# Checks that a name belongs to this node of the cluster. Returns the message to refuse it with, otherwise None.
+def ownership_rejection(cluster, name):
+    if cluster is None or cluster.owns(name):
+        return None
+    return f"Upload Failed: {name} belongs to cluster node {cluster.ring.owner(name)}"
+
+
+# Returns the BLAKE2b digest of the bytes a download sends: the stored checksum of the file when the
+# whole file is sent, which is then only computed once, otherwise the digest of the range.
+def download_digest(storage, file_name, offset, length, file_size):
+    if not offset and length == file_size:
+        return storage.checksum(file_name)
+    return storage.range_checksum(file_name, offset, length)
+
+
+# Checks the digest an upload's sender put in its trailer against the digest of the bytes received.
+# On a mismatch the staged bytes are thrown away, since some of them are not what the client sent.
+# Returns (status, message, meta) when the upload must fail, otherwise None.
+def digest_rejection(storage, frame, digest, expected):
+    if digest == expected:
+        return None
+    storage.discard_staged(frame.name)
+    return protocol.STATUS_INVALID, "Upload Failed: checksum mismatch", {'digest': digest}
+
+
+# Parses the body of a batch request: a JSON list of file names. Raises ValueError when it is not one.
+def batch_names(payload):
+    names = json.loads(payload or b'[]')
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError('body must be a JSON list of file names')
+    return names
+
+
+# Deletes every named file. Returns a dict mapping each name to 'ok', 'not_found', 'invalid' or 'error'.
+def delete_many(storage, names):
+    results = {}
+    for name in names:
+        file_name = valid_name(name)
+        try:
+            if file_name is None:
+                status = protocol.STATUS_INVALID
+            else:
+                status = protocol.STATUS_OK if storage.delete(file_name) else protocol.STATUS_NOT_FOUND
+        except OSError as ex:
+            print(f"Delete error: {str(ex)}")
+            status = protocol.STATUS_ERROR
+        results[name] = protocol.status_name(status)
+    return results
+
+
+# Returns the index entries of the named files as dicts, in order, with None for names that are not stored
+# or not valid.
+def stat_many(storage, names, checksums=False):
+    entries = []
+    for name in names:
+        file_name = valid_name(name)
+        entry = storage.index.get(file_name) if file_name is not None else None
+        item = entry.to_dict() if entry is not None else None
+        if item and checksums and item['checksum'] is None:
+            try:
+                item['checksum'] = storage.checksum(file_name)
+            except FileNotFoundError:
+                item = None
+        entries.append(item)
+    return entries
+
+
+# Returns the status name of a request that ended in an error reply, for the error metrics, otherwise None.
+def error_status(frame):
+    if frame.reply_status in (None, protocol.STATUS_OK, protocol.STATUS_CONTINUE):
+        return None
+    return protocol.status_name(frame.reply_status)
+
+
+# Replaces the shared locks of the storage and the statistics log with ones that record their wait times,
+# which tells lock contention apart from slow disks or networks.
+def instrument_locks(metrics, storage, statistics):
+    storage.index.lock = metrics.timed_lock('index', storage.index.lock)
+    storage.chunked_lock = metrics.timed_lock('chunked_uploads', storage.chunked_lock)
+    if storage.chunk_store:
+        storage.chunk_store.lock = metrics.timed_lock('chunk_store', storage.chunk_store.lock)
+    statistics.lock = metrics.timed_lock('statistics', statistics.lock)
+
+
+# Returns the rate_limit.TrafficShaper for the given limits in bytes/sec, exporting its waits in metrics,
+# or None when no limit is set.
+def shaper_for(rate, client_rate, operation_rates, metrics):
+    shaper = TrafficShaper(rate, client_rate, operation_rates)
+    if not shaper.enabled():
+        return None
+    metrics.watch_shaper(shaper)
+    return shaper
+
+
+# Returns the constructor options of prefork worker number (from 0) of workers, given those of a single
+# server: each worker gets an equal share of every rate limit and serves its metrics on the next port.
+def worker_options(options, number, workers):
+    options = dict(options, shared_storage=True)
+    for limit in ('rate_limit', 'client_rate_limit'):
+        if options.get(limit):
+            options[limit] = options[limit] / workers
+    if options.get('operation_rate_limits'):
+        options['operation_rate_limits'] = {operation: rate / workers
+                                            for operation, rate in options['operation_rate_limits'].items()}
+    if options.get('metrics_port') is not None:
+        options['metrics_port'] += number
+    return options
+
+
+# Parses --operation-rate-limit values such as 'download=50' into {operation: bytes/sec}.
+def parse_operation_rates(values):
+    rates = {}
+    for value in values or []:
+        operation, _, megabytes = value.partition('=')
+        try:
+            rates[operation.strip()] = float(megabytes) * 1024 * 1024
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'expected OPERATION=MB, got {value!r}')
+    return rates
+
+
+# Starts the metrics HTTP endpoint and the periodic summary line when they are configured.
+def start_metrics(metrics, port, interval):
+    if port is not None:
+        metrics.serve(port)
+    if interval:
+        metrics.report_every(interval)
+
+
+# Yields the frames of a directory listing as (flags, meta, body) triples, at most LISTING_BATCH entries each.
+# The request meta may hold 'prefix', 'sort' ('name', 'size' or 'mtime'), 'reverse', 'limit' (0 for all),
+# the 'cursor' returned with a previous page, and 'checksums' to fill in checksums not computed yet.
+# Each entry is {"name", "size", "mtime", "checksum"}; the last frame carries the cursor of the next page
+# in its meta, or null when the listing is complete. Pages are taken from the index one batch at a time,
+# so memory stays bounded however many files there are.
+def listing_batches(storage, frame):
+    meta = frame.meta
+    prefix = str(meta.get('prefix', ''))
+    sort = meta.get('sort', 'name')
+    reverse = bool(meta.get('reverse', False))
+    limit = int(meta.get('limit', 0))
+    cursor = meta.get('cursor')
+    checksums = bool(meta.get('checksums', False))
+    if limit < 0:
+        raise ValueError('limit must not be negative')
+
+    sent = 0
+    while True:
+        batch = LISTING_BATCH if not limit else min(LISTING_BATCH, limit - sent)
+        entries, cursor = storage.index.page(prefix, sort, reverse, batch, cursor)
+        sent += len(entries)
+        listing = []
+        for entry in entries:
+            item = entry.to_dict()
+            if checksums and item['checksum'] is None:
+                try:
+                    item['checksum'] = storage.checksum(entry.name)
+                except FileNotFoundError:
+                    continue
+            listing.append(item)
+        body = json.dumps(listing, separators=(',', ':')).encode()
+        if cursor is None or (limit and sent >= limit):
+            yield 0, {'cursor': cursor}, body
+            return
+        yield protocol.FLAG_MORE, None, body
+
+
+# Reads the range of an upload request: the body starts at meta 'offset' of a file of meta 'total' bytes.
+def upload_range(frame):
+    offset = int(frame.meta.get('offset', 0))
+    return offset, int(frame.meta.get('total', offset + protocol.body_size(frame)))
+
+
+# Returns the codec of an upload request with an encoded body, or None when the body is sent as it is.
+# A delta body is decoded against the stored file, so storage is needed for those.
+def upload_codec(frame, storage=None):
+    encoding = frame.meta.get('encoding')
+    if encoding == delta_sync.ENCODING:
+        return delta_sync.DeltaCodec(storage, frame.name, int(frame.meta['block_size']), protocol.body_size(frame))
+    return compression.CODECS.get(encoding)
+
+
+# Picks the codec to send a download range with: the first codec in the request's 'accept_encoding'
+# that this server has, as long as the range is at least compression.MIN_SIZE bytes and a probe of
+# its first bytes compresses well. Returns None when the range should be sent as it is, with sendfile.
+# The file is left positioned at offset, since the sendfile fallbacks read from the current position.
+def download_codec(frame, file, offset, length):
+    codec = compression.choose(frame.meta.get('accept_encoding'))
+    if codec is None or length < compression.MIN_SIZE:
+        return None
+    file.seek(offset)
+    sample = file.read(min(compression.PROBE_SIZE, length))
+    file.seek(offset)
+    return codec if compression.worth_compressing(codec, sample) else None
+
+
+# Requests that name one stored file in their frame name and have at most a plain body. Their names are checked
+# by name_rejection before they reach a handler. Uploads, whose bodies may be encoded or sent only after a
+# STATUS_CONTINUE reply, check theirs in upload_rejection, and batch requests check each of their names.
+FILE_COMMANDS = {protocol.CMD_DOWNLOAD, protocol.CMD_DELETE, protocol.CMD_UPLOAD_STATUS, protocol.CMD_UPLOAD_BEGIN,
+                 protocol.CMD_UPLOAD_CHUNK, protocol.CMD_UPLOAD_COMMIT, protocol.CMD_MANIFEST_PUT,
+                 protocol.CMD_SIGNATURES}
+
+
+# Checks the file name of a request and replaces it with its normalized form (see storage_layout.normalize_name),
+# so the handlers and the storage only ever see names that are safe to store under. Returns the message to
+# refuse the request with when the name is not valid, otherwise None.
+def name_rejection(frame):
+    try:
+        frame.name = normalize_name(frame.name)
+    except InvalidName as ex:
+        return f"Invalid file name: {str(ex)}"
+    return None
+
+
+# Checks an upload request, or one file of a batch upload, against the stored and staged files, and against
+# the ring of a cluster node, after normalizing its file name (see name_rejection).
+# Returns (status, message, meta) when the upload must be refused, otherwise None.
+def upload_rejection(storage, frame, cluster=None):
+    rejection = name_rejection(frame)
+    if rejection:
+        return protocol.STATUS_INVALID, f"Upload Failed: {rejection}", None
+
+    moved = ownership_rejection(cluster, frame.name)
+    if moved:
+        return protocol.STATUS_MOVED, moved, {'owner': cluster.ring.owner(frame.name)}
+
+    encoding = frame.meta.get('encoding')
+    if encoding and encoding not in compression.CODECS and encoding != delta_sync.ENCODING:
+        return protocol.STATUS_INVALID, f"Upload Failed: unsupported encoding {encoding}", None
+
+    offset, total = upload_range(frame)
+    if offset < 0 or offset + protocol.body_size(frame) > total:
+        return protocol.STATUS_INVALID, "Upload Failed: body does not fit in the declared file size", None
+
+    if storage.exists(frame.name) and not frame.flags & protocol.FLAG_OVERWRITE:
+        return protocol.STATUS_EXISTS, "File Exists.", None
+
+    staged = storage.staged_size(frame.name)
+    if offset and offset != staged:
+        return (protocol.STATUS_INVALID, f"Upload Failed: {staged} bytes are staged, not {offset}",
+                {'offset': staged})
+    if encoding == delta_sync.ENCODING:
+        return delta_rejection(storage, frame)
+    return None
+
+
+# Checks one file of a batch upload (upload_many) like upload_rejection. Members carry their bytes as they are,
+# so a member whose meta names an encoding, a compression or a delta, is refused; its body is skipped unread.
+def member_rejection(storage, member, cluster=None):
+    if member.meta.get('encoding'):
+        return protocol.STATUS_INVALID, "Upload Failed: members of a batch cannot be encoded", None
+    return upload_rejection(storage, member, cluster)
+
+
+# Checks an upload with a delta body: it must be a whole, verified file, and the stored file must still be the
+# version the client computed the delta against (meta 'base' holds its size and mtime from the signatures
+# reply). Returns (status, message, meta) when the upload must be refused, otherwise None; a client that is
+# refused sends the whole file instead.
+def delta_rejection(storage, frame):
+    if frame.meta.get('offset') or not frame.meta.get('verify'):
+        return protocol.STATUS_INVALID, "Upload Failed: a delta must be a whole, verified file", None
+    base = frame.meta.get('base') or {}
+    entry = storage.index.get(frame.name)
+    if entry is None or base.get('size') != entry.size or base.get('mtime') != entry.mtime:
+        return protocol.STATUS_INVALID, "Upload Failed: the stored file changed since its signatures were sent", None
+    try:
+        delta_sync.requested_block_size({'block_size': frame.meta['block_size']}, entry.size)
+    except (KeyError, ValueError, TypeError):
+        return protocol.STATUS_INVALID, "Upload Failed: invalid delta block size", None
+    return None
+
+
+# Serves a signatures request for a stored file. Returns (status, body, meta); see FileServer.handle_signatures.
+def signature_response(storage, frame, cluster=None):
+    moved = ownership_rejection(cluster, frame.name)
+    if moved:
+        return protocol.STATUS_MOVED, moved.encode(), {'owner': cluster.ring.owner(frame.name)}
+    # The entry is read before the file is opened, so a file replaced in between is described by an older
+    # mtime than its own and a delta against it is refused.
+    entry = storage.index.get(frame.name)
+    if entry is None:
+        return protocol.STATUS_NOT_FOUND, b"File not found", None
+    try:
+        block_size = delta_sync.requested_block_size(frame.meta, entry.size)
+    except (ValueError, TypeError) as ex:
+        return protocol.STATUS_INVALID, f"Invalid signatures request: {str(ex)}".encode(), None
+    try:
+        file, size = storage.open_read(frame.name)
+    except FileNotFoundError:
+        return protocol.STATUS_NOT_FOUND, b"File not found", None
+    with file:
+        body = delta_sync.signatures(file, block_size)
+    count = len(body) // delta_sync.SIGNATURE.size
+    return protocol.STATUS_OK, body, {'block_size': block_size, 'size': size, 'mtime': entry.mtime, 'count': count}
+
+
+# Checks an upload_begin request. Returns (status, message) when it must be refused, otherwise None.
+def chunked_upload_rejection(storage, frame, cluster=None):
+    if not frame.name or int(frame.meta.get('total', -1)) < 0:
+        return protocol.STATUS_INVALID, "Upload Failed: missing file name or size"
+    moved = ownership_rejection(cluster, frame.name)
+    if moved:
+        return protocol.STATUS_MOVED, moved
+    if storage.exists(frame.name) and not frame.flags & protocol.FLAG_OVERWRITE:
+        return protocol.STATUS_EXISTS, "File Exists."
+    return None
+
+
+# Serves one deduplicating upload command against the storage chunk store. Returns (status, body, meta).
+#   chunk_query:  body is a JSON list of chunk hashes; the reply body lists the ones not stored yet.
+#   chunk_put:    name is the chunk hash and body the chunk data.
+#   manifest_put: body is a JSON object {"chunks": [[hash, length], ...]} describing the file in order;
+#                 when chunks are missing the reply is STATUS_INVALID with their hashes in meta 'missing'.
+# Chunk hashes must be 40 lowercase hex digits (see chunk_store.is_chunk_hash); anything else is STATUS_INVALID.
+def dedup_response(storage, frame, payload, cluster=None):
+    store = storage.chunk_store
+    if store is None:
+        return protocol.STATUS_INVALID, b"Deduplication is not enabled on this server", None
+
+    try:
+        if frame.command == protocol.CMD_CHUNK_QUERY:
+            missing = store.missing_chunks(json.loads(payload))
+            return protocol.STATUS_OK, json.dumps(missing).encode(), None
+
+        if frame.command == protocol.CMD_CHUNK_PUT:
+            store.put_chunk(frame.name, payload)
+            return protocol.STATUS_OK, b"", None
+
+        moved = ownership_rejection(cluster, frame.name)
+        if moved:
+            return protocol.STATUS_MOVED, moved.encode(), {'owner': cluster.ring.owner(frame.name)}
+        if storage.exists(frame.name) and not frame.flags & protocol.FLAG_OVERWRITE:
+            return protocol.STATUS_EXISTS, b"File Exists.", None
+        chunks = json.loads(payload)['chunks']
+        missing = storage.put_manifest(frame.name, chunks)
+        if missing:
+            return protocol.STATUS_INVALID, b"Upload Failed: chunks are missing", {'missing': missing}
+        return protocol.STATUS_OK, b"Upload Complete.", None
+    except (ValueError, KeyError, TypeError) as ex:
+        return protocol.STATUS_INVALID, f"Invalid request: {str(ex)}".encode(), None
+    except OSError as ex:
+        return protocol.STATUS_ERROR, f"Upload Failed: {str(ex)}".encode(), None
+
+
+# Main method which creates a server object and runs it by calling start().
 # This is run when the server_side.py file is executed.
 if __name__ == '__main__':
-    server = FileServer()
+    parser = argparse.ArgumentParser(description='Socket based cloud file sharing server')
+    parser.add_argument('--host', default='10.128.0.2')
+    parser.add_argument('--port', type=int, default=3300)
+    parser.add_argument('--storage', default='server_storage')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded',
+                        help='thread per connection, or a single asyncio event loop')
+    parser.add_argument('--backlog', type=int, default=128, help='listen() backlog')
+    parser.add_argument('--max-connections', type=int, default=None,
+                        help='connections served at the same time; extra ones are refused')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='seconds a connection may stay silent before it is closed')
+    parser.add_argument('--no-sendfile', dest='use_sendfile', action='store_false',
+                        help='send downloads from memory-mapped files instead of with zero-copy sendfile')
+    parser.add_argument('--dedup', action='store_true',
+                        help='store files as deduplicated content-defined chunks')
+    parser.add_argument('--stats-file', default='network_statistics.jsonl',
+                        help='JSON Lines file the transfer statistics are appended to')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-interval', type=float, default=None,
+                        help='print a metrics summary line every this many seconds')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='megabytes of memory for caching popular files, 0 to read every download from disk')
+    parser.add_argument('--cache-max-file', type=int, default=None,
+                        help='largest file in megabytes the cache keeps (default: an eighth of --cache-size)')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='MB/s the whole server may send and receive; set it just under the link speed '
+                             'so listings and small transfers are scheduled ahead of bulk streams')
+    parser.add_argument('--client-rate-limit', type=float, default=None, help='MB/s for each client IP')
+    parser.add_argument('--operation-rate-limit', action='append', metavar='OPERATION=MB',
+                        help='MB/s for all transfers of an operation, e.g. download=50; may be repeated')
+    parser.add_argument('--cluster', default=None, metavar='NODE,NODE,...',
+                        help='run as a node of a cluster of these HOST:PORT nodes, storing only the files '
+                             'consistent hashing gives this node')
+    parser.add_argument('--node-id', default=None,
+                        help='HOST:PORT this node is listed under in --cluster (default: --host:--port)')
+    parser.add_argument('--vnodes', type=int, default=VNODES, help='points per node on the hash ring')
+    parser.add_argument('--durability', choices=DURABILITY_MODES, default='group',
+                        help='sync every committed upload to disk (always), share the directory syncs of '
+                             'concurrent commits (group, the default), or leave it to the OS (none)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes sharing the port, to use more than one core (default 1)')
+    parser.add_argument('--no-reuseport', dest='reuse_port', action='store_false',
+                        help='let the workers accept on one inherited socket instead of SO_REUSEPORT sockets')
+    args = parser.parse_args()
+    try:
+        operation_rates = parse_operation_rates(args.operation_rate_limit)
+    except argparse.ArgumentTypeError as ex:
+        parser.error(str(ex))
+    if args.workers > 1 and args.dedup:
+        parser.error('--dedup keeps chunk reference counts in memory and cannot be used with --workers')
+    if args.workers > 1 and args.cluster:
+        parser.error('--cluster cannot be used with --workers; run one node per port instead')
+    if is_flat_store(args.storage):
+        print(f'{args.storage} uses the flat layout; run "python storage_layout.py {args.storage}" '
+              f'to move it to the hashed layout')
+
+    if args.engine == 'asyncio':
+        from async_server import AsyncFileServer
+        server_class = AsyncFileServer
+    else:
+        server_class = FileServer
+    options = dict(backlog=args.backlog,
+                   max_connections=args.max_connections,
+                   idle_timeout=args.idle_timeout,
+                   use_sendfile=args.use_sendfile,
+                   dedup=args.dedup,
+                   stats_file=args.stats_file,
+                   metrics_port=args.metrics_port,
+                   metrics_interval=args.metrics_interval,
+                   cache_size=args.cache_size * 1024 * 1024,
+                   cache_max_file=args.cache_max_file * 1024 * 1024 if args.cache_max_file else None,
+                   rate_limit=args.rate_limit * 1024 * 1024 if args.rate_limit else None,
+                   client_rate_limit=args.client_rate_limit * 1024 * 1024 if args.client_rate_limit else None,
+                   operation_rate_limits=operation_rates,
+                   cluster_nodes=[node.strip() for node in args.cluster.split(',')] if args.cluster else None,
+                   node_id=args.node_id,
+                   vnodes=args.vnodes,
+                   durability=args.durability)
+    if args.workers > 1:
+        from prefork import Supervisor
+
+        # Builds the server of one worker process, which binds its own SO_REUSEPORT socket when it has
+        # not inherited one.
+        def make_server(number, listen_socket):
+            return server_class(args.host, args.port, args.storage, listen_socket=listen_socket,
+                                reuse_port=listen_socket is None,
+                                **worker_options(options, number, args.workers))
+
+        server = Supervisor(make_server, args.workers, args.host, args.port, args.backlog, args.reuse_port)
+    else:
+        server = server_class(args.host, args.port, args.storage, **options)
     server.start()
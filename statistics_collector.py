@@ -1,24 +1,41 @@
 from datetime import datetime
+import argparse
+import atexit
+import fcntl
 import json
 import os
+import threading
 
 
 # Class to call which will collect statistics of the files in the network.
-class Network_Statistics:
-    def __init__(self, file_name='network_statistics.json'):
-        self.transfer_statistics = []
+# One instance is shared by every connection of a server. Records are buffered in memory and a
+# background thread appends them in batches to a JSON Lines file (one record per line), so a transfer
+# never waits for the disk and the cost of a record does not grow with the history.
+# When the file would grow past max_bytes it is rotated to <file>.1, <file>.2, ... keeping backups old files.
+# With shared, several processes append to the same log: each flush holds an flock on <file>.lock,
+# so batches from different processes never interleave and only one process rotates the file at a time.
+class StatisticsLog:
+    def __init__(self, file_name='network_statistics.jsonl', flush_interval=1.0, batch_size=512,
+                 max_bytes=16 * 1024 * 1024, backups=5, shared=False):
         self.stats_file = file_name
-        # Creates 'network_statistics.json' file if it doesn't exist. If it does, modifies the data.
-        if os.path.exists(file_name):
-            try:
-                with open(file_name, 'r') as file:
-                    self.transfer_statistics = json.load(file)
-            except (json.JSONDecodeError, IOError):
-                self.transfer_statistics = []
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.pending = []
+        self.lock = threading.Lock()
+        # Serializes writers, so a flush from close() and one from the background thread never interleave.
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.shared = shared
+        self.closed = False
+        self.flusher = threading.Thread(target=self.run, name='statistics-flusher', daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
 
     # Function to collect the statistics of the files in the network.
     def transfer_stats(self, operation, file_name, size, duration, rate):
-        self.transfer_statistics.append({
+        self.record({
             'timestamp': datetime.now().isoformat(),
             'operation': operation,
             'filename': file_name,
@@ -27,10 +44,116 @@ class Network_Statistics:
             'mbps_rate': rate
         })
 
-        self.save_stats()
+    # Method to queue one record. A full batch wakes the flusher early.
+    def record(self, record):
+        with self.lock:
+            self.pending.append(record)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wake.set()
+
+    # Background loop that flushes the buffer every flush_interval seconds or when a batch fills up.
+    def run(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except OSError as ex:
+                print(f"Statistics flush failed: {str(ex)}")
+
+    # Method to append every buffered record to the log file.
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                records, self.pending = self.pending, []
+            if not records:
+                return
+            if self.shared:
+                with open(self.stats_file + '.lock', 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    self.write_records(records)
+            else:
+                self.write_records(records)
+
+    # Method to append records to the log file, rotating it at record boundaries. The caller holds write_lock.
+    def write_records(self, records):
+        size = self.current_size()
+        file = open(self.stats_file, 'ab')
+        try:
+            for record in records:
+                line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+                if self.max_bytes and size and size + len(line) > self.max_bytes:
+                    file.close()
+                    self.rotate()
+                    file = open(self.stats_file, 'ab')
+                    size = 0
+                file.write(line)
+                size += len(line)
+        finally:
+            file.close()
+
+    def current_size(self):
+        try:
+            return os.path.getsize(self.stats_file)
+        except FileNotFoundError:
+            return 0
+
+    # Method to shift <file> to <file>.1, <file>.1 to <file>.2 and so on, dropping the oldest backup.
+    def rotate(self):
+        if not self.current_size():
+            return
+        if not self.backups:
+            os.remove(self.stats_file)
+            return
+        for number in range(self.backups - 1, 0, -1):
+            source = f'{self.stats_file}.{number}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.stats_file}.{number + 1}')
+        os.replace(self.stats_file, f'{self.stats_file}.1')
+
+    # Method to stop the background thread and write out whatever is still buffered.
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wake.set()
+        self.flusher.join()
+        self.flush()
+
+
+# Reads every record of a statistics log, oldest first, including its rotated backups.
+def read_records(file_name='network_statistics.jsonl'):
+    number = 1
+    while os.path.exists(f'{file_name}.{number}'):
+        number += 1
+    paths = [f'{file_name}.{backup}' for backup in range(number - 1, 0, -1)] + [file_name]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# Converts the old network_statistics.json (one JSON array, rewritten on every transfer) to JSON Lines.
+# The records are appended to target, so converting into an existing log keeps what it already holds.
+# Returns the number of records converted.
+def convert_json_log(source='network_statistics.json', target='network_statistics.jsonl'):
+    with open(source) as file:
+        records = json.load(file)
+    with open(target, 'a') as file:
+        for record in records:
+            file.write(json.dumps(record, separators=(',', ':')) + '\n')
+    return len(records)
 
-    # Saves the statistics in json format which is very efficient to view offline.
-    def save_stats(self, file_name='network_statistics.json'):
-        with open(file_name, 'w') as file:
-            json.dump(self.transfer_statistics, file, indent=2)
 
+# Running this file converts an old statistics file: python statistics_collector.py network_statistics.json
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert network_statistics.json to the JSON Lines statistics log')
+    parser.add_argument('source', nargs='?', default='network_statistics.json')
+    parser.add_argument('target', nargs='?', default='network_statistics.jsonl')
+    args = parser.parse_args()
+    count = convert_json_log(args.source, args.target)
+    print(f'Converted {count} records from {args.source} to {args.target}')
@@ -0,0 +1,324 @@
+import argparse
+import errno
+import hashlib
+import json
+import mmap
+import os
+import threading
+import unicodedata
+from durability import sync_directory
+from read_cache import MemoryReader
+
+# Where the stored files of a FileStorage live inside its root. A hashed layout puts each file in nested
+# fan-out directories named after the hash of its name, e.g. server_storage/3/f/report.pdf for LEVELS
+# levels of WIDTH hex digits: 256 directories, about 4,000 files each with a million files stored. File systems
+# that index their directories (ext4, XFS) look names up about as fast in one directory of a million files,
+# but every listing, backup or cleanup then works through it in one piece; more, emptier directories cost
+# a slower lookup each (see benchmarks/bench_layout.py). The flat layout of older stores (every file straight
+# in the root) is levels 0. The layout of a store is recorded in LAYOUT_FILE; a store without one is flat when
+# it already holds files and hashed when it is new.
+LAYOUT_FILE = '.layout'
+LEVELS = 2
+WIDTH = 1
+MAX_LEVELS = 4
+MAX_WIDTH = 4
+HEX_DIGITS = frozenset('0123456789abcdef')
+
+# Directory of a store's root that migrate moves files into while they are in the way of fan-out directories.
+PARKING_DIR = '.migrating'
+
+# Longest file name accepted, in UTF-8 bytes: the 255 byte limit of common file systems, less room for the
+# suffixes of staged uploads ('.part.chunks').
+MAX_NAME_BYTES = 240
+
+
+# Raised for a file name a client may not use.
+class InvalidName(ValueError):
+    pass
+
+
+# Returns the name a file is stored under: name in Unicode NFC form, so the same name typed on different systems
+# refers to the same file. Raises InvalidName for names that could escape the storage directory or clash
+# with its own entries: empty names, names with path separators, NUL or other control characters, names
+# starting with '.' (which includes '.' and '..') and names too long for the file system.
+def normalize_name(name):
+    if not isinstance(name, str) or not name:
+        raise InvalidName('the name is empty')
+    name = unicodedata.normalize('NFC', name)
+    if name[0] == '.':
+        raise InvalidName(f'{name!r} starts with a dot')
+    if '/' in name or '\\' in name:
+        raise InvalidName(f'{name!r} contains a path separator')
+    if any(ord(character) < 32 or ord(character) == 127 for character in name):
+        raise InvalidName(f'{name!r} contains a control character')
+    try:
+        size = len(name.encode('utf-8'))
+    except UnicodeEncodeError:
+        raise InvalidName(f'{name!r} is not valid Unicode')
+    if size > MAX_NAME_BYTES:
+        raise InvalidName(f'the name is {size} bytes long, more than {MAX_NAME_BYTES}')
+    return name
+
+
+# Returns the normalized form of name, or None when it is not a valid file name.
+def valid_name(name):
+    try:
+        return normalize_name(name)
+    except InvalidName:
+        return None
+
+
+# Class that maps file names to paths under root. Names are expected to have been through normalize_name
+# already; path_for only refuses names that would leave the directory, as a last line of defence.
+class StorageLayout:
+    def __init__(self, root, levels=LEVELS, width=WIDTH):
+        if not 0 <= levels <= MAX_LEVELS or not 1 <= width <= MAX_WIDTH:
+            raise ValueError(f'Unsupported layout: {levels} levels of {width} hex digits')
+        self.root = root
+        self.levels = levels
+        self.width = width
+        # Fan-out directories known to exist, so a commit does not have to create them again.
+        self.directories = set()
+        self.lock = threading.Lock()
+
+    @property
+    def hashed(self):
+        return self.levels > 0
+
+    # Method to describe the layout in words, for messages.
+    def describe(self):
+        if not self.hashed:
+            return 'flat'
+        return (f'hashed, {self.levels} level{"s" if self.levels > 1 else ""} of {self.width} '
+                f'hex digit{"s" if self.width > 1 else ""}')
+
+    # Method to get the fan-out directory names of a file, from the root down.
+    def buckets(self, file_name):
+        digest = hashlib.blake2b(file_name.encode('utf-8'), digest_size=8).hexdigest()
+        return [digest[level * self.width:(level + 1) * self.width] for level in range(self.levels)]
+
+    # Method to get the on-disk path of a stored file.
+    def path_for(self, file_name):
+        if not file_name or file_name[0] == '.' or '/' in file_name or '\\' in file_name or '\0' in file_name:
+            raise InvalidName(f'{file_name!r} is not a valid file name')
+        if not self.levels:
+            return os.path.join(self.root, file_name)
+        return os.path.join(self.root, *self.buckets(file_name), file_name)
+
+    # Method to check whether path is where one of the layout's fan-out directories goes, or would go.
+    def is_bucket(self, path):
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        return len(parts) <= self.levels and all(len(part) == self.width and HEX_DIGITS.issuperset(part)
+                                                 for part in parts)
+
+    # Method to create the fan-out directories that will hold path. Returns the directories whose entries
+    # changed, parents first, which must be synced for the new directories to survive a crash. Raises
+    # NotADirectoryError when a file is where one of them belongs, e.g. a file named 'a' left in the root of
+    # a flat store.
+    def make_parent(self, path):
+        directory = os.path.dirname(path)
+        if not self.levels or directory in self.directories:
+            return []
+        changed = []
+        parent = self.root
+        for bucket in os.path.relpath(directory, self.root).split(os.sep):
+            path = os.path.join(parent, bucket)
+            try:
+                os.mkdir(path)
+                changed.append(parent)
+            except FileExistsError:
+                if not os.path.isdir(path):
+                    raise NotADirectoryError(errno.ENOTDIR, 'A file is in the way of a fan-out directory', path)
+            parent = path
+        with self.lock:
+            self.directories.add(directory)
+        return changed
+
+    # Method to list every stored file as (name, os.stat_result). Hidden entries of the root, such as the
+    # staging area, and anything that is not where the layout puts files are skipped.
+    def scan(self):
+        yield from self.scan_directory(self.root, self.levels)
+
+    # Method to list the stored files under directory, which is levels fan-out levels above the files.
+    def scan_directory(self, directory, levels):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if not levels:
+                    if entry.is_file():
+                        yield entry.name, entry.stat()
+                elif len(entry.name) == self.width and entry.is_dir():
+                    yield from self.scan_directory(entry.path, levels - 1)
+
+    # Method to record the layout in the root, so the store is opened with it from now on.
+    def save(self):
+        path = os.path.join(self.root, LAYOUT_FILE)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'levels': self.levels, 'width': self.width}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+        sync_directory(self.root)
+
+
+# Returns the layout recorded in a store's root, or None when it has none.
+def read_layout(root):
+    try:
+        with open(os.path.join(root, LAYOUT_FILE)) as file:
+            record = json.load(file)
+    except FileNotFoundError:
+        return None
+    return StorageLayout(root, int(record['levels']), int(record['width']))
+
+
+# Returns whether a directory holds any file that is not hidden, i.e. is a flat store with files in it.
+def has_plain_files(root):
+    with os.scandir(root) as entries:
+        return any(not entry.name.startswith('.') and entry.is_file() for entry in entries)
+
+
+# Returns whether the store at root has no recorded layout but already has files, so open_layout keeps it
+# flat until it is migrated.
+def is_flat_store(root):
+    return os.path.isdir(root) and read_layout(root) is None and has_plain_files(root)
+
+
+# Returns the layout of the store at root. A store with no recorded layout keeps the flat layout when it
+# already has files, until it is migrated, and is given the default hashed layout when it has none.
+def open_layout(root):
+    layout = read_layout(root)
+    if layout is not None:
+        return layout
+    if has_plain_files(root):
+        return StorageLayout(root, 0)
+    layout = StorageLayout(root)
+    layout.save()
+    return layout
+
+
+# Smallest file worth mapping. Setting a mapping up and tearing it down costs more than copying a smaller
+# file with read (see benchmarks/bench_layout.py).
+MAP_MIN_SIZE = 1024 * 1024
+
+
+# Read-only file object over a memory map of an open file, which may be closed once this is made. It reads
+# like MemoryReader, the reader of the read cache, and has the same view method, so the servers send it
+# straight from the page cache, without reading it into a buffer first. The file is unmapped once the reader
+# and every view of it are gone.
+class MappedFile(MemoryReader):
+    def __init__(self, file):
+        self.size = os.fstat(file.fileno()).st_size
+        # A file of 0 bytes cannot be mapped.
+        self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        super().__init__(self.mapping)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.data.release()
+                if self.size:
+                    self.mapping.close()
+            except BufferError:
+                # A view of it is still being sent; the mapping goes away with the last one.
+                pass
+        super().close()
+
+
+# Moves every file of the store at root to where a hashed layout of levels and width puts it (levels 0
+# moves them back to the flat layout), then records the layout. Names are normalized on the way; files whose
+# names are not valid, or whose normalized name is taken, are left where they are and listed. Files where a
+# fan-out directory belongs, such as a file named 'a' in a flat store for a width of 1, are first moved out
+# of the way, into PARKING_DIR.
+# The server must not be running. Interrupted, it can simply be run again. Returns (files moved, files left).
+def migrate(root, levels=LEVELS, width=WIDTH, dry_run=False):
+    current = read_layout(root) or StorageLayout(root, 0)
+    target = StorageLayout(root, levels, width)
+    parking = os.path.join(root, PARKING_DIR)
+    # Files may be in the flat root, in the current layout or, after an interrupted run, in the target one or
+    # parked.
+    sources = {}
+    layouts = [StorageLayout(root, 0), current, target]
+    if os.path.isdir(parking):
+        layouts.append(StorageLayout(parking, 0))
+    for layout in layouts:
+        for name, _ in layout.scan():
+            sources.setdefault(layout.path_for(name), name)
+
+    moved, left = 0, []
+    changed = set()
+    if not dry_run:
+        for path, name in list(sources.items()):
+            parked = os.path.join(parking, name)
+            if not target.is_bucket(path) or os.path.exists(parked):
+                continue
+            os.makedirs(parking, exist_ok=True)
+            os.rename(path, parked)
+            changed.update((os.path.dirname(path), root))
+            del sources[path]
+            sources[parked] = name
+
+    for path, name in sources.items():
+        file_name = valid_name(name)
+        if file_name is None:
+            left.append(f'{path!r}: invalid file name')
+            continue
+        destination = target.path_for(file_name)
+        if destination == path:
+            continue
+        if os.path.exists(destination):
+            left.append(f'{path!r}: {destination!r} already exists')
+            continue
+        if not dry_run:
+            try:
+                changed.update(target.make_parent(destination))
+            except NotADirectoryError as ex:
+                left.append(f'{path!r}: {ex.filename!r} is a file, not a directory')
+                continue
+            os.rename(path, destination)
+            changed.update((os.path.dirname(path), os.path.dirname(destination)))
+        moved += 1
+
+    if not dry_run:
+        for directory in changed:
+            sync_directory(directory)
+        remove_empty_buckets(root, target)
+        try:
+            os.rmdir(parking)
+        except OSError:
+            pass
+        target.save()
+    return moved, left
+
+
+# Removes the fan-out directories that are empty, or that the layout does not use, once they are empty.
+def remove_empty_buckets(root, layout):
+    with os.scandir(root) as entries:
+        buckets = [entry.path for entry in entries if not entry.name.startswith('.') and entry.is_dir()]
+    for bucket in buckets:
+        for directory, _, _ in os.walk(bucket, topdown=False):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+    with layout.lock:
+        layout.directories.clear()
+
+
+# Running this file migrates a store: python storage_layout.py server_storage [--levels 2] [--width 2]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move the files of a storage directory to a hashed (or flat) '
+                                                 'layout; stop the server first')
+    parser.add_argument('root', nargs='?', default='server_storage')
+    parser.add_argument('--levels', type=int, default=LEVELS, help='fan-out levels, 0 for the flat layout')
+    parser.add_argument('--width', type=int, default=WIDTH, help='hex digits of the name hash per level')
+    parser.add_argument('--dry-run', action='store_true', help='only count the files that would move')
+    args = parser.parse_args()
+    before = (read_layout(args.root) or StorageLayout(args.root, 0)).describe()
+    moved, left = migrate(args.root, args.levels, args.width, args.dry_run)
+    for line in left:
+        print(f'Left in place: {line}')
+    after = StorageLayout(args.root, args.levels, args.width).describe()
+    print(f'{"Would move" if args.dry_run else "Moved"} {moved} files of {args.root} from the {before} layout '
+          f'to the {after} layout; {len(left)} left in place')
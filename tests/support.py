@@ -0,0 +1,51 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Directory holding server_side.py and the other project modules, and the benchmark helpers that start servers.
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from bench_utils import start_server, stop_server
+from transfer_client import TransferClient
+
+
+# Base class of tests that talk to a server_side.py started in a temporary directory, with the threaded
+# engine unless a subclass sets engine. The server stores its files in work_dir/server_storage; extra_args
+# is passed to it on top of the engine.
+class ServerTestCase(unittest.TestCase):
+    engine = 'threaded'
+    extra_args = ()
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.storage = os.path.join(self.work_dir, 'server_storage')
+        self.start()
+
+    # Method to start the server, on port when it is given, and connect self.client to it.
+    def start(self, port=None):
+        self.process, self.port = start_server(self.work_dir, port, extra_args=['--engine', self.engine,
+                                                                                *self.extra_args])
+        self.client = TransferClient('127.0.0.1', self.port, timeout=10).connect()
+
+    # Method to stop the server and start it again on the same port and storage, e.g. after changing files
+    # behind its back.
+    def restart(self):
+        self.client.close()
+        stop_server(self.process)
+        self.start(self.port)
+
+    def tearDown(self):
+        self.client.close()
+        stop_server(self.process)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    # Method to open another connection to the server, closed with the test.
+    def connect(self):
+        client = TransferClient('127.0.0.1', self.port, timeout=10).connect()
+        self.addCleanup(client.close)
+        return client
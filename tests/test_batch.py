@@ -0,0 +1,158 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unicodedata
+import unittest
+import zlib
+
+from support import ServerTestCase
+from transfer_client import TransferClient
+import protocol
+from protocol import IntegrityError
+from server_side import batch_names
+
+
+class BatchNamesTest(unittest.TestCase):
+    def test_names_are_a_json_list_of_strings(self):
+        self.assertEqual(batch_names(b'["a.txt", "b.txt"]'), ['a.txt', 'b.txt'])
+        self.assertEqual(batch_names(b''), [])
+        for payload in (b'{"a": 1}', b'["a", 2]', b'not json'):
+            with self.assertRaises(ValueError, msg=payload):
+                batch_names(payload)
+
+
+# Batch commands: delete_many, stat_many, upload_many and download_many.
+class BatchTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = {
+            'small.txt': b'small file',
+            'empty.txt': b'',
+            'large.bin': os.urandom(3 * protocol.CHUNK_SIZE + 11),
+        }
+        self.download_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.download_dir)
+
+    def upload_all(self, client=None, overwrite=False):
+        batch = [(name, io.BytesIO(data), len(data)) for name, data in self.files.items()]
+        success, results = (client or self.client).upload_many(batch, overwrite)
+        self.assertTrue(success, results)
+        return results
+
+    def download(self, name):
+        file = io.BytesIO()
+        success, message = self.client.download(name, file)
+        return file.getvalue() if success else None
+
+    def test_upload_many(self):
+        self.assertEqual(self.upload_all(), dict.fromkeys(self.files, 'ok'))
+        for name, data in self.files.items():
+            self.assertEqual(self.download(name), data)
+
+    def test_upload_many_reports_existing_files(self):
+        self.client.upload('small.txt', io.BytesIO(b'old'), 3)
+        results = self.upload_all()
+        self.assertEqual(results['small.txt'], 'exists')
+        self.assertEqual(results['large.bin'], 'ok')
+        self.assertEqual(self.download('small.txt'), b'old')
+        self.assertEqual(self.upload_all(overwrite=True)['small.txt'], 'ok')
+        self.assertEqual(self.download('small.txt'), self.files['small.txt'])
+
+    def test_unverified_upload_many(self):
+        client = TransferClient('127.0.0.1', self.port, timeout=10, verify=False).connect()
+        self.addCleanup(client.close)
+        self.assertEqual(self.upload_all(client), dict.fromkeys(self.files, 'ok'))
+        self.assertEqual(self.download('large.bin'), self.files['large.bin'])
+
+    def test_encoded_member_is_refused(self):
+        compressed = zlib.compress(b'x' * 1000)
+        request = self.client.new_request(protocol.CMD_UPLOAD_MANY, flags=protocol.FLAG_MORE)
+        member = protocol.member_frame(request, 'encoded.txt', 0, True, meta={'encoding': 'zlib', 'size': 1000})
+        plain = protocol.member_frame(request, 'plain.txt', 5, False)
+        self.client.frames.send_frames([(request, b''), (member, b''),
+                                        (protocol.data_frame(member, False), compressed), (plain, b'hello')])
+        response = self.client.read_response(request)
+        self.assertEqual(json.loads(self.client.frames.read_payload(response)),
+                         {'encoded.txt': 'invalid', 'plain.txt': 'ok'})
+        self.assertIsNone(self.download('encoded.txt'))
+        self.assertEqual(self.download('plain.txt'), b'hello')
+
+    def test_download_many(self):
+        self.upload_all()
+        success, results = self.client.download_many(['large.bin', 'missing.txt', 'small.txt'], self.download_dir)
+        self.assertTrue(success, results)
+        self.assertEqual(results, {'large.bin': 'ok', 'missing.txt': 'not_found', 'small.txt': 'ok'})
+        for name in ('large.bin', 'small.txt'):
+            with open(os.path.join(self.download_dir, name), 'rb') as file:
+                self.assertEqual(file.read(), self.files[name])
+        self.assertFalse(os.path.exists(os.path.join(self.download_dir, 'missing.txt')))
+
+    def test_download_many_by_invalid_and_nfd_names(self):
+        # The same names decomposed, as macOS file systems spell them, reach the files stored under NFC.
+        names = {'café.txt': os.urandom(500), 'naïve.bin': os.urandom(2 * protocol.CHUNK_SIZE)}
+        self.assertTrue(self.client.upload_many([(name, io.BytesIO(data), len(data))
+                                                 for name, data in names.items()])[0])
+        decomposed = [unicodedata.normalize('NFD', name) for name in names]
+        success, results = self.client.download_many(decomposed + ['../escape'], self.download_dir)
+        self.assertEqual(results, dict.fromkeys(decomposed, 'ok') | {'../escape': 'invalid'})
+        for name, data in names.items():
+            with open(os.path.join(self.download_dir, unicodedata.normalize('NFD', name)), 'rb') as file:
+                self.assertEqual(file.read(), data)
+        self.assertTrue(self.client.ping())
+
+    def test_files_left_unread_are_skipped(self):
+        self.upload_all()
+        success, response = self.client.start_download_many(['large.bin', 'small.txt', 'large.bin', 'empty.txt'])
+        self.assertTrue(response.meta.get('verify'))
+        files = self.client.iter_download_many(response)
+        name, status, chunks = next(files)
+        self.assertEqual(next(chunks), self.files['large.bin'][:protocol.CHUNK_SIZE])
+        name, status, chunks = next(files)
+        self.assertEqual((name, b''.join(chunks)), ('small.txt', self.files['small.txt']))
+        next(files)
+        name, status, chunks = next(files)
+        self.assertEqual((name, b''.join(chunks)), ('empty.txt', b''))
+        self.assertEqual(list(files), [])
+        self.assertTrue(self.client.ping())
+
+    def test_mismatched_download_is_reported(self):
+        self.upload_all()
+        success, response = self.client.start_download_many(['large.bin', 'small.txt'])
+        read_trailer = self.client.frames.read_trailer
+        self.client.frames.read_trailer = lambda member: read_trailer(member) + '0'
+        files = self.client.iter_download_many(response)
+        name, status, chunks = next(files)
+        with self.assertRaises(IntegrityError):
+            b''.join(chunks)
+        self.client.frames.read_trailer = read_trailer
+        self.assertEqual(b''.join(next(files)[2]), self.files['small.txt'])
+
+    def test_stat_many(self):
+        self.upload_all()
+        success, entries = self.client.stat_many(['small.txt', 'missing.txt'], checksums=True)
+        self.assertTrue(success, entries)
+        self.assertIsNone(entries['missing.txt'])
+        self.assertEqual(entries['small.txt']['size'], len(self.files['small.txt']))
+        self.assertEqual(len(entries['small.txt']['checksum']), 64)
+
+    def test_delete_many(self):
+        self.upload_all()
+        success, results = self.client.delete_many(['small.txt', 'missing.txt'])
+        self.assertEqual(results, {'small.txt': 'ok', 'missing.txt': 'not_found'})
+        self.assertIsNone(self.download('small.txt'))
+        self.assertEqual(self.download('empty.txt'), b'')
+
+    def test_bad_batch_request_is_invalid(self):
+        response, text = self.client.request(protocol.CMD_DELETE_MANY, payload=b'{"a": 1}')
+        self.assertEqual(response.status, protocol.STATUS_INVALID)
+        self.assertTrue(self.client.ping())
+
+
+class AsyncBatchTest(BatchTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
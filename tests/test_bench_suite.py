@@ -0,0 +1,60 @@
+import argparse
+import unittest
+
+import support  # noqa: F401 (puts the project modules on the path)
+from bench_suite import SCENARIOS, compare, run_suite
+
+
+def metric(value, unit='MB/s', better='higher'):
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def results(**metrics):
+    return {'meta': {}, 'metrics': {name.replace('_', '.'): value for name, value in metrics.items()}}
+
+
+class CompareTest(unittest.TestCase):
+    def verdicts(self, baseline, current, threshold=10.0):
+        rows, regressions = compare(baseline, current, threshold)
+        return {row[0]: row[-1] for row in rows}, regressions
+
+    def test_verdicts(self):
+        baseline = results(large_upload=metric(100), large_download=metric(100), small_upload=metric(100),
+                           listing_full=metric(10, 'ms', 'lower'))
+        current = results(large_upload=metric(85), large_download=metric(120), small_upload=metric(95),
+                          listing_full=metric(12, 'ms', 'lower'))
+        verdicts, regressions = self.verdicts(baseline, current)
+        self.assertEqual(verdicts, {'large.upload': 'REGRESSION', 'large.download': 'improved',
+                                    'small.upload': 'ok', 'listing.full': 'REGRESSION'})
+        self.assertEqual(regressions, 2)
+        self.assertEqual(self.verdicts(baseline, current, threshold=25)[1], 0)
+
+    def test_missing_and_new_metrics(self):
+        verdicts, regressions = self.verdicts(results(large_upload=metric(100)), results(small_upload=metric(5)))
+        self.assertEqual(verdicts, {'large.upload': 'missing', 'small.upload': 'new'})
+        self.assertEqual(regressions, 0)
+
+    def test_zero_baseline(self):
+        self.assertEqual(self.verdicts(results(small_stat=metric(0)), results(small_stat=metric(5)))[0],
+                         {'small.stat': 'ok'})
+
+
+# A run of every scenario, cut down so it takes a few seconds.
+class RunSuiteTest(unittest.TestCase):
+    def test_every_scenario_records_its_metrics(self):
+        args = argparse.Namespace(scenarios=SCENARIOS, engine='threaded', durability='none', no_verify=False,
+                                  delay=0.0, bandwidth=None, window='4M', large_size='1M', small_size='1K',
+                                  small_files=20, scaling_size='64K', clients=[1, 2], listing_files=[10, 30],
+                                  duration=0.5, repeat=1)
+        document = run_suite(args)
+        self.assertEqual(document['meta']['durability'], 'none')
+        self.assertIsNone(document['meta']['link'])
+        metrics = document['metrics']
+        for name in ('large.upload', 'small.delete', 'scaling.clients-2.throughput', 'listing.files-30.page'):
+            self.assertGreater(metrics[name]['value'], 0, name)
+        self.assertEqual(metrics['listing.files-10.full']['better'], 'lower')
+        self.assertEqual(compare(document, document, 10.0)[1], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import importlib
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+
+from support import ServerTestCase
+
+
+# Imports client_side.py, or returns None when Flask is not installed. The module makes its upload folder
+# in the working directory, so it is imported from a scratch directory.
+def import_client_side():
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        return importlib.import_module('client_side')
+    except ImportError:
+        return None
+    finally:
+        os.chdir(cwd)
+
+
+client_side = import_client_side()
+
+
+# Base class of tests that drive the Flask client with its test client, connected to a test server.
+@unittest.skipIf(client_side is None, 'Flask is not installed')
+class WebClientTestCase(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.web = client_side.app.test_client()
+        response = self.web.post('/connect', json={'host': '127.0.0.1', 'port': self.port})
+        self.assertEqual(response.status_code, 200, response.get_json())
+
+    def tearDown(self):
+        client_side.client.close()
+        super().tearDown()
+
+    # Method to read a file back from the test server.
+    def stored(self, name):
+        file = io.BytesIO()
+        success, message = self.client.download(name, file)
+        return file.getvalue() if success else None
+
+
+# Browser uploads piped to the server by the upload route.
+class WebUploadTest(WebClientTestCase):
+    def put(self, name, data, overwrite=False, **options):
+        return self.web.put(f'/upload?name={name}&overwrite={str(overwrite).lower()}', data=data, **options)
+
+    def test_put_streams_the_body(self):
+        data = os.urandom(300 * 1024)
+        response = self.put('a.bin', data)
+        self.assertTrue(response.get_json()['success'], response.get_json())
+        self.assertEqual(self.stored('a.bin'), data)
+
+    def test_put_needs_overwrite_for_an_existing_file(self):
+        self.put('a.bin', b'first')
+        self.assertFalse(self.put('a.bin', b'second').get_json()['success'])
+        self.assertTrue(self.put('a.bin', b'second', overwrite=True).get_json()['success'])
+        self.assertEqual(self.stored('a.bin'), b'second')
+
+    def test_put_name_is_made_safe(self):
+        self.assertTrue(self.put('../../etc/passwd', b'data').get_json()['success'])
+        self.assertEqual(self.stored('etc_passwd'), b'data')
+
+    def test_put_without_name(self):
+        self.assertEqual(self.put('', b'data').get_json()['message'], 'No file selected')
+
+    def test_put_too_large(self):
+        limit = client_side.app.config['MAX_CONTENT_LENGTH']
+        client_side.app.config['MAX_CONTENT_LENGTH'] = 10
+        self.addCleanup(client_side.app.config.__setitem__, 'MAX_CONTENT_LENGTH', limit)
+        self.assertEqual(self.put('a.bin', b'x' * 11).status_code, 413)
+        self.assertIsNone(self.stored('a.bin'))
+
+    def test_short_body_fails_and_reconnects(self):
+        response = self.put('a.bin', b'x' * 1000, headers={'Content-Length': '5000'})
+        self.assertFalse(response.get_json()['success'])
+        self.assertTrue(self.put('b.bin', b'data').get_json()['success'])
+        self.assertEqual(self.stored('b.bin'), b'data')
+
+    def test_multipart_post(self):
+        data = os.urandom(100 * 1024)
+        response = self.web.post('/upload', data={'file': (io.BytesIO(data), 'form.bin'), 'overwrite': 'false'})
+        self.assertTrue(response.get_json()['success'], response.get_json())
+        self.assertEqual(self.stored('form.bin'), data)
+
+
+@unittest.skipIf(client_side is None, 'Flask is not installed')
+class ParseRangeTest(unittest.TestCase):
+    def test_single_ranges(self):
+        self.assertEqual(client_side.parse_range('bytes=0-99'), {'offset': 0, 'length': 100})
+        self.assertEqual(client_side.parse_range('bytes=100-'), {'offset': 100})
+        self.assertEqual(client_side.parse_range('bytes=-500'), {'suffix': 500})
+
+    def test_ranges_served_as_whole_file(self):
+        for header in (None, '', 'items=0-9', 'bytes=0-9,20-29', 'bytes=9-0', 'bytes=a-b', 'bytes=-'):
+            self.assertIsNone(client_side.parse_range(header), header)
+
+
+# Downloads piped from the server to the browser by the download route.
+class WebDownloadTest(WebClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(300 * 1024 + 5)
+        self.client.upload('data.bin', io.BytesIO(self.data), len(self.data))
+
+    def get(self, byte_range=None, name='data.bin'):
+        return self.web.get(f'/download/{name}', headers={'Range': byte_range} if byte_range else {})
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.data, self.data)
+
+    def test_range(self):
+        response = self.get('bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(response.data, self.data[100:200])
+
+    def test_open_and_suffix_ranges(self):
+        self.assertEqual(self.get('bytes=300000-').data, self.data[300000:])
+        response = self.get('bytes=-10')
+        self.assertEqual(response.headers['Content-Range'],
+                         f'bytes {len(self.data) - 10}-{len(self.data) - 1}/{len(self.data)}')
+        self.assertEqual(response.data, self.data[-10:])
+
+    def test_unsatisfiable_range(self):
+        self.assertEqual(self.get(f'bytes={len(self.data)}-').status_code, 416)
+        self.assertEqual(self.get(f'bytes={len(self.data) + 10}-').status_code, 416)
+        self.assertEqual(self.get('bytes=0-9').status_code, 206)
+
+    def test_multiple_ranges_get_the_whole_file(self):
+        response = self.get('bytes=0-9,20-29')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.data)
+
+    def test_missing_file(self):
+        self.assertEqual(self.get(name='missing.bin').status_code, 404)
+
+    def test_abandoned_download_frees_its_connection(self):
+        response = self.web.get('/download/data.bin', buffered=False)
+        next(response.response)
+        response.close()
+        self.assertEqual(self.get('bytes=0-9').data, self.data[:10])
+
+
+# Batch routes: several files uploaded, downloaded as a ZIP archive or deleted with one request each.
+class WebBatchTest(WebClientTestCase):
+    def test_upload_many_maps_picked_names_to_stored_ones(self):
+        self.client.upload('my_file.txt', io.BytesIO(b'old'), 3)
+        data = {'files': [(io.BytesIO(b'new'), 'my file.txt'), (io.BytesIO(b'other'), 'other.txt')],
+                'overwrite': 'false'}
+        response = self.web.post('/upload_many', data=data).get_json()
+        self.assertEqual(response['existing'], ['my_file.txt'])
+        self.assertEqual(response['names'], {'my file.txt': 'my_file.txt', 'other.txt': 'other.txt'})
+        self.assertEqual(self.stored('other.txt'), b'other')
+
+    def test_download_many_as_archive(self):
+        self.client.upload('a.txt', io.BytesIO(b'aaa'), 3)
+        self.client.upload('b.txt', io.BytesIO(b'bbb'), 3)
+        response = self.web.get('/download_many?name=a.txt&name=missing.txt&name=b.txt')
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            self.assertEqual(archive.namelist(), ['a.txt', 'b.txt'])
+            self.assertEqual(archive.read('b.txt'), b'bbb')
+
+    def test_delete_many(self):
+        self.client.upload('a.txt', io.BytesIO(b'aaa'), 3)
+        response = self.web.post('/delete_many', json={'names': ['a.txt', 'missing.txt']}).get_json()
+        self.assertEqual(response['results'], {'a.txt': 'ok', 'missing.txt': 'not_found'})
+        self.assertIsNone(self.stored('a.txt'))
+
+
+# Progress updates of the transfers the web client runs, as emitted to the page.
+class WebProgressTest(WebClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = []
+        emit = client_side.progress.emit
+        client_side.progress.emit = lambda event, data: self.events.append((event, data))
+        self.addCleanup(setattr, client_side.progress, 'emit', emit)
+
+    def test_upload_is_tagged_with_the_page_id(self):
+        data = os.urandom(300 * 1024)
+        response = self.web.put('/upload?name=a.bin&overwrite=false&id=upload-1', data=data)
+        self.assertTrue(response.get_json()['success'])
+        self.assertTrue(all(event == 'upload_progress' and update['id'] == 'upload-1'
+                            for event, update in self.events))
+        self.assertEqual((self.events[-1][1]['state'], self.events[-1][1]['done']), ('done', len(data)))
+        self.assertEqual(self.web.get('/transfers').get_json(), {'transfers': []})
+
+    def test_abandoned_download_is_reported_failed(self):
+        self.client.upload('a.bin', io.BytesIO(os.urandom(300 * 1024)), 300 * 1024)
+        response = self.web.get('/download/a.bin', buffered=False)
+        next(response.response)
+        response.close()
+        self.assertEqual(self.events[-1][1]['state'], 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import support  # noqa: F401 (puts the project modules on the path)
+from bench_utils import start_server, stop_server, free_port
+from transfer_client import TransferClient
+from cluster import HashRing, ClusterClient, parse_node
+import protocol
+
+
+class HashRingTest(unittest.TestCase):
+    nodes = ['127.0.0.1:4001', '127.0.0.1:4002', '127.0.0.1:4003']
+
+    def test_names_are_spread_over_the_nodes(self):
+        ring = HashRing(self.nodes)
+        names = [f'file-{number}' for number in range(3000)]
+        counts = {node: 0 for node in self.nodes}
+        for name in names:
+            counts[ring.owner(name)] += 1
+        for count in counts.values():
+            self.assertGreater(count, 700)
+        self.assertEqual(ring.owner('file-1'), HashRing(list(reversed(self.nodes))).owner('file-1'))
+
+    def test_adding_a_node_moves_only_its_share(self):
+        names = [f'file-{number}' for number in range(3000)]
+        before = HashRing(self.nodes)
+        after = HashRing(self.nodes + ['127.0.0.1:4004'])
+        moved = [name for name in names if before.owner(name) != after.owner(name)]
+        self.assertTrue(all(after.owner(name) == '127.0.0.1:4004' for name in moved))
+        self.assertLess(len(moved), 1100)
+
+    def test_meta_round_trip(self):
+        ring = HashRing(self.nodes, vnodes=16, version=3)
+        copy = HashRing.from_meta(ring.to_meta())
+        self.assertEqual((copy.nodes, copy.vnodes, copy.version), (self.nodes, 16, 3))
+        self.assertEqual(copy.owners, ring.owners)
+
+    def test_invalid_rings(self):
+        for nodes, vnodes in (([], 8), (self.nodes, 0), (['no-port'], 8)):
+            with self.assertRaises(ValueError):
+                HashRing(nodes, vnodes)
+        with self.assertRaises(TypeError):
+            HashRing.from_meta({'nodes': 'a:1'})
+        self.assertEqual(parse_node('example.com:80'), ('example.com', 80))
+
+
+# A cluster of three server processes on loopback, of which the first two make up the ring at first.
+class ClusterTest(unittest.TestCase):
+    engine = 'threaded'
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+        ports = [free_port() for _ in range(3)]
+        self.nodes = [f'127.0.0.1:{port}' for port in ports]
+        for number, port in enumerate(ports):
+            directory = os.path.join(self.work_dir, f'node-{number}')
+            os.makedirs(directory)
+            process, _ = start_server(directory, port, ['--engine', self.engine, '--cluster',
+                                                        ','.join(self.nodes[:2]), '--node-id', self.nodes[number]])
+            self.addCleanup(stop_server, process)
+        self.client = ClusterClient([self.nodes[0]], timeout=10)
+        self.addCleanup(self.client.close)
+        self.files = {f'file-{number}.txt': b'contents of %d' % number for number in range(40)}
+
+    # Method to list the names stored on one node.
+    def stored_on(self, node):
+        success, entries, _ = self.client.client(node).list_entries(limit=0)
+        return {entry['name'] for entry in entries}
+
+    # Method to list the names ring gives to one node.
+    def owned_by(self, node, ring):
+        return {name for name in self.files if ring.owner(name) == node}
+
+    def upload_all(self):
+        for name, data in self.files.items():
+            success, message = self.client.upload(name, io.BytesIO(data), len(data))
+            self.assertTrue(success, message)
+
+    def download(self, name):
+        file = io.BytesIO()
+        success, message = self.client.download(name, file)
+        return file.getvalue() if success else None
+
+    def test_files_are_stored_on_their_owner(self):
+        self.upload_all()
+        for node in self.nodes[:2]:
+            self.assertEqual(self.stored_on(node), self.owned_by(node, self.client.ring))
+        self.assertEqual(self.stored_on(self.nodes[2]), set())
+        self.assertEqual(self.download('file-7.txt'), self.files['file-7.txt'])
+        success, entries = self.client.list_entries()
+        self.assertEqual([entry['name'] for entry in entries], sorted(self.files))
+
+    def test_node_refuses_names_it_does_not_own(self):
+        name = next(name for name in self.files if self.client.ring.owner(name) == self.nodes[1])
+        direct = TransferClient(*parse_node(self.nodes[0]), timeout=10).connect()
+        self.addCleanup(direct.close)
+        success, message = direct.upload(name, io.BytesIO(b'data'), 4)
+        self.assertFalse(success)
+        self.assertIn(self.nodes[1], message)
+
+    def test_added_node_takes_its_share(self):
+        self.upload_all()
+        success, message = self.client.add_node(self.nodes[2])
+        self.assertTrue(success, message)
+        self.assertTrue(self.client.wait_rebalanced(timeout=30))
+        ring = self.client.ring
+        self.assertEqual(ring.nodes, sorted(self.nodes))
+        for node in self.nodes:
+            self.assertEqual(self.stored_on(node), self.owned_by(node, ring))
+        for name, data in self.files.items():
+            self.assertEqual(self.download(name), data)
+
+    def test_batches_are_split_by_owner(self):
+        batch = [(name, io.BytesIO(data), len(data)) for name, data in self.files.items()]
+        success, results = self.client.upload_many(batch)
+        self.assertEqual(results, dict.fromkeys(self.files, 'ok'))
+        success, entries = self.client.stat_many(self.files)
+        self.assertTrue(all(entries[name]['size'] == len(data) for name, data in self.files.items()))
+        success, results = self.client.delete_many(self.files)
+        self.assertEqual(results, dict.fromkeys(self.files, 'ok'))
+        self.assertEqual(self.client.list_files(), (True, 'No Files Found'))
+
+    def test_stale_ring_is_refused(self):
+        stale = HashRing(self.nodes).to_meta()
+        response, text = self.client.client(self.nodes[0]).request(protocol.CMD_RING, meta=stale)
+        self.assertEqual(response.status, protocol.STATUS_INVALID)
+
+
+class AsyncClusterTest(ClusterTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
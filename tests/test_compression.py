@@ -0,0 +1,163 @@
+import io
+import os
+import unittest
+import zlib
+
+from support import ServerTestCase
+from transfer_client import TransferClient
+import compression
+import protocol
+from protocol import ProtocolError
+
+
+# Returns the peak resident memory of a process in bytes, from /proc.
+def peak_memory(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    raise unittest.SkipTest('no VmHWM in /proc')
+
+
+class DecompressorTest(unittest.TestCase):
+    def test_round_trip(self):
+        data = os.urandom(100000) + b'a' * 300000
+        for name, codec in compression.CODECS.items():
+            compressor, decompressor = codec.compressor(), codec.decompressor()
+            blocks = [compressor.compress(block) for block in compression.iter_blocks(io.BytesIO(data), len(data))]
+            blocks.append(compressor.finish())
+            self.assertEqual(b''.join(decompressor.decompress(block, len(data)) for block in blocks), data, name)
+
+    def test_output_is_capped(self):
+        for name, codec in compression.CODECS.items():
+            compressor = codec.compressor()
+            bomb = compressor.compress(b'x' * (64 * 1024 * 1024)) + compressor.finish()
+            with self.assertRaises(ProtocolError, msg=name):
+                codec.decompressor().decompress(bomb, 1 << 40)
+            compressor = codec.compressor()
+            with self.assertRaises(ProtocolError, msg=name):
+                codec.decompressor().decompress(compressor.compress(b'y' * 1000), 999)
+
+
+class NegotiationTest(unittest.TestCase):
+    def test_choose_follows_the_offer(self):
+        self.assertIs(compression.choose(['zlib']), compression.CODECS['zlib'])
+        self.assertIs(compression.choose(['brotli', 'zlib']), compression.CODECS['zlib'])
+        self.assertIsNone(compression.choose(['brotli']))
+        self.assertIsNone(compression.choose(['zlib'], supported=[]))
+        self.assertIsNone(compression.choose(None))
+
+    def test_zlib_is_always_available(self):
+        self.assertIn('zlib', compression.available())
+
+    def test_probe(self):
+        codec = compression.CODECS['zlib']
+        self.assertTrue(compression.worth_compressing(codec, b'abc' * 10000))
+        self.assertFalse(compression.worth_compressing(codec, os.urandom(30000)))
+        self.assertFalse(compression.worth_compressing(codec, b''))
+
+    def test_probed_file_replays_the_sample(self):
+        file = io.BytesIO(b'0123456789')
+        probed = compression.ProbedFile(file.read(4), file)
+        self.assertEqual(probed.read(2), b'01')
+        self.assertEqual(probed.read(5), b'23')
+        self.assertEqual(probed.read(), b'456789')
+
+    def test_unknown_codec_is_refused_by_the_client(self):
+        with self.assertRaises(ValueError):
+            TransferClient(compress='brotli')
+
+
+# Transfers between a client with compression turned on and the server.
+class CompressedTransferTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.compressing = TransferClient('127.0.0.1', self.port, timeout=10, compress='zlib').connect()
+        self.addCleanup(self.compressing.close)
+        self.text = b''.join(b'line %d of a log file\n' % number for number in range(50000))
+
+    def download(self, client, name):
+        file = io.BytesIO()
+        success, message = client.download(name, file)
+        self.assertTrue(success, message)
+        return file.getvalue()
+
+    def test_server_offers_its_codecs(self):
+        self.assertTrue(self.compressing.ping())
+        self.assertEqual(self.compressing.encodings, compression.available())
+
+    def test_compressed_upload(self):
+        success, message = self.compressing.upload('log.txt', io.BytesIO(self.text), len(self.text))
+        self.assertTrue(success, message)
+        self.assertEqual(self.download(self.client, 'log.txt'), self.text)
+
+    def test_compressed_download(self):
+        self.client.upload('log.txt', io.BytesIO(self.text), len(self.text))
+        success, response = self.compressing.start_download('log.txt')
+        self.assertEqual(response.meta.get('encoding'), 'zlib')
+        self.assertEqual(protocol.body_size(response), len(self.text))
+        self.assertEqual(b''.join(self.compressing.iter_download(response)), self.text)
+        self.assertEqual(self.download(self.compressing, 'log.txt'), self.text)
+
+    def test_incompressible_download_is_sent_raw(self):
+        data = os.urandom(200 * 1024)
+        self.client.upload('random.bin', io.BytesIO(data), len(data))
+        success, response = self.compressing.start_download('random.bin')
+        self.assertNotIn('encoding', response.meta)
+        self.assertEqual(b''.join(self.compressing.iter_download(response)), data)
+
+    def test_compressed_range(self):
+        self.client.upload('log.txt', io.BytesIO(self.text), len(self.text))
+        file = io.BytesIO()
+        self.assertTrue(self.compressing.download('log.txt', file, offset=100000, length=300000)[0])
+        self.assertEqual(file.getvalue(), self.text[100000:400000])
+
+    def test_unsupported_encoding_is_refused(self):
+        request = self.client.new_request(protocol.CMD_UPLOAD, 'a.bin', protocol.FLAG_MORE,
+                                          {'encoding': 'brotli', 'size': 10})
+        self.client.frames.send_frame(request)
+        self.client.frames.send_frame(protocol.data_frame(request, False), b'0123456789')
+        response = self.client.read_response(request)
+        self.assertEqual(response.status, protocol.STATUS_INVALID)
+        self.client.frames.read_payload(response)
+        self.assertTrue(self.client.ping())
+
+
+class AsyncCompressedTransferTest(CompressedTransferTest):
+    engine = 'asyncio'
+
+
+# A client declaring a large file and sending a small frame that inflates to it must not make the server
+# allocate it all.
+class DecompressionBombTest(ServerTestCase):
+    bomb_size = 512 * 1024 * 1024
+
+    def test_bomb_upload_is_refused(self):
+        compressor = zlib.compressobj(9)
+        piece = b'x' * (1024 * 1024)
+        bomb = b''.join(compressor.compress(piece) for _ in range(self.bomb_size // len(piece)))
+        bomb += compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        flags = protocol.FLAG_OVERWRITE | protocol.FLAG_MORE
+        request = self.client.new_request(protocol.CMD_UPLOAD, 'bomb.bin', flags,
+                                          {'encoding': 'zlib', 'size': self.bomb_size})
+        self.client.frames.send_frame(request)
+        try:
+            self.client.frames.send_frame(protocol.data_frame(request, False), bomb)
+            response = self.client.frames.recv_frame()
+        except OSError:
+            response = None
+        self.assertTrue(response is None or response.status != protocol.STATUS_OK)
+
+        other = self.connect()
+        self.assertTrue(other.ping())
+        self.assertIsNone(other.file_size('bomb.bin'))
+        self.assertLess(peak_memory(self.process.pid), 200 * 1024 * 1024)
+
+
+class DecompressionBombAsyncTest(DecompressionBombTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
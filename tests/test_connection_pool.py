@@ -0,0 +1,105 @@
+import io
+import threading
+import time
+import unittest
+
+from support import ServerTestCase
+from connection_pool import ConnectionPool
+
+
+class ConnectionPoolTest(ServerTestCase):
+    def pool(self, **options):
+        pool = ConnectionPool('127.0.0.1', self.port, timeout=10, **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    # Starts a thread that checks out a connection and keeps it until the returned event is set.
+    # Waits until the thread holds the connection.
+    def hold(self, pool, bulk=False):
+        taken = threading.Event()
+        done = threading.Event()
+
+        def work():
+            with pool.checkout(bulk):
+                taken.set()
+                done.wait(10)
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        self.assertTrue(taken.wait(10))
+        self.addCleanup(thread.join)
+        self.addCleanup(done.set)
+        return done
+
+    def test_connection_is_reused(self):
+        pool = self.pool()
+        with pool.checkout() as first:
+            self.assertTrue(first.ping())
+        with pool.checkout() as second:
+            self.assertIs(second, first)
+        self.assertEqual(pool.open_count, 1)
+
+    def test_concurrent_checkouts_get_their_own_connections(self):
+        pool = self.pool(size=4)
+        with pool.checkout() as first, pool.checkout() as second:
+            self.assertIsNot(first, second)
+            first.upload('a.txt', io.BytesIO(b'a'), 1)
+            self.assertTrue(second.download('a.txt', io.BytesIO())[0])
+        self.assertEqual(pool.open_count, 2)
+
+    def test_full_pool_waits_for_a_connection(self):
+        pool = self.pool(size=2)
+        done = self.hold(pool)
+        self.hold(pool)
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+        waiter.start()
+        time.sleep(0.2)
+        self.assertEqual(got, [])
+        done.set()
+        waiter.join(10)
+        self.assertEqual(len(got), 1)
+        pool.release(got[0])
+        self.assertEqual(pool.open_count, 2)
+
+    def test_bulk_transfers_leave_room_for_small_operations(self):
+        pool = self.pool(size=3, bulk_limit=1)
+        self.hold(pool, bulk=True)
+        self.assertFalse(pool.bulk_slots.acquire(timeout=0.1))
+        with pool.checkout() as connection:
+            self.assertTrue(connection.ping())
+
+    def test_failed_operation_discards_its_connection(self):
+        pool = self.pool()
+        with self.assertRaises(RuntimeError):
+            with pool.checkout() as broken:
+                raise RuntimeError('failed mid-frame')
+        self.assertEqual(pool.open_count, 0)
+        with pool.checkout() as connection:
+            self.assertIsNot(connection, broken)
+            self.assertTrue(connection.ping())
+
+    def test_stale_connection_is_replaced(self):
+        pool = self.pool(check_after=0)
+        with pool.checkout() as connection:
+            connection.ping()
+        self.restart()
+        with self.assertLogs('connection_pool', 'INFO') as logs:
+            self.assertTrue(pool.check())
+        self.assertIn('Reconnecting stale connection', logs.output[0])
+
+    def test_closed_pool_refuses_checkouts(self):
+        pool = self.pool()
+        pool.check()
+        pool.close()
+        self.assertEqual(pool.open_count, 0)
+        with self.assertRaises(ConnectionError):
+            pool.acquire()
+
+
+class AsyncConnectionPoolTest(ConnectionPoolTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
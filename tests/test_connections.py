@@ -0,0 +1,82 @@
+import io
+import time
+import unittest
+
+from support import ServerTestCase
+import protocol
+from protocol import Frame
+
+
+# A server started with --max-connections turns extra clients away instead of queueing them.
+class ConnectionLimitTest(ServerTestCase):
+    extra_args = ('--max-connections', '1')
+
+    def setUp(self):
+        super().setUp()
+        # The connection start_server probed the port with may hold the only slot for a moment.
+        time.sleep(0.5)
+        self.client.connect()
+
+    def test_extra_connection_is_refused(self):
+        self.assertTrue(self.client.list_files()[0])
+        other = self.connect()
+        response = other.frames.recv_frame()
+        self.assertEqual(response.status, protocol.STATUS_ERROR)
+        self.assertEqual(other.frames.read_text(response), 'Server busy')
+        self.assertIsNone(other.frames.recv_frame())
+
+    def test_slot_is_freed_when_a_client_leaves(self):
+        self.assertTrue(self.client.list_files()[0])
+        self.client.close()
+        deadline = time.monotonic() + 5
+        while True:
+            other = self.connect()
+            try:
+                self.assertTrue(other.list_files()[0])
+                return
+            except protocol.ProtocolError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+
+class AsyncConnectionLimitTest(ConnectionLimitTest):
+    engine = 'asyncio'
+
+
+# A server started with --idle-timeout closes connections that stay silent for longer.
+class IdleTimeoutTest(ServerTestCase):
+    extra_args = ('--idle-timeout', '0.5')
+
+    def test_idle_connection_is_closed(self):
+        self.assertTrue(self.client.list_files()[0])
+        time.sleep(1.5)
+        self.assertIsNone(self.client.frames.recv_frame())
+
+    def test_busy_connection_stays_open(self):
+        for _ in range(4):
+            self.assertTrue(self.client.list_files()[0])
+            time.sleep(0.25)
+
+
+class AsyncIdleTimeoutTest(IdleTimeoutTest):
+    engine = 'asyncio'
+
+
+# One client stuck in the middle of an upload must not hold up the others.
+class StalledClientTest(ServerTestCase):
+    def test_other_clients_are_served(self):
+        stalled = self.connect()
+        stalled.frames.send_frame(Frame(protocol.CMD_UPLOAD, flags=protocol.FLAG_OVERWRITE, request_id=1,
+                                        name='slow.bin', size=1024 * 1024))
+        stalled.frames.sock.sendall(b'x' * 1000)
+        self.assertTrue(self.client.upload('a.txt', io.BytesIO(b'a'), 1)[0])
+        self.assertTrue(self.client.list_files()[0])
+
+
+class AsyncStalledClientTest(StalledClientTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
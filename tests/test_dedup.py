@@ -0,0 +1,230 @@
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from support import ServerTestCase
+import protocol
+import chunk_store
+from chunk_store import ChunkStore, chunk_hash, iter_chunks
+
+
+# Returns size pseudo-random bytes, the same for every run.
+def sample_data(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+
+class ChunkingTest(unittest.TestCase):
+    def test_chunks_cover_the_stream_within_size_bounds(self):
+        data = sample_data(2 * 1024 * 1024)
+        chunks = list(iter_chunks(io.BytesIO(data)))
+        self.assertEqual(b''.join(chunk for _, chunk in chunks), data)
+        self.assertEqual([offset for offset, _ in chunks],
+                         [sum(len(chunk) for _, chunk in chunks[:index]) for index in range(len(chunks))])
+        for _, chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), chunk_store.MIN_CHUNK_SIZE)
+            self.assertLessEqual(len(chunk), chunk_store.MAX_CHUNK_SIZE)
+
+    def test_insertion_only_changes_nearby_chunks(self):
+        data = sample_data(2 * 1024 * 1024)
+        edited = data[:1000000] + b'inserted' + data[1000000:]
+        before = {chunk_hash(chunk) for _, chunk in iter_chunks(io.BytesIO(data))}
+        after = [chunk_hash(chunk) for _, chunk in iter_chunks(io.BytesIO(edited))]
+        self.assertLessEqual(len([digest for digest in after if digest not in before]), 2)
+
+    def test_empty_stream_has_no_chunks(self):
+        self.assertEqual(list(iter_chunks(io.BytesIO(b''))), [])
+
+    def test_chunk_hash_format(self):
+        self.assertTrue(chunk_store.is_chunk_hash(chunk_hash(b'data')))
+        self.assertFalse(chunk_store.is_chunk_hash(chunk_hash(b'data').upper()))
+
+
+class ChunkStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = ChunkStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def store_bytes(self, file_name, data):
+        path = os.path.join(self.root, 'source')
+        with open(path, 'wb') as file:
+            file.write(data)
+        self.store.store_file(file_name, path)
+
+    def read_file(self, file_name):
+        file, size = self.store.open_manifest(file_name)
+        with file:
+            data = file.read()
+        self.assertEqual(len(data), size)
+        return data
+
+    def test_file_round_trips_through_manifest(self):
+        data = sample_data(700 * 1024)
+        self.store_bytes('a.bin', data)
+        self.assertEqual(self.read_file('a.bin'), data)
+        file, _ = self.store.open_manifest('a.bin')
+        file.seek(300000)
+        self.assertEqual(file.read(5000), data[300000:305000])
+
+    def test_identical_files_share_chunks(self):
+        data = sample_data(700 * 1024)
+        self.store_bytes('a.bin', data)
+        self.store_bytes('b.bin', data)
+        self.assertEqual(self.store.usage(), (2 * len(data), len(data)))
+
+    def test_chunks_go_with_their_last_file(self):
+        data = sample_data(700 * 1024)
+        self.store_bytes('a.bin', data)
+        self.store_bytes('b.bin', data)
+        self.assertTrue(self.store.delete_manifest('a.bin'))
+        self.assertEqual(self.read_file('b.bin'), data)
+        self.assertTrue(self.store.delete_manifest('b.bin'))
+        self.assertEqual(self.store.usage(), (0, 0))
+        self.assertFalse(self.store.delete_manifest('b.bin'))
+
+    def test_replacing_a_file_releases_old_chunks(self):
+        self.store_bytes('a.bin', sample_data(300 * 1024, seed=1))
+        self.store_bytes('a.bin', sample_data(300 * 1024, seed=2))
+        self.assertEqual(self.store.usage(), (300 * 1024, 300 * 1024))
+
+    def test_manifest_needs_its_chunks(self):
+        digest = chunk_hash(b'data')
+        self.assertEqual(self.store.put_manifest('a.bin', [(digest, 4)]), [digest])
+        self.assertFalse(self.store.has_manifest('a.bin'))
+        self.store.put_chunk(digest, b'data')
+        self.assertEqual(self.store.put_manifest('a.bin', [(digest, 4)]), [])
+        self.assertEqual(self.read_file('a.bin'), b'data')
+
+    def test_chunk_must_match_its_hash(self):
+        with self.assertRaises(ValueError):
+            self.store.put_chunk(chunk_hash(b'data'), b'other')
+
+    def test_references_survive_a_restart(self):
+        data = sample_data(300 * 1024)
+        self.store_bytes('a.bin', data)
+        self.store_bytes('b.bin', data)
+        self.store = ChunkStore(self.root)
+        self.store.delete_manifest('a.bin')
+        self.assertEqual(self.read_file('b.bin'), data)
+
+
+# dedup_upload against a --dedup server: only chunks the server lacks cross the wire.
+class DedupUploadTest(ServerTestCase):
+    extra_args = ('--dedup',)
+
+    def download(self, name):
+        file = io.BytesIO()
+        success, result = self.client.download(name, file)
+        return success, file.getvalue() if success else result
+
+    def test_similar_file_sends_only_changed_chunks(self):
+        data = sample_data(2 * 1024 * 1024)
+        success, _, stats = self.client.dedup_upload('a.bin', io.BytesIO(data))
+        self.assertTrue(success)
+        self.assertEqual(stats['sent_bytes'], len(data))
+        edited = data[:1000000] + b'inserted' + data[1000000:]
+        success, _, stats = self.client.dedup_upload('b.bin', io.BytesIO(edited))
+        self.assertTrue(success)
+        self.assertEqual(stats['size'], len(edited))
+        self.assertLess(stats['sent_bytes'], len(edited) // 4)
+        self.assertEqual(self.download('a.bin'), (True, data))
+        self.assertEqual(self.download('b.bin'), (True, edited))
+
+    def test_existing_file_needs_overwrite(self):
+        self.client.dedup_upload('a.bin', io.BytesIO(b'first'))
+        self.assertFalse(self.client.dedup_upload('a.bin', io.BytesIO(b'second'))[0])
+        self.assertTrue(self.client.dedup_upload('a.bin', io.BytesIO(b'second'), overwrite=True)[0])
+        self.assertEqual(self.download('a.bin'), (True, b'second'))
+
+    def test_plain_upload_is_chunked_on_commit(self):
+        data = sample_data(500 * 1024)
+        self.assertTrue(self.client.upload('a.bin', io.BytesIO(data), len(data))[0])
+        self.assertFalse(os.path.exists(os.path.join(self.storage, 'a.bin')))
+        success, _, stats = self.client.dedup_upload('b.bin', io.BytesIO(data))
+        self.assertTrue(success)
+        self.assertEqual(stats['sent_chunks'], 0)
+        self.assertEqual(self.download('a.bin'), (True, data))
+        self.assertIn('a.bin', self.client.list_files()[1])
+
+    def test_ranged_download(self):
+        data = sample_data(500 * 1024)
+        self.client.dedup_upload('a.bin', io.BytesIO(data))
+        file = io.BytesIO()
+        success, _ = self.client.download('a.bin', file, offset=200000, length=100000)
+        self.assertTrue(success)
+        self.assertEqual(file.getvalue(), data[200000:300000])
+
+    def test_delete_releases_chunks(self):
+        self.client.dedup_upload('a.bin', io.BytesIO(sample_data(500 * 1024)))
+        self.assertTrue(self.client.delete('a.bin')[0])
+        self.assertFalse(self.download('a.bin')[0])
+        chunks = os.path.join(self.storage, '.chunks')
+        self.assertEqual([name for _, _, names in os.walk(chunks) for name in names], [])
+
+
+class DedupUploadAsyncTest(DedupUploadTest):
+    engine = 'asyncio'
+
+
+# Chunk hashes come from the client and name files under the store; anything but a real hash must be refused
+# before it reaches a path, or a client could read or delete files outside server_storage.
+class DedupTraversalTest(ServerTestCase):
+    extra_args = ('--dedup',)
+    bad_digests = ('../secret.txt', '../../secret.txt', '/etc/passwd', 'AB' * 20, 'ab' * 19, 'g' * 40, 7, None)
+
+    def setUp(self):
+        super().setUp()
+        self.secret = os.path.join(self.work_dir, 'secret.txt')
+        with open(self.secret, 'wb') as file:
+            file.write(b'not for clients')
+
+    def tearDown(self):
+        with open(self.secret, 'rb') as file:
+            self.assertEqual(file.read(), b'not for clients')
+        super().tearDown()
+
+    def test_chunk_query_rejects_non_hashes(self):
+        for digest in self.bad_digests:
+            response, _ = self.client.request(protocol.CMD_CHUNK_QUERY, payload=json.dumps([digest]).encode())
+            self.assertEqual(response.status, protocol.STATUS_INVALID, digest)
+
+    def test_chunk_put_rejects_non_hashes(self):
+        for digest in ('../secret.txt', '../../secret.txt', 'AB' * 20):
+            response, _ = self.client.request(protocol.CMD_CHUNK_PUT, digest, payload=b'overwritten')
+            self.assertEqual(response.status, protocol.STATUS_INVALID, digest)
+
+    def test_manifest_rejects_non_hashes(self):
+        for digest in self.bad_digests:
+            manifest = json.dumps({'chunks': [[digest, 15]]}).encode()
+            response, _ = self.client.request(protocol.CMD_MANIFEST_PUT, 'stolen.txt', protocol.FLAG_OVERWRITE,
+                                              payload=manifest)
+            self.assertEqual(response.status, protocol.STATUS_INVALID, digest)
+        self.assertFalse(self.client.download('stolen.txt', io.BytesIO())[0])
+        # Deleting the file would release its chunks, which must not reach the secret either.
+        self.client.delete('stolen.txt')
+
+    def test_real_hashes_still_work(self):
+        data = b'chunk data' * 1000
+        digest = chunk_hash(data)
+        response, text = self.client.request(protocol.CMD_CHUNK_QUERY, payload=json.dumps([digest]).encode())
+        self.assertEqual(response.status, protocol.STATUS_OK)
+        self.assertEqual(json.loads(text), [digest])
+        response, _ = self.client.request(protocol.CMD_CHUNK_PUT, digest, payload=data)
+        self.assertEqual(response.status, protocol.STATUS_OK)
+        manifest = json.dumps({'chunks': [[digest, len(data)]]}).encode()
+        response, _ = self.client.request(protocol.CMD_MANIFEST_PUT, 'real.txt', payload=manifest)
+        self.assertEqual(response.status, protocol.STATUS_OK)
+
+
+class DedupTraversalAsyncTest(DedupTraversalTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import hashlib
+import io
+import os
+import unittest
+
+from support import ServerTestCase
+import delta_sync
+import integrity
+import protocol
+from delta_sync import DeltaDecoder
+from protocol import ProtocolError
+
+
+# Returns data with a block changed near its start, bytes inserted in the middle and more appended.
+def edited(data):
+    middle = len(data) // 2
+    return data[:1000] + b'x' * 100 + data[1100:middle] + os.urandom(5000) + data[middle:] + os.urandom(3000)
+
+
+# Rebuilds the new file of a delta against base the way the server does, piece by piece.
+def rebuild(base, new, block_size):
+    signature_list = delta_sync.parse_signatures(delta_sync.signatures(io.BytesIO(base), block_size))
+    delta = delta_sync.compute_delta(io.BytesIO(new), signature_list, block_size, len(base))
+    decoder = DeltaDecoder(io.BytesIO(base), len(base), block_size, delta.size)
+    output = [decoder.decompress(piece, delta.size) for piece in delta_sync.iter_delta(io.BytesIO(new), delta)]
+    return delta, b''.join(output)
+
+
+class DeltaTest(unittest.TestCase):
+    def test_block_sizes(self):
+        self.assertEqual(delta_sync.choose_block_size(1000), delta_sync.MIN_BLOCK_SIZE)
+        self.assertEqual(delta_sync.choose_block_size(1024 ** 4), delta_sync.MAX_BLOCK_SIZE)
+        self.assertEqual(delta_sync.requested_block_size({'block_size': 4096}, 10 ** 6), 4096)
+        for block_size in (1024, 1024 * 1024):
+            with self.assertRaises(ValueError):
+                delta_sync.requested_block_size({'block_size': block_size}, 10 ** 6)
+
+    def test_edited_file_is_rebuilt(self):
+        base = os.urandom(1024 * 1024)
+        new = edited(base)
+        delta, output = rebuild(base, new, 4096)
+        self.assertEqual(output, new)
+        self.assertEqual(delta.digest, hashlib.blake2b(new, digest_size=integrity.DIGEST_SIZE).hexdigest())
+        self.assertLess(delta.literal_bytes, 20000)
+        self.assertLess(delta.encoded_size(), len(new) // 20)
+
+    def test_unrelated_and_empty_files(self):
+        delta, output = rebuild(os.urandom(50000), b'other' * 1000, 2048)
+        self.assertEqual((output, delta.copied_bytes), (b'other' * 1000, 0))
+        self.assertEqual(rebuild(b'', b'new', 2048)[1], b'new')
+        self.assertEqual(rebuild(b'base', b'', 2048)[1], b'')
+
+    def test_invalid_signatures(self):
+        with self.assertRaises(ProtocolError):
+            delta_sync.parse_signatures(b'x' * (delta_sync.SIGNATURE.size + 1))
+
+    def test_invalid_records_are_refused(self):
+        base = os.urandom(10000)
+        records = (b'X',
+                   delta_sync.COPY.pack(b'C', 5, 1),
+                   delta_sync.COPY.pack(b'C', 0, 0),
+                   delta_sync.LITERAL.pack(b'L', delta_sync.MAX_LITERAL_SIZE + 1))
+        for record in records:
+            with self.assertRaises(ProtocolError, msg=record):
+                DeltaDecoder(io.BytesIO(base), len(base), 2048, 20000).decompress(record, 20000)
+
+    def test_output_is_limited(self):
+        base = os.urandom(10000)
+        decoder = DeltaDecoder(io.BytesIO(base), len(base), 2048, 10000)
+        with self.assertRaises(ProtocolError):
+            decoder.decompress(delta_sync.COPY.pack(b'C', 0, 2), 3000)
+        decoder = DeltaDecoder(io.BytesIO(base), len(base), 2048, 1000)
+        with self.assertRaises(ProtocolError):
+            decoder.decompress(delta_sync.COPY.pack(b'C', 0, 1), 10000)
+
+    def test_record_split_between_pieces(self):
+        base = os.urandom(4096)
+        decoder = DeltaDecoder(io.BytesIO(base), len(base), 2048, 2053)
+        records = delta_sync.COPY.pack(b'C', 1, 1) + delta_sync.LITERAL.pack(b'L', 5) + b'hello'
+        self.assertEqual(decoder.decompress(records[:7], 2053), b'')
+        self.assertEqual(decoder.decompress(records[7:], 2053), base[2048:] + b'hello')
+        self.assertIsNone(decoder.base)
+
+
+# Delta uploads against the copy a server already has.
+class DeltaUploadTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.base = os.urandom(1024 * 1024)
+        self.assertTrue(self.client.upload('data.bin', io.BytesIO(self.base), len(self.base))[0])
+
+    def stored(self, name='data.bin'):
+        file = io.BytesIO()
+        success, message = self.client.download(name, file)
+        return file.getvalue() if success else None
+
+    def test_only_changes_are_sent(self):
+        new = edited(self.base)
+        success, message, stats = self.client.delta_upload('data.bin', io.BytesIO(new))
+        self.assertTrue(success, message)
+        self.assertTrue(stats['delta'])
+        self.assertLess(stats['sent_bytes'], len(new) // 10)
+        self.assertEqual(self.stored(), new)
+
+    def test_new_file_is_sent_whole(self):
+        success, message, stats = self.client.delta_upload('new.bin', io.BytesIO(b'new file'))
+        self.assertTrue(success, message)
+        self.assertEqual((stats['delta'], stats['sent_bytes']), (False, 8))
+        self.assertEqual(self.stored('new.bin'), b'new file')
+
+    def test_stale_base_is_refused(self):
+        meta = {'encoding': delta_sync.ENCODING, 'size': 10, 'block_size': 4096, 'verify': True,
+                'base': {'size': len(self.base), 'mtime': 0}}
+        request = self.client.new_request(protocol.CMD_UPLOAD, 'data.bin',
+                                          protocol.FLAG_OVERWRITE | protocol.FLAG_EXPECT_CONTINUE, meta)
+        self.client.frames.send_frame(request)
+        response = self.client.read_response(request)
+        self.assertEqual(response.status, protocol.STATUS_INVALID)
+        self.assertIn('changed', self.client.frames.read_text(response))
+        self.assertEqual(self.stored(), self.base)
+
+    # Method to request the signatures of a stored file. Returns the response and its body.
+    def signatures(self, name, meta=None):
+        request = self.client.new_request(protocol.CMD_SIGNATURES, name, meta=meta)
+        self.client.frames.send_frame(request)
+        response = self.client.read_response(request)
+        return response, self.client.frames.read_payload(response)
+
+    def test_signatures(self):
+        response, body = self.signatures('data.bin', {'block_size': 4096})
+        self.assertEqual(response.status, protocol.STATUS_OK)
+        self.assertEqual(body, delta_sync.signatures(io.BytesIO(self.base), 4096))
+        self.assertEqual(response.meta['count'], len(self.base) // 4096)
+        for name, meta, status in (('missing.bin', None, protocol.STATUS_NOT_FOUND),
+                                   ('data.bin', {'block_size': 100}, protocol.STATUS_INVALID)):
+            self.assertEqual(self.signatures(name, meta)[0].status, status)
+
+
+class AsyncDeltaUploadTest(DeltaUploadTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
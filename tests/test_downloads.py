@@ -0,0 +1,77 @@
+import io
+import os
+import unittest
+
+from support import ServerTestCase
+import protocol
+
+
+# Whole and ranged downloads, sent with sendfile unless a subclass passes --no-sendfile.
+class RangedDownloadTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(200 * 1024 + 17)
+        self.client.upload('data.bin', io.BytesIO(self.data), len(self.data))
+
+    def download(self, **byte_range):
+        file = io.BytesIO()
+        success, result = self.client.download('data.bin', file, **byte_range)
+        return success, file.getvalue() if success else result
+
+    def test_whole_file(self):
+        self.assertEqual(self.download(), (True, self.data))
+
+    def test_range(self):
+        self.assertEqual(self.download(offset=1000, length=70000), (True, self.data[1000:71000]))
+
+    def test_range_to_end(self):
+        self.assertEqual(self.download(offset=150000), (True, self.data[150000:]))
+
+    def test_length_is_cut_at_end_of_file(self):
+        self.assertEqual(self.download(offset=len(self.data) - 5, length=100), (True, self.data[-5:]))
+
+    def test_empty_range(self):
+        self.assertEqual(self.download(offset=len(self.data)), (True, b''))
+        self.assertEqual(self.download(offset=10, length=0), (True, b''))
+
+    def test_range_past_end_is_refused(self):
+        self.assertEqual(self.download(offset=len(self.data) + 1), (False, 'Requested range not satisfiable'))
+        self.assertEqual(self.download(offset=-1), (False, 'Requested range not satisfiable'))
+
+    def test_reply_reports_range(self):
+        request = self.client.new_request(protocol.CMD_DOWNLOAD, 'data.bin', meta={'offset': 100, 'length': 10})
+        self.client.frames.send_frame(request)
+        response = self.client.read_response(request)
+        self.assertEqual((response.size, response.meta), (10, {'offset': 100, 'total': len(self.data)}))
+        self.assertEqual(self.client.frames.read_exact(10), self.data[100:110])
+
+    def test_suffix(self):
+        success, response = self.client.start_download('data.bin', suffix=1000)
+        self.assertTrue(success)
+        self.assertEqual((response.meta['offset'], response.meta['total']), (len(self.data) - 1000, len(self.data)))
+        self.assertEqual(b''.join(self.client.iter_download(response)), self.data[-1000:])
+
+    def test_suffix_longer_than_file(self):
+        success, response = self.client.start_download('data.bin', suffix=len(self.data) * 2)
+        self.assertEqual(b''.join(self.client.frames.iter_body(response.size)), self.data)
+
+    def test_negative_suffix_is_refused(self):
+        self.assertEqual(self.client.start_download('data.bin', suffix=-1), (False, 'Requested range not satisfiable'))
+        self.assertTrue(self.client.ping())
+
+
+class BufferedDownloadTest(RangedDownloadTest):
+    extra_args = ('--no-sendfile',)
+
+
+class AsyncRangedDownloadTest(RangedDownloadTest):
+    engine = 'asyncio'
+
+
+class AsyncBufferedDownloadTest(RangedDownloadTest):
+    engine = 'asyncio'
+    extra_args = ('--no-sendfile',)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+from support import ServerTestCase
+from bench_utils import free_port, wait_for_port
+from chunk_store import ChunkStore
+from durability import Committer
+from file_storage import FileStorage, reserve
+
+
+class CommitterTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+    # Method to write a temporary file and return its path and the path it is committed to.
+    def temp_file(self, name, data=b'data'):
+        path = os.path.join(self.work_dir, name)
+        with open(path + '.tmp', 'wb') as file:
+            file.write(data)
+        return path + '.tmp', path
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Committer('sometimes')
+
+    def test_syncs_per_mode(self):
+        for mode, syncs in (('always', 2), ('group', 2), ('none', 0)):
+            committer = Committer(mode)
+            temp_path, path = self.temp_file(mode, mode.encode())
+            committer.commit(temp_path, path)
+            self.assertEqual(committer.syncs, syncs, mode)
+            self.assertFalse(os.path.exists(temp_path))
+            with open(path, 'rb') as file:
+                self.assertEqual(file.read(), mode.encode())
+
+    def test_concurrent_commits_share_directory_syncs(self):
+        committer = Committer('group')
+        files = [self.temp_file(f'file{number}') for number in range(32)]
+        barrier = threading.Barrier(len(files))
+
+        def commit(temp_path, path):
+            barrier.wait()
+            committer.commit(temp_path, path)
+
+        threads = [threading.Thread(target=commit, args=paths) for paths in files]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(os.listdir(self.work_dir)), sorted(f'file{number}' for number in range(32)))
+        # One data sync per file, and at most one directory sync per file.
+        self.assertLessEqual(committer.syncs, 2 * len(files))
+        self.assertEqual(committer.started, committer.finished)
+
+    def test_failed_group_sync_is_raised(self):
+        committer = Committer('group')
+        with self.assertRaises(OSError):
+            committer.sync_directory(os.path.join(self.work_dir, 'missing'))
+        self.assertFalse(committer.syncing)
+        committer.sync_directory(self.work_dir)
+
+    def test_chunk_store_commits_durably(self):
+        committer = Committer('always')
+        store = ChunkStore(self.work_dir, committer)
+        temp_path, path = self.temp_file('source.bin', os.urandom(100000))
+        store.store_file('a.bin', temp_path)
+        self.assertGreater(committer.syncs, 2)
+
+
+# Staged files written through the write buffer into reserved space.
+class StagedWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = FileStorage(self.root, durability='always')
+
+    def test_reserved_space_does_not_change_the_staged_size(self):
+        total = 4 * FileStorage.WRITE_BUFFER
+        file = self.storage.open_staged('a.bin', 0, total)
+        with file:
+            file.write(b'x' * 1000)
+            file.flush()
+            self.assertEqual(self.storage.staged_size('a.bin'), 1000)
+        file = self.storage.open_staged('a.bin', 500, total)
+        with file:
+            file.write(b'y' * 100)
+        self.assertEqual(self.storage.staged_size('a.bin'), 600)
+        self.storage.commit_staged('a.bin')
+        with open(self.storage.path_for('a.bin'), 'rb') as file:
+            self.assertEqual(file.read(), b'x' * 500 + b'y' * 100)
+        # The file and its directory, and the directory each new fan-out directory was made in.
+        self.assertEqual(self.storage.committer.syncs, 2 + self.storage.layout.levels)
+
+    def test_reserve(self):
+        with open(os.path.join(self.root, 'b.bin'), 'wb') as file:
+            reserved = reserve(file.fileno(), 0, 1024 * 1024)
+            self.assertIn(reserved, (True, False))
+            self.assertEqual(os.fstat(file.fileno()).st_size, 0)
+
+
+# Uploads to a server that syncs every commit, counted by its metrics.
+class DurableServerTest(ServerTestCase):
+    def setUp(self):
+        self.metrics_port = free_port()
+        self.extra_args = ('--durability', 'always', '--metrics-port', str(self.metrics_port))
+        super().setUp()
+        wait_for_port('127.0.0.1', self.metrics_port)
+
+    def fsyncs(self):
+        url = f'http://127.0.0.1:{self.metrics_port}/metrics'
+        with urllib.request.urlopen(url, timeout=10) as response:
+            for line in response.read().decode().splitlines():
+                if line.startswith('fileserver_fsyncs_total '):
+                    return float(line.split()[1])
+
+    def test_every_commit_is_synced(self):
+        data = os.urandom(3 * 1024 * 1024)
+        self.assertTrue(self.client.upload('a.bin', io.BytesIO(data), len(data))[0])
+        # The file and its directory, and the parents of the fan-out directories made for it.
+        first = self.fsyncs()
+        self.assertGreaterEqual(first, 2)
+        self.assertTrue(self.client.upload('a.bin', io.BytesIO(data), len(data), overwrite=True)[0])
+        self.assertEqual(self.fsyncs(), first + 2)
+        batch = [(f'file{number}.txt', io.BytesIO(b'data'), 4) for number in range(3)]
+        self.assertTrue(self.client.upload_many(batch)[0])
+        self.assertGreaterEqual(self.fsyncs(), first + 8)
+        file = io.BytesIO()
+        self.assertTrue(self.client.download('a.bin', file)[0])
+        self.assertEqual(file.getvalue(), data)
+        self.assertEqual(os.listdir(os.path.join(self.storage, '.staging')), [])
+
+
+class AsyncDurableServerTest(DurableServerTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
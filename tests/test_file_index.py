@@ -0,0 +1,193 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import ServerTestCase
+import protocol
+from file_index import FileIndex, FileEntry
+from file_storage import FileStorage
+from storage_layout import read_layout
+
+
+# Builds an index of entries named file000.txt, file001.txt, ... with sizes counting down and mtimes counting up.
+def numbered_index(count):
+    index = FileIndex()
+    index.load(FileEntry(f'file{number:03}.txt', count - number, 1000 + number) for number in range(count))
+    return index
+
+
+# Pages through an index with limit entries per page. Returns the names of every page.
+def all_pages(index, limit, **options):
+    pages = []
+    cursor = None
+    while True:
+        entries, cursor = index.page(limit=limit, cursor=cursor, **options)
+        pages.append([entry.name for entry in entries])
+        if cursor is None:
+            return pages
+
+
+class FileIndexTest(unittest.TestCase):
+    def test_pages_cover_every_name_once(self):
+        index = numbered_index(25)
+        pages = all_pages(index, 10)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), sorted(index.entries))
+
+    def test_reverse_order(self):
+        index = numbered_index(25)
+        self.assertEqual(sum(all_pages(index, 10, reverse=True), []), sorted(index.entries, reverse=True))
+
+    def test_size_and_mtime_orders(self):
+        index = numbered_index(25)
+        by_size = sum(all_pages(index, 7, sort='size'), [])
+        self.assertEqual(by_size, sorted(index.entries, reverse=True))
+        by_mtime = sum(all_pages(index, 7, sort='mtime', reverse=True), [])
+        self.assertEqual(by_mtime, sorted(index.entries, reverse=True))
+
+    def test_equal_keys_are_ordered_by_name(self):
+        index = FileIndex()
+        index.load(FileEntry(name, 5, 1) for name in ('c', 'a', 'b'))
+        self.assertEqual(sum(all_pages(index, 2, sort='size'), []), ['a', 'b', 'c'])
+
+    def test_prefix(self):
+        index = numbered_index(25)
+        index.update('other.txt', 1, 1)
+        self.assertEqual(sum(all_pages(index, 3, prefix='file01'), []), [f'file01{digit}.txt' for digit in range(10)])
+        self.assertEqual(sum(all_pages(index, 3, prefix='file01', reverse=True), []),
+                         [f'file01{digit}.txt' for digit in reversed(range(10))])
+        self.assertEqual(sum(all_pages(index, 3, prefix='o', sort='size'), []), ['other.txt'])
+
+    def test_no_limit_returns_everything(self):
+        entries, cursor = numbered_index(25).page()
+        self.assertEqual(len(entries), 25)
+        self.assertIsNone(cursor)
+
+    def test_updates_keep_sorted_views(self):
+        index = numbered_index(5)
+        index.page(sort='size')
+        index.update('file000.txt', 100, 1)
+        index.update('new.txt', 0, 1)
+        self.assertTrue(index.remove('file004.txt'))
+        self.assertFalse(index.remove('file004.txt'))
+        self.assertEqual([entry.name for entry in index.page(sort='size')[0]],
+                         ['new.txt', 'file003.txt', 'file002.txt', 'file001.txt', 'file000.txt'])
+        self.assertEqual(index.names, ['file000.txt', 'file001.txt', 'file002.txt', 'file003.txt', 'new.txt'])
+
+    def test_cursor_survives_removal_of_its_entry(self):
+        index = numbered_index(10)
+        entries, cursor = index.page(limit=3)
+        index.remove(entries[-1].name)
+        self.assertEqual([entry.name for entry in index.page(limit=3, cursor=cursor)[0]],
+                         ['file003.txt', 'file004.txt', 'file005.txt'])
+
+    def test_unknown_sort_is_rejected(self):
+        with self.assertRaises(ValueError):
+            numbered_index(3).page(sort='owner')
+
+
+# The index FileStorage keeps in step with the files on disk.
+class StorageIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_index_is_built_from_existing_files(self):
+        with open(os.path.join(self.root, 'a.txt'), 'wb') as file:
+            file.write(b'hello')
+        os.makedirs(os.path.join(self.root, 'directory'))
+        storage = FileStorage(self.root)
+        self.assertEqual(storage.list_names(), ['a.txt'])
+        self.assertEqual(storage.index.get('a.txt').size, 5)
+        self.assertTrue(storage.exists('a.txt'))
+        self.assertFalse(storage.exists('directory'))
+
+    def test_commit_and_delete_update_the_index(self):
+        storage = FileStorage(self.root)
+        file = storage.open_staged('a.txt')
+        with file:
+            file.write(b'12345678')
+        storage.commit_staged('a.txt')
+        self.assertEqual(storage.index.get('a.txt').size, 8)
+        self.assertTrue(storage.delete('a.txt'))
+        self.assertFalse(storage.exists('a.txt'))
+
+    def test_checksum_is_cached_until_the_file_changes(self):
+        storage = FileStorage(self.root)
+        checksums = []
+        for data in (b'first', b'second'):
+            file = storage.open_staged('a.txt')
+            with file:
+                file.write(data)
+            storage.commit_staged('a.txt')
+            self.assertIsNone(storage.index.get('a.txt').checksum)
+            checksums.append(storage.checksum('a.txt'))
+            self.assertEqual(storage.index.get('a.txt').checksum, checksums[-1])
+        self.assertNotEqual(checksums[0], checksums[1])
+        with self.assertRaises(FileNotFoundError):
+            storage.checksum('missing.txt')
+
+
+# Paginated listings served over the dir command.
+class ListingTest(ServerTestCase):
+    def upload(self, name, data):
+        return self.client.upload(name, io.BytesIO(data), len(data))
+
+    def test_listing_spans_several_frames(self):
+        names = [f'f{number:04}' for number in range(2500)]
+        layout = read_layout(self.storage)
+        for name in names:
+            path = layout.path_for(name)
+            layout.make_parent(path)
+            open(path, 'wb').close()
+        self.restart()
+        success, entries, cursor = self.client.list_entries(limit=0)
+        self.assertTrue(success)
+        self.assertEqual([entry['name'] for entry in entries], names)
+        self.assertIsNone(cursor)
+
+    def test_pages_with_cursor(self):
+        for name in ('a.txt', 'b.txt', 'c.txt', 'd.txt', 'e.txt'):
+            self.upload(name, name.encode())
+        success, first, cursor = self.client.list_entries(limit=2)
+        self.assertEqual([entry['name'] for entry in first], ['a.txt', 'b.txt'])
+        success, second, cursor = self.client.list_entries(limit=2, cursor=cursor)
+        self.assertEqual([entry['name'] for entry in second], ['c.txt', 'd.txt'])
+        success, third, cursor = self.client.list_entries(limit=2, cursor=cursor)
+        self.assertEqual(([entry['name'] for entry in third], cursor), (['e.txt'], None))
+
+    def test_sort_by_size_with_checksums(self):
+        self.upload('big.bin', b'x' * 3000)
+        self.upload('small.bin', b'x')
+        success, entries, _ = self.client.list_entries(sort='size', reverse=True, checksums=True)
+        self.assertEqual([(entry['name'], entry['size']) for entry in entries], [('big.bin', 3000), ('small.bin', 1)])
+        self.assertTrue(all(len(entry['checksum']) == 64 for entry in entries))
+
+    def test_prefix(self):
+        for name in ('log-1', 'log-2', 'data'):
+            self.upload(name, b'1')
+        success, entries, _ = self.client.list_entries(prefix='log-')
+        self.assertEqual([entry['name'] for entry in entries], ['log-1', 'log-2'])
+
+    def test_delete_leaves_the_listing(self):
+        self.upload('a.txt', b'a')
+        self.client.delete('a.txt')
+        self.assertEqual(self.client.list_files(), (True, 'No Files Found'))
+
+    def test_bad_request_is_invalid(self):
+        for meta in ({'sort': 'owner'}, {'limit': -1}):
+            response, _ = self.client.request(protocol.CMD_DIR, meta=meta)
+            self.assertEqual(response.status, protocol.STATUS_INVALID)
+        self.assertTrue(self.client.list_files()[0])
+
+
+class AsyncListingTest(ListingTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
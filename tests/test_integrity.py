@@ -0,0 +1,194 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import ServerTestCase
+from transfer_client import TransferClient
+import integrity
+import protocol
+from file_storage import FileStorage
+from protocol import Frame, ProtocolError
+from storage_layout import read_layout
+
+
+def blake2b(data):
+    return hashlib.blake2b(data, digest_size=integrity.DIGEST_SIZE).hexdigest()
+
+
+class DigestTest(unittest.TestCase):
+    def test_digest_file(self):
+        data = os.urandom(3 * integrity.READ_SIZE + 7)
+        self.assertEqual(integrity.digest_file(io.BytesIO(data)), blake2b(data))
+        file = io.BytesIO(data)
+        file.seek(10)
+        length = 2 * integrity.READ_SIZE
+        self.assertEqual(integrity.digest_file(file, length), blake2b(data[10:10 + length]))
+
+    def test_hasher_matches_one_pass(self):
+        chunks = [os.urandom(size) for size in (1, 1000, 300000, 0, 64)]
+        with integrity.Hasher(max_pending=2) as hasher:
+            for chunk in chunks:
+                hasher.update(chunk)
+            self.assertEqual(hasher.hexdigest(), blake2b(b''.join(chunks)))
+        self.assertFalse(hasher.thread.is_alive())
+
+    def test_hashing_reader(self):
+        data = os.urandom(10000)
+        with integrity.Hasher() as hasher:
+            reader = integrity.HashingReader(io.BytesIO(data), hasher)
+            self.assertEqual(reader.read(100) + reader.read(), data)
+            self.assertEqual(hasher.hexdigest(), blake2b(data))
+
+    def test_trailer(self):
+        request = Frame(protocol.CMD_UPLOAD, request_id=7, name='a.bin')
+        trailer = protocol.trailer_frame(request, 'abc')
+        self.assertEqual(protocol.trailer_digest(request, trailer), 'abc')
+        for wrong in (None, protocol.trailer_frame(Frame(protocol.CMD_UPLOAD, request_id=8), 'abc'),
+                      protocol.trailer_frame(Frame(protocol.CMD_DOWNLOAD, request_id=7), 'abc')):
+            with self.assertRaises(ProtocolError):
+                protocol.trailer_digest(request, wrong)
+
+
+# Checksums recorded by FileStorage and kept in its checksum log across restarts.
+class StorageChecksumTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def store(self, storage, name, data, checksum=None):
+        file = storage.open_staged(name)
+        with file:
+            file.write(data)
+        storage.commit_staged(name, checksum)
+
+    def test_upload_checksum_is_kept_across_restarts(self):
+        storage = FileStorage(self.root)
+        self.store(storage, 'a.txt', b'hello', blake2b(b'hello'))
+        self.assertEqual(storage.index.get('a.txt').checksum, blake2b(b'hello'))
+        self.assertEqual(FileStorage(self.root).index.get('a.txt').checksum, blake2b(b'hello'))
+
+    def test_computed_checksum_is_logged(self):
+        storage = FileStorage(self.root)
+        self.store(storage, 'a.txt', b'hello')
+        self.assertEqual(storage.checksum('a.txt'), blake2b(b'hello'))
+        self.assertEqual(FileStorage(self.root).index.get('a.txt').checksum, blake2b(b'hello'))
+
+    def test_changed_file_loses_its_checksum(self):
+        self.store(FileStorage(self.root), 'a.txt', b'hello', blake2b(b'hello'))
+        with open(read_layout(self.root).path_for('a.txt'), 'ab') as file:
+            file.write(b' world')
+        storage = FileStorage(self.root)
+        self.assertIsNone(storage.index.get('a.txt').checksum)
+        self.assertEqual(storage.checksum('a.txt'), blake2b(b'hello world'))
+
+    def test_damaged_log_lines_are_skipped(self):
+        self.store(FileStorage(self.root), 'a.txt', b'hello', blake2b(b'hello'))
+        with open(os.path.join(self.root, FileStorage.CHECKSUM_LOG), 'a') as file:
+            file.write('{"name": "b.txt", "si')
+        storage = FileStorage(self.root)
+        self.assertEqual(storage.index.get('a.txt').checksum, blake2b(b'hello'))
+        with open(storage.checksum_path) as file:
+            self.assertEqual([json.loads(line)['name'] for line in file], ['a.txt'])
+
+    def test_log_is_compacted(self):
+        storage = FileStorage(self.root)
+        for number in range(1100):
+            self.store(storage, 'a.txt', b'%d' % number, blake2b(b'%d' % number))
+        self.assertLess(storage.checksum_records, 1100)
+        self.assertEqual(FileStorage(self.root).index.get('a.txt').checksum, blake2b(b'1099'))
+
+    def test_range_checksum(self):
+        storage = FileStorage(self.root)
+        self.store(storage, 'a.txt', b'0123456789')
+        self.assertEqual(storage.range_checksum('a.txt', 2, 5), blake2b(b'23456'))
+
+
+# Transfers checked end to end with digest trailers.
+class VerifiedTransferTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(700 * 1024 + 3)
+
+    def upload(self, client, name='data.bin'):
+        success, message = client.upload(name, io.BytesIO(self.data), len(self.data))
+        self.assertTrue(success, message)
+
+    def test_server_supports_verification(self):
+        self.assertTrue(self.client.verifies())
+        self.assertFalse(TransferClient(verify=False).verifies())
+
+    def test_verified_upload_gives_the_server_its_checksum(self):
+        self.upload(self.client)
+        self.assertEqual(self.client.remote_checksum('data.bin'), blake2b(self.data))
+        self.assertIsNone(self.client.remote_checksum('data'))
+
+    def test_verified_download(self):
+        self.upload(self.client)
+        success, response = self.client.start_download('data.bin')
+        self.assertTrue(response.meta.get('verify'))
+        self.assertEqual(b''.join(self.client.iter_download(response)), self.data)
+        file = io.BytesIO()
+        self.assertTrue(self.client.download('data.bin', file, offset=1000, length=300000)[0])
+        self.assertEqual(file.getvalue(), self.data[1000:301000])
+
+    def test_mismatched_upload_is_not_committed(self):
+        request = self.client.new_request(protocol.CMD_UPLOAD, 'data.bin', protocol.FLAG_OVERWRITE,
+                                          {'verify': True}, size=len(self.data))
+        self.client.frames.send_frame(request, self.data)
+        self.client.frames.send_frame(protocol.trailer_frame(request, blake2b(b'other')))
+        response = self.client.read_response(request)
+        self.assertEqual(self.client.frames.read_text(response), 'Upload Failed: checksum mismatch')
+        self.assertEqual(response.status, protocol.STATUS_INVALID)
+        self.assertEqual(response.meta['digest'], blake2b(self.data))
+        self.assertIsNone(self.client.file_size('data.bin'))
+        self.assertEqual(self.client.upload_offset('data.bin'), 0)
+
+    def test_mismatched_download_fails(self):
+        self.upload(self.client)
+        self.client.frames.read_trailer = lambda response: blake2b(b'other')
+        file = io.BytesIO()
+        success, message = self.client.download('data.bin', file)
+        self.assertFalse(success)
+        self.assertIn('Checksum mismatch', message)
+        self.assertLess(len(file.getvalue()), len(self.data))
+
+    def test_compressed_verified_transfers(self):
+        text = b''.join(b'line %d\n' % number for number in range(100000))
+        compressing = TransferClient('127.0.0.1', self.port, timeout=10, compress='zlib').connect()
+        self.addCleanup(compressing.close)
+        self.assertTrue(compressing.upload('log.txt', io.BytesIO(text), len(text))[0])
+        self.assertEqual(compressing.remote_checksum('log.txt'), blake2b(text))
+        file = io.BytesIO()
+        self.assertTrue(compressing.download('log.txt', file)[0])
+        self.assertEqual(file.getvalue(), text)
+
+    def test_unverified_client(self):
+        client = TransferClient('127.0.0.1', self.port, timeout=10, verify=False).connect()
+        self.addCleanup(client.close)
+        self.upload(client)
+        success, response = client.start_download('data.bin')
+        self.assertNotIn('verify', response.meta)
+        self.assertEqual(b''.join(client.iter_download(response)), self.data)
+        self.assertEqual(client.remote_checksum('data.bin'), blake2b(self.data))
+
+    def test_resumed_upload_is_verified(self):
+        half = len(self.data) // 2
+        self.assertTrue(self.client.upload('data.bin', io.BytesIO(self.data[:half]), half, total=len(self.data))[0])
+        success, message = self.client.upload('data.bin', io.BytesIO(self.data[half:]), len(self.data) - half,
+                                              offset=half)
+        self.assertTrue(success, message)
+        self.assertEqual(self.client.remote_checksum('data.bin'), blake2b(self.data))
+
+
+class AsyncVerifiedTransferTest(VerifiedTransferTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import io
+import threading
+import unittest
+import urllib.request
+
+from support import ServerTestCase
+from bench_utils import free_port, wait_for_port
+import metrics
+from metrics import Counter, Gauge, Histogram, ServerMetrics, bucket_percentile
+
+
+# Returns the value of one sample line of a Prometheus text document, e.g. 'name{label="x"}', or None.
+def sample(text, series):
+    for line in text.splitlines():
+        if line.startswith(series + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+class MetricTypesTest(unittest.TestCase):
+    def test_counter_by_label(self):
+        counter = Counter('bytes_total', 'Bytes', ('command',))
+        counter.inc(10, 'upload')
+        counter.inc(5, 'upload')
+        counter.inc(1, 'download')
+        self.assertEqual(counter.total(), 16)
+        text = '\n'.join(counter.render())
+        self.assertIn('# TYPE bytes_total counter', text)
+        self.assertEqual(sample(text, 'bytes_total{command="upload"}'), 15)
+
+    def test_gauge_with_source(self):
+        gauge = Gauge('threads', 'Threads', source=lambda: 7)
+        self.assertEqual(gauge.get(), 7)
+        self.assertEqual(sample('\n'.join(gauge.render()), 'threads'), 7)
+
+    def test_gauge_up_and_down(self):
+        gauge = Gauge('connections', 'Connections')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(gauge.get(), 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency', 'Latency', ('command',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value, 'dir')
+        text = '\n'.join(histogram.render())
+        self.assertEqual(sample(text, 'latency_bucket{command="dir",le="0.1"}'), 2)
+        self.assertEqual(sample(text, 'latency_bucket{command="dir",le="1.0"}'), 3)
+        self.assertEqual(sample(text, 'latency_bucket{command="dir",le="+Inf"}'), 4)
+        self.assertEqual(sample(text, 'latency_count{command="dir"}'), 4)
+        self.assertAlmostEqual(sample(text, 'latency_sum{command="dir"}'), 5.65)
+
+    def test_bucket_percentile(self):
+        buckets = (1.0, 2.0, 4.0)
+        self.assertEqual(bucket_percentile(buckets, [0, 0, 0, 0], 50), 0.0)
+        self.assertEqual(bucket_percentile(buckets, [10, 0, 0, 0], 50), 0.5)
+        self.assertEqual(bucket_percentile(buckets, [0, 10, 0, 0], 100), 2.0)
+        self.assertEqual(bucket_percentile(buckets, [0, 0, 0, 10], 99), 4.0)
+
+    def test_timed_lock_records_waits(self):
+        server_metrics = ServerMetrics()
+        lock = server_metrics.timed_lock('index', threading.Lock())
+        with lock:
+            pass
+        self.assertTrue(lock.acquire(timeout=1))
+        self.assertFalse(lock.acquire(timeout=0.01))
+        lock.release()
+        self.assertEqual(sum(server_metrics.lock_wait.snapshot()[('index',)]), 3)
+
+    def test_summary_reports_deltas(self):
+        server_metrics = ServerMetrics()
+        before = server_metrics.snapshot()
+        for _ in range(10):
+            server_metrics.observe_request('download', 0.002, 0, 1024 * 1024)
+        server_metrics.observe_request('upload', 0.02, 2 * 1024 * 1024, 0, 'invalid')
+        line = server_metrics.summary(before, server_metrics.snapshot(), 1.0)
+        self.assertTrue(line.startswith('[metrics] 11.0 req/s, in 2.00 MB/s, out 10.00 MB/s'), line)
+        self.assertIn('errors 1', line)
+        self.assertIn('download 10 p50=', line)
+
+    def test_timer_observes_storage_time(self):
+        server_metrics = ServerMetrics()
+        with server_metrics.timed('commit'):
+            pass
+        self.assertEqual(sum(server_metrics.storage.snapshot()[('commit',)]), 1)
+        self.assertEqual(len(metrics.LATENCY_BUCKETS) + 1, len(server_metrics.storage.snapshot()[('commit',)]))
+
+
+# The metrics a server exports on --metrics-port while it serves requests.
+class ServerMetricsTest(ServerTestCase):
+    def setUp(self):
+        self.metrics_port = free_port()
+        self.extra_args = ('--metrics-port', str(self.metrics_port))
+        super().setUp()
+        # The endpoint may start a moment after the server accepts connections.
+        wait_for_port('127.0.0.1', self.metrics_port)
+
+    def scrape(self):
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.metrics_port}/metrics', timeout=10) as response:
+            return response.read().decode()
+
+    def test_requests_bytes_and_errors_are_counted(self):
+        data = b'x' * 5000
+        self.client.upload('a.txt', io.BytesIO(data), len(data))
+        self.client.download('a.txt', io.BytesIO())
+        self.client.download('missing.txt', io.BytesIO())
+        # A request is recorded just after its reply is sent; the next reply means the ones before are in.
+        self.client.list_files()
+        text = self.scrape()
+        self.assertEqual(sample(text, 'fileserver_request_seconds_count{command="upload"}'), 1)
+        self.assertEqual(sample(text, 'fileserver_received_bytes_total{command="upload"}'), 5000)
+        self.assertGreaterEqual(sample(text, 'fileserver_sent_bytes_total{command="download"}'), 5000)
+        self.assertEqual(sample(text, 'fileserver_errors_total{command="download",reason="not_found"}'), 1)
+        self.assertEqual(sample(text, 'fileserver_storage_seconds_count{operation="commit"}'), 1)
+        self.assertEqual(sample(text, 'fileserver_active_connections'), 1)
+
+    def test_unknown_path_is_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'http://127.0.0.1:{self.metrics_port}/other', timeout=10)
+
+
+class AsyncServerMetricsTest(ServerMetricsTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
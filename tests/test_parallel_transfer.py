@@ -0,0 +1,121 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from support import ServerTestCase
+import protocol
+from parallel_transfer import ParallelTransfer
+
+
+# Files moved over several connections at once, one chunk per request.
+class ParallelTransferTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.local_dir = tempfile.mkdtemp(dir=self.work_dir)
+        self.transfer = ParallelTransfer('127.0.0.1', self.port, streams=3, chunk_size=64 * 1024)
+
+    def local_file(self, name, data):
+        path = os.path.join(self.local_dir, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def read_local(self, name):
+        with open(os.path.join(self.local_dir, name), 'rb') as file:
+            return file.read()
+
+    def test_upload_and_download(self):
+        data = os.urandom(1000 * 1000)
+        reported = []
+        path = self.local_file('source.bin', data)
+        self.assertEqual(self.transfer.upload('data.bin', path, progress=reported.append),
+                         (True, 'Upload Complete.'))
+        self.assertEqual(reported[-1], len(data))
+        self.assertEqual(sorted(reported), reported)
+
+        self.assertEqual(self.transfer.download('data.bin', os.path.join(self.local_dir, 'copy.bin')),
+                         (True, len(data)))
+        self.assertEqual(self.read_local('copy.bin'), data)
+
+    def test_empty_file(self):
+        path = self.local_file('empty.bin', b'')
+        self.assertTrue(self.transfer.upload('empty.bin', path)[0])
+        self.assertEqual(self.transfer.download('empty.bin', os.path.join(self.local_dir, 'copy.bin')),
+                         (True, 0))
+        self.assertEqual(self.read_local('copy.bin'), b'')
+
+    def test_existing_file_needs_overwrite(self):
+        path = self.local_file('source.bin', b'new')
+        self.client.upload('data.bin', io.BytesIO(b'old'), 3)
+        self.assertEqual(self.transfer.upload('data.bin', path), (False, 'File Exists.'))
+        self.assertTrue(self.transfer.upload('data.bin', path, overwrite=True)[0])
+
+    def test_missing_file(self):
+        self.assertEqual(self.transfer.download('missing.bin', os.path.join(self.local_dir, 'copy.bin')),
+                         (False, 'File not found'))
+
+
+class AsyncParallelTransferTest(ParallelTransferTest):
+    engine = 'asyncio'
+
+
+# The upload_begin / upload_chunk / upload_commit commands the parallel uploads are made of.
+class ChunkedUploadTest(ServerTestCase):
+    def send_chunk(self, name, data, offset, length):
+        return self.client.upload_chunk(name, io.BytesIO(data[offset:offset + length]), offset, length)
+
+    def test_chunks_in_any_order(self):
+        data = os.urandom(300 * 1024)
+        self.assertTrue(self.client.begin_upload('a.bin', len(data))[0])
+        for offset in (200 * 1024, 0, 100 * 1024):
+            self.assertTrue(self.send_chunk('a.bin', data, offset, 100 * 1024)[0])
+        self.assertTrue(self.client.commit_upload('a.bin')[0])
+        self.assertEqual(self.client.file_size('a.bin'), len(data))
+        out = io.BytesIO()
+        self.client.download('a.bin', out)
+        self.assertEqual(out.getvalue(), data)
+
+    def test_commit_with_missing_chunks_is_refused(self):
+        data = os.urandom(200 * 1024)
+        self.client.begin_upload('a.bin', len(data))
+        self.send_chunk('a.bin', data, 0, 100 * 1024)
+        self.assertEqual(self.client.commit_upload('a.bin'), (False, 'Upload Failed: chunks are missing'))
+        self.send_chunk('a.bin', data, 100 * 1024, 100 * 1024)
+        self.assertTrue(self.client.commit_upload('a.bin')[0])
+
+    def test_chunk_outside_an_upload_is_refused(self):
+        self.assertFalse(self.send_chunk('a.bin', b'x' * 10, 0, 10)[0])
+        self.client.begin_upload('a.bin', 10)
+        self.assertFalse(self.send_chunk('a.bin', b'x' * 20, 0, 20)[0])
+        self.assertTrue(self.client.list_files()[0])
+
+    def test_begin_needs_a_size(self):
+        response, _ = self.client.request(protocol.CMD_UPLOAD_BEGIN, 'a.bin')
+        self.assertEqual(response.status, protocol.STATUS_INVALID)
+
+    def test_begin_is_refused_while_streaming(self):
+        request = self.client.new_request(protocol.CMD_UPLOAD, 'a.bin', protocol.FLAG_OVERWRITE,
+                                          size=6 * 1024 * 1024)
+        self.client.frames.send_frame(request)
+        # Half the body, so some of it is written to the staged file while the rest is awaited.
+        self.client.frames.sock.sendall(b'x' * (3 * 1024 * 1024))
+        other = self.connect()
+        deadline = time.monotonic() + 10
+        staged = os.path.join(self.storage, '.staging', 'a.bin.part')
+        # The staged file exists just before it is locked; bytes in it mean the upload holds the lock.
+        while not os.path.exists(staged) or not os.path.getsize(staged):
+            self.assertLess(time.monotonic(), deadline, 'the upload was never staged')
+            time.sleep(0.01)
+        success, message = other.begin_upload('a.bin', 10, overwrite=True)
+        self.assertFalse(success)
+        self.assertIn('another upload', message)
+
+
+class AsyncChunkedUploadTest(ChunkedUploadTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
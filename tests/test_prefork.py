@@ -0,0 +1,165 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import ServerTestCase
+from file_index import FileEntry, SharedFileIndex
+from file_storage import FileStorage
+from parallel_transfer import ParallelTransfer
+from server_side import worker_options
+from statistics_collector import StatisticsLog, read_records
+
+
+# Two SharedFileIndex objects on one journal, standing in for two worker processes. Each is given its own
+# pid, since records a process appended itself are skipped when it replays the journal.
+class SharedFileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.journal = os.path.join(self.work_dir, 'journal')
+        self.scanned = [FileEntry('old.txt', 1, 1.0)]
+
+    def open_index(self, pid, **options):
+        index = SharedFileIndex(self.journal, lambda: list(self.scanned), **options)
+        index.pid = pid
+        index.load(list(self.scanned))
+        return index
+
+    def test_changes_are_seen_by_the_other_index(self):
+        first, second = self.open_index(1), self.open_index(2)
+        first.update('a.txt', 5, 2.0, 'abc')
+        self.assertEqual(second.list_names(), ['a.txt', 'old.txt'])
+        self.assertEqual(second.get('a.txt').checksum, 'abc')
+        second.remove('old.txt')
+        self.assertNotIn('old.txt', first)
+        self.assertEqual(len(first), 1)
+
+    def test_journal_is_continued_in_a_new_file(self):
+        first, second = self.open_index(1, max_bytes=200), self.open_index(2, max_bytes=200)
+        for number in range(10):
+            first.update(f'file{number}.txt', number, 2.0)
+            self.assertEqual(len(second.list_names()), number + 2)
+        self.assertGreater(second.generation, 0)
+        self.assertFalse(os.path.exists(f'{self.journal}.0'))
+
+    def test_index_that_fell_behind_is_rescanned(self):
+        first, second = self.open_index(1, max_bytes=100), self.open_index(2, max_bytes=100)
+        for number in range(20):
+            first.update(f'file{number}.txt', number, 2.0)
+        self.scanned = [FileEntry('rescanned.txt', 1, 1.0)]
+        self.assertEqual(second.list_names(), ['rescanned.txt'])
+
+    def test_line_being_written_is_kept_for_later(self):
+        index = self.open_index(1)
+        index.replay(b'{"op":"put","name":"a.txt","size":1,"mtime":2.0,"pid":2}\n{"op":"put","na')
+        self.assertEqual(super(SharedFileIndex, index).list_names(), ['a.txt', 'old.txt'])
+        index.replay(b'me":"b.txt","size":1,"mtime":2.0,"pid":2}\n')
+        self.assertIn('b.txt', super(SharedFileIndex, index).list_names())
+
+
+# Two FileStorage objects with shared set on one directory, as in two workers of a prefork server.
+class SharedStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.first = FileStorage(self.root, shared=True)
+        self.second = FileStorage(self.root, shared=True)
+        self.second.index.pid = -1
+
+    def test_commit_is_listed_by_the_other_storage(self):
+        file = self.first.open_staged('a.txt')
+        with file:
+            file.write(b'hello')
+        self.first.commit_staged('a.txt')
+        self.assertEqual(self.second.list_names(), ['a.txt'])
+        self.second.delete('a.txt')
+        self.assertEqual(self.first.list_names(), [])
+
+    def test_chunks_written_by_either_storage(self):
+        upload = self.first.begin_chunked('a.bin', 10)
+        upload.write_at(0, b'01234')
+        upload.mark_written(0, 5)
+        other = self.second.get_chunked('a.bin')
+        other.write_at(5, b'56789')
+        other.mark_written(5, 5)
+        self.assertTrue(self.first.commit_chunked('a.bin'))
+        file, size = self.second.open_read('a.bin')
+        with file:
+            self.assertEqual(file.read(), b'0123456789')
+        self.assertIsNone(self.second.get_chunked('a.bin'))
+
+    def test_upload_begun_again_is_picked_up(self):
+        self.first.begin_chunked('a.bin', 10)
+        earlier = self.second.get_chunked('a.bin')
+        self.first.begin_chunked('a.bin', 4)
+        self.assertFalse(earlier.current())
+        self.assertEqual(self.second.get_chunked('a.bin').total, 4)
+
+
+class SharedStatisticsTest(unittest.TestCase):
+    def test_logs_of_several_processes_do_not_interleave(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        path = os.path.join(work_dir, 'stats.jsonl')
+        logs = [StatisticsLog(path, flush_interval=60, max_bytes=2000, shared=True) for _ in range(2)]
+        for number in range(50):
+            logs[number % 2].transfer_stats('upload', f'file{number}.txt', number, 0.5, 0.1)
+        for log in logs:
+            log.close()
+        self.assertTrue(os.path.exists(path + '.1'))
+        names = [record['filename'] for record in read_records(path)]
+        self.assertEqual(sorted(names), sorted(f'file{number}.txt' for number in range(50)))
+
+
+class WorkerOptionsTest(unittest.TestCase):
+    def test_limits_are_shared_out(self):
+        options = worker_options({'rate_limit': 8, 'client_rate_limit': None, 'metrics_port': 9000,
+                                  'operation_rate_limits': {'download': 4}}, 1, 2)
+        self.assertEqual(options, {'rate_limit': 4, 'client_rate_limit': None, 'metrics_port': 9001,
+                                   'operation_rate_limits': {'download': 2}, 'shared_storage': True})
+        self.assertEqual(worker_options({'metrics_port': None}, 1, 2)['metrics_port'], None)
+
+
+# A server started with two worker processes; each new connection may be accepted by either of them.
+class PreforkServerTest(ServerTestCase):
+    extra_args = ('--workers', '2')
+
+    def test_uploads_are_listed_on_every_connection(self):
+        names = [f'file{number}.txt' for number in range(8)]
+        for name in names:
+            self.assertTrue(self.connect().upload(name, io.BytesIO(name.encode()), len(name))[0])
+        for _ in range(4):
+            success, entries, _ = self.connect().list_entries(limit=0)
+            self.assertEqual([entry['name'] for entry in entries], names)
+
+    def test_parallel_upload_over_several_workers(self):
+        data = os.urandom(1000 * 1000)
+        path = os.path.join(self.work_dir, 'source.bin')
+        with open(path, 'wb') as file:
+            file.write(data)
+        transfer = ParallelTransfer('127.0.0.1', self.port, streams=4, chunk_size=64 * 1024)
+        self.assertEqual(transfer.upload('data.bin', path), (True, 'Upload Complete.'))
+        file = io.BytesIO()
+        self.assertTrue(self.connect().download('data.bin', file)[0])
+        self.assertEqual(file.getvalue(), data)
+
+    def test_statistics_of_every_worker_are_logged(self):
+        for number in range(4):
+            self.connect().upload(f'file{number}.txt', io.BytesIO(b'data'), 4)
+        self.client.close()
+        self.process.terminate()
+        self.process.wait(timeout=15)
+        with open(os.path.join(self.work_dir, 'network_statistics.jsonl')) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(len([record for record in records if record['operation'] == 'upload']), 4)
+
+
+class AsyncPreforkServerTest(PreforkServerTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
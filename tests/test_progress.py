@@ -0,0 +1,72 @@
+import time
+import unittest
+
+import support  # noqa: F401 (puts the project modules on the path)
+from progress import ProgressReporter
+
+
+class ProgressReporterTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.reporter = ProgressReporter(lambda event, data: self.events.append((event, data)))
+
+    def states(self):
+        return [data['state'] for event, data in self.events]
+
+    def test_chunks_are_coalesced(self):
+        total = 1024 * 1024 * 1024
+        with self.reporter.start('upload', 'big.bin', total) as transfer:
+            for done in range(0, total + 1, 4096):
+                transfer.update(done)
+        # One update when it starts, at most one per MIN_INTERVAL while it runs, and the last one.
+        self.assertLess(len(self.events), 40)
+        self.assertEqual(self.states()[0], 'running')
+        event, data = self.events[-1]
+        self.assertEqual((event, data['state'], data['progress'], data['done']), ('upload_progress', 'done', 100.0,
+                                                                                   total))
+        self.assertEqual(self.reporter.active(), [])
+
+    def test_update_is_sent_every_step(self):
+        reporter = ProgressReporter(lambda event, data: self.events.append((event, data)), min_interval=0, step=10)
+        transfer = reporter.start('download', 'a.bin', 1000)
+        for done in range(1, 1001):
+            transfer.update(done)
+        self.assertEqual(len(self.events), 11)
+        self.assertEqual([data['done'] for event, data in self.events[1:4]], [100, 200, 300])
+
+    def test_slow_transfer_is_reported_after_max_interval(self):
+        reporter = ProgressReporter(lambda event, data: self.events.append((event, data)), max_interval=0.05)
+        transfer = reporter.start('upload', 'a.bin', 1000)
+        time.sleep(0.15)
+        transfer.update(1)
+        self.assertEqual(len(self.events), 2)
+        self.assertGreater(self.events[-1][1]['rate'], 0)
+        self.assertIsNotNone(self.events[-1][1]['eta'])
+
+    def test_failed_transfer(self):
+        with self.assertRaises(ValueError):
+            with self.reporter.start('upload', 'a.bin', 10):
+                raise ValueError('connection lost')
+        event, data = self.events[-1]
+        self.assertEqual((data['state'], data['message']), ('failed', 'connection lost'))
+
+    def test_unknown_size(self):
+        with self.reporter.start('download', 'files.zip') as transfer:
+            self.assertIsNone(self.reporter.active()[0]['progress'])
+            transfer.update(5000)
+        self.assertEqual((self.events[-1][1]['progress'], self.events[-1][1]['eta']), (100.0, None))
+
+    def test_transfer_ids(self):
+        self.assertEqual(self.reporter.start('upload', 'a.bin', 10, 'upload-1').id, 'upload-1')
+        self.assertNotEqual(self.reporter.start('upload', 'a.bin', 10, '<script>').id, '<script>')
+        self.assertEqual([data['id'] for data in self.reporter.active()][0], 'upload-1')
+
+    def test_finish_is_reported_once(self):
+        transfer = self.reporter.start('upload', 'a.bin', 10)
+        transfer.finish()
+        transfer.finish(False, 'late')
+        self.assertEqual(self.states(), ['running', 'done'])
+
+
+if __name__ == '__main__':
+    unittest.main()
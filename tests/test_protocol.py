@@ -0,0 +1,213 @@
+import io
+import socket
+import tempfile
+import unittest
+import zlib
+
+import support  # noqa: F401 (puts the project modules on the path)
+import protocol
+from protocol import Frame, FrameConnection, ProtocolError
+
+
+# Encodes frame and decodes it again the way FrameConnection.recv_frame does. Returns the frame and its body.
+def round_trip(frame, payload=b''):
+    data = protocol.encode_frame(frame, payload)
+    decoded, name_length, meta_length = protocol.decode_header(data[:protocol.HEADER.size])
+    extra = data[protocol.HEADER.size:protocol.HEADER.size + name_length + meta_length]
+    protocol.decode_extra(decoded, extra, name_length)
+    return decoded, data[protocol.HEADER.size + name_length + meta_length:]
+
+
+# Builds a header by hand, for frames encode_frame would never produce.
+def raw_header(magic=protocol.MAGIC, version=protocol.PROTOCOL_VERSION, name_length=0, meta_length=0, size=0):
+    return protocol.HEADER.pack(magic, version, protocol.CMD_DIR, protocol.STATUS_OK, 0, 1,
+                                name_length, meta_length, size, 0)
+
+
+class FrameCodecTest(unittest.TestCase):
+    def test_header_fields_round_trip(self):
+        frame = Frame(protocol.CMD_UPLOAD, protocol.STATUS_EXISTS, protocol.FLAG_OVERWRITE, 4096,
+                      'report.pdf', {'offset': 10}, size=123456789012, checksum=77)
+        decoded, body = round_trip(frame)
+        self.assertEqual(body, b'')
+        self.assertEqual((decoded.command, decoded.status, decoded.flags, decoded.request_id),
+                         (protocol.CMD_UPLOAD, protocol.STATUS_EXISTS, protocol.FLAG_OVERWRITE, 4096))
+        self.assertEqual((decoded.name, decoded.meta, decoded.size, decoded.checksum),
+                         ('report.pdf', {'offset': 10}, 123456789012, 77))
+
+    def test_payload_is_sized_and_checksummed(self):
+        decoded, body = round_trip(Frame(protocol.CMD_DIR, request_id=3), b'a.txt\nb.txt')
+        self.assertEqual(body, b'a.txt\nb.txt')
+        self.assertEqual(decoded.size, len(body))
+        self.assertTrue(decoded.flags & protocol.FLAG_CHECKSUM)
+        self.assertEqual(decoded.checksum, zlib.crc32(body))
+        self.assertEqual(protocol.verify_payload(decoded, body), body)
+
+    def test_non_ascii_name(self):
+        decoded, _ = round_trip(Frame(protocol.CMD_DOWNLOAD, name='résumé 履歴書.txt'))
+        self.assertEqual(decoded.name, 'résumé 履歴書.txt')
+
+    def test_reply_keeps_command_and_request_id(self):
+        reply = Frame(protocol.CMD_DELETE, request_id=9, name='a.txt').reply(protocol.STATUS_NOT_FOUND)
+        self.assertEqual((reply.command, reply.status, reply.request_id, reply.name),
+                         (protocol.CMD_DELETE, protocol.STATUS_NOT_FOUND, 9, 'a.txt'))
+
+    def test_corrupt_payload_is_rejected(self):
+        decoded, body = round_trip(Frame(protocol.CMD_DIR), b'listing')
+        with self.assertRaises(ProtocolError):
+            protocol.verify_payload(decoded, b'lusting')
+
+    def test_bad_magic_is_rejected(self):
+        with self.assertRaises(ProtocolError):
+            protocol.decode_header(raw_header(magic=b'GE'))
+
+    def test_unknown_version_is_rejected(self):
+        with self.assertRaises(ProtocolError):
+            protocol.decode_header(raw_header(version=protocol.PROTOCOL_VERSION + 1))
+
+    def test_oversized_meta_is_rejected(self):
+        with self.assertRaises(ProtocolError):
+            protocol.decode_header(raw_header(meta_length=protocol.MAX_META_SIZE + 1))
+
+    def test_malformed_meta_is_rejected(self):
+        frame, _, _ = protocol.decode_header(raw_header(name_length=1, meta_length=4))
+        with self.assertRaises(ProtocolError):
+            protocol.decode_extra(frame, b'a{no}', 1)
+
+    def test_malformed_name_is_rejected(self):
+        frame, _, _ = protocol.decode_header(raw_header(name_length=2))
+        with self.assertRaises(ProtocolError):
+            protocol.decode_extra(frame, b'\xff\xfe', 2)
+
+
+class RequestedRangeTest(unittest.TestCase):
+    def resolve(self, file_size, **meta):
+        return protocol.requested_range(Frame(protocol.CMD_DOWNLOAD, meta=meta), file_size)
+
+    def test_whole_file(self):
+        self.assertEqual(self.resolve(100), (0, 100))
+
+    def test_offset_and_length(self):
+        self.assertEqual(self.resolve(100, offset=10, length=20), (10, 20))
+        self.assertEqual(self.resolve(100, offset=90, length=20), (90, 10))
+        self.assertEqual(self.resolve(100, offset=100), (100, 0))
+
+    def test_suffix(self):
+        self.assertEqual(self.resolve(100, suffix=30), (70, 30))
+        self.assertEqual(self.resolve(100, suffix=300), (0, 100))
+        self.assertEqual(self.resolve(100, suffix=0), (100, 0))
+
+    def test_unsatisfiable(self):
+        self.assertIsNone(self.resolve(100, offset=101))
+        self.assertIsNone(self.resolve(100, offset=-1))
+        self.assertIsNone(self.resolve(100, length=-1))
+        self.assertIsNone(self.resolve(100, suffix=-1))
+
+
+class FrameConnectionTest(unittest.TestCase):
+    def setUp(self):
+        left, right = socket.socketpair()
+        self.sender = FrameConnection(left)
+        self.receiver = FrameConnection(right)
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def test_frames_arrive_in_order(self):
+        self.sender.send_frames([(Frame(protocol.CMD_DELETE, request_id=1, name='a'), b''),
+                                 (Frame(protocol.CMD_DIR, request_id=2, meta={'limit': 5}), b'body')])
+        first = self.receiver.recv_frame()
+        self.assertEqual((first.request_id, first.name), (1, 'a'))
+        self.assertEqual(self.receiver.read_payload(first), b'')
+        second = self.receiver.recv_frame()
+        self.assertEqual((second.request_id, second.meta), (2, {'limit': 5}))
+        self.assertEqual(self.receiver.read_text(second), 'body')
+
+    def test_streamed_body(self):
+        data = bytes(range(256)) * 400
+        self.sender.send_frame(Frame(protocol.CMD_UPLOAD, name='data', size=len(data)))
+        self.sender.send_body(io.BytesIO(data), len(data))
+        frame = self.receiver.recv_frame()
+        chunks = list(self.receiver.iter_body(frame.size))
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(all(len(chunk) <= protocol.CHUNK_SIZE for chunk in chunks))
+
+    def test_skipped_body_keeps_frames_aligned(self):
+        self.sender.send_frame(Frame(protocol.CMD_UPLOAD, request_id=1, size=5))
+        self.sender.sock.sendall(b'12345')
+        self.sender.send_frame(Frame(protocol.CMD_DIR, request_id=2))
+        self.receiver.skip_body(self.receiver.recv_frame().size)
+        self.assertEqual(self.receiver.recv_frame().request_id, 2)
+
+    def test_clean_close_returns_none(self):
+        self.sender.sock.shutdown(socket.SHUT_WR)
+        self.assertIsNone(self.receiver.recv_frame())
+
+    def test_truncated_header_is_rejected(self):
+        self.sender.sock.sendall(protocol.encode_frame(Frame(protocol.CMD_DIR))[:10])
+        self.sender.sock.shutdown(socket.SHUT_WR)
+        with self.assertRaises(ProtocolError):
+            self.receiver.recv_frame()
+
+    def test_truncated_body_is_rejected(self):
+        self.sender.send_frame(Frame(protocol.CMD_UPLOAD, size=10))
+        self.sender.sock.sendall(b'12345')
+        self.sender.sock.shutdown(socket.SHUT_WR)
+        frame = self.receiver.recv_frame()
+        with self.assertRaises(ProtocolError):
+            list(self.receiver.iter_body(frame.size))
+
+    def test_corrupt_payload_is_rejected(self):
+        data = bytearray(protocol.encode_frame(Frame(protocol.CMD_DIR), b'listing'))
+        data[-1] ^= 0xff
+        self.sender.sock.sendall(bytes(data))
+        frame = self.receiver.recv_frame()
+        with self.assertRaises(ProtocolError):
+            self.receiver.read_payload(frame)
+
+    def test_oversized_payload_is_not_buffered(self):
+        self.sender.send_frame(Frame(protocol.CMD_DIR, size=protocol.MAX_PAYLOAD_SIZE + 1))
+        frame = self.receiver.recv_frame()
+        with self.assertRaises(ProtocolError):
+            self.receiver.read_payload(frame)
+
+
+# FrameConnection.send_file_range sends part of a regular file as a frame body, with sendfile or with reads.
+class SendFileRangeTest(unittest.TestCase):
+    def setUp(self):
+        left, right = socket.socketpair()
+        self.sender = FrameConnection(left)
+        self.receiver = FrameConnection(right)
+        self.file = tempfile.TemporaryFile()
+        self.data = bytes(range(256)) * 300
+        self.file.write(self.data)
+        self.file.flush()
+
+    def tearDown(self):
+        self.file.close()
+        self.sender.close()
+        self.receiver.close()
+
+    def check_range(self, use_sendfile):
+        self.assertEqual(self.sender.send_file_range(self.file, 1000, 70000, use_sendfile), 70000)
+        self.assertEqual(self.receiver.read_exact(70000), self.data[1000:71000])
+
+    def test_sendfile(self):
+        self.check_range(True)
+
+    def test_buffered(self):
+        self.check_range(False)
+
+    def test_empty_range_sends_nothing(self):
+        self.assertEqual(self.sender.send_file_range(self.file, 5, 0), 0)
+
+    def test_range_past_end_of_file_is_an_error(self):
+        for use_sendfile in (True, False):
+            with self.assertRaises(ProtocolError):
+                self.sender.send_file_range(self.file, len(self.data) - 10, 20, use_sendfile)
+            self.receiver.read_exact(10)
+
+
+if __name__ == '__main__':
+    unittest.main()
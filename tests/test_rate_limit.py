@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import io
+import os
+import threading
+import time
+import unittest
+
+from support import ServerTestCase
+from rate_limit import TokenBucket, FairScheduler, TrafficShaper, operation_group, QUANTUM
+from server_side import parse_operation_rates
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(10 * QUANTUM, burst=2 * QUANTUM)
+        self.assertEqual(bucket.try_take(QUANTUM), 0)
+        self.assertEqual(bucket.try_take(QUANTUM), 0)
+        self.assertAlmostEqual(bucket.try_take(QUANTUM), 0.1, delta=0.01)
+        self.assertFalse(bucket.idle())
+
+    def test_large_amount_leaves_the_bucket_in_debt(self):
+        bucket = TokenBucket(10 * QUANTUM, burst=QUANTUM)
+        self.assertEqual(bucket.try_take(5 * QUANTUM), 0)
+        self.assertAlmostEqual(bucket.try_take(QUANTUM), 0.5, delta=0.01)
+
+    def test_take_waits_for_tokens(self):
+        bucket = TokenBucket(10 * QUANTUM, burst=QUANTUM)
+        bucket.take(QUANTUM)
+        start = time.monotonic()
+        self.assertGreater(bucket.take(QUANTUM), 0)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        bucket.tokens = 0
+        self.assertGreater(asyncio.run(bucket.take_async(QUANTUM)), 0)
+
+
+class FairSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = FairScheduler(TokenBucket(1024 * QUANTUM))
+
+    def test_interactive_tickets_go_first(self):
+        bulk = self.scheduler.enqueue('a', QUANTUM, False, threading.Event())
+        listing = self.scheduler.enqueue('b', QUANTUM, True, threading.Event())
+        self.assertIsNone(self.scheduler.try_grant(bulk))
+        self.assertEqual(self.scheduler.try_grant(listing), 0)
+        self.assertTrue(bulk.event.is_set())
+        self.assertEqual(self.scheduler.try_grant(bulk), 0)
+
+    def test_bulk_clients_take_turns(self):
+        self.scheduler.try_grant(self.scheduler.enqueue('a', QUANTUM, False, threading.Event()))
+        first = self.scheduler.enqueue('a', QUANTUM, False, threading.Event())
+        second = self.scheduler.enqueue('a', QUANTUM, False, threading.Event())
+        other = self.scheduler.enqueue('b', QUANTUM, False, threading.Event())
+        self.assertIs(self.scheduler.head(), other)
+        self.scheduler.try_grant(other)
+        self.assertIs(self.scheduler.head(), first)
+        self.scheduler.cancel(first)
+        self.assertIs(self.scheduler.head(), second)
+
+    def test_wait(self):
+        self.assertGreaterEqual(self.scheduler.wait('a', QUANTUM, True), 0)
+        self.assertGreaterEqual(asyncio.run(self.scheduler.wait_async('a', QUANTUM, False)), 0)
+        self.assertEqual(self.scheduler.waiting, [])
+
+
+class TrafficShaperTest(unittest.TestCase):
+    def test_operation_groups(self):
+        self.assertEqual(operation_group('upload_many'), 'upload')
+        self.assertEqual(operation_group('download_many'), 'download')
+        self.assertEqual(operation_group('dir'), 'dir')
+
+    def test_no_limits(self):
+        self.assertFalse(TrafficShaper().enabled())
+        self.assertTrue(TrafficShaper(operation_rates={'upload': 1}).enabled())
+
+    def test_pacer_uses_the_limits_of_its_request(self):
+        shaper = TrafficShaper(client_rate=1024, operation_rates={'download': 2048})
+        pacer = shaper.pacer('10.0.0.1', 'download_many')
+        self.assertEqual([scope for scope, _ in pacer.buckets], ['client', 'operation'])
+        self.assertIs(pacer.buckets[0][1], shaper.pacer('10.0.0.1', 'dir').buckets[0][1])
+        self.assertIsNot(pacer.buckets[0][1], shaper.pacer('10.0.0.2', 'dir').buckets[0][1])
+        self.assertEqual(len(shaper.pacer('10.0.0.1', 'upload').buckets), 1)
+
+    def test_transfers_turn_bulk_after_their_first_bytes(self):
+        shaper = TrafficShaper(rate=1024 * 1024, small_transfer=2 * QUANTUM)
+        pacer = shaper.pacer('10.0.0.1', 'download')
+        self.assertEqual([pacer.priority(QUANTUM) for _ in range(3)], [True, True, False])
+        self.assertTrue(shaper.pacer('10.0.0.1', 'dir').priority(10 * QUANTUM))
+
+    def test_waits_are_reported(self):
+        shaper = TrafficShaper(client_rate=10 * QUANTUM, burst=QUANTUM)
+        waits = []
+        shaper.on_wait = lambda seconds, scope: waits.append(scope)
+        pacer = shaper.pacer('10.0.0.1', 'download')
+        pacer.pace(QUANTUM)
+        pacer.pace(QUANTUM)
+        self.assertEqual(waits, ['client'])
+
+    def test_parse_operation_rates(self):
+        self.assertEqual(parse_operation_rates(['download=2', 'upload = 0.5']),
+                         {'download': 2 * 1024 * 1024, 'upload': 512 * 1024})
+        self.assertEqual(parse_operation_rates(None), {})
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_operation_rates(['download'])
+
+
+# Transfers through a server started with a client rate limit of 2 MB/s.
+class RateLimitedServerTest(ServerTestCase):
+    extra_args = ('--client-rate-limit', '2')
+
+    def test_transfers_are_paced(self):
+        data = os.urandom(3 * 1024 * 1024)
+        start = time.monotonic()
+        self.assertTrue(self.client.upload('a.bin', io.BytesIO(data), len(data))[0])
+        self.assertGreater(time.monotonic() - start, 1.0)
+        file = io.BytesIO()
+        start = time.monotonic()
+        self.assertTrue(self.client.download('a.bin', file)[0])
+        self.assertGreater(time.monotonic() - start, 1.0)
+        self.assertEqual(file.getvalue(), data)
+
+    def test_small_requests_are_not_held_up(self):
+        self.client.upload('a.txt', io.BytesIO(b'hello'), 5)
+        start = time.monotonic()
+        for _ in range(20):
+            self.assertTrue(self.client.list_files()[0])
+        self.assertLess(time.monotonic() - start, 1.0)
+
+
+class AsyncRateLimitedServerTest(RateLimitedServerTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
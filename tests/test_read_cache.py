@@ -0,0 +1,154 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import ServerTestCase
+from file_storage import FileStorage
+from read_cache import ReadCache, MemoryReader
+
+
+class ReadCacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = ReadCache(100)
+        self.assertIsNone(cache.get('a', 1.0, 3))
+        cache.put('a', 1.0, b'abc')
+        self.assertEqual(cache.get('a', 1.0, 3), b'abc')
+        self.assertEqual((cache.hits, cache.misses, cache.hit_rate()), (1, 1, 0.5))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ReadCache(30, max_file_size=10)
+        for name in 'abc':
+            cache.put(name, 1.0, name.encode() * 10)
+        cache.get('a', 1.0, 10)
+        cache.put('d', 1.0, b'd' * 10)
+        self.assertEqual(list(cache.entries), ['c', 'a', 'd'])
+        self.assertEqual((cache.size, cache.evictions), (30, 1))
+
+    def test_large_files_are_not_admitted(self):
+        cache = ReadCache(80)
+        self.assertTrue(cache.admits(10))
+        self.assertFalse(cache.admits(11))
+        cache.put('a', 1.0, b'x' * 11)
+        self.assertEqual(len(cache), 0)
+
+    def test_stale_entry_is_dropped(self):
+        cache = ReadCache(100)
+        cache.put('a', 1.0, b'abc')
+        self.assertIsNone(cache.get('a', 2.0, 3))
+        self.assertEqual((len(cache), cache.size), (0, 0))
+        cache.put('a', 1.0, b'abc')
+        self.assertIsNone(cache.get('a', 1.0, 4))
+
+    def test_invalidate(self):
+        cache = ReadCache(100)
+        cache.put('a', 1.0, b'abc')
+        cache.invalidate('a')
+        cache.invalidate('b')
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+
+class MemoryReaderTest(unittest.TestCase):
+    def test_reads_and_seeks_like_a_file(self):
+        reader = MemoryReader(b'0123456789')
+        self.assertEqual(reader.read(3), b'012')
+        self.assertEqual(reader.seek(-2, io.SEEK_END), 8)
+        self.assertEqual(reader.read(), b'89')
+        self.assertEqual(reader.read(5), b'')
+        reader.seek(1)
+        buffer = bytearray(4)
+        self.assertEqual(reader.readinto(buffer), 4)
+        self.assertEqual((bytes(buffer), reader.tell()), (b'1234', 5))
+
+    def test_view(self):
+        self.assertEqual(bytes(MemoryReader(b'0123456789').view(4, 3)), b'456')
+
+
+# FileStorage with a cache: reads go through it and changes invalidate it.
+class StorageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = ReadCache(1024)
+        self.storage = FileStorage(self.root, cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def store(self, name, data):
+        file = self.storage.open_staged(name)
+        with file:
+            file.write(data)
+        self.storage.commit_staged(name)
+
+    def read(self, name):
+        file, size = self.storage.open_read(name)
+        with file:
+            return file, file.read()
+
+    def test_second_read_is_a_hit(self):
+        self.store('a.txt', b'hello')
+        file, data = self.read('a.txt')
+        self.assertIsInstance(file, MemoryReader)
+        self.assertEqual((data, self.cache.misses, self.cache.hits), (b'hello', 1, 0))
+        self.assertEqual(self.read('a.txt')[1], b'hello')
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_overwrite_and_delete_invalidate(self):
+        self.store('a.txt', b'hello')
+        self.read('a.txt')
+        self.store('a.txt', b'changed')
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.read('a.txt')[1], b'changed')
+        self.storage.delete('a.txt')
+        self.assertEqual(len(self.cache), 0)
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open_read('a.txt')
+
+    def test_large_file_bypasses_the_cache(self):
+        self.store('big.bin', b'x' * 1000)
+        file, data = self.read('big.bin')
+        self.assertNotIsInstance(file, MemoryReader)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_checksum_does_not_fill_the_cache(self):
+        self.store('a.txt', b'hello')
+        self.storage.checksum('a.txt')
+        self.assertEqual(len(self.cache), 0)
+
+
+# Downloads from a server started with --cache-size.
+class CachedDownloadTest(ServerTestCase):
+    extra_args = ('--cache-size', '8')
+
+    def download(self, name, **options):
+        file = io.BytesIO()
+        success, message = self.client.download(name, file, **options)
+        self.assertTrue(success, message)
+        return file.getvalue()
+
+    def test_cached_downloads(self):
+        data = os.urandom(300 * 1024)
+        self.client.upload('a.bin', io.BytesIO(data), len(data))
+        self.assertEqual(self.download('a.bin'), data)
+        self.assertEqual(self.download('a.bin'), data)
+        self.assertEqual(self.download('a.bin', offset=1000, length=5000), data[1000:6000])
+
+    def test_overwritten_file_is_not_served_stale(self):
+        self.client.upload('a.txt', io.BytesIO(b'first'), 5)
+        self.assertEqual(self.download('a.txt'), b'first')
+        self.client.upload('a.txt', io.BytesIO(b'second'), 6, overwrite=True)
+        self.assertEqual(self.download('a.txt'), b'second')
+
+    def test_file_larger_than_the_cache_limit(self):
+        data = os.urandom(2 * 1024 * 1024)
+        self.client.upload('big.bin', io.BytesIO(data), len(data))
+        self.assertEqual(self.download('big.bin'), data)
+
+
+class AsyncCachedDownloadTest(CachedDownloadTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
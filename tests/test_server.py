@@ -0,0 +1,75 @@
+import io
+import os
+import unittest
+
+from support import ServerTestCase
+import protocol
+
+
+# Requests served end to end by server_side.py over the framed protocol.
+class ServerTest(ServerTestCase):
+    def upload(self, name, data, overwrite=False):
+        return self.client.upload(name, io.BytesIO(data), len(data), overwrite)
+
+    def download(self, name):
+        file = io.BytesIO()
+        success, result = self.client.download(name, file)
+        return success, file.getvalue() if success else result
+
+    def test_upload_download_round_trip(self):
+        data = os.urandom(300 * 1024)
+        self.assertEqual(self.upload('data.bin', data), (True, 'Upload Complete.'))
+        self.assertEqual(self.download('data.bin'), (True, data))
+
+    def test_empty_file(self):
+        self.assertTrue(self.upload('empty.txt', b'')[0])
+        self.assertEqual(self.download('empty.txt'), (True, b''))
+
+    def test_existing_file_needs_overwrite(self):
+        self.upload('a.txt', b'first')
+        self.assertEqual(self.upload('a.txt', b'second'), (False, 'File Exists.'))
+        self.assertEqual(self.download('a.txt'), (True, b'first'))
+        self.assertTrue(self.upload('a.txt', b'second', overwrite=True)[0])
+        self.assertEqual(self.download('a.txt'), (True, b'second'))
+
+    def test_listing(self):
+        self.upload('a.txt', b'a')
+        self.upload('b.txt', b'b')
+        success, listing = self.client.list_files()
+        self.assertTrue(success)
+        self.assertIn('a.txt', listing)
+        self.assertIn('b.txt', listing)
+
+    def test_delete(self):
+        self.upload('a.txt', b'a')
+        self.assertTrue(self.client.delete('a.txt')[0])
+        self.assertEqual(self.client.delete('a.txt'), (False, 'File not found'))
+        self.assertFalse(self.download('a.txt')[0])
+
+    def test_missing_file(self):
+        self.assertEqual(self.download('missing.txt'), (False, 'File not found'))
+
+    def test_pipelined_requests_are_answered_in_order(self):
+        self.upload('a.txt', b'a')
+        results = self.client.pipeline([(protocol.CMD_DELETE, 'missing.txt'), (protocol.CMD_DELETE, 'a.txt'),
+                                        (protocol.CMD_DELETE, 'a.txt')])
+        self.assertEqual([response.status for response, _ in results],
+                         [protocol.STATUS_NOT_FOUND, protocol.STATUS_OK, protocol.STATUS_NOT_FOUND])
+
+    def test_unknown_command_keeps_connection_usable(self):
+        response, _ = self.client.request(200, payload=b'ignored')
+        self.assertEqual(response.status, protocol.STATUS_INVALID)
+        self.assertTrue(self.upload('a.txt', b'a')[0])
+
+    def test_connections_are_served_at_once(self):
+        other = self.connect()
+        self.upload('a.txt', b'a')
+        self.assertTrue(other.download('a.txt', io.BytesIO())[0])
+
+
+class AsyncServerTest(ServerTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
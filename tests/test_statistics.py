@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from support import ServerTestCase
+from statistics_collector import StatisticsLog, convert_json_log, read_records
+
+
+class StatisticsLogTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, 'stats.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def open_log(self, **options):
+        log = StatisticsLog(self.path, **options)
+        self.addCleanup(log.close)
+        return log
+
+    def test_close_writes_buffered_records(self):
+        log = self.open_log(flush_interval=60)
+        log.transfer_stats('upload', 'a.txt', 10, 0.5, 0.02)
+        log.transfer_stats('download', 'a.txt', 10, 0.25, 0.04)
+        self.assertFalse(os.path.exists(self.path))
+        log.close()
+        records = list(read_records(self.path))
+        self.assertEqual([(record['operation'], record['filename'], record['byte_size']) for record in records],
+                         [('upload', 'a.txt', 10), ('download', 'a.txt', 10)])
+        self.assertEqual(set(records[0]), {'timestamp', 'operation', 'filename', 'byte_size', 'seconds_duration',
+                                           'mbps_rate'})
+
+    def test_full_batch_is_flushed_early(self):
+        log = self.open_log(flush_interval=60, batch_size=10)
+        for number in range(10):
+            log.record({'number': number})
+        deadline = time.monotonic() + 5
+        while len(list(read_records(self.path))) < 10:
+            self.assertLess(time.monotonic(), deadline, 'the full batch was not flushed')
+            time.sleep(0.01)
+
+    def test_concurrent_records_are_all_kept(self):
+        log = self.open_log(flush_interval=0.01, batch_size=50)
+
+        def work(thread):
+            for number in range(500):
+                log.record({'thread': thread, 'number': number})
+
+        threads = [threading.Thread(target=work, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.close()
+        records = list(read_records(self.path))
+        self.assertEqual(len(records), 4000)
+        for thread in range(8):
+            self.assertEqual([record['number'] for record in records if record['thread'] == thread], list(range(500)))
+
+    def test_rotation_keeps_backups_in_order(self):
+        log = self.open_log(flush_interval=60, max_bytes=200, backups=3)
+        for number in range(100):
+            log.record({'number': number})
+            log.flush()
+        log.close()
+        for path in (self.path, self.path + '.1', self.path + '.2', self.path + '.3'):
+            self.assertLessEqual(os.path.getsize(path), 200)
+        self.assertFalse(os.path.exists(self.path + '.4'))
+        numbers = [record['number'] for record in read_records(self.path)]
+        self.assertEqual(numbers, list(range(numbers[0], 100)))
+        self.assertGreater(numbers[0], 0)
+
+    def test_rotation_without_backups_starts_over(self):
+        log = self.open_log(flush_interval=60, max_bytes=100, backups=0)
+        for number in range(20):
+            log.record({'number': number})
+        log.close()
+        numbers = [record['number'] for record in read_records(self.path)]
+        self.assertFalse(os.path.exists(self.path + '.1'))
+        self.assertEqual(numbers, list(range(numbers[0], 20)))
+        self.assertLessEqual(os.path.getsize(self.path), 100)
+
+    def test_convert_old_json_file(self):
+        source = os.path.join(self.work_dir, 'stats.json')
+        old = [{'operation': 'upload', 'filename': 'a.txt'}, {'operation': 'download', 'filename': 'a.txt'}]
+        with open(source, 'w') as file:
+            json.dump(old, file)
+        with open(self.path, 'w') as file:
+            file.write(json.dumps({'operation': 'delete'}) + '\n')
+        self.assertEqual(convert_json_log(source, self.path), 2)
+        self.assertEqual(list(read_records(self.path)), [{'operation': 'delete'}] + old)
+
+
+# The server records every transfer in the log given with --stats-file.
+class ServerStatisticsTest(ServerTestCase):
+    extra_args = ('--stats-file', 'transfers.jsonl')
+
+    def test_transfers_are_logged(self):
+        self.client.upload('a.txt', io.BytesIO(b'hello'), 5)
+        self.client.download('a.txt', io.BytesIO())
+        path = os.path.join(self.work_dir, 'transfers.jsonl')
+        deadline = time.monotonic() + 10
+        while len(list(read_records(path))) < 2:
+            self.assertLess(time.monotonic(), deadline, 'the transfers were not logged')
+            time.sleep(0.05)
+        self.assertEqual([(record['operation'], record['byte_size']) for record in read_records(path)],
+                         [('upload', 5), ('download', 5)])
+
+
+class AsyncServerStatisticsTest(ServerStatisticsTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import PROJECT_ROOT  # noqa: F401 (puts the project on sys.path)
+from storage_layout import (InvalidName, MappedFile, StorageLayout, is_flat_store, migrate, normalize_name,
+                            open_layout, read_layout)
+
+
+class NameTest(unittest.TestCase):
+    def test_names_are_stored_in_nfc_form(self):
+        self.assertEqual(normalize_name('cafe\u0301.txt'), 'caf\u00e9.txt')
+        self.assertEqual(normalize_name('report 1.pdf'), 'report 1.pdf')
+
+    def test_invalid_names(self):
+        for name in ('', None, '.', '..', '.staging', '../escape', 'a/b', 'a\\b', 'a\0b', 'tab\tname',
+                     'x' * 241, '\u00e9' * 121, '\ud800'):
+            with self.assertRaises(InvalidName, msg=repr(name)):
+                normalize_name(name)
+
+
+class OpenLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_new_store_is_hashed(self):
+        self.assertFalse(is_flat_store(self.root))
+        self.assertTrue(open_layout(self.root).hashed)
+        self.assertTrue(read_layout(self.root).hashed)
+
+    def test_store_with_files_stays_flat(self):
+        with open(os.path.join(self.root, 'a.txt'), 'w') as file:
+            file.write('a')
+        self.assertTrue(is_flat_store(self.root))
+        self.assertFalse(open_layout(self.root).hashed)
+        self.assertIsNone(read_layout(self.root))
+        migrate(self.root)
+        self.assertFalse(is_flat_store(self.root))
+        self.assertFalse(is_flat_store(os.path.join(self.root, 'missing')))
+
+
+class MappedFileTest(unittest.TestCase):
+    def mapped(self, data):
+        with tempfile.TemporaryFile() as file:
+            file.write(data)
+            file.flush()
+            return MappedFile(file)
+
+    def test_reads_and_views(self):
+        data = os.urandom(100000)
+        reader = self.mapped(data)
+        self.assertEqual(reader.read(10), data[:10])
+        reader.seek(-5, 2)
+        self.assertEqual(reader.read(), data[-5:])
+        view = reader.view(1000, 50)
+        reader.close()
+        self.assertEqual(bytes(view), data[1000:1050])
+        view.release()
+
+    def test_empty_file(self):
+        reader = self.mapped(b'')
+        self.assertEqual(reader.read(), b'')
+        reader.close()
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    # Method to create files with the given names straight in the root, as a flat store holds them.
+    def make_flat(self, names):
+        for name in names:
+            with open(os.path.join(self.root, name), 'w') as file:
+                file.write(name)
+
+    # Method to check that each of names is where the layout of the store puts it, with its own contents.
+    def assert_stored(self, names):
+        layout = read_layout(self.root)
+        for name in names:
+            with open(layout.path_for(name)) as file:
+                self.assertEqual(file.read(), name)
+
+    def test_flat_to_hashed(self):
+        names = [f'file-{number}.txt' for number in range(200)]
+        self.make_flat(names)
+        moved, left = migrate(self.root, 2, 1)
+        self.assertEqual((moved, left), (len(names), []))
+        self.assert_stored(names)
+        self.assertEqual(sorted(name for name, _ in read_layout(self.root).scan()), sorted(names))
+
+    def test_files_named_like_buckets(self):
+        # Every hex digit is the name of a top-level bucket, and the files named so belong in each other's.
+        names = list('0123456789abcdef') + ['ab', 'f0'] + [f'file-{number}.txt' for number in range(200)]
+        self.make_flat(names)
+        moved, left = migrate(self.root, 2, 1)
+        self.assertEqual((moved, left), (len(names), []))
+        self.assert_stored(names)
+        self.assertEqual(sorted(os.listdir(self.root)), sorted(['.layout'] + list('0123456789abcdef')))
+
+    def test_interrupted_parking_is_resumed(self):
+        names = ['a', 'file-1.txt']
+        self.make_flat(names)
+        os.mkdir(os.path.join(self.root, '.migrating'))
+        os.rename(os.path.join(self.root, 'a'), os.path.join(self.root, '.migrating', 'a'))
+        self.assertEqual(migrate(self.root, 2, 1), (2, []))
+        self.assert_stored(names)
+
+    def test_bucket_file_stops_commit_cleanly(self):
+        self.make_flat(['a'])
+        layout = StorageLayout(self.root, 2, 1)
+        name = next(f'file-{number}' for number in range(1000) if layout.buckets(f'file-{number}')[0] == 'a')
+        with self.assertRaises(NotADirectoryError):
+            layout.make_parent(layout.path_for(name))
+
+
+if __name__ == '__main__':
+    unittest.main()
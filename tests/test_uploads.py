@@ -0,0 +1,135 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from support import ServerTestCase
+import protocol
+from storage_layout import read_layout
+
+
+# Uploads are staged and only committed once complete, so an interrupted one can be resumed.
+class ResumableUploadTest(ServerTestCase):
+    def download(self, name):
+        file = io.BytesIO()
+        success, result = self.client.download(name, file)
+        return success, file.getvalue() if success else result
+
+    def test_partial_upload_is_staged(self):
+        data = os.urandom(100 * 1024)
+        self.assertEqual(self.client.upload('a.bin', io.BytesIO(data), 40000, total=len(data)),
+                         (True, 'Upload Partial.'))
+        self.assertEqual(self.client.upload_offset('a.bin'), 40000)
+        self.assertNotIn('a.bin', self.client.list_files()[1])
+
+        self.assertEqual(self.client.resume_upload('a.bin', io.BytesIO(data), len(data)),
+                         (True, 'Upload Complete.'))
+        self.assertEqual(self.download('a.bin'), (True, data))
+        self.assertEqual(self.client.upload_offset('a.bin'), 0)
+
+    def test_wrong_offset_is_refused(self):
+        data = os.urandom(1000)
+        self.client.upload('a.bin', io.BytesIO(data), 500, total=len(data))
+        request = self.client.new_request(protocol.CMD_UPLOAD, 'a.bin', protocol.FLAG_OVERWRITE,
+                                          {'offset': 600, 'total': len(data)}, size=400)
+        self.client.frames.send_frame(request)
+        self.client.frames.sock.sendall(data[600:])
+        response = self.client.read_response(request)
+        self.assertEqual((response.status, response.meta), (protocol.STATUS_INVALID, {'offset': 500}))
+        self.client.frames.read_text(response)
+        self.assertEqual(self.client.upload_offset('a.bin'), 500)
+
+    def test_body_past_total_is_refused(self):
+        self.assertFalse(self.client.upload('a.bin', io.BytesIO(b'x' * 10), 10, total=5)[0])
+
+    def test_dropped_upload_is_resumed(self):
+        data = os.urandom(300 * 1024)
+        dropped = self.connect()
+        dropped.frames.send_frame(dropped.new_request(protocol.CMD_UPLOAD, 'a.bin', protocol.FLAG_OVERWRITE,
+                                                      size=len(data)))
+        dropped.frames.sock.sendall(data[:100 * 1024])
+        dropped.close()
+        deadline = time.monotonic() + 10
+        while self.client.upload_offset('a.bin') < 100 * 1024:
+            self.assertLess(time.monotonic(), deadline, 'the received bytes were not kept')
+            time.sleep(0.05)
+
+        self.assertTrue(self.client.resume_upload('a.bin', io.BytesIO(data), len(data))[0])
+        self.assertEqual(self.download('a.bin'), (True, data))
+
+    def test_stored_file_is_kept_until_commit(self):
+        self.client.upload('a.bin', io.BytesIO(b'old'), 3)
+        self.client.upload('a.bin', io.BytesIO(b'new contents'), 3, overwrite=True, total=12)
+        self.assertEqual(self.download('a.bin'), (True, b'old'))
+
+    def test_resume_download(self):
+        data = os.urandom(200 * 1024)
+        self.client.upload('a.bin', io.BytesIO(data), len(data))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a.bin')
+            with open(path, 'wb') as file:
+                file.write(data[:12345])
+            self.assertEqual(self.client.resume_download('a.bin', path), (True, len(data) - 12345))
+            with open(path, 'rb') as file:
+                self.assertEqual(file.read(), data)
+
+
+class AsyncResumableUploadTest(ResumableUploadTest):
+    engine = 'asyncio'
+
+
+# Two uploads of one file at the same time must not write into the same staged file, and an upload that
+# cannot be committed must be answered, not dropped.
+class ConcurrentUploadTest(ServerTestCase):
+    def staged_path(self, name):
+        return os.path.join(self.storage, '.staging', name + '.part')
+
+    # Sends the request and the first half of a body of data, leaving the upload waiting for the rest.
+    def start_upload(self, client, name, data):
+        request = client.new_request(protocol.CMD_UPLOAD, name, protocol.FLAG_OVERWRITE, size=len(data))
+        client.frames.send_frame(request)
+        client.frames.sock.sendall(data[:len(data) // 2])
+        deadline = time.monotonic() + 10
+        # The staged file exists just before it is locked; bytes in it mean the upload holds the lock.
+        while not os.path.exists(self.staged_path(name)) or not os.path.getsize(self.staged_path(name)):
+            self.assertLess(time.monotonic(), deadline, 'the upload was never staged')
+            time.sleep(0.01)
+        return request
+
+    def test_second_upload_is_refused(self):
+        first, second = os.urandom(6 * 1024 * 1024), os.urandom(6 * 1024 * 1024)
+        request = self.start_upload(self.client, 'same.bin', first)
+
+        other = self.connect()
+        success, message = other.upload('same.bin', io.BytesIO(second), len(second), overwrite=True)
+        self.assertFalse(success)
+        self.assertIn('another upload', message)
+        self.assertTrue(other.list_files()[0])
+
+        self.client.frames.sock.sendall(first[len(first) // 2:])
+        response = self.client.read_response(request)
+        self.assertEqual(response.status, protocol.STATUS_OK, self.client.frames.read_text(response))
+        out = io.BytesIO()
+        self.assertTrue(other.download('same.bin', out)[0])
+        self.assertEqual(out.getvalue(), first)
+
+        # Once the first upload is done, the file can be uploaded again.
+        self.assertTrue(other.upload('same.bin', io.BytesIO(second), len(second), overwrite=True)[0])
+
+    def test_failed_commit_is_answered(self):
+        # A directory where the file belongs makes the rename into place fail.
+        os.makedirs(read_layout(self.storage).path_for('blocked.bin'))
+        data = os.urandom(64 * 1024)
+        success, message = self.client.upload('blocked.bin', io.BytesIO(data), len(data), overwrite=True)
+        self.assertFalse(success)
+        self.assertTrue(message.startswith('Upload Failed'))
+        self.assertTrue(self.client.list_files()[0])
+
+
+class ConcurrentUploadAsyncTest(ConcurrentUploadTest):
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
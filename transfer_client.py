@@ -0,0 +1,621 @@
+import inspect
+import itertools
+import json
+import os
+import socket
+import compression
+import delta_sync
+import integrity
+import protocol
+from chunk_store import iter_chunks, chunk_hash
+from protocol import Frame, FrameConnection, ProtocolError, IntegrityError
+
+
+# Class that speaks the framed protocol to a FileServer. It has no web dependencies,
+# so it is shared by the Flask client and by the benchmark scripts.
+# compress selects on-the-wire compression of uploads and downloads: None sends bytes as they are,
+# 'auto' uses the best codec both sides have, and a codec name ('zstd', 'lz4' or 'zlib') uses only that one.
+# Either way a transfer is only compressed when a probe of its first bytes shows that it pays off.
+# With verify, uploads and downloads are checked end to end: both sides hash the bytes as they go and
+# compare digests when the transfer ends (when the server supports it).
+class TransferClient:
+    def __init__(self, host='localhost', port=3300, timeout=None, compress=None, verify=True):
+        if compress not in (None, 'auto') and compress not in compression.CODECS:
+            raise ValueError(f"Compression {compress!r} is not available; use one of {compression.available()}")
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.compress = compress
+        self.verify = verify
+        self.frames = None
+        self.request_ids = itertools.count(1)
+        # What the server supports, learned from its reply to a ping: the codecs it can decode,
+        # whether it sends and checks digest trailers and whether it takes delta uploads.
+        self.encodings = None
+        self.server_verifies = False
+        self.server_delta = False
+
+    # Method to open the connection to the server.
+    def connect(self):
+        self.close()
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.frames = FrameConnection(sock)
+        self.encodings = None
+        return self
+
+    @property
+    def connected(self):
+        return self.frames is not None
+
+    # Method to build a request frame with a fresh request id.
+    def new_request(self, command, name='', flags=0, meta=None, size=0):
+        return Frame(command, flags=flags, request_id=next(self.request_ids), name=name, meta=meta, size=size)
+
+    # Method to read the response to a request and check that it belongs to it.
+    def read_response(self, request):
+        response = self.frames.recv_frame()
+        if response is None:
+            raise ProtocolError('Server closed the connection')
+        if response.request_id != request.request_id:
+            raise ProtocolError(f'Response {response.request_id} does not match request {request.request_id}')
+        return response
+
+    # Method to send a request with an in-memory body and return the response frame and its text.
+    def request(self, command, name='', flags=0, meta=None, payload=b''):
+        request = self.new_request(command, name, flags, meta)
+        self.frames.send_frame(request, payload)
+        response = self.read_response(request)
+        return response, self.frames.read_text(response)
+
+    # Method to send many small requests at once and collect their responses in order.
+    # Each entry of requests is a (command, name) pair.
+    def pipeline(self, requests):
+        frames = [(self.new_request(command, name), b'') for command, name in requests]
+        self.frames.send_frames(frames)
+        results = []
+        for request, _ in frames:
+            response = self.read_response(request)
+            results.append((response, self.frames.read_text(response)))
+        return results
+
+    # Method to check that the server answers on this connection.
+    def ping(self):
+        response, _ = self.request(protocol.CMD_PING)
+        self.encodings = response.meta.get('encodings', [])
+        self.server_verifies = bool(response.meta.get('verify'))
+        self.server_delta = bool(response.meta.get('delta'))
+        return response.status == protocol.STATUS_OK
+
+    # Method to get the cluster ring of a cluster node, or to give it a new one when ring (a
+    # cluster.HashRing.to_meta dict) is passed. Returns (True, the node's cluster status) or (False, error message).
+    def ring(self, ring=None):
+        response, text = self.request(protocol.CMD_RING, meta=ring)
+        if response.status != protocol.STATUS_OK:
+            return False, text
+        return True, response.meta
+
+    # Method to learn what the server supports, once per connection.
+    def negotiate(self):
+        if self.encodings is None:
+            self.ping()
+
+    # Method to check whether transfers on this connection are verified with digest trailers.
+    def verifies(self):
+        if not self.verify:
+            return False
+        self.negotiate()
+        return self.server_verifies
+
+    # Method to get the codecs this client is willing to use, in order of preference.
+    def offered_encodings(self):
+        if not self.compress:
+            return []
+        if self.compress == 'auto':
+            return compression.available()
+        return [self.compress]
+
+    # Method to decide whether to compress an upload of size bytes read from file.
+    # Returns (codec or None, file to read the body from); the bytes read for the probe come first from it,
+    # so streams that cannot seek work too.
+    def upload_codec(self, file, size):
+        offered = self.offered_encodings()
+        if not offered or size < compression.MIN_SIZE:
+            return None, file
+        self.negotiate()
+        codec = compression.choose(offered, self.encodings)
+        if codec is None:
+            return None, file
+        sample = file.read(min(compression.PROBE_SIZE, size))
+        file = compression.ProbedFile(sample, file)
+        return (codec if compression.worth_compressing(codec, sample) else None), file
+
+    # Method to list all files in the server. Returns (success, names one per line) or (False, error message).
+    def list_files(self):
+        success, entries, _ = self.list_entries(limit=0)
+        if not success:
+            return False, entries
+        names = [entry['name'] for entry in entries]
+        return True, "\n".join(names) if names else "No Files Found"
+
+    # Method to list one page of files with their size, mtime and checksum.
+    # prefix filters by name, sort is 'name', 'size' or 'mtime', and limit 0 asks for every matching file.
+    # Pass the returned cursor back to get the next page; it is None after the last one.
+    # Returns (True, entries, cursor) or (False, error message, None).
+    def list_entries(self, prefix='', sort='name', reverse=False, limit=1000, cursor=None, checksums=False):
+        meta = {'prefix': prefix, 'sort': sort, 'reverse': reverse, 'limit': limit, 'cursor': cursor,
+                'checksums': checksums}
+        request = self.new_request(protocol.CMD_DIR, meta=meta)
+        self.frames.send_frame(request)
+        entries = []
+        while True:
+            response = self.read_response(request)
+            if response.status != protocol.STATUS_OK:
+                return False, self.frames.read_text(response), None
+            entries.extend(json.loads(self.frames.read_payload(response)))
+            if not response.flags & protocol.FLAG_MORE:
+                return True, entries, response.meta.get('cursor')
+
+    # Method to upload size bytes read from a file object under the given name.
+    # offset and total describe where those bytes sit in the complete file when only part of it is sent;
+    # progress is called with the number of bytes of the complete file that have been sent.
+    # When verified, the body is hashed in the background while it is sent and the digest follows it in a
+    # trailer; the server only commits the file when its own digest matches.
+    def upload(self, file_name, file, file_size, overwrite=False, progress=None, offset=0, total=None):
+        flags = protocol.FLAG_OVERWRITE if overwrite else protocol.FLAG_EXPECT_CONTINUE
+        meta = {}
+        if offset:
+            meta['offset'] = offset
+        if total is not None and total != offset + file_size:
+            meta['total'] = total
+        hasher = integrity.Hasher() if self.verifies() else None
+        try:
+            if hasher:
+                meta['verify'] = True
+                file = integrity.HashingReader(file, hasher)
+            codec, file = self.upload_codec(file, file_size)
+            if codec:
+                meta.update({'encoding': codec.name, 'size': file_size})
+                flags |= protocol.FLAG_MORE
+            request = self.new_request(protocol.CMD_UPLOAD, file_name, flags, meta, size=0 if codec else file_size)
+            self.frames.send_frame(request)
+
+            if not overwrite:
+                response = self.read_response(request)
+                if response.status != protocol.STATUS_CONTINUE:
+                    return False, self.frames.read_text(response)
+
+            report = (lambda sent: progress(offset + sent)) if progress and offset else progress
+            if codec:
+                sent = self.frames.send_encoded(request, codec.compressor(),
+                                                compression.iter_blocks(file, file_size), progress=report)
+                if sent != file_size:
+                    raise ProtocolError(f'Source ended after {sent} of {file_size} bytes')
+            else:
+                self.frames.send_body(file, file_size, progress=report)
+            if hasher:
+                digest = hasher.hexdigest()
+                self.frames.send_frame(protocol.trailer_frame(request, digest))
+        finally:
+            if hasher:
+                hasher.close()
+
+        response = self.read_response(request)
+        text = self.frames.read_text(response)
+        if response.status != protocol.STATUS_OK:
+            return False, text
+        checksum = response.meta.get('checksum')
+        if hasher and checksum and checksum != digest:
+            return False, "Upload Failed: the server stored a different checksum"
+        return True, text
+
+    # Method to ask how many bytes of an interrupted upload the server has staged.
+    def upload_offset(self, file_name):
+        response, _ = self.request(protocol.CMD_UPLOAD_STATUS, file_name)
+        return int(response.meta.get('offset', 0))
+
+    # Method to upload a seekable file of total bytes, continuing from whatever
+    # an earlier interrupted upload of the same name left staged on the server.
+    def resume_upload(self, file_name, file, total, overwrite=False, progress=None):
+        offset = self.upload_offset(file_name)
+        if offset > total:
+            offset = 0
+        file.seek(offset)
+        return self.upload(file_name, file, total - offset, overwrite, progress, offset=offset, total=total)
+
+    # Method to download a file from the server into a writable file object.
+    # offset and length select a byte range; by default the whole file is fetched.
+    # Returns (success, bytes received) or (False, error message).
+    def download(self, file_name, file, progress=None, offset=0, length=None):
+        success, response = self.start_download(file_name, offset, length)
+        if not success:
+            return False, response
+
+        received_size = 0
+        try:
+            for chunk in self.iter_download(response):
+                file.write(chunk)
+                received_size += len(chunk)
+                if progress:
+                    progress(received_size)
+        except IntegrityError as ex:
+            return False, f"Download Failed: {str(ex)}"
+        return True, received_size
+
+    # Method to request a download and read only the reply header, so the caller can stream the body.
+    # Pass suffix instead of offset and length for the last suffix bytes of the file.
+    # Returns (True, response) whose body must then be read with iter_download(response), or (False, error
+    # message). protocol.body_size(response) is the number of bytes the body holds once decompressed.
+    def start_download(self, file_name, offset=0, length=None, suffix=None):
+        meta = {}
+        offered = self.offered_encodings()
+        if offered:
+            meta['accept_encoding'] = offered
+        if self.verifies():
+            meta['verify'] = True
+        if suffix is not None:
+            meta['suffix'] = suffix
+        if offset:
+            meta['offset'] = offset
+        if length is not None:
+            meta['length'] = length
+        request = self.new_request(protocol.CMD_DOWNLOAD, file_name, meta=meta)
+        self.frames.send_frame(request)
+        response = self.read_response(request)
+        if response.status != protocol.STATUS_OK:
+            return False, self.frames.read_text(response)
+        return True, response
+
+    # Method to read the body of a download reply, decompressing it when the server sent it encoded
+    # and checking it against the digest trailer when the server sent one.
+    def iter_download(self, response):
+        codec = compression.CODECS.get(response.meta.get('encoding'))
+        if codec:
+            chunks = self.frames.iter_encoded(response, codec.decompressor())
+        else:
+            chunks = self.frames.iter_body(response.size)
+        if response.meta.get('verify'):
+            return self.iter_verified(response, chunks)
+        return chunks
+
+    # Method to pass chunks on while hashing them in the background. The last chunk is held back until the
+    # digest trailer has been checked, so whoever consumes the body never sees all of it when it is corrupt;
+    # a mismatch raises IntegrityError instead. With skip_rest, closing the generator before the end of the body
+    # reads past the rest of it and the trailer without checking them, so the next frame can be read.
+    def iter_verified(self, response, chunks, skip_rest=False):
+        with integrity.Hasher() as hasher:
+            previous = None
+            try:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    if previous is not None:
+                        yield previous
+                    previous = chunk
+            except GeneratorExit:
+                if skip_rest:
+                    for _ in chunks:
+                        pass
+                    self.frames.read_trailer(response)
+                raise
+            expected = self.frames.read_trailer(response)
+            if hasher.hexdigest() != expected:
+                raise IntegrityError(f'Checksum mismatch for {response.name}')
+        if previous is not None:
+            yield previous
+
+    # Method to get the checksum the server keeps for a file, or None when there is no such file.
+    # Comparing it with integrity.digest_path of a local copy tells whether the file changed without
+    # transferring it; the server hashes each stored file at most once.
+    def remote_checksum(self, file_name):
+        success, entries, _ = self.list_entries(prefix=file_name, limit=1, checksums=True)
+        if success and entries and entries[0]['name'] == file_name:
+            return entries[0]['checksum']
+        return None
+
+    # Method to start a chunked upload of a file of total bytes.
+    def begin_upload(self, file_name, total, overwrite=False):
+        flags = protocol.FLAG_OVERWRITE if overwrite else 0
+        response, text = self.request(protocol.CMD_UPLOAD_BEGIN, file_name, flags, {'total': total})
+        return response.status == protocol.STATUS_OK, text
+
+    # Method to send length bytes read from a file object as the chunk of a chunked upload at offset.
+    def upload_chunk(self, file_name, file, offset, length, progress=None):
+        request = self.new_request(protocol.CMD_UPLOAD_CHUNK, file_name, meta={'offset': offset}, size=length)
+        self.frames.send_frame(request)
+        self.frames.send_body(file, length, progress=progress)
+        response = self.read_response(request)
+        return response.status == protocol.STATUS_OK, self.frames.read_text(response)
+
+    # Method to finish a chunked upload once every chunk has been acknowledged.
+    def commit_upload(self, file_name):
+        response, text = self.request(protocol.CMD_UPLOAD_COMMIT, file_name)
+        return response.status == protocol.STATUS_OK, text
+
+    # Method to upload a new version of a file the server already has, sending only what changed: the block
+    # signatures of the stored version are fetched, the blocks the server still has are found in the new
+    # version (see delta_sync) and sent as references to them, and only the rest as literal bytes. The server
+    # rebuilds the file, checks it against the digest of the new version and swaps it in atomically.
+    # The whole file is uploaded instead when the server has no copy or does not take deltas, when the delta
+    # would not be much smaller, or when the stored file changes before the delta arrives.
+    # file must be seekable and is read from its start. Returns (success, message, stats) where stats has
+    # the size of the file, whether a delta was sent, and the body bytes sent and received for the upload.
+    def delta_upload(self, file_name, file, progress=None, block_size=None):
+        size = file.seek(0, os.SEEK_END)
+        stats = {'size': size, 'delta': False, 'sent_bytes': 0, 'signature_bytes': 0}
+        sent_before = self.frames.body_bytes_sent
+        self.negotiate()
+        if self.server_delta and self.server_verifies:
+            success, message = self.send_delta(file_name, file, size, progress, block_size, stats)
+            if success is not None:
+                stats['sent_bytes'] = self.frames.body_bytes_sent - sent_before
+                return success, message, stats
+
+        file.seek(0)
+        success, message = self.upload(file_name, file, size, overwrite=True, progress=progress)
+        stats['delta'] = False
+        stats['sent_bytes'] = self.frames.body_bytes_sent - sent_before
+        return success, message, stats
+
+    # Method to send a file as a delta against the server's copy. Returns (success, message), or
+    # (None, reason) when the whole file should be sent instead.
+    def send_delta(self, file_name, file, size, progress, block_size, stats):
+        request = self.new_request(protocol.CMD_SIGNATURES, file_name,
+                                   meta={'block_size': block_size} if block_size else None)
+        self.frames.send_frame(request)
+        response = self.read_response(request)
+        body = self.frames.read_payload(response)
+        if response.status != protocol.STATUS_OK:
+            return None, body.decode()
+        stats['signature_bytes'] = len(body)
+
+        base = {'size': response.meta['size'], 'mtime': response.meta['mtime']}
+        block_size = response.meta['block_size']
+        file.seek(0)
+        delta = delta_sync.compute_delta(file, delta_sync.parse_signatures(body), block_size, base['size'])
+        stats.update(delta.stats())
+        if delta.size != size:
+            raise ProtocolError(f'Source changed size from {size} to {delta.size} bytes during the upload')
+        if delta.encoded_size() >= size * delta_sync.MAX_DELTA_RATIO:
+            return None, 'delta is not smaller than the file'
+
+        meta = {'encoding': delta_sync.ENCODING, 'size': size, 'block_size': block_size, 'base': base,
+                'verify': True}
+        flags = protocol.FLAG_OVERWRITE | protocol.FLAG_EXPECT_CONTINUE | protocol.FLAG_MORE
+        request = self.new_request(protocol.CMD_UPLOAD, file_name, flags, meta)
+        self.frames.send_frame(request)
+        response = self.read_response(request)
+        if response.status != protocol.STATUS_CONTINUE:
+            text = self.frames.read_text(response)
+            # Refused as invalid when the stored file changed since the signatures were made.
+            return (None, text) if response.status == protocol.STATUS_INVALID else (False, text)
+
+        stats['delta'] = True
+        self.frames.send_encoded(request, delta_sync.Passthrough(), delta_sync.iter_delta(file, delta, progress))
+        self.frames.send_frame(protocol.trailer_frame(request, delta.digest))
+        response = self.read_response(request)
+        text = self.frames.read_text(response)
+        # A file rebuilt wrong, e.g. against a base replaced within the resolution of its mtime, fails
+        # verification and is sent whole.
+        if response.status == protocol.STATUS_INVALID:
+            return None, text
+        if response.status != protocol.STATUS_OK:
+            return False, text
+        if response.meta.get('checksum') != delta.digest:
+            return False, "Upload Failed: the server stored a different checksum"
+        return True, text
+
+    # Method to upload a seekable file to a server running with dedup, sending only the chunks it lacks.
+    # Returns (success, message, stats) where stats counts the file's chunks and what was actually sent.
+    def dedup_upload(self, file_name, file, overwrite=False, progress=None, window=32):
+        chunks = []
+        for offset, data in iter_chunks(file):
+            chunks.append((chunk_hash(data), offset, len(data)))
+        stats = {'chunks': len(chunks), 'size': sum(length for _, _, length in chunks),
+                 'sent_chunks': 0, 'sent_bytes': 0}
+
+        missing = set()
+        digests = sorted({digest for digest, _, _ in chunks})
+        for start in range(0, len(digests), 4096):
+            response, text = self.request(protocol.CMD_CHUNK_QUERY,
+                                          payload=json.dumps(digests[start:start + 4096]).encode())
+            if response.status != protocol.STATUS_OK:
+                return False, text, stats
+            missing.update(json.loads(text))
+
+        manifest = json.dumps({'chunks': [(digest, length) for digest, _, length in chunks]}).encode()
+        flags = protocol.FLAG_OVERWRITE if overwrite else 0
+        # A chunk reported as present may be removed before the manifest lands; resend what the server reports.
+        for _ in range(2):
+            success, message = self.put_chunks(file, chunks, missing, stats, progress, window)
+            if not success:
+                return False, message, stats
+            response, text = self.request(protocol.CMD_MANIFEST_PUT, file_name, flags, payload=manifest)
+            if response.status != protocol.STATUS_INVALID or 'missing' not in response.meta:
+                break
+            missing = set(response.meta['missing'])
+        return response.status == protocol.STATUS_OK, text, stats
+
+    # Method to send the chunks whose hashes are in missing, keeping up to window requests in flight.
+    def put_chunks(self, file, chunks, missing, stats, progress, window):
+        in_flight = []
+        sent = set()
+        for digest, offset, length in chunks:
+            if digest not in missing or digest in sent:
+                continue
+            sent.add(digest)
+            file.seek(offset)
+            request = self.new_request(protocol.CMD_CHUNK_PUT, digest)
+            self.frames.send_frame(request, file.read(length))
+            in_flight.append(request)
+            stats['sent_chunks'] += 1
+            stats['sent_bytes'] += length
+            if progress:
+                progress(stats['sent_bytes'])
+            if len(in_flight) >= window:
+                success, message = self.finish_requests(in_flight)
+                if not success:
+                    return False, message
+        return self.finish_requests(in_flight)
+
+    # Method to read the responses of pipelined requests. Returns (False, message) on the first failure.
+    def finish_requests(self, in_flight):
+        failure = None
+        while in_flight:
+            request = in_flight.pop(0)
+            response = self.read_response(request)
+            text = self.frames.read_text(response)
+            if response.status != protocol.STATUS_OK and failure is None:
+                failure = text
+        return (False, failure) if failure else (True, '')
+
+    # Method to get the size of a stored file without transferring it, via an empty ranged download.
+    # Returns None when there is no such file.
+    def file_size(self, file_name):
+        request = self.new_request(protocol.CMD_DOWNLOAD, file_name, meta={'length': 0})
+        self.frames.send_frame(request)
+        response = self.read_response(request)
+        if response.status != protocol.STATUS_OK:
+            self.frames.read_payload(response)
+            return None
+        return int(response.meta['total'])
+
+    # Method to continue downloading a file into local_path from the bytes already there.
+    # Returns (success, bytes received by this call) or (False, error message).
+    def resume_download(self, file_name, local_path, progress=None):
+        offset = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+        with open(local_path, 'ab') as file:
+            return self.download(file_name, file, progress, offset=offset)
+
+    # Method to delete a file from the server.
+    def delete(self, file_name):
+        response, text = self.request(protocol.CMD_DELETE, file_name)
+        return response.status == protocol.STATUS_OK, text
+
+    # Method to delete many files with one request.
+    # Returns (True, {name: 'ok', 'not_found' or 'error'}) or (False, error message).
+    def delete_many(self, names):
+        response, text = self.request(protocol.CMD_DELETE_MANY, payload=json.dumps(list(names)).encode())
+        if response.status != protocol.STATUS_OK:
+            return False, text
+        return True, json.loads(text)
+
+    # Method to look up the size, mtime and checksum of many files with one request.
+    # Returns (True, {name: entry dict, or None when not stored}) or (False, error message).
+    def stat_many(self, names, checksums=False):
+        names = list(names)
+        response, text = self.request(protocol.CMD_STAT_MANY, meta={'checksums': True} if checksums else None,
+                                      payload=json.dumps(names).encode())
+        if response.status != protocol.STATUS_OK:
+            return False, text
+        return True, dict(zip(names, json.loads(text)))
+
+    # Method to upload many files with one request. files yields (name, file object, size) triples and is
+    # read lazily, so the files can be opened one at a time. Each file is sent as a member frame followed by
+    # its bytes (and its digest trailer when verified); files up to CHUNK_SIZE go out in a single write with
+    # their member frame. progress is called with the bytes sent so far over the whole batch.
+    # Returns (True, {name: 'ok', 'exists', 'invalid' or 'error'}) or (False, error message).
+    def upload_many(self, files, overwrite=False, progress=None):
+        verify = self.verifies()
+        files = iter(files)
+        current = next(files, None)
+        flags = (protocol.FLAG_OVERWRITE if overwrite else 0) | (protocol.FLAG_MORE if current else 0)
+        request = self.new_request(protocol.CMD_UPLOAD_MANY, flags=flags)
+        self.frames.send_frame(request)
+
+        sent = 0
+        while current is not None:
+            file_name, file, size = current
+            following = next(files, None)
+            member = protocol.member_frame(request, file_name, size, following is not None,
+                                           meta={'verify': True} if verify else None)
+            digest = integrity.new_digest()
+            if size <= protocol.CHUNK_SIZE:
+                data = file.read(size)
+                if len(data) != size:
+                    raise ProtocolError(f'Source ended after {len(data)} of {size} bytes')
+                batch = [(member, data)]
+                if verify:
+                    digest.update(data)
+                    batch.append((protocol.trailer_frame(member, digest.hexdigest()), b''))
+                self.frames.send_frames(batch)
+            else:
+                self.frames.send_frame(member)
+                self.frames.send_body(integrity.HashingReader(file, digest) if verify else file, size)
+                if verify:
+                    self.frames.send_frame(protocol.trailer_frame(member, digest.hexdigest()))
+            sent += size
+            if progress:
+                progress(sent)
+            current = following
+
+        response = self.read_response(request)
+        if response.status != protocol.STATUS_OK:
+            return False, self.frames.read_text(response)
+        return True, json.loads(self.frames.read_payload(response))
+
+    # Method to ask for many files with one request. Returns (True, response) when the server accepted it,
+    # after which iter_download_many must be used to read the files, or (False, error message).
+    def start_download_many(self, names):
+        meta = {'verify': True} if self.verifies() else None
+        request = self.new_request(protocol.CMD_DOWNLOAD_MANY, meta=meta)
+        self.frames.send_frame(request, json.dumps(list(names)).encode())
+        response = self.read_response(request)
+        if response.status != protocol.STATUS_OK:
+            return False, self.frames.read_text(response)
+        return True, response
+
+    # Method to read the files of an accepted batch download. Yields (name, status, chunks) for each name in
+    # order; chunks yields the file's bytes (nothing unless status is STATUS_OK) and should be read before
+    # the next file is asked for, otherwise the rest of it is skipped. A verified file that does not match
+    # its digest raises IntegrityError from chunks, as in iter_download; the batch can still be read on.
+    # Only files read to the end are checked: the part of a file left unread is skipped with its digest trailer.
+    def iter_download_many(self, response):
+        more = response.flags & protocol.FLAG_MORE
+        while more:
+            member = self.read_response(response)
+            more = member.flags & protocol.FLAG_MORE
+            if member.flags & protocol.FLAG_CHECKSUM:
+                body = iter([self.frames.read_payload(member)])
+            else:
+                body = self.frames.iter_body(member.size)
+            verify = response.meta.get('verify') and member.status == protocol.STATUS_OK
+            chunks = self.iter_verified(member, body, skip_rest=True) if verify else body
+            yield member.name, member.status, chunks
+            if verify and inspect.getgeneratorstate(chunks) != inspect.GEN_CREATED:
+                chunks.close()
+                continue
+            for _ in body:
+                pass
+            if verify:
+                self.frames.read_trailer(member)
+
+    # Method to download many files with one request into a local directory.
+    # Returns (True, {name: status name}) or (False, error message); a file that fails verification
+    # is removed and reported as 'invalid'.
+    def download_many(self, names, directory):
+        success, response = self.start_download_many(names)
+        if not success:
+            return False, response
+        results = {}
+        for file_name, status, chunks in self.iter_download_many(response):
+            if status != protocol.STATUS_OK:
+                results[file_name] = protocol.status_name(status)
+                continue
+            path = os.path.join(directory, os.path.basename(file_name))
+            try:
+                with open(path, 'wb') as file:
+                    for chunk in chunks:
+                        file.write(chunk)
+            except IntegrityError:
+                os.remove(path)
+                status = protocol.STATUS_INVALID
+            results[file_name] = protocol.status_name(status)
+        return True, results
+
+    def close(self):
+        if self.frames:
+            try:
+                self.frames.close()
+            except OSError:
+                pass
+            self.frames = None